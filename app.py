@@ -1,2375 +1,6486 @@
-# bot.py
-import os
-import sys
-import time
-import sqlite3
-import requests
-import random
-import asyncio
-import re
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime, timedelta
-from yt_dlp import YoutubeDL
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, CallbackQueryHandler, filters
-from telegram.error import BadRequest, RetryAfter
-from flask import Flask, jsonify, request
-from threading import Thread
-import json
-import signal
-
-# Configuración
-BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
-USDT_ADDRESS = "0x594EAB95D5683851E0eBFfC457C07dc217Bf4830".lower()
-BSC_API_KEY = os.environ.get("BSC_API_KEY", "")
-LIMIT_POR_DIA = 100
-MIN_USDT = 4.99
-DB_NAME = "usuarios.db"
-MAX_WORKERS = 3
-MAX_FRAGMENTS = 16
-CHUNK_SIZE = 10 * 1024 * 1024
-MAX_FILE_SIZE = 7000 * 1024 * 1024  
-ADMIN_IDS = []
-MIN_WITHDRAWAL = 50
-
-# Configuración API
-API_HOST = "0.0.0.0"
-API_PORT = int(os.environ.get("PORT", 5000))  # Usar puerto de Render o 5000 por defecto
-API_SECRET_KEY = os.environ.get("API_SECRET_KEY", "default_secret_key_change_in_production")
-
-# Sistema de recompensas
-REWARD_PER_DOWNLOAD_MIN = 0.01
-REWARD_PER_DOWNLOAD_MAX = 0.50
-REFERRAL_REWARD = 5.00
-
-# URLs
-COMUNIDAD_URL = "https://t.me/descargar_videos_de_tiktok"
-DONACION_URL = "https://www.paypal.com/paypalme/JeffersonFaria525"
-RECOMPENSAS_URL = "https://cryptorewards.page.gd/"
-
-# Límites
-MAX_TT_SIZE_NON_PREMIUM = 50 * 1024 * 1024
-YOUTUBE_DAILY_LIMIT = 5
-
-# Almacenamiento temporal
-download_jobs = {}
-executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
-current_downloads = {}
-progress_trackers = {}
-
-# Inicializar Flask app para API
-api_app = Flask(__name__)
-api_app.secret_key = API_SECRET_KEY
-
-# Sistema de colas mejorado
-class DownloadQueueSystem:
-    def __init__(self, max_workers=3):
-        self.max_workers = max_workers
-        self.priority_queue = asyncio.Queue()
-        self.active_tasks = {}
-        self.task_counter = 0
-        self.workers = []
-        self.is_running = True
-        self.app = None
-        
-    def set_application(self, app):
-        self.app = app
-        
-    async def start(self):
-        """Inicia los workers de la cola"""
-        for i in range(self.max_workers):
-            worker = asyncio.create_task(self._worker(i))
-            self.workers.append(worker)
-        log_event(f"🚀 Sistema de colas iniciado con {self.max_workers} workers")
-        
-    async def stop(self):
-        """Detiene todos los workers"""
-        self.is_running = False
-        for worker in self.workers:
-            worker.cancel()
-        await asyncio.gather(*self.workers, return_exceptions=True)
-        
-    async def add_task(self, priority, task_data):
-        """Añade una tarea a la cola con prioridad"""
-        self.task_counter += 1
-        task_id = self.task_counter
-        await self.priority_queue.put((priority, task_id, task_data))
-        return task_id
-        
-    async def _worker(self, worker_id):
-        """Worker que procesa tareas de la cola"""
-        log_event(f"👷 Worker {worker_id} iniciado")
-        
-        while self.is_running:
-            try:
-                try:
-                    priority, task_id, task_data = await asyncio.wait_for(
-                        self.priority_queue.get(), timeout=5.0
-                    )
-                except asyncio.TimeoutError:
-                    continue
-                    
-                job_id, user_id, url, tipo, chat_id, message_id = task_data
-                
-                if user_id in self.active_tasks:
-                    log_event(f"⏳ Usuario {user_id} ya tiene tarea activa, reencolando...")
-                    new_priority = max(0, priority - 0.1)
-                    await self.add_task(new_priority, task_data)
-                    self.priority_queue.task_done()
-                    await asyncio.sleep(1)
-                    continue
-                
-                self.active_tasks[user_id] = task_id
-                try:
-                    await self._process_task(worker_id, task_data)
-                finally:
-                    if user_id in self.active_tasks:
-                        del self.active_tasks[user_id]
-                    self.priority_queue.task_done()
-                    
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                log_event(f"❌ Error en worker {worker_id}: {e}")
-                await asyncio.sleep(1)
-                
-    async def _process_task(self, worker_id, task_data):
-        """Procesa una tarea individual"""
-        job_id, user_id, url, tipo, chat_id, message_id = task_data
-        
-        try:
-            log_event(f"🔁 Worker {worker_id} procesando tarea para usuario {user_id}")
-            
-            progress_tracker = SafeProgressTracker(chat_id, message_id, user_id, self.app)
-            progress_trackers[user_id] = progress_tracker
-            
-            lang = get_user_language(user_id)
-            t = translations[lang]
-            
-            if "youtube.com" in url or "youtu.be" in url:
-                if not await puede_descargar_youtube(user_id):
-                    await progress_tracker.safe_edit_message(
-                        "❌ Has alcanzado tu límite diario de descargas de YouTube (5).\n\n"
-                        "💎 Conviértete en Premium para descargas ilimitadas de YouTube."
-                    )
-                    return
-            
-            await progress_tracker.safe_edit_message(t['analyzing_size'])
-            
-            es_valido, tamano_estimado, titulo, duracion, calidad, formato = await analizar_video_con_detalles(url, user_id, tipo)
-            
-            if not es_valido:
-                if tipo.startswith("tt_"):
-                    tamano_mb = tamano_estimado / (1024 * 1024)
-                    error_msg = t['video_too_large'].format(tamano_mb)
-                    await progress_tracker.safe_edit_message(error_msg)
-                return
-                
-            tamano_mb = tamano_estimado / (1024 * 1024) if tamano_estimado > 0 else 0
-            duracion_formateada = format_duration(duracion) if duracion > 0 else "Desconocida"
-            
-            if "youtube" in url:
-                platform = "YouTube"
-            else:
-                platform = "TikTok"
-                
-            info_msg = f"📊 **Información del {platform}:**\n• Duración: {duracion_formateada}\n• Tamaño estimado: {tamano_mb:.2f}MB\n• Calidad: {calidad}"
-            await progress_tracker.safe_edit_message(info_msg)
-            await asyncio.sleep(2)
-            
-            loop = asyncio.get_event_loop()
-            downloader = SafeParallelDownloader(url, user_id, tipo, progress_tracker)
-            downloader.estimated_size = tamano_estimado
-            
-            success = await loop.run_in_executor(executor, downloader.download)
-            filename = downloader.filename
-            
-            if not success or not filename:
-                error_msg = t['download_failed'].format(1)
-                await progress_tracker.safe_edit_message(error_msg)
-                log_event(f"❌ Error al descargar: {url}")
-                return
-                
-            await progress_tracker.safe_edit_message("📤 Preparando para enviar...")
-            await self._send_file(user_id, filename, tipo, progress_tracker)
-            
-            recompensa = incrementar_descarga(user_id)
-            
-            if "youtube.com" in url or "youtu.be" in url:
-                incrementar_descarga_youtube(user_id)
-                
-            actualizar_estadisticas(user_id)
-            
-            # CORREGIDO: Asegurar que se muestre el menú después de la descarga
-            await mostrar_menu_post_descarga(self.app, chat_id, message_id, recompensa)
-            
-            try:
-                if filename and os.path.exists(filename):
-                    os.remove(filename)
-                    log_event(f"🧹 Archivo temporal eliminado: {filename}")
-            except Exception as e:
-                log_event(f"⚠️ Error eliminando archivo: {e}")
-                
-        except Exception as e:
-            log_event(f"❌ Error procesando tarea: {e}")
-            try:
-                lang = get_user_language(user_id)
-                t = translations[lang]
-                await progress_tracker.safe_edit_message(f"❌ Error: {str(e)}")
-            except:
-                pass
-                
-    async def _send_file(self, user_id, filename, tipo, progress_tracker):
-        """Envía el archivo al usuario"""
-        try:
-            file_size = os.path.getsize(filename)
-            file_size_mb = file_size / (1024 * 1024)
-            
-            if file_size > MAX_FILE_SIZE:
-                raise Exception(f"Archivo demasiado grande ({file_size_mb:.2f}MB)")
-            
-            for progress in range(0, 101, 20):
-                await progress_tracker.update_upload_progress(progress)
-                await asyncio.sleep(0.5)
-            
-            timeout = 60
-            
-            if tipo.endswith("video"):
-                with open(filename, 'rb') as video_file:
-                    await self.app.bot.send_video(
-                        chat_id=user_id,
-                        video=video_file,
-                        caption="✅ ¡Descarga completada!",
-                        supports_streaming=True,
-                        read_timeout=timeout,
-                        write_timeout=timeout,
-                        connect_timeout=timeout
-                    )
-            else:
-                with open(filename, 'rb') as audio_file:
-                    await self.app.bot.send_audio(
-                        chat_id=user_id,
-                        audio=audio_file,
-                        caption="✅ ¡Descarga completada!",
-                        read_timeout=timeout,
-                        write_timeout=timeout,
-                        connect_timeout=timeout
-                    )
-                    
-            await progress_tracker.update_upload_progress(100)
-            log_event(f"✅ Archivo enviado: {filename} ({file_size_mb:.2f}MB)")
-            
-        except Exception as e:
-            log_event(f"❌ Error enviando archivo: {e}")
-            raise
-
-download_queue_system = DownloadQueueSystem(max_workers=MAX_WORKERS)
-
-stats = {
-    "start_time": time.time(),
-    "total_downloads": 0,
-    "daily_downloads": 0,
-    "unique_users": set(),
-    "premium_users": 0,
-    "active_downloads": 0,
-    "completed_today": 0,
-    "queue_size": 0,
-    "errors": 0,
-    "total_rewards": 0.0,
-    "total_withdrawals": 0.0,
-    "total_referral_earnings": 0.0,
-    "api_requests": 0,
-    "last_api_request": None
-}
-
-translations = {
-    "es": {
-        "welcome": "🌟 ¡Bienvenido al Bot de Descargas más Potente! 🚀",
-        "download_options": "🎬 Descarga videos y audio en calidad premium de TikTok y YouTube ✨",
-        "select_option": "👇 ¡Elige una opción y comienza a descargar!",
-        "download_content": "⬇️ Descargar Contenido",
-        "premium": "💎 Premium VIP",
-        "referrals": "👥 Programa de Referidos",
-        "stats": "📊 Mis Estadísticas",
-        "support": "🆘 Soporte Técnico",
-        "withdraw": "💰 Retirar Fondos",
-        "language": "🌐 Idioma/Language",
-        "menu_principal": "🏠 Menú Principal",
-        "back": "🔙 Volver",
-        "available_downloads": "📊 Descargas disponibles hoy: {}/{}",
-        "youtube_downloads": "🎵 Descargas de YouTube hoy: {}/{}",
-        "balance_info": "💰 Balance Actual: ${:.2f} USDT",
-        "withdraw_minimum": "⚠️ El mínimo para retirar es {} USDT",
-        "withdraw_success": "✅ ¡Retiro procesado exitosamente!",
-        "withdraw_request": "📋 Solicitud de retiro enviada para revisión",
-        "referral_notification": "🎉 ¡Has ganado ${} por referir a un nuevo usuario!",
-        "limit_reached": "⛔ ¡Límite Diario Alcanzado!",
-        "limit_message": "Has usado tus {} descargas gratuitas de hoy.\n🔓 Obtén descargas ilimitadas:",
-        "large_file": "📦 El archivo es grande ({:.2f}MB). ⏳ Esto puede tardar varios minutos...",
-        "community": "👥 Unirse a la Comunidad",
-        "donate": "❤️ Apoyar con Donación",
-        "video_too_large": "❌ **Video demasiado grande**\n\nEste video es de {:.2f}MB y supera el límite de 50MB. ⚠️\n\n💎 Conviértete en Premium para descargar videos de cualquier tamaño.",
-        "referral_earnings": "💰 **Ganancias por referidos:** ${:.2f} USDT",
-        "processing_queue": "⏳ **Procesando tu solicitud**\n\n{}",
-        "queue_position": "📊 Posición en cola: {}",
-        "premium_priority": "🚀 Prioridad Premium (procesamiento inmediato)",
-        "analyzing": "🔍 **Analizando video...**",
-        "downloading": "⬇️ **Descargando... {}%**",
-        "uploading": "📤 **Enviando... {}%**",
-        "daily_reminder": "📢 **Recordatorio Diario**\n\nTienes {} descargas disponibles hoy!\n\n",
-        "error_download": "❌ Error durante la descarga: {}",
-        "error_upload": "❌ Error durante el envío: {}",
-        "file_too_large": "❌ El archivo es demasiado grande ({:.2f}MB). El límite de Telegram es {:.2f}MB.",
-        "try_audio": "💡 Intenta descargar solo el audio o un video de menor calidad.",
-        "download_failed": "❌ La descarga falló después de {} intentos.",
-        "retrying": "🔄 Reintentando ({}/{})...",
-        "download_cancelled": "❌ Descarga cancelada debido a múltiples errores.",
-        "analyzing_size": "🔍 **Analizando video...**\n\n📊 Calculando tamaño y duración...",
-        "size_info": "📊 **Información del video:**\n• Duración: {}\n• Tamaño estimado: {:.2f}MB\n• Calidad: {}",
-        "new_referral": "🎉 **¡Nuevo referido!**\n\n@{} ha usado tu enlace de referido.\n💰 Has ganado ${:.2f} USDT de recompensa!",
-        "queue_stalled": "⚠️ **Procesamiento retrasado**\n\nEl sistema está experimentando alta demanda. Tu descarga se reanudará automáticamente.",
-        "youtube_premium_only": "❌ **YouTube requiere Premium para video**\n\nPara descargar videos de YouTube necesitas una cuenta Premium. 💎\n\n🎵 Pero puedes descargar el audio MP3 gratis (límite 5 por día)",
-        "more_rewards": "🎁 Más Recompensas",
-        "youtube_audio_only": "🎵 **Descarga de YouTube**\n\nLos usuarios gratuitos pueden descargar solo audio MP3 de YouTube (límite 5 por día).\n\n💎 Conviértete en Premium para descargar videos completos de YouTube.",
-        "enter_tx_hash": "🔍 **Verificación de Pago**\n\nPor favor, envía el **hash de la transacción (TX ID)** de tu pago de 4.99 USDT.\n\nEjemplo: `0x1234567890abcdef...`\n\n⚠️ Asegúrate de que:\n- El monto sea exactamente 4.99 USDT\n- La red sea BSC (BEP-20)\n- La transacción esté confirmada"
-    },
-    "en": {
-        "welcome": "🌟 Welcome to the Most Powerful Download Bot! 🚀",
-        "download_options": "🎬 Download premium quality videos and audio from TikTok and YouTube ✨",
-        "select_option": "👇 Choose an option and start downloading!",
-        "download_content": "⬇️ Download Content",
-        "premium": "💎 Premium VIP", 
-        "referrals": "👥 Referral Program",
-        "stats": "📊 My Statistics",
-        "support": "🆘 Technical Support",
-        "withdraw": "💰 Withdraw Funds",
-        "language": "🌐 Language/Idioma",
-        "menu_principal": "🏠 Main Menu",
-        "back": "🔙 Back",
-        "available_downloads": "📊 Downloads available today: {}/{}",
-        "youtube_downloads": "🎵 YouTube downloads today: {}/{}",
-        "balance_info": "💰 Current Balance: ${:.2f} USDT",
-        "withdraw_minimum": "⚠️ Minimum withdrawal is {} USDT",
-        "withdraw_success": "✅ Withdrawal processed successfully!",
-        "withdraw_request": "📋 Withdrawal request sent for review",
-        "referral_notification": "🎉 You've earned ${} for referring a new user!",
-        "limit_reached": "⛔ Daily Limit Reached!",
-        "limit_message": "You've used your {} free downloads today.\n🔓 Get unlimited downloads:",
-        "large_file": "📦 The file is large ({:.2f}MB). ⏳ This may take several minutes...",
-        "community": "👥 Join Community",
-        "donate": "❤️ Support with Donation",
-        "video_too_large": "❌ **Video too large**\n\nThis video is {:.2f}MB and exceeds the 50MB limit. ⚠️\n\n💎 Become Premium to download videos of any size.",
-        "referral_earnings": "💰 **Referral earnings:** ${:.2f} USDT",
-        "processing_queue": "⏳ **Processing your request**\n\n{}",
-        "queue_position": "📊 Queue position: {}",
-        "premium_priority": "🚀 Premium priority (immediate processing)",
-        "analyzing": "🔍 **Analyzing video...**",
-        "downloading": "⬇️ **Downloading... {}%**",
-        "uploading": "📤 **Uploading... {}%**",
-        "daily_reminder": "📢 **Daily Reminder**\n\nYou have {} downloads available today!\n\n",
-        "error_download": "❌ Error during download: {}",
-        "error_upload": "❌ Error during upload: {}",
-        "file_too_large": "❌ The file is too large ({:.2f}MB). The Telegram limit is {:.2f}MB.",
-        "try_audio": "💡 Try downloading only audio or a lower quality video.",
-        "download_failed": "❌ Download failed after {} attempts.",
-        "retrying": "🔄 Retrying ({}/{})...",
-        "download_cancelled": "❌ Download cancelled due to multiple errors.",
-        "analyzing_size": "🔍 **Analyzing video...**\n\n📊 Calculating size and duration...",
-        "size_info": "📊 **Video information:**\n• Duration: {}\n• Estimated size: {:.2f}MB\n• Quality: {}",
-        "new_referral": "🎉 **New referral!**\n\n@{} used your referral link.\n💰 You earned ${:.2f} USDT reward!",
-        "queue_stalled": "⚠️ **Processing delayed**\n\nThe system is experiencing high demand. Your download will resume automatically.",
-        "youtube_premium_only": "❌ **YouTube requires Premium for video**\n\nTo download YouTube videos you need a Premium account. 💎\n\n🎵 But you can download MP3 audio for free (limit 5 per day)",
-        "more_rewards": "🎁 More Rewards",
-        "youtube_audio_only": "🎵 **YouTube Download**\n\nFree users can only download MP3 audio from YouTube (limit 5 per day).\n\n💎 Become Premium to download full YouTube videos.",
-        "enter_tx_hash": "🔍 **Payment Verification**\n\nPlease send the **transaction hash (TX ID)** of your 4.99 USDT payment.\n\nExample: `0x1234567890abcdef...`\n\n⚠️ Make sure:\n- Amount is exactly 4.99 USDT\n- Network is BSC (BEP-20)\n- Transaction is confirmed"
-    }
-}
-
-# ===========================================
-# FUNCIONES PARA LA API
-# ===========================================
-
-def obtener_estadisticas_db():
-    """Obtiene estadísticas detalladas de la base de datos"""
-    conn = conectar_db()
-    cur = conn.cursor()
-    
-    # Estadísticas generales
-    cur.execute("SELECT COUNT(*) FROM usuarios")
-    total_usuarios = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM usuarios WHERE premium = 1")
-    premium_usuarios = cur.fetchone()[0]
-    
-    cur.execute("SELECT SUM(descargas) FROM usuarios")
-    total_descargas = cur.fetchone()[0] or 0
-    
-    cur.execute("SELECT SUM(balance) FROM usuarios")
-    total_balance = cur.fetchone()[0] or 0.0
-    
-    cur.execute("SELECT SUM(total_earned) FROM usuarios")
-    total_ganado = cur.fetchone()[0] or 0.0
-    
-    cur.execute("SELECT SUM(referral_earnings) FROM usuarios")
-    total_referidos = cur.fetchone()[0] or 0.0
-    
-    cur.execute("SELECT COUNT(DISTINCT id) FROM usuarios WHERE last_active > ?", (int(time.time()) - 86400,))
-    activos_24h = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM withdrawals WHERE status = 'pending'")
-    retiros_pendientes = cur.fetchone()[0]
-    
-    cur.execute("SELECT SUM(amount) FROM withdrawals WHERE status = 'completed'")
-    retiros_completados = cur.fetchone()[0] or 0.0
-    
-    # Top usuarios
-    cur.execute("SELECT username, descargas, balance, premium FROM usuarios ORDER BY descargas DESC LIMIT 10")
-    top_usuarios = []
-    for row in cur.fetchall():
-        top_usuarios.append({
-            "username": row[0] or "Sin nombre",
-            "descargas": row[1],
-            "balance": row[2],
-            "premium": bool(row[3])
-        })
-    
-    conn.close()
-    
-    return {
-        "total_usuarios": total_usuarios,
-        "premium_usuarios": premium_usuarios,
-        "total_descargas": total_descargas,
-        "total_balance": total_balance,
-        "total_ganado": total_ganado,
-        "total_referidos": total_referidos,
-        "activos_24h": activos_24h,
-        "retiros_pendientes": retiros_pendientes,
-        "retiros_completados": retiros_completados,
-        "top_usuarios": top_usuarios
-    }
-
-def obtener_estado_sistema():
-    """Obtiene el estado actual del sistema"""
-    ahora = datetime.now()
-    uptime = time.time() - stats["start_time"]
-    horas, resto = divmod(uptime, 3600)
-    minutos, segundos = divmod(resto, 60)
-    
-    return {
-        "estado": "🟢 Activo" if stats["active_downloads"] > 0 or stats["queue_size"] > 0 else "🟡 En espera",
-        "uptime": f"{int(horas)}h {int(minutos)}m {int(segundos)}s",
-        "tiempo_activo": uptime,
-        "hora_servidor": ahora.strftime("%Y-%m-%d %H:%M:%S"),
-        "ultimo_reinicio": datetime.fromtimestamp(stats["start_time"]).strftime("%Y-%m-%d %H:%M:%S"),
-        "api_requests": stats["api_requests"],
-        "ultima_api_request": stats["last_api_request"]
-    }
-
-def verificar_autenticacion(auth_header):
-    """Verifica la autenticación de la API"""
-    if not auth_header:
-        return False
-    
-    try:
-        # Formato: Bearer {API_SECRET_KEY}
-        if auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            return token == API_SECRET_KEY
-    except:
-        pass
-    
-    return False
-
-# ===========================================
-# ENDPOINTS DE LA API
-# ===========================================
-
-@api_app.route('/')
-def index():
-    """Página principal de la API"""
-    return jsonify({
-        "api": "Bot de Descargas - API de Monitoreo",
-        "version": "1.0.0",
-        "endpoints": {
-            "/api/status": "Estado general del sistema",
-            "/api/stats": "Estadísticas detalladas",
-            "/api/users": "Información de usuarios",
-            "/api/queue": "Estado de la cola de descargas",
-            "/api/health": "Verificación de salud del sistema"
-        },
-        "documentation": "Usa Bearer token para autenticación"
-    })
-
-@api_app.route('/api/status', methods=['GET'])
-def api_status():
-    """Endpoint para estado general del sistema"""
-    stats["api_requests"] += 1
-    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    auth_header = request.headers.get('Authorization')
-    if not verificar_autenticacion(auth_header):
-        return jsonify({"error": "No autorizado"}), 401
-    
-    estado_sistema = obtener_estado_sistema()
-    
-    return jsonify({
-        "sistema": estado_sistema,
-        "estadisticas_activas": {
-            "descargas_totales": stats["total_downloads"],
-            "descargas_hoy": stats["daily_downloads"],
-            "usuarios_unicos": len(stats["unique_users"]),
-            "usuarios_premium": stats["premium_users"],
-            "descargas_activas": stats["active_downloads"],
-            "en_cola": stats["queue_size"],
-            "completadas_hoy": stats["completed_today"],
-            "errores": stats["errors"],
-            "recompensas": stats["total_rewards"],
-            "retiros": stats["total_withdrawals"],
-            "ganancias_referidos": stats["total_referral_earnings"]
-        }
-    })
-
-@api_app.route('/api/stats', methods=['GET'])
-def api_stats():
-    """Endpoint para estadísticas detalladas"""
-    stats["api_requests"] += 1
-    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    auth_header = request.headers.get('Authorization')
-    if not verificar_autenticacion(auth_header):
-        return jsonify({"error": "No autorizado"}), 401
-    
-    estadisticas_db = obtener_estadisticas_db()
-    estado_sistema = obtener_estado_sistema()
-    
-    return jsonify({
-        "estadisticas_generales": estadisticas_db,
-        "estado_sistema": estado_sistema,
-        "estadisticas_tiempo_real": {
-            "descargas_hoy": stats["daily_downloads"],
-            "descargas_activas": stats["active_downloads"],
-            "tareas_en_cola": stats["queue_size"],
-            "errores_hoy": stats["errors"]
-        }
-    })
-
-@api_app.route('/api/users', methods=['GET'])
-def api_users():
-    """Endpoint para información de usuarios"""
-    stats["api_requests"] += 1
-    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    auth_header = request.headers.get('Authorization')
-    if not verificar_autenticacion(auth_header):
-        return jsonify({"error": "No autorizado"}), 401
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    
-    # Parámetros de consulta
-    limit = request.args.get('limit', 50, type=int)
-    offset = request.args.get('offset', 0, type=int)
-    
-    cur.execute("""
-        SELECT id, username, descargas, youtube_descargas, premium, 
-               referrals, balance, total_earned, referral_earnings,
-               datetime(last_active, 'unixepoch') as ultima_actividad
-        FROM usuarios 
-        ORDER BY descargas DESC 
-        LIMIT ? OFFSET ?
-    """, (limit, offset))
-    
-    usuarios = []
-    for row in cur.fetchall():
-        usuarios.append({
-            "id": row[0],
-            "username": row[1] or "Sin nombre",
-            "descargas": row[2],
-            "youtube_descargas": row[3],
-            "premium": bool(row[4]),
-            "referrals": row[5],
-            "balance": row[6],
-            "total_earned": row[7],
-            "referral_earnings": row[8],
-            "ultima_actividad": row[9]
-        })
-    
-    # Total de usuarios para paginación
-    cur.execute("SELECT COUNT(*) FROM usuarios")
-    total = cur.fetchone()[0]
-    
-    conn.close()
-    
-    return jsonify({
-        "usuarios": usuarios,
-        "paginacion": {
-            "total": total,
-            "limit": limit,
-            "offset": offset,
-            "pagina_actual": (offset // limit) + 1,
-            "total_paginas": (total + limit - 1) // limit
-        }
-    })
-
-@api_app.route('/api/queue', methods=['GET'])
-def api_queue():
-    """Endpoint para estado de la cola de descargas"""
-    stats["api_requests"] += 1
-    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    auth_header = request.headers.get('Authorization')
-    if not verificar_autenticacion(auth_header):
-        return jsonify({"error": "No autorizado"}), 401
-    
-    # Obtener información de la cola
-    queue_info = {
-        "tareas_activas": list(download_queue_system.active_tasks.values()),
-        "cantidad_activas": len(download_queue_system.active_tasks),
-        "tamaño_cola": download_queue_system.priority_queue.qsize(),
-        "workers_activos": sum(1 for w in download_queue_system.workers if not w.done()),
-        "total_workers": download_queue_system.max_workers,
-        "tareas_procesadas": download_queue_system.task_counter
-    }
-    
-    # Obtener descargas activas
-    descargas_activas = []
-    for user_id, tracker in progress_trackers.items():
-        if tracker.is_active:
-            descargas_activas.append({
-                "user_id": user_id,
-                "chat_id": tracker.chat_id,
-                "progreso_descarga": tracker.download_progress,
-                "progreso_upload": tracker.upload_progress,
-                "ultima_actualizacion": tracker.last_update_time
-            })
-    
-    return jsonify({
-        "estado_cola": queue_info,
-        "descargas_activas": descargas_activas,
-        "jobs_pendientes": len(download_jobs)
-    })
-
-@api_app.route('/api/health', methods=['GET'])
-def api_health():
-    """Endpoint de verificación de salud del sistema"""
-    stats["api_requests"] += 1
-    
-    try:
-        # Verificar base de datos
-        conn = conectar_db()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        db_ok = cur.fetchone()[0] == 1
-        conn.close()
-        
-        # Verificar sistema de colas
-        queue_ok = download_queue_system.is_running
-        
-        # Verificar workers
-        workers_ok = len([w for w in download_queue_system.workers if not w.done()]) > 0
-        
-        return jsonify({
-            "status": "healthy" if all([db_ok, queue_ok, workers_ok]) else "degraded",
-            "checks": {
-                "database": db_ok,
-                "queue_system": queue_ok,
-                "workers": workers_ok,
-                "total_checks": 3,
-                "passed_checks": sum([db_ok, queue_ok, workers_ok])
-            },
-            "timestamp": datetime.now().isoformat()
-        })
-        
-    except Exception as e:
-        return jsonify({
-            "status": "unhealthy",
-            "error": str(e),
-            "timestamp": datetime.now().isoformat()
-        }), 500
-
-@api_app.route('/api/transactions', methods=['GET'])
-def api_transactions():
-    """Endpoint para ver transacciones recientes"""
-    stats["api_requests"] += 1
-    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    auth_header = request.headers.get('Authorization')
-    if not verificar_autenticacion(auth_header):
-        return jsonify({"error": "No autorizado"}), 401
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    
-    limit = request.args.get('limit', 100, type=int)
-    
-    cur.execute("""
-        SELECT t.id, t.user_id, u.username, t.amount, t.type, t.description,
-               datetime(t.timestamp, 'unixepoch') as fecha
-        FROM transactions t
-        LEFT JOIN usuarios u ON t.user_id = u.id
-        ORDER BY t.timestamp DESC
-        LIMIT ?
-    """, (limit,))
-    
-    transacciones = []
-    for row in cur.fetchall():
-        transacciones.append({
-            "id": row[0],
-            "user_id": row[1],
-            "username": row[2] or f"User_{row[1]}",
-            "amount": row[3],
-            "type": row[4],
-            "description": row[5],
-            "fecha": row[6]
-        })
-    
-    conn.close()
-    
-    return jsonify({"transacciones": transacciones})
-
-@api_app.route('/api/withdrawals', methods=['GET'])
-def api_withdrawals():
-    """Endpoint para ver retiros"""
-    stats["api_requests"] += 1
-    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    auth_header = request.headers.get('Authorization')
-    if not verificar_autenticacion(auth_header):
-        return jsonify({"error": "No autorizado"}), 401
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    
-    status = request.args.get('status', 'all')
-    limit = request.args.get('limit', 50, type=int)
-    
-    query = """
-        SELECT w.id, w.user_id, u.username, w.amount, w.address, 
-               w.status, datetime(w.timestamp, 'unixepoch') as fecha, w.tx_hash
-        FROM withdrawals w
-        LEFT JOIN usuarios u ON w.user_id = u.id
-    """
-    
-    params = []
-    if status != 'all':
-        query += " WHERE w.status = ?"
-        params.append(status)
-    
-    query += " ORDER BY w.timestamp DESC LIMIT ?"
-    params.append(limit)
-    
-    cur.execute(query, params)
-    
-    retiros = []
-    for row in cur.fetchall():
-        retiros.append({
-            "id": row[0],
-            "user_id": row[1],
-            "username": row[2] or f"User_{row[1]}",
-            "amount": row[3],
-            "address": row[4],
-            "status": row[5],
-            "fecha": row[6],
-            "tx_hash": row[7]
-        })
-    
-    conn.close()
-    
-    return jsonify({"retiros": retiros})
-
-def print_stats():
-    os.system('cls' if os.name == 'nt' else 'clear')
-    
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    elapsed_time = time.time() - stats["start_time"]
-    hours, remainder = divmod(elapsed_time, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    
-    stats["queue_size"] = download_queue_system.priority_queue.qsize()
-    stats["active_downloads"] = len(download_queue_system.active_tasks)
-    
-    print(f"🤖 BOT ACTIVO | {current_time}")
-    print("=" * 50)
-    print(f"⬇️  DESCARGAS TOTALES: {stats['total_downloads']}")
-    print(f"📊 DESCARGAS HOY: {stats['daily_downloads']}")
-    print(f"👤 USUARIOS ÚNICOS: {len(stats['unique_users'])}")
-    print(f"💎 USUARIOS PREMIUM: {stats['premium_users']}")
-    print(f"🚀 DESCARGAS ACTIVAS: {stats['active_downloads']}")
-    print(f"⏳ EN COLA: {stats['queue_size']}")
-    print(f"✅ COMPLETADAS HOY: {stats['completed_today']}")
-    print(f"❌ ERRORES: {stats['errors']}")
-    print(f"💰 RECOMPENSAS: ${stats['total_rewards']:.2f}")
-    print(f"💸 RETIROS: ${stats['total_withdrawals']:.2f}")
-    print(f"👥 GANANCIAS POR REFERIDOS: ${stats['total_referral_earnings']:.2f}")
-    print(f"🌐 API REQUESTS: {stats['api_requests']}")
-    print(f"⏱  TIEMPO ACTIVO: {int(hours)}h {int(minutes)}m {int(seconds)}s")
-    print("=" * 50)
-    
-    if stats["active_downloads"] > 0:
-        print("ESTADO ACTUAL: Procesando descargas...")
-    elif stats["queue_size"] > 0:
-        print("ESTADO ACTUAL: En espera (cola no vacía)")
-    else:
-        print("ESTADO ACTUAL: Esperando solicitudes...")
-
-def log_event(event):
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] {event}")
-
-def conectar_db():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def crear_tabla():
-    conn = conectar_db()
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY,
-            username TEXT,
-            descargas INTEGER DEFAULT 0,
-            youtube_descargas INTEGER DEFAULT 0,
-            ultimo_reset INTEGER,
-            youtube_ultimo_reset INTEGER,
-            premium INTEGER DEFAULT 0,
-            referido_por INTEGER,
-            ultima_tx TEXT DEFAULT '',
-            referrals INTEGER DEFAULT 0,
-            last_active INTEGER,
-            balance REAL DEFAULT 0.0,
-            language TEXT DEFAULT 'es',
-            total_earned REAL DEFAULT 0.0,
-            referral_earnings REAL DEFAULT 0.0,
-            last_daily_notification INTEGER DEFAULT 0
-        )
-    """)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            amount REAL,
-            type TEXT,
-            description TEXT,
-            timestamp INTEGER
-        )
-    """)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS withdrawals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            amount REAL,
-            address TEXT,
-            status TEXT DEFAULT 'pending',
-            timestamp INTEGER,
-            tx_hash TEXT
-        )
-    """)
-    
-    try:
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(usuarios)")
-        columns = [column[1] for column in cur.fetchall()]
-        
-        if 'youtube_descargas' not in columns:
-            conn.execute("ALTER TABLE usuarios ADD COLUMN youtube_descargas INTEGER DEFAULT 0")
-            log_event("✅ Columna 'youtube_descargas' añadida")
-            
-        if 'youtube_ultimo_reset' not in columns:
-            conn.execute("ALTER TABLE usuarios ADD COLUMN youtube_ultimo_reset INTEGER DEFAULT 0")
-            log_event("✅ Columna 'youtube_ultimo_reset' añadida")
-            
-        if 'ultima_tx' not in columns:
-            conn.execute("ALTER TABLE usuarios ADD COLUMN ultima_tx TEXT DEFAULT ''")
-            log_event("✅ Columna 'ultima_tx' añadida")
-            
-    except Exception as e:
-        log_event(f"⚠️ Error verificando columnas: {e}")
-    
-    conn.commit()
-    conn.close()
-
-def es_url_valida(url):
-    patterns = [
-        r'https?://(www\.)?tiktok\.com/',
-        r'https?://vm\.tiktok\.com/',
-        r'https?://(www\.)?youtube\.com/',
-        r'https?://youtu\.be/'
-    ]
-    return any(re.match(pattern, url) for pattern in patterns)
-
-def get_user_language(user_id):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT language FROM usuarios WHERE id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row["language"] if row else "es"
-
-def get_user_balance(user_id):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT balance FROM usuarios WHERE id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row["balance"] if row else 0.0
-
-def add_user_balance(user_id, amount):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE usuarios SET balance = balance + ?, total_earned = total_earned + ? WHERE id=?", 
-                (amount, amount, user_id))
-    conn.commit()
-    conn.close()
-    stats["total_rewards"] += amount
-
-def add_referral_earnings(user_id, amount):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE usuarios SET referral_earnings = referral_earnings + ? WHERE id=?", 
-                (amount, user_id))
-    conn.commit()
-    conn.close()
-    stats["total_referral_earnings"] += amount
-
-def es_premium(user_id):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT premium FROM usuarios WHERE id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row and row["premium"] == 1
-
-def get_priority(user_id):
-    return 0 if es_premium(user_id) else 1
-
-def actualizar_estadisticas(user_id):
-    stats["unique_users"].add(user_id)
-    stats["daily_downloads"] += 1
-    stats["total_downloads"] += 1
-    stats["completed_today"] += 1
-    
-    if es_premium(user_id):
-        stats["premium_users"] = len([u for u in stats["unique_users"] if es_premium(u)])
-    
-    print_stats()
-
-def sanitize_filename(filename):
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        filename = filename.replace(char, '_')
-    if len(filename) > 100:
-        filename = filename[:100]
-    return filename
-
-def format_duration(seconds):
-    hours, remainder = divmod(seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    if hours > 0:
-        return f"{int(hours)}:{int(minutes):02d}:{int(seconds):02d}"
-    else:
-        return f"{int(minutes)}:{int(seconds):02d}"
-
-def registrar_usuario(user_id, username, referido_por=None):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM usuarios WHERE id=?", (user_id,))
-    usuario_existente = cur.fetchone()
-    
-    if not usuario_existente:
-        cur.execute(
-            "INSERT INTO usuarios (id, username, descargas, youtube_descargas, ultimo_reset, youtube_ultimo_reset, premium, referido_por, last_active, balance, language, total_earned, referral_earnings, last_daily_notification, ultima_tx) VALUES (?, ?, 0, 0, ?, ?, 0, ?, ?, 0.0, 'es', 0.0, 0.0, ?, '')",
-            (user_id, username, int(time.time()), int(time.time()), referido_por, int(time.time()), int(time.time()))
-        )
-        
-        if referido_por:
-            cur.execute("UPDATE usuarios SET referrals = referrals + 1 WHERE id=?", (referido_por,))
-            add_user_balance(referido_por, REFERRAL_REWARD)
-            add_referral_earnings(referido_por, REFERRAL_REWARD)
-            
-            cur.execute(
-                "INSERT INTO transactions (user_id, amount, type, description, timestamp) VALUES (?, ?, ?, ?, ?)",
-                (referido_por, REFERRAL_REWARD, 'referral', 'Bonus por nuevo referido', int(time.time()))
-            )
-    else:
-        cur.execute("UPDATE usuarios SET last_active = ?, username = ? WHERE id = ?", 
-                   (int(time.time()), username, user_id))
-    conn.commit()
-    conn.close()
-    
-    stats["unique_users"].add(user_id)
-    print_stats()
-    log_event(f"👤 Usuario registrado: @{username} ({user_id})")
-
-async def notificar_referidor(referidor_id, username_referido, recompensa):
-    try:
-        application = ApplicationBuilder().token(BOT_TOKEN).build()
-        lang = get_user_language(referidor_id)
-        t = translations[lang]
-        
-        mensaje = t['new_referral'].format(username_referido, recompensa)
-        
-        await application.bot.send_message(
-            chat_id=referidor_id,
-            text=mensaje,
-            parse_mode='Markdown'
-        )
-        log_event(f"✅ Notificación enviada al referidor {referidor_id}")
-    except Exception as e:
-        log_event(f"❌ Error enviando notificación a referidor: {e}")
-
-def puede_descargar(user_id):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM usuarios WHERE id=?", (user_id,))
-    usuario = cur.fetchone()
-    conn.close()
-    
-    if not usuario:
-        return False, 0, 0
-        
-    limite_base = LIMIT_POR_DIA
-    limite_extra = usuario["referrals"]
-    limite_total = limite_base + limite_extra
-    
-    if usuario["premium"]:
-        return True, 0, 0
-        
-    ahora = int(time.time())
-    if ahora - usuario["ultimo_reset"] > 86400:
-        conn = conectar_db()
-        conn.execute(
-            "UPDATE usuarios SET descargas=0, ultimo_reset=? WHERE id=?", (ahora, user_id)
-        )
-        conn.commit()
-        conn.close()
-        return True, 0, limite_total
-        
-    descargas_restantes = limite_total - usuario["descargas"]
-    return usuario["descargas"] < limite_total, usuario["descargas"], limite_total
-
-async def puede_descargar_youtube(user_id):
-    if es_premium(user_id):
-        return True
-        
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT youtube_descargas, youtube_ultimo_reset FROM usuarios WHERE id=?", (user_id,))
-    usuario = cur.fetchone()
-    
-    if not usuario:
-        conn.close()
-        return False
-        
-    ahora = int(time.time())
-    
-    if ahora - usuario["youtube_ultimo_reset"] > 86400:
-        conn.execute(
-            "UPDATE usuarios SET youtube_descargas=0, youtube_ultimo_reset=? WHERE id=?", (ahora, user_id)
-        )
-        conn.commit()
-        conn.close()
-        return True
-        
-    puede = usuario["youtube_descargas"] < YOUTUBE_DAILY_LIMIT
-    conn.close()
-    return puede
-
-def incrementar_descarga(user_id):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE usuarios SET descargas = descargas + 1, last_active = ? WHERE id=?", 
-                (int(time.time()), user_id))
-    
-    recompensa = round(random.uniform(REWARD_PER_DOWNLOAD_MIN, REWARD_PER_DOWNLOAD_MAX), 2)
-    cur.execute("UPDATE usuarios SET balance = balance + ?, total_earned = total_earned + ? WHERE id=?", 
-                (recompensa, recompensa, user_id))
-    
-    conn.commit()
-    conn.close()
-    
-    stats["total_rewards"] += recompensa
-    return recompensa
-
-def incrementar_descarga_youtube(user_id):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE usuarios SET youtube_descargas = youtube_descargas + 1 WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
-
-def get_youtube_stats(user_id):
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT youtube_descargas, youtube_ultimo_reset FROM usuarios WHERE id=?", (user_id,))
-    usuario = cur.fetchone()
-    conn.close()
-    
-    if not usuario:
-        return 0, YOUTUBE_DAILY_LIMIT
-        
-    ahora = int(time.time())
-    if ahora - usuario["youtube_ultimo_reset"] > 86400:
-        return 0, YOUTUBE_DAILY_LIMIT
-    else:
-        return usuario["youtube_descargas"], YOUTUBE_DAILY_LIMIT
-
-# NUEVO: Diccionario para usuarios esperando TX
-waiting_for_tx = {}
-
-def validar_pago_con_tx(user_id, tx_hash):
-    """Verifica un pago específico usando el hash de transacción"""
-    try:
-        url = f"https://api.bscscan.com/api?module=transaction&action=gettxreceiptstatus&txhash={tx_hash}&apikey={BSC_API_KEY}"
-        
-        response = requests.get(url, timeout=15)
-        if response.status_code != 200:
-            return False, "❌ Error consultando BscScan. Intenta más tarde."
-            
-        data = response.json()
-        
-        # Verificar si la transacción existe y fue exitosa
-        if data.get("status") != "1":
-            return False, "❌ Transacción no encontrada o fallida."
-            
-        # Obtener detalles de la transacción
-        url_details = f"https://api.bscscan.com/api?module=proxy&action=eth_getTransactionByHash&txhash={tx_hash}&apikey={BSC_API_KEY}"
-        response_details = requests.get(url_details, timeout=15)
-        
-        if response_details.status_code != 200:
-            return False, "❌ Error obteniendo detalles de la transacción."
-            
-        tx_data = response_details.json()
-        
-        if not tx_data.get("result"):
-            return False, "❌ No se pudieron obtener los detalles de la transacción."
-            
-        tx_result = tx_data["result"]
-        
-        # Verificar que la transacción es para nuestra dirección
-        if tx_result.get("to", "").lower() != USDT_ADDRESS.lower():
-            return False, "❌ Esta transacción no fue enviada a la dirección correcta."
-        
-        # Verificar el valor de la transacción
-        if tx_result.get("value"):
-            value_wei = int(tx_result["value"], 16)
-            value_bnb = value_wei / 10**18
-            
-            # Para transacciones de BNB directas
-            if value_bnb > 0:
-                # Convertir BNB a USDT (aproximadamente)
-                bnb_price_url = "https://api.binance.com/api/v3/ticker/price?symbol=BNBUSDT"
-                bnb_response = requests.get(bnb_price_url, timeout=10)
-                if bnb_response.status_code == 200:
-                    bnb_data = bnb_response.json()
-                    bnb_price = float(bnb_data["price"])
-                    value_usdt = value_bnb * bnb_price
-                    
-                    if value_usdt >= MIN_USDT:
-                        return activar_premium(user_id, tx_hash, value_usdt, "BNB")
-        
-        # Buscar transacciones de tokens USDT
-        url_token = f"https://api.bscscan.com/api?module=account&action=tokentx&address={USDT_ADDRESS}&txhash={tx_hash}&apikey={BSC_API_KEY}"
-        response_token = requests.get(url_token, timeout=15)
-        
-        if response_token.status_code == 200:
-            token_data = response_token.json()
-            
-            if token_data.get("status") == "1" and token_data.get("result"):
-                for tx in token_data["result"]:
-                    if (tx.get("to", "").lower() == USDT_ADDRESS.lower() and 
-                        tx.get("tokenSymbol") == "USDT"):
-                        
-                        decimals = int(tx.get("tokenDecimal", 6))
-                        amount = float(tx["value"]) / (10 ** decimals)
-                        
-                        if amount >= MIN_USDT:
-                            return activar_premium(user_id, tx_hash, amount, "USDT")
-        
-        return False, "❌ No se encontró un pago válido de 4.99 USDT en esta transacción."
-        
-    except Exception as e:
-        log_event(f"❌ Error validando TX: {e}")
-        return False, f"❌ Error de conexión: {str(e)}"
-
-def activar_premium(user_id, tx_hash, amount, token_type):
-    """Activa la cuenta premium para un usuario"""
-    try:
-        conn = conectar_db()
-        cur = conn.cursor()
-        
-        # Verificar si el TX ya fue usado
-        cur.execute("SELECT id FROM usuarios WHERE ultima_tx = ?", (tx_hash,))
-        if cur.fetchone():
-            conn.close()
-            return False, "❌ Esta transacción ya fue utilizada anteriormente."
-        
-        # Activar premium
-        cur.execute("UPDATE usuarios SET premium=1, ultima_tx=? WHERE id=?", (tx_hash, user_id))
-        conn.commit()
-        conn.close()
-        
-        stats["premium_users"] += 1
-        print_stats()
-        
-        log_event(f"✅ Pago confirmado para usuario {user_id}: {amount:.2f} {token_type} (TX: {tx_hash})")
-        return True, f"✅ **¡Pago confirmado!** 🎉\n\n💎 **Cuenta Premium Activada**\n💰 Monto: {amount:.2f} {token_type}\n🔗 TX: `{tx_hash}`\n\n¡Disfruta de tus beneficios premium!"
-        
-    except Exception as e:
-        log_event(f"❌ Error activando premium: {e}")
-        return False, "❌ Error activando cuenta premium."
-
-def solicitar_retiro(user_id, amount, address):
-    user_balance = get_user_balance(user_id)
-    
-    if amount < MIN_WITHDRAWAL:
-        return False, f"El mínimo para retirar es {MIN_WITHDRAWAL} USDT"
-    
-    if amount > user_balance:
-        return False, "Fondos insuficientes"
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    
-    cur.execute(
-        "INSERT INTO withdrawals (user_id, amount, address, timestamp) VALUES (?, ?, ?, ?)",
-        (user_id, amount, address, int(time.time()))
-    )
-    
-    cur.execute("UPDATE usuarios SET balance = balance - ? WHERE id = ?", (amount, user_id))
-    
-    conn.commit()
-    conn.close()
-    
-    stats["total_withdrawals"] += amount
-    
-    for admin_id in ADMIN_IDS:
-        try:
-            asyncio.create_task(send_async_message(admin_id, f"🔄 Nueva solicitud de retiro:\nUser: {user_id}\nAmount: {amount} USDT\nAddress: {address}"))
-        except:
-            pass
-    
-    return True, "Solicitud de retiro procesada. Será revisada por un administrador."
-
-async def analizar_video_con_detalles(url, user_id, tipo):
-    try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'skip_download': True,
-            'forcejson': True
-        }
-        
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            titulo = info.get('title', 'Video sin título')
-            duracion = info.get('duration', 0)
-            formato = info.get('ext', 'desconocido')
-            
-            if 'filesize' in info and info['filesize']:
-                tamaño = info['filesize']
-            elif 'filesize_approx' in info and info['filesize_approx']:
-                tamaño = info['filesize_approx']
-            else:
-                if duracion > 0:
-                    tamaño = duracion * 2 * 1024 * 1024 / 60
-                else:
-                    tamaño = 0
-            
-            calidad = "Desconocida"
-            if 'height' in info:
-                calidad = f"{info['height']}p"
-            
-            if ("youtube.com" in url or "youtu.be" in url) and tipo == "yt_audio":
-                return True, tamaño, titulo, duracion, calidad, formato
-            
-            if not es_premium(user_id) and tamaño > MAX_TT_SIZE_NON_PREMIUM:
-                return False, tamaño, titulo, duracion, calidad, formato
-            
-            return True, tamaño, titulo, duracion, calidad, formato
-            
-    except Exception as e:
-        log_event(f"❌ Error analizando video: {e}")
-        return True, 0, "Video", 0, "Desconocida", "desconocido"
-
-async def send_async_message(chat_id, text):
-    try:
-        application = ApplicationBuilder().token(BOT_TOKEN).build()
-        await application.bot.send_message(chat_id=chat_id, text=text)
-    except Exception as e:
-        log_event(f"Error enviando mensaje async: {e}")
-
-class SafeProgressTracker:
-    def __init__(self, chat_id, message_id, user_id, app):
-        self.chat_id = chat_id
-        self.message_id = message_id
-        self.user_id = user_id
-        self.app = app
-        self.download_progress = 0
-        self.upload_progress = 0
-        self.is_active = True
-        self.lang = get_user_language(user_id)
-        self.t = translations[self.lang]
-        self.last_update_time = 0
-        self.last_message = ""
-        
-    async def safe_edit_message(self, text):
-        if text == self.last_message:
-            return False
-            
-        try:
-            await self.app.bot.edit_message_text(
-                chat_id=self.chat_id,
-                message_id=self.message_id,
-                text=text,
-                parse_mode='Markdown'
-            )
-            self.last_message = text
-            self.last_update_time = time.time()
-            return True
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                self.last_message = text
-                return True
-            else:
-                log_event(f"⚠️ Error editando mensaje: {e}")
-                return False
-        except Exception as e:
-            log_event(f"⚠️ Error editando mensaje: {e}")
-            return False
-            
-    async def update_download_progress(self, progress):
-        if not self.is_active:
-            return
-            
-        self.download_progress = progress
-        if time.time() - self.last_update_time >= 1:
-            text = self.t['downloading'].format(progress)
-            await self.safe_edit_message(text)
-            
-    async def update_upload_progress(self, progress):
-        if not self.is_active:
-            return
-            
-        self.upload_progress = progress
-        if time.time() - self.last_update_time >= 1:
-            text = self.t['uploading'].format(progress)
-            await self.safe_edit_message(text)
-            
-    def stop(self):
-        self.is_active = False
-
-class SafeParallelDownloader:
-    def __init__(self, url, user_id, tipo, progress_tracker):
-        self.url = url
-        self.user_id = user_id
-        self.tipo = tipo
-        self.filename = None
-        self.video_title = None
-        self.estimated_size = 0
-        self.priority = 0 if es_premium(user_id) else 1
-        self.timestamp = int(time.time())
-        self.prefix = "download"
-        self.base_filename = f"{self.prefix}_{user_id}_{self.timestamp}"
-        self.progress_tracker = progress_tracker
-        
-    def get_video_info(self):
-        try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'skip_download': True,
-                'forcejson': True
-            }
-            
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(self.url, download=False)
-                self.video_title = info.get('title', 'video')
-                self.estimated_size = info.get('filesize', 0) or info.get('filesize_approx', 0)
-                return True
-        except Exception as e:
-            log_event(f"❌ Error obteniendo información del video: {e}")
-            self.video_title = None
-            self.estimated_size = 0
-            return False
-            
-    def download(self):
-        try:
-            self.get_video_info()
-                
-            ydl_opts = self._get_ydl_options()
-            
-            ydl_opts['progress_hooks'] = [self._progress_hook]
-            
-            ydl_opts['socket_timeout'] = 0
-            ydl_opts['retries'] = 0
-            ydl_opts['fragment_retries'] = 0
-            
-            with open(os.devnull, 'w') as devnull:
-                with YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([self.url])
-            
-            for file in os.listdir('.'):
-                if file.startswith(self.base_filename):
-                    self.filename = file
-                    
-                    if self.video_title:
-                        file_ext = os.path.splitext(file)[1]
-                        safe_title = sanitize_filename(self.video_title)
-                        new_filename = f"{safe_title}{file_ext}"
-                        
-                        counter = 1
-                        original_new_filename = new_filename
-                        while os.path.exists(new_filename):
-                            new_filename = f"{os.path.splitext(original_new_filename)[0]}_{counter}{file_ext}"
-                            counter += 1
-                            
-                        os.rename(file, new_filename)
-                        self.filename = new_filename
-                    
-                    file_size = os.path.getsize(self.filename)
-                    if file_size > MAX_FILE_SIZE:
-                        raise Exception(f"El archivo es demasiado grande ({file_size/1024/1024:.2f}MB > {MAX_FILE_SIZE/1024/1024}MB)")
-                        
-                    return True
-            return False
-        except Exception as e:
-            log_event(f"❌ Error en descarga: {e}")
-            stats["errors"] += 1
-            return False
-            
-    def _progress_hook(self, d):
-        if d['status'] == 'downloading':
-            total = d.get('total_bytes', 0)
-            downloaded = d.get('downloaded_bytes', 0)
-            if total and downloaded:
-                progress = int((downloaded / total) * 100)
-                if progress % 5 == 0:
-                    try:
-                        asyncio.run(self.progress_tracker.update_download_progress(progress))
-                    except RuntimeError as e:
-                        if "Event loop is closed" not in str(e):
-                            raise
-                        log_event("⚠️ Event loop cerrado, no se puede actualizar progreso")
-        elif d['status'] == 'finished':
-            try:
-                asyncio.run(self.progress_tracker.update_download_progress(100))
-            except RuntimeError as e:
-                if "Event loop is closed" not in str(e):
-                    raise
-                log_event("⚠️ Event loop cerrado, no se puede actualizar progreso")
-            
-    def _get_ydl_options(self):
-        base_opts = {
-            'outtmpl': self.base_filename + '.%(ext)s',
-            'noprogress': True,
-            'socket_timeout': 0,
-            'retries': 0,
-            'fragment_retries': 0,
-            'concurrent_fragment_downloads': MAX_FRAGMENTS,
-            'http_chunk_size': CHUNK_SIZE,
-            'abort_on_unavailable_fragment': False,
-            'quiet': True,
-        }
-        
-        if self.tipo == "tt_video":
-            return {**base_opts, 'format': 'best'}
-        elif self.tipo == "tt_audio":
-            return {
-                **base_opts,
-                'format': 'bestaudio/best',
-                'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3'}]
-            }
-        elif self.tipo == "yt_audio":
-            return {
-                **base_opts,
-                'format': 'bestaudio/best',
-                'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3'}]
-            }
-        elif self.tipo == "yt_video":
-            return {**base_opts, 'format': 'best'}
-        else:
-            return {**base_opts, 'format': 'best'}
-
-async def monitor_sistema():
-    while True:
-        try:
-            await asyncio.sleep(30)
-            
-            workers_activos = sum(1 for worker in download_queue_system.workers if not worker.done())
-            
-            if workers_activos < download_queue_system.max_workers:
-                log_event(f"⚠️ Solo {workers_activos}/{download_queue_system.max_workers} workers activos")
-                
-                for i in range(download_queue_system.max_workers - workers_activos):
-                    worker = asyncio.create_task(download_queue_system._worker(len(download_queue_system.workers)))
-                    download_queue_system.workers.append(worker)
-                log_event("🔄 Workers reiniciados")
-                
-            download_queue_system.workers = [w for w in download_queue_system.workers if not w.done()]
-            
-        except Exception as e:
-            log_event(f"❌ Error en monitor del sistema: {e}")
-            await asyncio.sleep(60)
-
-async def verificar_estado_sistema():
-    while True:
-        try:
-            await asyncio.sleep(60)
-            
-            stats["queue_size"] = download_queue_system.priority_queue.qsize()
-            stats["active_downloads"] = len(download_queue_system.active_tasks)
-            
-            print_stats()
-                
-        except Exception as e:
-            log_event(f"❌ Error en verificador del sistema: {e}")
-            await asyncio.sleep(60)
-
-async def mostrar_menu_principal(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id=None):
-    if hasattr(update, 'effective_user'):
-        user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
-    else:
-        user_id = update.from_user.id
-        chat_id = update.message.chat_id
-    
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    puede_desc, usadas, total = puede_descargar(user_id)
-    balance = get_user_balance(user_id)
-    youtube_usadas, youtube_total = get_youtube_stats(user_id)
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT referral_earnings FROM usuarios WHERE id=?", (user_id,))
-    row = cur.fetchone()
-    referral_earnings = row["referral_earnings"] if row else 0.0
-    conn.close()
-    
-    texto = (
-        f"{t['welcome']}\n\n"
-        f"{t['download_options']}\n\n"
-        f"{t['available_downloads'].format(usadas, total) if not es_premium(user_id) else '💎 Descargas ilimitadas (Premium)'}\n"
-        f"{t['youtube_downloads'].format(youtube_usadas, youtube_total) if not es_premium(user_id) else '🎵 Descargas YouTube ilimitadas (Premium)'}\n"
-        f"{t['balance_info'].format(balance)}\n"
-        f"{t['referral_earnings'].format(referral_earnings)}\n\n"
-        f"{t['select_option']}"
-    )
-    
-    teclado = InlineKeyboardMarkup([
-        [InlineKeyboardButton(t['download_content'], callback_data="iniciar_descarga")],
-        [
-            InlineKeyboardButton(t['premium'], callback_data="menu_premium"),
-            InlineKeyboardButton(t['referrals'], callback_data="menu_referral")
-        ],
-        [
-            InlineKeyboardButton(t['more_rewards'], url=RECOMPENSAS_URL),
-            InlineKeyboardButton(t['withdraw'], callback_data="menu_withdraw")
-        ],
-        [
-            InlineKeyboardButton(t['support'], url="https://t.me/soporte_bot"),
-            InlineKeyboardButton(t['language'], callback_data="menu_language")
-        ],
-        [
-            InlineKeyboardButton(t['community'], url=COMUNIDAD_URL),
-            InlineKeyboardButton(t['donate'], url=DONACION_URL)
-        ]
-    ])
-    
-    if message_id:
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=texto,
-            reply_markup=teclado,
-            parse_mode='Markdown'
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=texto,
-            reply_markup=teclado,
-            parse_mode='Markdown'
-        )
-
-# CORREGIDO: Función corregida con todos los parámetros necesarios
-async def mostrar_menu_premium(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id=None):
-    if hasattr(update, 'effective_user'):
-        user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
-    else:
-        user_id = update.from_user.id
-        chat_id = update.message.chat.id
-    
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    texto = (
-        "💎 **¡CONVIÉRTETE EN PREMIUM!** 💎\n\n"
-        "✨ **Beneficios exclusivos:**\n"
-        "- Descargas ilimitadas 24/7\n"
-        "- Videos en 4K/HD sin restricciones\n"
-        "- Procesamiento prioritario\n"
-        "- Soporte directo\n"
-        "- Videos sin límite de tamaño\n"
-        "- Descargas ilimitadas de YouTube\n\n"
-        "💳 **Cómo activar:**\n"
-        "1. Envía *4.99 USDT* (BEP-20) a:\n"
-        f"`{USDT_ADDRESS}`\n"
-        "2. Verifica tu pago enviando el TX Hash\n\n"
-        "⏱️ **Activación inmediata** después de la confirmación\n"
-        "🛡️ **Garantía de satisfacción**"
-    )
-    teclado = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔍 Verificar TX Hash", callback_data="verificar_pago")],
-        [InlineKeyboardButton("❓ Cómo pagar", callback_data="como_pagar")],
-        [InlineKeyboardButton(t['back'], callback_data="menu_principal")]
-    ])
-    
-    if message_id:
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=texto,
-            reply_markup=teclado,
-            parse_mode='Markdown'
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=texto,
-            reply_markup=teclado,
-            parse_mode='Markdown'
-        )
-
-async def mostrar_como_pagar(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
-    if hasattr(update, 'effective_user'):
-        user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
-    else:
-        user_id = update.from_user.id
-        chat_id = update.message.chat.id
-    
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    texto = (
-        "❓ **¿Cómo pagar?** ❓\n\n"
-        "1. **Necesitas tener una billetera con USDT en la red BSC (Binance Smart Chain).**\n"
-        "2. Envía exactamente **4.99 USDT** a la siguiente dirección:\n"
-        f"`{USDT_ADDRESS}`\n"
-        "3. Asegúrate de que la red sea **BEP-20 (BSC)**.\n"
-        "4. Después de enviar, copia el **TX Hash** de la transacción.\n"
-        "5. Regresa al bot y presiona '🔍 Verificar TX Hash'.\n\n"
-        "⚠️ **Nota:** Las transacciones pueden tardar unos minutos en confirmarse."
-    )
-    teclado = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔍 Verificar TX Hash", callback_data="verificar_pago")],
-        [InlineKeyboardButton(t['back'], callback_data="menu_premium")]
-    ])
-    
-    await context.bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=message_id,
-        text=texto,
-        reply_markup=teclado,
-        parse_mode='Markdown'
-    )
-
-async def mostrar_menu_referral(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
-    if hasattr(update, 'effective_user'):
-        user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
-    else:
-        user_id = update.from_user.id
-        chat_id = update.message.chat.id
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT referrals, referral_earnings FROM usuarios WHERE id=?", (user_id,))
-    row = cur.fetchone()
-    referrals = row["referrals"] if row else 0
-    referral_earnings = row["referral_earnings"] if row else 0.0
-    conn.close()
-    
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    link = f"https://t.me/DescargaVideoTikTokBot?start=ref_{user_id}"
-    texto = (
-        "🔥 **¡GANA DESCARGAS EXTRA Y RECOMPENSAS!** 🔥\n\n"
-        f"👥 **Referidos actuales:** {referrals}\n"
-        f"💰 **Ganancias por referidos:** ${referral_earnings:.2f} USDT\n"
-        f"🎁 **Recompensa por referido:** ${REFERRAL_REWARD} USDT\n"
-        f"🎯 **Beneficios:** +1 descarga/día por cada amigo\n\n"
-        f"🔗 Tu enlace exclusivo:\n`{link}`\n\n"
-        "📤 Compártelo con tus amigos and disfruta de más descargas y recompensas!"
-    )
-    teclado = InlineKeyboardMarkup([
-        [InlineKeyboardButton("📋 Copiar enlace", callback_data=f"copiar_{user_id}")],
-        [InlineKeyboardButton(t['more_rewards'], url=RECOMPENSAS_URL)],
-        [InlineKeyboardButton(t['menu_principal'], callback_data="menu_principal")]
-    ])
-    
-    await context.bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=message_id,
-        text=texto,
-        reply_markup=teclado,
-        parse_mode='Markdown'
-    )
-
-async def mostrar_menu_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
-    if hasattr(update, 'effective_user'):
-        user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
-    else:
-        user_id = update.from_user.id
-        chat_id = update.message.chat.id
-    
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    balance = get_user_balance(user_id)
-    
-    texto = (
-        "💰 **RETIRO DE FONDOS** 💰\n\n"
-        f"💵 **Balance disponible:** ${balance:.2f} USDT\n"
-        f"📦 **Mínimo para retirar:** {MIN_WITHDRAWAL} USDT\n\n"
-        "Para retirar tus fondos, envía un mensaje con el siguiente formato:\n"
-        "`/withdraw <cantidad> <dirección_billetera>`\n\n"
-        "Ejemplo:\n"
-        "`/withdraw 50 0xTuDirecciónDeBilletera`"
-    )
-    
-    teclado = InlineKeyboardMarkup([
-        [InlineKeyboardButton(t['menu_principal'], callback_data="menu_principal")]
-    ])
-    
-    await context.bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=message_id,
-        text=texto,
-        reply_markup=teclado,
-        parse_mode='Markdown'
-    )
-
-async def mostrar_menu_language(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
-    if hasattr(update, 'effective_user'):
-        user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
-    else:
-        user_id = update.from_user.id
-        chat_id = update.message.chat.id
-    
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    texto = "🌐 **SELECCIONA TU IDIOMA** 🌐\n\nElige el idioma de tu preferencia:"
-    
-    teclado = InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("🇪🇸 Español", callback_data="setlang_es"),
-            InlineKeyboardButton("🇺🇸 English", callback_data="setlang_en")
-        ],
-        [InlineKeyboardButton(t['back'], callback_data="menu_principal")]
-    ])
-    
-    await context.bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=message_id,
-        text=texto,
-        reply_markup=teclado,
-        parse_mode='Markdown'
-    )
-
-async def mostrar_menu_post_descarga(app, chat_id: int, message_id: int, recompensa: float = 0):
-    user_id = chat_id
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    texto = f"🎉 **¡Descarga completada!**\n\n"
-    if recompensa > 0:
-        texto += f"💰 Has ganado ${recompensa:.2f} USDT por esta descarga!\n\n"
-    texto += "¿Qué deseas hacer ahora?"
-    
-    teclado = InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("⬇️ Descargar Otro", callback_data="iniciar_descarga"),
-            InlineKeyboardButton("👥 Invitar Amigos", callback_data="menu_referral")
-        ],
-        [
-            InlineKeyboardButton("💎 Obtener Premium", callback_data="menu_premium"),
-            InlineKeyboardButton(t['more_rewards'], url=RECOMPENSAS_URL)
-        ],
-        [InlineKeyboardButton("🏠 Menú principal", callback_data="menu_principal")]
-    ])
-    
-    await app.bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=message_id,
-        text=texto,
-        reply_markup=teclado,
-        parse_mode='Markdown'
-    )
-
-async def mostrar_estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
-    if hasattr(update, 'effective_user'):
-        user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
-    else:
-        user_id = update.from_user.id
-        chat_id = update.message.chat.id
-    
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT descargas, youtube_descargas, premium, referrals, balance, total_earned, referral_earnings, 
-               (SELECT COUNT(*) FROM usuarios WHERE referido_por = ?) as referidos_activos
-        FROM usuarios WHERE id = ?
-    """, (user_id, user_id))
-    
-    usuario = cur.fetchone()
-    
-    if not usuario:
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text="❌ No se encontraron estadísticas.",
-            parse_mode='Markdown'
-        )
-        return
-    
-    puede_desc, usadas, total = puede_descargar(user_id)
-    youtube_usadas, youtube_total = get_youtube_stats(user_id)
-    
-    texto = (
-        "📊 **TUS ESTADÍSTICAS** 📊\n\n"
-        f"⬇️ **Descargas TikTok hoy:** {usadas}/{total}\n"
-        f"🎵 **Descargas YouTube hoy:** {youtube_usadas}/{youtube_total}\n"
-        f"💰 **Balance actual:** ${usuario['balance']:.2f} USDT\n"
-        f"🎯 **Total ganado:** ${usuario['total_earned']:.2f} USDT\n"
-        f"👥 **Referidos:** {usuario['referrals']} (${usuario['referral_earnings']:.2f} USDT)\n"
-        f"👤 **Referidos activos:** {usuario['referidos_activos']}\n"
-        f"💎 **Estado:** {'Premium ✅' if usuario['premium'] else 'Gratuito ⏳'}\n\n"
-    )
-    
-    if not usuario['premium']:
-        texto += "🔓 **Mejora a Premium para:**\n- Descargas ilimitadas\n- Videos sin límite de tamaño\n- Prioridad en procesamiento\n- Descargas ilimitadas de YouTube"
-    
-    teclado = InlineKeyboardMarkup([
-        [InlineKeyboardButton(t['menu_principal'], callback_data="menu_principal")]
-    ])
-    
-    await context.bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=message_id,
-        text=texto,
-        reply_markup=teclado,
-        parse_mode='Markdown'
-    )
-    
-    conn.close()
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    referido_por = None
-    
-    if context.args and context.args[0].startswith('ref_'):
-        try:
-            referido_por = int(context.args[0][4:])
-            log_event(f"👥 Referido detectado: {user.id} -> {referido_por}")
-        except:
-            pass
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM usuarios WHERE id=?", (user.id,))
-    usuario_existente = cur.fetchone()
-    conn.close()
-    
-    if not usuario_existente:
-        texto = "🌐 **¡Bienvenido! Welcome!** 🌐\n\nSelecciona tu idioma / Select your language:"
-        teclado = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("🇪🇸 Español", callback_data="setlang_es"),
-                InlineKeyboardButton("🇺🇸 English", callback_data="setlang_en")
-            ]
-        ])
-        await update.message.reply_text(texto, reply_markup=teclado)
-        
-        registrar_usuario(user.id, user.username, referido_por)
-        return
-    
-    registrar_usuario(user.id, user.username, referido_por)
-    await mostrar_menu_principal(update, context)
-
-async def withdraw_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    if not context.args or len(context.args) < 2:
-        await update.message.reply_text(
-            "❌ Formato incorrecto. Usa:\n`/withdraw <cantidad> <dirección_billetera>`",
-            parse_mode='Markdown'
-        )
-        return
-    
-    try:
-        amount = float(context.args[0])
-        address = context.args[1]
-        
-        if not re.match(r'^0x[a-fA-F0-9]{40}$', address):
-            await update.message.reply_text("❌ Dirección de billetera inválida.")
-            return
-        
-        success, message = solicitar_retiro(user_id, amount, address)
-        await update.message.reply_text(message)
-        
-    except ValueError:
-        await update.message.reply_text("❌ Cantidad inválida. Debe ser un número.")
-    except Exception as e:
-        await update.message.reply_text(f"❌ Error: {str(e)}")
-
-async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if user_id not in ADMIN_IDS:
-        return
-    
-    conn = conectar_db()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT COUNT(*) FROM usuarios")
-    total_usuarios = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM usuarios WHERE premium = 1")
-    premium_usuarios = cur.fetchone()[0]
-    
-    cur.execute("SELECT SUM(descargas) FROM usuarios")
-    total_descargas = cur.fetchone()[0] or 0
-    
-    cur.execute("SELECT COUNT(DISTINCT id) FROM usuarios WHERE last_active > ?", (int(time.time()) - 86400,))
-    activos_24h = cur.fetchone()[0]
-    
-    cur.execute("SELECT SUM(balance) FROM usuarios")
-    total_balance = cur.fetchone()[0] or 0
-    
-    cur.execute("SELECT SUM(total_earned) FROM usuarios")
-    total_earned = cur.fetchone()[0] or 0
-    
-    cur.execute("SELECT SUM(referral_earnings) FROM usuarios")
-    total_referral_earnings = cur.fetchone()[0] or 0
-    
-    conn.close()
-    
-    texto = (
-        "👑 **ESTADÍSTICAS DE ADMINISTRADOR**\n\n"
-        f"👥 Usuarios totales: {total_usuarios}\n"
-        f"💎 Usuarios premium: {premium_usuarios}\n"
-        f"⬇️ Descargas totales: {total_descargas}\n"
-        f"👤 Usuarios activos (24h): {activos_24h}\n"
-        f"💰 Balance total en sistema: ${total_balance:.2f}\n"
-        f"🎁 Total ganado por usuarios: ${total_earned:.2f}\n"
-        f"👥 Ganancias por referidos: ${total_referral_earnings:.2f}\n\n"
-        f"📊 Hoy:\n"
-        f"- Descargas: {stats['daily_downloads']}\n"
-        f"- Completadas: {stats['completed_today']}\n"
-        f"- Errores: {stats['errors']}\n\n"
-        f"⚙️ Sistema:\n"
-        f"- En cola: {stats['queue_size']}\n"
-        f"- Activas: {stats['active_downloads']}\n"
-        f"- Uptime: {time.time() - stats['start_time']:.0f} segundos"
-    )
-    
-    await update.message.reply_text(texto, parse_mode='Markdown')
-
-async def procesar_descarga(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    username = update.effective_user.username
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    # Verificar si el usuario está esperando un TX
-    if user_id in waiting_for_tx:
-        tx_hash = update.message.text.strip()
-        if re.match(r'^0x[a-fA-F0-9]{64}$', tx_hash):
-            del waiting_for_tx[user_id]
-            await update.message.reply_text("🔍 Verificando transacción...", parse_mode='Markdown')
-            
-            ok, msg = validar_pago_con_tx(user_id, tx_hash)
-            await update.message.reply_text(msg, parse_mode='Markdown')
-            
-            if ok:
-                await mostrar_menu_principal(update, context)
-            else:
-                # CORREGIDO: Llamada corregida con todos los parámetros
-                await mostrar_menu_premium(update, context)
-        else:
-            await update.message.reply_text("❌ Formato de TX Hash inválido. Debe tener 64 caracteres hexadecimales después de '0x'.")
-        return
-    
-    registrar_usuario(user_id, username)
-    
-    text = update.message.text.strip()
-    
-    es_youtube = "youtube.com" in text or "youtu.be" in text
-    
-    if not es_url_valida(text):
-        await update.message.reply_text("❌ Solo se admiten enlaces de TikTok o YouTube.")
-        log_event(f"❌ Enlace inválido de @{username}: {text}")
-        return
-    
-    if es_youtube:
-        if not await puede_descargar_youtube(user_id):
-            await update.message.reply_text(
-                "❌ Has alcanzado tu límite diario de descargas de YouTube (5).\n\n"
-                "💎 Conviértete en Premium para descargas ilimitadas de YouTube.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("💎 Obtener Premium", callback_data="menu_premium")],
-                    [InlineKeyboardButton("🏠 Menú Principal", callback_data="menu_principal")]
-                ])
-            )
-            log_event(f"⚠️ Límite de YouTube alcanzado para @{username}")
-            return
-    else:
-        puede_desc, usadas, total = puede_descargar(user_id)
-        if not puede_desc:
-            texto = (
-                f"{t['limit_reached']}\n\n"
-                f"{t['limit_message'].format(total)}\n"
-                "🔓 Para descargas ilimitadas y máxima calidad:"
-            )
-            teclado = InlineKeyboardMarkup([
-                [InlineKeyboardButton("💎 Obtener Premium", callback_data="menu_premium")],
-                [InlineKeyboardButton("👥 Invitar Amigos", callback_data="menu_referral")],
-                [InlineKeyboardButton(t['menu_principal'], callback_data="menu_principal")]
-            ])
-            await update.message.reply_text(texto, reply_markup=teclado, parse_mode='Markdown')
-            log_event(f"⚠️ Límite diario alcanzado para @{username}")
-            return
-    
-    job_id = f"{user_id}_{int(time.time())}_{random.randint(1000,9999)}"
-    
-    download_jobs[job_id] = {
-        'url': text,
-        'chat_id': update.message.chat_id,
-        'message_id': update.message.message_id,
-        'timestamp': time.time()
-    }
-    
-    if es_youtube:
-        if es_premium(user_id):
-            teclado = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("🎥 Video HD", callback_data=f"yt_video|{job_id}"),
-                    InlineKeyboardButton("🎵 Audio MP3", callback_data=f"yt_audio|{job_id}")
-                ],
-                [InlineKeyboardButton(t['menu_principal'], callback_data="menu_principal")]
-            ])
-            msg_text = "🎬 **Selecciona formato para YouTube:**\n✅ Calidad HD Premium"
-        else:
-            teclado = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎵 Audio MP3", callback_data=f"yt_audio|{job_id}")],
-                [InlineKeyboardButton("💎 Obtener Premium", callback_data="menu_premium")],
-                [InlineKeyboardButton(t['menu_principal'], callback_data="menu_principal")]
-            ])
-            msg_text = t['youtube_audio_only']
-    else:
-        teclado = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("🎥 Video HD", callback_data=f"tt_video|{job_id}"),
-                InlineKeyboardButton("🎵 Audio MP3", callback_data=f"tt_audio|{job_id}")
-            ],
-            [InlineKeyboardButton(t['menu_principal'], callback_data="menu_principal")]
-        ])
-        msg_text = "🎬 **Selecciona formato para TikTok:**\n✅ Calidad HD sin marca de agua"
-    
-    msg = await update.message.reply_text(
-        msg_text,
-        reply_markup=teclado,
-        parse_mode='Markdown'
-    )
-    download_jobs[job_id]['message_id'] = msg.message_id
-    log_event(f"📥 Solicitud recibida de @{username}: {text}")
-
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    username = query.from_user.username
-    data = query.data
-    message_id = query.message.message_id
-    chat_id = query.message.chat_id
-    
-    # Obtener idioma ANTES de procesar cualquier callback
-    lang = get_user_language(user_id)
-    t = translations[lang]
-    
-    if data.startswith("setlang_"):
-        nuevo_idioma = data.split('_')[1]
-        conn = conectar_db()
-        conn.execute("UPDATE usuarios SET language = ? WHERE id = ?", (nuevo_idioma, user_id))
-        conn.commit()
-        conn.close()
-        
-        log_event(f"🌐 Idioma cambiado a {nuevo_idioma} por @{username}")
-        
-        # Recargar traducciones después del cambio
-        t = translations[nuevo_idioma]
-        
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=f"✅ Idioma cambiado a {'Español' if nuevo_idioma == 'es' else 'English'}",
-            parse_mode='Markdown'
-        )
-        
-        # Mostrar menú principal con el nuevo idioma
-        await mostrar_menu_principal(update, context, message_id)
-        return
-    
-    if data == "menu_principal":
-        await mostrar_menu_principal(update, context, message_id)
-        log_event(f"🏠 Menú principal mostrado a @{username}")
-    
-    elif data == "menu_premium":
-        # CORREGIDO: Llamada corregida con todos los parámetros
-        await mostrar_menu_premium(update, context, message_id)
-        log_event(f"💎 Menú premium mostrado a @{username}")
-    
-    elif data == "menu_referral":
-        await mostrar_menu_referral(update, context, message_id)
-        log_event(f"👥 Menú referidos mostrado a @{username}")
-    
-    elif data == "menu_withdraw":
-        await mostrar_menu_withdraw(update, context, message_id)
-        log_event(f"💰 Menú retiros mostrado a @{username}")
-    
-    elif data == "menu_language":
-        await mostrar_menu_language(update, context, message_id)
-        log_event(f"🌐 Menú idioma mostrado a @{username}")
-    
-    elif data == "como_pagar":
-        await mostrar_como_pagar(update, context, message_id)
-        log_event(f"❓ Cómo pagar mostrado a @{username}")
-    
-    elif data == "iniciar_descarga":
-        texto = "⬇️ **Envía el enlace del video que deseas descargar:**\nSe admiten enlaces de TikTok y YouTube."
-        teclado = InlineKeyboardMarkup([[InlineKeyboardButton(t['menu_principal'], callback_data="menu_principal")]])
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=texto,
-            reply_markup=teclado,
-            parse_mode='Markdown'
-        )
-        log_event(f"⬇️ Inicio de descarga solicitado por @{username}")
-    
-    elif data.startswith("copiar_"):
-        ref_user_id = data.split('_')[1]
-        link = f"https://t.me/DescargaVideoTikTokBot?start=ref_{ref_user_id}"
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"🔗 Copia este enlace de referido:\n\n`{link}`\n\nLuego compártelo con tus amigos!",
-            parse_mode='Markdown'
-        )
-        log_event(f"📋 Enlace de referido copiado por @{username}")
-    
-    elif data == "verificar_pago":
-        # Marcar usuario como esperando TX
-        waiting_for_tx[user_id] = True
-        
-        texto = t['enter_tx_hash']
-        teclado = InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ Cancelar", callback_data="cancelar_verificacion")]
-        ])
-        
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=texto,
-            reply_markup=teclado,
-            parse_mode='Markdown'
-        )
-        log_event(f"🔍 Solicitando TX Hash a @{username}")
-    
-    elif data == "cancelar_verificacion":
-        if user_id in waiting_for_tx:
-            del waiting_for_tx[user_id]
-        # CORREGIDO: Llamada corregida con todos los parámetros
-        await mostrar_menu_premium(update, context, message_id)
-        log_event(f"❌ Verificación cancelada por @{username}")
-    
-    elif data == "estadisticas":
-        await mostrar_estadisticas(update, context, message_id)
-        log_event(f"📊 Estadísticas mostradas a @{username}")
-    
-    elif "|" in data:
-        tipo, job_id = data.split("|", 1)
-        job = download_jobs.get(job_id)
-        
-        if not job:
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="❌ El enlace ha expirado. Por favor, envía un nuevo enlace.",
-                parse_mode='Markdown'
-            )
-            log_event(f"❌ Tarea expirada: {job_id}")
-            return
-        
-        url = job['url']
-        
-        if tipo.startswith("yt_"):
-            if not await puede_descargar_youtube(user_id):
-                await context.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text="❌ Has alcanzado tu límite diario de descargas de YouTube (5).\n\n💎 Conviértete en Premium para descargas ilimitadas.",
-                    parse_mode='Markdown'
-                )
-                log_event(f"⚠️ Límite de YouTube alcanzado al procesar: @{username}")
-                return
-        else:
-            puede_desc, usadas, total = puede_descargar(user_id)
-            if not puede_desc:
-                await context.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=f"⚠️ *Límite diario alcanzado*\n\n{t['limit_message'].format(total)}",
-                    parse_mode='Markdown'
-                )
-                log_event(f"⚠️ Límite diario alcanzado al procesar: @{username}")
-                return
-        
-        if tipo == "yt_video" and not es_premium(user_id):
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=t['youtube_premium_only'],
-                parse_mode='Markdown'
-            )
-            log_event(f"❌ Intento de descarga de YouTube video sin premium: @{username}")
-            return
-        
-        priority = 0 if es_premium(user_id) else 1
-        
-        task_id = await download_queue_system.add_task(
-            priority, 
-            (job_id, user_id, url, tipo, chat_id, message_id)
-        )
-        
-        stats["queue_size"] = download_queue_system.priority_queue.qsize()
-        print_stats()
-        
-        queue_size = download_queue_system.priority_queue.qsize()
-        if priority == 0:
-            status = t['premium_priority']
-        else:
-            status = t['queue_position'].format(queue_size)
-            
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=t['processing_queue'].format("En cola de espera") + f"\n\n{status}",
-            parse_mode='Markdown'
-        )
-        log_event(f"📥 Tarea añadida a cola (Prioridad: {priority}, ID: {task_id}) por @{username}: {url}")
-
-async def scheduled_tasks():
-    while True:
-        try:
-            await asyncio.sleep(3600)
-        except Exception as e:
-            log_event(f"❌ Error en tareas programadas: {e}")
-            await asyncio.sleep(3600)
-
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        raise context.error
-    except BadRequest as e:
-        if "Message is not modified" in str(e):
-            log_event("⚠️ Error 'Message is not modified' ignorado")
-        else:
-            log_event(f"❌ Error de BadRequest: {e}")
-    except RetryAfter as e:
-        log_event(f"⏰ Rate limit alcanzado: {e}")
-    except Exception as e:
-        log_event(f"❌ Error no manejado: {e}")
-        stats["errors"] += 1
-
-def start_background_tasks(application):
-    download_queue_system.set_application(application)
-    loop = asyncio.get_event_loop()
-    loop.create_task(download_queue_system.start())
-    loop.create_task(monitor_sistema())
-    loop.create_task(verificar_estado_sistema())
-    loop.create_task(scheduled_tasks())
-
-def run_api():
-    """Función para ejecutar la API en un hilo separado"""
-    log_event(f"🌐 Iniciando API web en puerto {API_PORT}...")
-    api_app.run(host=API_HOST, port=API_PORT, debug=False, use_reloader=False)
-
-def signal_handler(signum, frame):
-    """Manejador de señales para cerrar correctamente"""
-    log_event(f"🛑 Recibida señal {signum}, cerrando...")
-    download_queue_system.is_running = False
-    executor.shutdown(wait=False)
-    sys.exit(0)
-
-def main():
-    # Configurar manejadores de señales
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    crear_tabla()
-    
-    stats["start_time"] = time.time()
-    print_stats()
-    log_event("🤖 Iniciando bot de descargas con sistema de colas mejorado y API web...")
-    
-    # Iniciar la API en un hilo separado
-    api_thread = Thread(target=run_api, daemon=True)
-    api_thread.start()
-    log_event("✅ API web iniciada en segundo plano")
-    
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
-    
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("stats", admin_stats))
-    application.add_handler(CommandHandler("withdraw", withdraw_command))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, procesar_descarga))
-    application.add_handler(CallbackQueryHandler(callback_handler))
-    
-    application.add_error_handler(error_handler)
-    
-    start_background_tasks(application)
-    
-    log_event("🚀 Bot en ejecución con NUEVO sistema de colas y API web...")
-    log_event(f"📊 API disponible en: http://localhost:{API_PORT}")
-    log_event(f"📊 Endpoints principales:")
-    log_event(f"  • http://localhost:{API_PORT}/api/status")
-    log_event(f"  • http://localhost:{API_PORT}/api/stats")
-    log_event(f"  • http://localhost:{API_PORT}/api/health")
-    
-    try:
-        application.run_polling()
-    except KeyboardInterrupt:
-        log_event("🛑 Bot detenido por el usuario")
-    except Exception as e:
-        log_event(f"❌ Error crítico: {e}")
-    finally:
-        executor.shutdown(wait=False)
-
-if __name__ == "__main__":
-    main()
-
+# bot.py
+import os
+import sys
+import time
+import sqlite3
+import random
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, CallbackQueryHandler, TypeHandler, filters
+from telegram.ext import BaseRateLimiter, BaseUpdateProcessor, ExtBot
+from telegram.error import BadRequest, RetryAfter, TimedOut, NetworkError, Forbidden
+from telegram.request import HTTPXRequest
+import httpx
+import aiohttp
+from aiohttp import web
+from flask import Flask, jsonify, request
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response as WSGIResponse
+from threading import Thread, Lock
+import json
+import hashlib
+from functools import lru_cache
+from string import Formatter
+import math
+import shutil
+import signal
+import subprocess
+import tempfile
+import multiprocessing
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+# Configuración
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
+USDT_ADDRESS = "0x594EAB95D5683851E0eBFfC457C07dc217Bf4830".lower()
+BSC_API_KEY = os.environ.get("BSC_API_KEY", "")
+LIMIT_POR_DIA = 100
+MIN_USDT = 4.99
+DB_NAME = "usuarios.db"
+MAX_WORKERS = 3
+MAX_FRAGMENTS = 16
+CHUNK_SIZE = 10 * 1024 * 1024
+MAX_FILE_SIZE = 7000 * 1024 * 1024  
+ADMIN_IDS = []
+MIN_WITHDRAWAL = 50
+
+# Explorador de BSC para verificar pagos (BSCSCAN_API_URL puede apuntar a un explorador local)
+BSCSCAN_API_URL = os.environ.get("BSCSCAN_API_URL", "https://api.bscscan.com/api")
+BNB_PRICE_URL = os.environ.get("BNB_PRICE_URL", "https://api.binance.com/api/v3/ticker/price?symbol=BNBUSDT")
+USDT_BEP20_CONTRACT = "0x55d398326f99059ff775485246999027b3197955"
+USDT_BEP20_DECIMALS = 18
+ERC20_TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+CHAIN_POOL_SIZE = 10
+CHAIN_CALL_TIMEOUT = 8
+CHAIN_MAX_RETRIES = 3
+CHAIN_RETRY_BASE = 1.0
+BNB_PRICE_TTL = 60
+
+# Indexador de pagos: lee del explorador solo las transferencias nuevas hacia USDT_ADDRESS
+PAYMENT_INDEXER = os.environ.get("PAYMENT_INDEXER", "1") == "1"
+PAYMENT_INDEX_INTERVAL = int(os.environ.get("PAYMENT_INDEX_INTERVAL", "20"))
+PAYMENT_CONFIRMATIONS = 5
+PAYMENT_PAGE_SIZE = 1000
+PAYMENT_INITIAL_LOOKBACK = 200000  # ~7 días de bloques en BSC
+# Acreditar sin que el usuario envíe el hash cuando el remitente es su wallet de retiros
+PAYMENT_AUTO_CREDIT = os.environ.get("PAYMENT_AUTO_CREDIT", "0") == "1"
+
+# Servidor telegram-bot-api propio (p. ej. http://localhost:8081). En modo local las subidas
+# se hacen pasando la ruta del archivo y el límite sube de 50MB a 2000MB
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "").rstrip("/")
+TELEGRAM_LOCAL_MODE = bool(TELEGRAM_API_URL) and os.environ.get("TELEGRAM_LOCAL_MODE", "1") == "1"
+PUBLIC_API_UPLOAD_LIMIT = 50 * 1024 * 1024
+LOCAL_API_UPLOAD_LIMIT = 2000 * 1024 * 1024
+UPLOAD_LIMIT = LOCAL_API_UPLOAD_LIMIT if TELEGRAM_LOCAL_MODE else PUBLIC_API_UPLOAD_LIMIT
+
+# Recepción de updates: "polling" (getUpdates) o "webhook" (servidor aiohttp en el loop del bot,
+# que también sirve la API de monitorización en API_PORT)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+BOT_MODE = "webhook" if os.environ.get("BOT_MODE", "polling") == "webhook" and WEBHOOK_URL else "polling"
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()[:32]
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Procesado de updates: chats distintos en paralelo (hasta UPDATE_CONCURRENCY), cada chat en orden
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "32"))
+UPDATE_MAX_PENDING = 1024
+
+# Pools HTTP hacia la Bot API: uno para llamadas pequeñas (mensajes, ediciones) y otro para subidas
+TG_API_POOL_SIZE = int(os.environ.get("TG_API_POOL_SIZE", "16"))
+TG_MEDIA_POOL_SIZE = int(os.environ.get("TG_MEDIA_POOL_SIZE", "4"))
+TG_POOL_TIMEOUT = 5.0
+TG_KEEPALIVE_EXPIRY = 30.0
+TG_MEDIA_READ_TIMEOUT = int(os.environ.get("TG_MEDIA_READ_TIMEOUT", "120"))
+TG_MEDIA_WRITE_TIMEOUT = int(os.environ.get("TG_MEDIA_WRITE_TIMEOUT", "300"))
+UPLOAD_MAX_RETRIES = 4
+UPLOAD_RETRY_BASE = 2
+
+# Envíos salientes: límites de Telegram (global, por chat privado y por grupo) y prioridades
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", "25"))
+TG_GLOBAL_BURST = 5  # ráfaga + ritmo de un segundo no pasa de los ~30 mensajes/s de Telegram
+TG_CHAT_RATE = 1.0
+TG_CHAT_BURST = 3
+TG_GROUP_RATE = 20 / 60
+TG_RETRY_AFTER_MAX_RETRIES = 3
+PRIORIDAD_USUARIO = 0
+PRIORIDAD_PROGRESO = 1
+PRIORIDAD_AVISOS = 2
+
+# Notificaciones (admins, referidos): cola acotada, agrupación por chat y reintentos
+NOTIFY_QUEUE_SIZE = 1000
+NOTIFY_CONCURRENCY = 4
+NOTIFY_BATCH_WINDOW = 2.0
+NOTIFY_MAX_RETRIES = 3
+NOTIFY_FLUSH_TIMEOUT = 10
+TELEGRAM_MAX_MESSAGE = 4096
+
+# Recordatorio diario: lotes por id con punto de control en la base y ritmo propio por debajo del global
+BROADCAST_HOUR = int(os.environ.get("BROADCAST_HOUR", "15"))
+BROADCAST_BATCH = 500
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "15"))
+BROADCAST_CONCURRENCY = 8
+BROADCAST_ACTIVE_DAYS = int(os.environ.get("BROADCAST_ACTIVE_DAYS", "30"))
+BROADCAST_CHECK_INTERVAL = 300
+
+# Archivos mayores que el límite de envío: dividir sin recodificar o recomprimir en un solo mensaje
+FIT_TARGET_RATIO = 0.92
+FIT_MAX_PARTS = 20
+FIT_PARALLEL_PARTS = 3
+FIT_CHOICE_TIMEOUT = 300
+FIT_DEFAULT_CHOICE = "split"
+FIT_AUDIO_KBPS = 96
+FIT_MIN_VIDEO_KBPS = 200
+
+# Configuración API
+API_HOST = "0.0.0.0"
+API_PORT = int(os.environ.get("PORT", 5000))  # Usar puerto de Render o 5000 por defecto
+API_SECRET_KEY = os.environ.get("API_SECRET_KEY", "default_secret_key_change_in_production")
+
+# Sistema de recompensas
+REWARD_PER_DOWNLOAD_MIN = 0.01
+REWARD_PER_DOWNLOAD_MAX = 0.50
+REFERRAL_REWARD = 5.00
+
+# URLs
+COMUNIDAD_URL = "https://t.me/descargar_videos_de_tiktok"
+DONACION_URL = "https://www.paypal.com/paypalme/JeffersonFaria525"
+RECOMPENSAS_URL = "https://cryptorewards.page.gd/"
+SOPORTE_URL = "https://t.me/soporte_bot"
+
+# Caché de textos renderizados del catálogo de mensajes
+CATALOG_CACHE_SIZE = 2048
+
+# Límites
+MAX_TT_SIZE_NON_PREMIUM = 50 * 1024 * 1024
+YOUTUBE_DAILY_LIMIT = 5
+
+# Autoescalado de workers de descarga
+AUTOSCALE_MIN_WORKERS = int(os.environ.get("AUTOSCALE_MIN_WORKERS", "1"))
+AUTOSCALE_MAX_WORKERS = int(os.environ.get("AUTOSCALE_MAX_WORKERS", "8"))
+AUTOSCALE_INTERVAL = 15
+AUTOSCALE_COOLDOWN = 45
+AUTOSCALE_QUEUE_PER_WORKER = 1
+AUTOSCALE_CPU_HIGH = 0.85
+AUTOSCALE_NET_MIN_GAIN = 0.10
+
+# Reserva de espacio en disco
+DOWNLOAD_DIR = "."
+DISK_OVERHEAD_FACTOR = float(os.environ.get("DISK_OVERHEAD_FACTOR", "2.0"))
+DISK_SAFETY_MARGIN = int(os.environ.get("DISK_SAFETY_MARGIN_MB", "500")) * 1024 * 1024
+DISK_DEFAULT_ESTIMATE = 200 * 1024 * 1024
+DISK_WAIT_TIMEOUT = 600
+
+# Ejecución de descargas: "thread" (ThreadPoolExecutor), "process" (un proceso spawn por descarga)
+# o "remote" (los procesos worker.py toman los trabajos de la cola compartida)
+DOWNLOAD_EXEC_MODE = os.environ.get("DOWNLOAD_EXEC_MODE", "thread")
+DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", "3600"))
+
+# Cola compartida entre el bot y los procesos worker.py
+SHARED_QUEUE_DB = os.environ.get("SHARED_QUEUE_DB", DB_NAME)
+SHARED_QUEUE_POLL = 1.0
+SHARED_QUEUE_HEARTBEAT = 10
+SHARED_QUEUE_STALE = 60
+SHARED_QUEUE_CLAIM_TIMEOUT = int(os.environ.get("SHARED_QUEUE_CLAIM_TIMEOUT", "300"))
+
+# Planificador de la cola: peso de cada nivel (0 = premium, 1 = gratis) y envejecimiento
+SCHEDULER_TIER_WEIGHTS = {
+    0: int(os.environ.get("SCHEDULER_PREMIUM_WEIGHT", "3")),
+    1: int(os.environ.get("SCHEDULER_FREE_WEIGHT", "1"))
+}
+SCHEDULER_AGING_SECONDS = int(os.environ.get("SCHEDULER_AGING_SECONDS", "120"))
+
+# Posición en cola: intervalo de revisión, mínimo entre ediciones por trabajo y ediciones por ciclo
+QUEUE_UPDATE_INTERVAL = 10
+QUEUE_UPDATE_MIN_GAP = 20
+QUEUE_UPDATE_MAX_EDITS = 20
+ETA_DEFAULT_JOB_SECONDS = 60
+
+# Diario de trabajos: reintentos y antigüedad máxima al recuperar tras un reinicio
+JOURNAL_MAX_ATTEMPTS = 3
+JOURNAL_MAX_AGE = 6 * 3600
+JOURNAL_RETENTION = 7 * 86400
+
+# Transcodificación (un proceso ffmpeg por núcleo)
+# Pipeline: concurrencia de cada etapa y cola acotada delante de la subida
+ANALYZE_CONCURRENCY = int(os.environ.get("ANALYZE_CONCURRENCY", "4"))
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "3"))
+UPLOAD_QUEUE_SIZE = int(os.environ.get("UPLOAD_QUEUE_SIZE", "6"))
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", os.cpu_count() or 1))
+TRANSCODE_AUDIO_CODEC = "mp3"
+# passthrough: enviar m4a/mp3 tal cual o remuxear sin recodificar; mp3: recodificar siempre
+AUDIO_MODE = os.environ.get("AUDIO_MODE", "passthrough")
+TELEGRAM_AUDIO_EXTS = ("mp3", "m4a")
+# Fracción de audios sin recodificar que además se recodifican a mp3 para medir el ahorro real
+AUDIO_BENCHMARK_SAMPLE = float(os.environ.get("AUDIO_BENCHMARK_SAMPLE", "0"))
+AUDIO_BENCHMARK_HISTORY = 50
+
+# Estado en memoria: caducidad (segundos) y tamaño máximo de cada almacén
+JOBS_STORE_TTL = int(os.environ.get("JOBS_STORE_TTL", "3600"))
+JOBS_STORE_MAX = int(os.environ.get("JOBS_STORE_MAX", "10000"))
+TRACKERS_STORE_TTL = DOWNLOAD_TIMEOUT + 1800
+TRACKERS_STORE_MAX = 2000
+TX_STORE_TTL = 1800
+TX_STORE_MAX = 5000
+
+class BoundedStore:
+    """Diccionario con caducidad por entrada, tamaño máximo y expulsión LRU.
+    
+    Las entradas caducadas se eliminan al leerlas y en purge(); se puede usar desde el hilo de la API."""
+    
+    def __init__(self, name, ttl, max_items, clock=time.time):
+        self.name = name
+        self.clock = clock
+        self.ttl = ttl
+        self.max_items = max_items
+        self.data = OrderedDict()
+        self.lock = Lock()
+        self.expired = 0
+        self.evicted = 0
+        
+    def _vivo(self, key, ahora):
+        valor, caduca = self.data[key]
+        if caduca < ahora:
+            del self.data[key]
+            self.expired += 1
+            return False
+        return True
+        
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data[key] = (value, self.clock() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_items:
+                self.data.popitem(last=False)
+                self.evicted += 1
+                
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data or not self._vivo(key, self.clock()):
+                return default
+            self.data.move_to_end(key)
+            return self.data[key][0]
+            
+    def __getitem__(self, key):
+        valor = self.get(key, self)
+        if valor is self:
+            raise KeyError(key)
+        return valor
+        
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+        
+    def __delitem__(self, key):
+        with self.lock:
+            del self.data[key]
+            
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            return self.data.pop(key)[0]
+            
+    def __len__(self):
+        return len(self.data)
+        
+    def items(self):
+        """Copia de las entradas vigentes"""
+        ahora = self.clock()
+        with self.lock:
+            return [(k, v) for k, (v, caduca) in self.data.items() if caduca >= ahora]
+            
+    def values(self):
+        return [v for _, v in self.items()]
+        
+    def purge(self):
+        ahora = self.clock()
+        with self.lock:
+            caducadas = [k for k, (_, caduca) in self.data.items() if caduca < ahora]
+            for k in caducadas:
+                del self.data[k]
+            self.expired += len(caducadas)
+        return len(caducadas)
+        
+    def status(self):
+        with self.lock:
+            # Tamaño aproximado: el índice más las claves y los valores de primer nivel
+            memoria = sys.getsizeof(self.data) + sum(
+                sys.getsizeof(k) + sys.getsizeof(v) for k, (v, _) in self.data.items()
+            )
+            return {
+                "entradas": len(self.data),
+                "maximo": self.max_items,
+                "ttl_segundos": self.ttl,
+                "caducadas": self.expired,
+                "expulsadas": self.evicted,
+                "memoria_bytes": memoria
+            }
+
+# Almacenamiento temporal
+download_jobs = BoundedStore("download_jobs", JOBS_STORE_TTL, JOBS_STORE_MAX)
+# (chat_id, message_id) del mensaje de elección de formato -> job_id
+format_prompts = BoundedStore("format_prompts", JOBS_STORE_TTL, JOBS_STORE_MAX)
+# El pool admite el máximo del autoescalado; la concurrencia real la fijan los workers de la cola
+executor = ThreadPoolExecutor(max_workers=AUTOSCALE_MAX_WORKERS)
+current_downloads = {}
+progress_trackers = BoundedStore("progress_trackers", TRACKERS_STORE_TTL, TRACKERS_STORE_MAX)
+
+# Inicializar Flask app para API
+api_app = Flask(__name__)
+api_app.secret_key = API_SECRET_KEY
+
+# Control de admisión por espacio en disco
+class DiskReservationManager:
+    def __init__(self, path=DOWNLOAD_DIR, overhead_factor=DISK_OVERHEAD_FACTOR, safety_margin=DISK_SAFETY_MARGIN):
+        self.path = path
+        self.overhead_factor = overhead_factor
+        self.safety_margin = safety_margin
+        self.reservations = {}
+        self.tracked = {}
+        self.lock = Lock()
+        self.condition = None
+        self.notifiers = set()
+        self.waiting = 0
+        self.rejected = 0
+
+    def _get_condition(self):
+        # Se crea dentro del event loop del bot
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.path).free
+
+    def total_bytes(self):
+        return shutil.disk_usage(self.path).total
+
+    def reserved_bytes(self):
+        with self.lock:
+            return self._pendiente()
+
+    def track(self, key, *prefijos):
+        """Archivos del trabajo (por prefijo): lo que ya escribieron se descuenta de su reserva"""
+        with self.lock:
+            if key in self.reservations:
+                self.tracked.setdefault(key, set()).update(p for p in prefijos if p)
+
+    def _escritos(self):
+        """Bytes ya escritos por cada reserva; el espacio libre del volumen ya los descuenta"""
+        escritos = dict.fromkeys(self.tracked, 0)
+        if not escritos:
+            return escritos
+        try:
+            entradas = list(os.scandir(self.path))
+        except OSError:
+            return escritos
+        for entrada in entradas:
+            for key, prefijos in self.tracked.items():
+                if any(entrada.name.startswith(prefijo) for prefijo in prefijos):
+                    try:
+                        escritos[key] += entrada.stat().st_size
+                    except OSError:
+                        pass
+                    break
+        return escritos
+
+    def _pendiente(self):
+        """Parte de las reservas que aún no ocupa disco (llamar con el lock)"""
+        escritos = self._escritos()
+        return sum(max(0, reservado - escritos.get(key, 0)) for key, reservado in self.reservations.items())
+
+    def bytes_needed(self, estimated_size):
+        """Bytes a reservar: tamaño estimado por el factor de transcodificación"""
+        base = estimated_size if estimated_size and estimated_size > 0 else DISK_DEFAULT_ESTIMATE
+        return int(base * self.overhead_factor)
+
+    def try_reserve(self, key, estimated_size):
+        """Reserva sin esperar; devuelve False si el volumen no tiene espacio"""
+        needed = self.bytes_needed(estimated_size)
+        with self.lock:
+            if key in self.reservations:
+                return True
+            disponible = self.free_bytes() - self._pendiente() - self.safety_margin
+            if disponible < needed:
+                return False
+            self.reservations[key] = needed
+            return True
+
+    async def reserve(self, key, estimated_size, timeout=DISK_WAIT_TIMEOUT):
+        """Espera hasta poder reservar el espacio del trabajo o hasta agotar el timeout"""
+        if self.bytes_needed(estimated_size) + self.safety_margin > self.total_bytes():
+            self.rejected += 1
+            return False
+
+        condition = self._get_condition()
+        deadline = time.time() + timeout
+        async with condition:
+            while not self.try_reserve(key, estimated_size):
+                restante = deadline - time.time()
+                if restante <= 0:
+                    self.rejected += 1
+                    return False
+                self.waiting += 1
+                try:
+                    # Se revisa periódicamente por si otro proceso liberó espacio
+                    await asyncio.wait_for(condition.wait(), timeout=min(restante, 30))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self.waiting -= 1
+        return True
+
+    def _pop(self, key):
+        with self.lock:
+            self.tracked.pop(key, None)
+            return self.reservations.pop(key, None)
+
+    async def _avisar(self):
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    async def release(self, key):
+        """Libera la reserva de un trabajo y despierta a los que esperan espacio"""
+        if self._pop(key) is not None:
+            await self._avisar()
+
+    def release_nowait(self, key):
+        """Como release, para callbacks síncronos: el aviso a los que esperan va en una tarea"""
+        if self._pop(key) is None or self.condition is None:
+            return
+        tarea = asyncio.ensure_future(self._avisar())
+        self.notifiers.add(tarea)
+        tarea.add_done_callback(self.notifiers.discard)
+
+    def status(self):
+        with self.lock:
+            reservado = self._pendiente()
+            reservas = len(self.reservations)
+        libre = self.free_bytes()
+        return {
+            "libre_bytes": libre,
+            "reservado_bytes": reservado,
+            "disponible_bytes": max(0, libre - reservado - self.safety_margin),
+            "margen_seguridad_bytes": self.safety_margin,
+            "factor_transcodificacion": self.overhead_factor,
+            "reservas_activas": reservas,
+            "trabajos_esperando": self.waiting,
+            "trabajos_rechazados": self.rejected
+        }
+
+disk_manager = DiskReservationManager()
+
+# Métricas por etapa (descarga, transcodificación...)
+class StageMetrics:
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.recent = deque(maxlen=500)
+        self.durations = deque(maxlen=50)
+
+    def start(self):
+        self.active += 1
+        return time.time()
+
+    def finish(self, started, ok=True):
+        self.active = max(0, self.active - 1)
+        duracion = time.time() - started
+        if ok:
+            self.completed += 1
+            self.total_time += duracion
+            self.durations.append(duracion)
+        else:
+            self.failed += 1
+        self.recent.append(time.time())
+
+    def rolling_mean(self, default=0.0):
+        """Duración media de los últimos trabajos completados"""
+        if not self.durations:
+            return default
+        return sum(self.durations) / len(self.durations)
+
+    def throughput(self, window=300):
+        """Trabajos terminados por minuto en la ventana indicada"""
+        limite = time.time() - window
+        return sum(1 for ts in self.recent if ts >= limite) * 60.0 / window
+
+    def snapshot(self, queue_depth=0):
+        return {
+            "etapa": self.name,
+            "concurrencia": self.concurrency,
+            "en_cola": queue_depth,
+            "activos": self.active,
+            "ocupacion": round(self.active / self.concurrency, 2) if self.concurrency else 0,
+            "completados": self.completed,
+            "fallidos": self.failed,
+            "duracion_media": round(self.total_time / self.completed, 2) if self.completed else 0,
+            "por_minuto": round(self.throughput(), 2)
+        }
+
+class PipelineStage:
+    """Etapa del pipeline con concurrencia propia y una cola acotada delante.
+    
+    admit() reserva sitio en la cola; si está llena, la etapa anterior espera (contrapresión).
+    slot() ejecuta el trabajo admitido cuando hay un hueco libre."""
+    
+    def __init__(self, name, concurrency, max_queue=0):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.metrics = StageMetrics(name, concurrency)
+        self.admission = None
+        self.slots = None
+        self.admitted = set()
+        self.waiting = 0
+        self.backpressure_waits = 0
+        self.busy_time = 0.0
+        self.created = time.time()
+        
+    def _ensure(self):
+        # Los semáforos se crean dentro del event loop del bot
+        if self.slots is None:
+            self.admission = asyncio.Semaphore(self.concurrency + self.max_queue)
+            self.slots = asyncio.Semaphore(self.concurrency)
+            
+    async def admit(self, job_id):
+        self._ensure()
+        if self.admission.locked():
+            self.backpressure_waits += 1
+        await self.admission.acquire()
+        self.admitted.add(job_id)
+        self.waiting += 1
+        
+    def leave(self, job_id):
+        """Devuelve el sitio de un trabajo admitido; no hace nada si ya se devolvió"""
+        if job_id in self.admitted:
+            self.admitted.discard(job_id)
+            self.waiting = max(0, self.waiting - 1)
+            self.admission.release()
+            
+    @asynccontextmanager
+    async def slot(self, job_id):
+        if job_id not in self.admitted:
+            await self.admit(job_id)
+        try:
+            await self.slots.acquire()
+        except BaseException:
+            self.leave(job_id)
+            raise
+        self.waiting = max(0, self.waiting - 1)
+        inicio = self.metrics.start()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.metrics.finish(inicio, ok)
+            self.busy_time += time.time() - inicio
+            self.slots.release()
+            if job_id in self.admitted:
+                self.admitted.discard(job_id)
+                self.admission.release()
+                
+    def snapshot(self):
+        datos = self.metrics.snapshot(self.waiting)
+        transcurrido = max(1.0, time.time() - self.created)
+        datos.update({
+            "cola_maxima": self.max_queue,
+            "esperas_contrapresion": self.backpressure_waits,
+            "utilizacion": round(self.busy_time / (transcurrido * self.concurrency), 3)
+        })
+        return datos
+
+analysis_stage = PipelineStage("analisis", ANALYZE_CONCURRENCY)
+upload_stage = PipelineStage("subida", UPLOAD_CONCURRENCY, UPLOAD_QUEUE_SIZE)
+
+# Latencia del event loop del bot (comparativa entre modos de ejecución)
+class LoopLagMonitor:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.samples = deque(maxlen=240)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            antes = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - antes - self.interval))
+
+    def snapshot(self):
+        if not self.samples:
+            return {"lag_medio_ms": 0, "lag_p95_ms": 0, "lag_max_ms": 0}
+        ordenadas = sorted(self.samples)
+        return {
+            "lag_medio_ms": round(sum(ordenadas) / len(ordenadas) * 1000, 1),
+            "lag_p95_ms": round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))] * 1000, 1),
+            "lag_max_ms": round(ordenadas[-1] * 1000, 1)
+        }
+
+loop_lag_monitor = LoopLagMonitor()
+
+# Etapa de transcodificación con su propia cola y pool de procesos ffmpeg
+# Un hilo por proceso ffmpeg en curso: espera su salida con wait4 para medir su CPU
+ffmpeg_executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS + 4, thread_name_prefix="ffmpeg")
+
+def ejecutar_medido(cmd, procesos):
+    """Ejecuta el comando y devuelve (código, segundos de CPU de ese proceso, final de stderr).
+    
+    wait4 da el consumo del hijo concreto; RUSAGE_CHILDREN sumaría también los ffmpeg
+    y procesos de descarga que corren a la vez."""
+    with tempfile.TemporaryFile() as errores:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=errores)
+        procesos.append(proc)
+        cpu = 0.0
+        if hasattr(os, "wait4"):
+            try:
+                _, estado, uso = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(estado)
+                cpu = uso.ru_utime + uso.ru_stime
+            except ChildProcessError:
+                # Lo recogió kill() al cancelar
+                proc.wait()
+        else:
+            proc.wait()
+        errores.seek(0, os.SEEK_END)
+        errores.seek(max(0, errores.tell() - 300))
+        return proc.returncode, cpu, errores.read().decode(errors='ignore')
+
+async def medir_proceso(cmd):
+    """Ejecuta el comando sin bloquear el loop; devuelve (segundos de reloj, segundos de CPU)"""
+    procesos = []
+    inicio = time.time()
+    try:
+        codigo, cpu, errores = await asyncio.wrap_future(ffmpeg_executor.submit(ejecutar_medido, cmd, procesos))
+    except asyncio.CancelledError:
+        for proc in procesos:
+            proc.kill()
+        raise
+    if codigo != 0:
+        raise Exception(f"{os.path.basename(cmd[0])} falló: {errores}")
+    return time.time() - inicio, cpu
+
+def planificar_audio(filename, acodec=None, vcodec=None):
+    """Decide si el audio se envía tal cual, se remuxea o se recodifica a mp3"""
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+    acodec = (acodec or "").lower()
+    sin_video = not vcodec or vcodec == "none"
+    
+    if AUDIO_MODE != "passthrough":
+        return "passthrough" if ext == TRANSCODE_AUDIO_CODEC and sin_video else "transcode"
+    if ext in TELEGRAM_AUDIO_EXTS and sin_video:
+        return "passthrough"
+    if acodec.startswith("mp4a") or acodec.startswith("aac") or acodec == "mp3":
+        return "remux"
+    return "transcode"
+
+class TranscodeStage:
+    # Mismos parámetros que FFmpegExtractAudio (mp3 VBR calidad 5), un hilo por proceso
+    ARGS_MP3 = ["-vn", "-threads", "1", "-codec:a", "libmp3lame", "-q:a", "5"]
+    
+    def __init__(self, workers=TRANSCODE_WORKERS):
+        self.max_workers = workers
+        self.queue = None
+        self.workers = []
+        self.metrics = StageMetrics("transcodificacion", workers)
+        self.modes = {
+            modo: {"trabajos": 0, "segundos_reloj": 0.0, "segundos_cpu": 0.0}
+            for modo in ("passthrough", "remux", "transcode", "segmentar", "ajustar")
+        }
+        self.comparaciones = deque(maxlen=AUDIO_BENCHMARK_HISTORY)
+
+    async def start(self):
+        """Inicia un worker por núcleo; cada uno lanza un proceso ffmpeg"""
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        for i in range(self.max_workers):
+            self.workers.append(asyncio.create_task(self._worker(i)))
+        log_event(f"🎛️ Etapa de transcodificación iniciada con {self.max_workers} procesos")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def qsize(self):
+        return self.queue.qsize() if self.queue else 0
+
+    async def submit(self, input_path, plan="transcode", acodec=None):
+        """Procesa el audio según el plan y devuelve el archivo a enviar"""
+        base, ext = os.path.splitext(input_path)
+        
+        if plan == "passthrough":
+            self._record("passthrough", 0.0, 0.0)
+            await self._muestrear(input_path, "passthrough", 0.0, 0.0)
+            return input_path
+            
+        if plan == "remux":
+            # Copia del stream sin recodificar: no pasa por la cola de CPU
+            destino_ext = "mp3" if (acodec or "").lower() == "mp3" else "m4a"
+            output_path = f"{base}.{destino_ext}"
+            if output_path == input_path:
+                self._record("passthrough", 0.0, 0.0)
+                await self._muestrear(input_path, "passthrough", 0.0, 0.0)
+                return input_path
+            reloj, cpu = await self.copy(input_path, output_path, ["-vn", "-codec:a", "copy"], "remux")
+            await self._muestrear(input_path, "remux", reloj, cpu)
+            return output_path
+            
+        if ext.lower() == f".{TRANSCODE_AUDIO_CODEC}":
+            self._record("passthrough", 0.0, 0.0)
+            return input_path
+        return await self.encode(input_path, f"{base}.{TRANSCODE_AUDIO_CODEC}", self.ARGS_MP3, "transcode")
+        
+    async def _muestrear(self, input_path, modo, reloj, cpu):
+        """En una fracción de trabajos mide también la recodificación a mp3 del mismo archivo"""
+        if AUDIO_BENCHMARK_SAMPLE <= 0 or random.random() >= AUDIO_BENCHMARK_SAMPLE:
+            return
+        referencia = f"{os.path.splitext(input_path)[0]}_referencia.{TRANSCODE_AUDIO_CODEC}"
+        try:
+            reloj_mp3, cpu_mp3 = await medir_proceso(self._comando(input_path, referencia, self.ARGS_MP3))
+        except Exception as e:
+            log_event(f"⚠️ No se pudo medir la recodificación de referencia: {e}")
+            return
+        finally:
+            if os.path.exists(referencia):
+                os.remove(referencia)
+        self.comparaciones.append({
+            "modo": modo,
+            "segundos_reloj": round(reloj, 3),
+            "segundos_cpu": round(cpu, 3),
+            "mp3_segundos_reloj": round(reloj_mp3, 3),
+            "mp3_segundos_cpu": round(cpu_mp3, 3)
+        })
+
+    async def copy(self, input_path, output_path, args, modo):
+        """Copia de streams sin recodificar (remux, segmentado): apenas usa CPU y no espera turno"""
+        return await self._run_ffmpeg(input_path, output_path, args, modo)
+
+    async def encode(self, input_path, output_path, args, modo):
+        """Recodificación que consume CPU: espera turno en la cola de la etapa"""
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((input_path, output_path, args, modo, future))
+        return await future
+
+    async def _worker(self, worker_id):
+        while True:
+            input_path, output_path, args, modo, future = await self.queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                inicio = self.metrics.start()
+                try:
+                    await self._run_ffmpeg(input_path, output_path, args, modo)
+                except asyncio.CancelledError:
+                    self.metrics.finish(inicio, False)
+                    raise
+                except Exception as e:
+                    self.metrics.finish(inicio, False)
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                self.metrics.finish(inicio, True)
+                if not future.done():
+                    future.set_result(output_path)
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def _comando(input_path, output_path, args):
+        return ["ffmpeg", "-y", "-loglevel", "error", "-i", input_path, *args, output_path]
+
+    async def _run_ffmpeg(self, input_path, output_path, args, modo):
+        reloj, cpu = await medir_proceso(self._comando(input_path, output_path, args))
+        self._record(modo, reloj, cpu)
+        return reloj, cpu
+
+    def _record(self, modo, segundos_reloj, segundos_cpu):
+        datos = self.modes[modo]
+        datos["trabajos"] += 1
+        datos["segundos_reloj"] += segundos_reloj
+        datos["segundos_cpu"] += max(0.0, segundos_cpu)
+
+    def benchmark(self):
+        """Coste medio por modo y ahorro estimado frente a recodificar siempre a mp3"""
+        resumen = {}
+        for modo, datos in self.modes.items():
+            n = datos["trabajos"]
+            resumen[modo] = {
+                "trabajos": n,
+                "reloj_medio": round(datos["segundos_reloj"] / n, 3) if n else 0,
+                "cpu_medio": round(datos["segundos_cpu"] / n, 3) if n else 0
+            }
+        
+        transcode = resumen["transcode"]
+        ahorro_reloj = 0.0
+        ahorro_cpu = 0.0
+        for modo in ("passthrough", "remux"):
+            n = resumen[modo]["trabajos"]
+            ahorro_reloj += n * max(0.0, transcode["reloj_medio"] - resumen[modo]["reloj_medio"])
+            ahorro_cpu += n * max(0.0, transcode["cpu_medio"] - resumen[modo]["cpu_medio"])
+        
+        resumen["ahorro_estimado"] = {
+            "segundos_reloj": round(ahorro_reloj, 2),
+            "segundos_cpu": round(ahorro_cpu, 2)
+        }
+        
+        # Ahorro medido sobre el mismo archivo en los trabajos muestreados
+        comparaciones = list(self.comparaciones)
+        n = len(comparaciones)
+        resumen["por_trabajo"] = {
+            "muestra": AUDIO_BENCHMARK_SAMPLE,
+            "trabajos": n,
+            "ahorro_reloj_medio": round(sum(c["mp3_segundos_reloj"] - c["segundos_reloj"] for c in comparaciones) / n, 3) if n else 0,
+            "ahorro_cpu_medio": round(sum(c["mp3_segundos_cpu"] - c["segundos_cpu"] for c in comparaciones) / n, 3) if n else 0,
+            "ultimos": comparaciones[-10:]
+        }
+        return resumen
+
+transcode_stage = TranscodeStage()
+
+async def duracion_media(path):
+    """Duración en segundos según ffprobe (0 si no se puede leer)"""
+    proc = await asyncio.create_subprocess_exec(
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    salida, _ = await proc.communicate()
+    try:
+        return float(salida.decode().strip())
+    except ValueError:
+        return 0.0
+
+class DeliveryFitter:
+    """Adapta al límite de envío los archivos que lo superan"""
+    
+    def __init__(self, ratio=FIT_TARGET_RATIO, max_parts=FIT_MAX_PARTS):
+        self.ratio = ratio
+        self.max_parts = max_parts
+        self.counts = {"split": 0, "reencode": 0, "fallidos": 0}
+        
+    def parts_needed(self, size, limit=None):
+        return math.ceil(size / ((limit or UPLOAD_LIMIT) * self.ratio))
+        
+    async def split(self, path, limit=None):
+        """Divide por duración copiando los streams; devuelve las partes en orden"""
+        limite = limit or UPLOAD_LIMIT
+        duracion = await duracion_media(path)
+        if duracion <= 0:
+            self.counts["fallidos"] += 1
+            raise Exception("No se pudo leer la duración del archivo")
+            
+        base, ext = os.path.splitext(path)
+        directorio = os.path.dirname(path) or "."
+        prefijo = os.path.basename(base) + "_parte"
+        n = self.parts_needed(os.path.getsize(path), limite)
+        
+        def _partes():
+            return sorted(os.path.join(directorio, f) for f in os.listdir(directorio) if f.startswith(prefijo))
+            
+        while n <= self.max_parts:
+            try:
+                await transcode_stage.copy(
+                    path, f"{base}_parte%03d{ext}",
+                    ["-map", "0", "-c", "copy", "-f", "segment", "-segment_time", f"{duracion / n:.3f}", "-reset_timestamps", "1"],
+                    "segmentar"
+                )
+            except BaseException:
+                # ffmpeg puede haber escrito algunos segmentos antes de fallar o de cancelarse
+                for parte in _partes():
+                    os.remove(parte)
+                self.counts["fallidos"] += 1
+                raise
+            partes = _partes()
+            if partes and all(os.path.getsize(parte) <= limite for parte in partes):
+                self.counts["split"] += 1
+                return partes
+            # Los cortes caen en keyframes y una parte puede pasarse: se repite con una más
+            for parte in partes:
+                os.remove(parte)
+            n += 1
+            
+        self.counts["fallidos"] += 1
+        raise Exception(f"Harían falta más de {self.max_parts} partes para enviar este archivo")
+        
+    async def reencode(self, path, tipo, limit=None):
+        """Recomprime con el bitrate justo para caber en un solo envío"""
+        limite = limit or UPLOAD_LIMIT
+        duracion = await duracion_media(path)
+        if duracion <= 0:
+            self.counts["fallidos"] += 1
+            raise Exception("No se pudo leer la duración del archivo")
+            
+        kbps = limite * self.ratio * 8 / 1000 / duracion
+        base, _ = os.path.splitext(path)
+        if tipo.endswith("audio"):
+            salida = f"{base}_ajustado.mp3"
+            args = ["-vn", "-threads", "1", "-codec:a", "libmp3lame", "-b:a", f"{int(min(kbps, 320))}k"]
+        else:
+            video_kbps = int(kbps - FIT_AUDIO_KBPS)
+            if video_kbps < FIT_MIN_VIDEO_KBPS:
+                self.counts["fallidos"] += 1
+                raise Exception("El vídeo es demasiado largo para recomprimirlo en un solo envío")
+            salida = f"{base}_ajustado.mp4"
+            args = [
+                "-threads", "1", "-c:v", "libx264", "-preset", "veryfast",
+                "-b:v", f"{video_kbps}k", "-maxrate", f"{video_kbps}k", "-bufsize", f"{video_kbps * 2}k",
+                "-c:a", "aac", "-b:a", f"{FIT_AUDIO_KBPS}k", "-movflags", "+faststart"
+            ]
+            
+        await transcode_stage.encode(path, salida, args, "ajustar")
+        if os.path.getsize(salida) > limite:
+            os.remove(salida)
+            self.counts["fallidos"] += 1
+            raise Exception("La recompresión no bajó del límite de envío")
+        self.counts["reencode"] += 1
+        return [salida]
+
+delivery_fitter = DeliveryFitter()
+
+# Cancelación de trabajos por el usuario
+JOB_STAGES = ("cola", "analisis", "descarga", "transcodificacion", "subida")
+
+class JobCancelled(Exception):
+    pass
+
+class CancellationToken:
+    def __init__(self, job_id, user_id):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.cancelled = False
+        self.stage = "cola"
+        self.tracker = None
+        
+    def cancel(self):
+        self.cancelled = True
+        
+    def check(self):
+        """Lanza JobCancelled si el usuario canceló el trabajo"""
+        if self.cancelled:
+            raise JobCancelled(f"Trabajo {self.job_id} cancelado en etapa '{self.stage}'")
+
+# Índice ordenado de la cola: da la posición (rango) de cada trabajo en O(log n)
+class _NodoRango:
+    __slots__ = ("clave", "prioridad", "izq", "der", "tam")
+    
+    def __init__(self, clave):
+        self.clave = clave
+        self.prioridad = random.random()
+        self.izq = None
+        self.der = None
+        self.tam = 1
+
+def _tam(nodo):
+    return nodo.tam if nodo is not None else 0
+
+class RankIndex:
+    """Árbol de estadísticos de orden (treap con el tamaño de cada subárbol).
+    
+    Insertar, borrar, mínimo y rango cuestan O(log n) esperado."""
+    
+    def __init__(self):
+        self.raiz = None
+        
+    def __len__(self):
+        return _tam(self.raiz)
+        
+    def __iter__(self):
+        claves = []
+        pila = []
+        nodo = self.raiz
+        while pila or nodo is not None:
+            while nodo is not None:
+                pila.append(nodo)
+                nodo = nodo.izq
+            nodo = pila.pop()
+            claves.append(nodo.clave)
+            nodo = nodo.der
+        return iter(claves)
+        
+    @staticmethod
+    def _actualizar(nodo):
+        nodo.tam = 1 + _tam(nodo.izq) + _tam(nodo.der)
+        
+    def _dividir(self, nodo, clave, incluida):
+        """Separa en (menores, resto); con incluida la clave igual va a la izquierda"""
+        if nodo is None:
+            return None, None
+        if nodo.clave < clave or (incluida and nodo.clave == clave):
+            izq, der = self._dividir(nodo.der, clave, incluida)
+            nodo.der = izq
+            self._actualizar(nodo)
+            return nodo, der
+        izq, der = self._dividir(nodo.izq, clave, incluida)
+        nodo.izq = der
+        self._actualizar(nodo)
+        return izq, nodo
+        
+    def _unir(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if a.prioridad > b.prioridad:
+            a.der = self._unir(a.der, b)
+            self._actualizar(a)
+            return a
+        b.izq = self._unir(a, b.izq)
+        self._actualizar(b)
+        return b
+        
+    def insert(self, key):
+        izq, der = self._dividir(self.raiz, key, False)
+        self.raiz = self._unir(self._unir(izq, _NodoRango(key)), der)
+        
+    def remove(self, key):
+        izq, der = self._dividir(self.raiz, key, False)
+        igual, der = self._dividir(der, key, True)
+        self.raiz = self._unir(izq, der)
+        return igual is not None
+        
+    def rank(self, key):
+        """Número de claves que van por delante"""
+        rango = 0
+        nodo = self.raiz
+        while nodo is not None:
+            if nodo.clave < key:
+                rango += _tam(nodo.izq) + 1
+                nodo = nodo.der
+            else:
+                nodo = nodo.izq
+        return rango
+        
+    def first(self):
+        nodo = self.raiz
+        if nodo is None:
+            return None
+        while nodo.izq is not None:
+            nodo = nodo.izq
+        return nodo.clave
+
+# Planificador: niveles ponderados (premium/gratis), round-robin por usuario y envejecimiento.
+# Cada trabajo recibe una etiqueta de tiempo virtual (fair queueing): los trabajos sucesivos
+# de un mismo usuario van en rondas distintas y el peso del nivel acelera sus rondas.
+# Los índices solo contienen trabajos elegibles (los de usuarios con una tarea activa salen
+# hasta que termina); los que superan el umbral de antigüedad pasan a sus propios índices.
+# Así elegir el siguiente y calcular la posición cuestan O(log n) sin recorrer la cola.
+# La API de Flask lee la cola desde su hilo: toda modificación y lectura va bajo self.lock
+# y el envejecimiento solo se aplica al modificar, nunca al leer.
+class FairScheduler:
+    def __init__(self, weights=SCHEDULER_TIER_WEIGHTS, aging_seconds=SCHEDULER_AGING_SECONDS):
+        self.weights = weights
+        self.aging_seconds = aging_seconds
+        self.index = RankIndex()
+        self.fresh = RankIndex()
+        self.aged_by_age = RankIndex()
+        self.aged_keys = RankIndex()
+        self.entries = {}
+        self.job_keys = {}
+        self.user_keys = {}
+        self.user_tags = {}
+        self.user_pending = {}
+        self.virtual_time = 0.0
+        self.seq = 0
+        self.busy_users = set()
+        self.condition = None
+        self.waiting_workers = 0
+        self.aged = 0
+        self.aging_limit = float("-inf")
+        self.lock = Lock()
+        
+    def _get_condition(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+        
+    def _tier_for(self, priority):
+        return min(self.weights) if priority < 1 else max(self.weights)
+        
+    def qsize(self):
+        return len(self.entries)
+        
+    def _indexar(self, clave):
+        self.index.insert(clave)
+        self.fresh.insert((self.entries[clave][3], clave))
+        
+    def _desindexar(self, clave):
+        self.index.remove(clave)
+        por_edad = (self.entries[clave][3], clave)
+        if self.aged_by_age.remove(por_edad):
+            self.aged_keys.remove(clave)
+        else:
+            self.fresh.remove(por_edad)
+            
+    def _envejecer(self):
+        """Mueve a los índices de envejecidos los trabajos elegibles que superaron el umbral
+        y guarda en aging_limit el instante de encolado a partir del cual no lo están"""
+        limite = time.time() - self.aging_seconds
+        self.aging_limit = limite
+        while True:
+            mas_antiguo = self.fresh.first()
+            if mas_antiguo is None or mas_antiguo[0] > limite:
+                return
+            self.fresh.remove(mas_antiguo)
+            self.aged_by_age.insert(mas_antiguo)
+            self.aged_keys.insert(mas_antiguo[1])
+        
+    def _ocupar(self, user_id):
+        """El usuario empieza una tarea: sus trabajos dejan de ser elegibles"""
+        if user_id in self.busy_users:
+            return
+        self.busy_users.add(user_id)
+        for clave in self.user_keys.get(user_id, ()):
+            self._desindexar(clave)
+        
+    async def put(self, priority, task_id, task_data):
+        job_id, user_id = task_data[0], task_data[1]
+        tier = self._tier_for(priority)
+        peso = max(1, self.weights[tier])
+        usuario = (tier, user_id)
+        
+        with self.lock:
+            etiqueta = max(self.virtual_time * peso, self.user_tags.get(usuario, 0)) + 1
+            self.user_tags[usuario] = etiqueta
+            self.user_pending[usuario] = self.user_pending.get(usuario, 0) + 1
+            self.seq += 1
+            clave = (etiqueta / peso, self.seq)
+            
+            self.entries[clave] = (priority, task_id, task_data, time.time(), tier)
+            self.job_keys[job_id] = clave
+            self.user_keys.setdefault(user_id, set()).add(clave)
+            if user_id not in self.busy_users:
+                self._indexar(clave)
+            self._envejecer()
+        
+        condition = self._get_condition()
+        async with condition:
+            condition.notify()
+            
+    async def get(self):
+        """Espera hasta que haya un trabajo elegible y marca a su usuario como ocupado"""
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                with self.lock:
+                    clave = self._pick()
+                    if clave is not None:
+                        priority, task_id, task_data = self._take(clave)[:3]
+                        self._ocupar(task_data[1])
+                        return priority, task_id, task_data
+                self.waiting_workers += 1
+                try:
+                    await condition.wait()
+                finally:
+                    self.waiting_workers -= 1
+                    
+    async def release_user(self, user_id):
+        """El usuario terminó su tarea; sus trabajos en cola vuelven a ser elegibles"""
+        with self.lock:
+            if user_id in self.busy_users:
+                self.busy_users.discard(user_id)
+                for clave in self.user_keys.get(user_id, ()):
+                    self._indexar(clave)
+            self._envejecer()
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+            
+    def remove(self, job_id):
+        with self.lock:
+            clave = self.job_keys.get(job_id)
+            if clave is None:
+                return False
+            self._take(clave, despachado=False)
+            self._envejecer()
+            return True
+        
+    def _rango(self, clave):
+        """Trabajos elegibles que _pick despacharía antes: primero los envejecidos por
+        antigüedad y después el resto por etiqueta"""
+        entrada = self.entries[clave]
+        if entrada[3] <= self.aging_limit:
+            return self.aged_by_age.rank((entrada[3], clave))
+        return len(self.aged_by_age) + self.index.rank(clave) - self.aged_keys.rank(clave)
+        
+    def rank(self, job_id):
+        """Posición del trabajo en la cola (0 = el siguiente), o None si ya no está.
+        
+        Los trabajos de usuarios ocupados no cuentan; los de un usuario ocupado reciben la
+        posición que tendrían al quedar libre. Refleja el envejecimiento aplicado en la
+        última modificación de la cola."""
+        with self.lock:
+            clave = self.job_keys.get(job_id)
+            if clave is None:
+                return None
+            return self._rango(clave)
+        
+    def jobs(self):
+        """Trabajos en cola en orden de despacho: (rango, entrada)"""
+        with self.lock:
+            envejecidos = [clave for _, clave in self.aged_by_age]
+            ya = set(envejecidos)
+            orden = envejecidos + [clave for clave in self.index if clave not in ya]
+            trabajos = [(rango, self.entries[clave]) for rango, clave in enumerate(orden)]
+            # Los de usuarios ocupados van detrás, con la posición que tendrían al quedar libres
+            ocupados = sorted(clave for user_id in self.busy_users for clave in self.user_keys.get(user_id, ()))
+            for clave in ocupados:
+                trabajos.append((self._rango(clave), self.entries[clave]))
+            return trabajos
+        
+    def _take(self, clave, despachado=True):
+        entrada = self.entries[clave]
+        user_id = entrada[2][1]
+        if user_id not in self.busy_users:
+            self._desindexar(clave)
+        del self.entries[clave]
+        self.job_keys.pop(entrada[2][0], None)
+        claves_usuario = self.user_keys.get(user_id)
+        if claves_usuario is not None:
+            claves_usuario.discard(clave)
+            if not claves_usuario:
+                del self.user_keys[user_id]
+        
+        usuario = (entrada[4], entrada[2][1])
+        self.user_pending[usuario] -= 1
+        if self.user_pending[usuario] <= 0:
+            del self.user_pending[usuario]
+            del self.user_tags[usuario]
+        if despachado:
+            self.virtual_time = max(self.virtual_time, clave[0])
+        return entrada
+        
+    def _pick(self):
+        # Envejecimiento: el trabajo elegible más antiguo pasa primero si superó el umbral
+        self._envejecer()
+        mas_antiguo = self.aged_by_age.first()
+        primero = self.index.first()
+        if mas_antiguo is not None and mas_antiguo[1] != primero:
+            self.aged += 1
+            return mas_antiguo[1]
+        return primero
+        
+    def snapshot(self):
+        with self.lock:
+            por_nivel = {str(tier): 0 for tier in self.weights}
+            for entrada in self.entries.values():
+                por_nivel[str(entrada[4])] += 1
+            return {
+                "en_cola": len(self.entries),
+                "elegibles": len(self.index),
+                "envejecidos": len(self.aged_by_age),
+                "por_nivel": por_nivel,
+                "usuarios_en_espera": len(self.user_pending),
+                "usuarios_ocupados": len(self.busy_users),
+                "workers_esperando": self.waiting_workers,
+                "pesos": {str(tier): peso for tier, peso in self.weights.items()},
+                "promovidos_por_antiguedad": self.aged
+            }
+
+# Diario persistente de trabajos (SQLite) para recuperar la cola tras un reinicio
+JOURNAL_STATES = {
+    "cola": "queued",
+    "analisis": "analyzing",
+    "descarga": "downloading",
+    "transcodificacion": "transcoding",
+    "subida": "uploading",
+    "completado": "done"
+}
+JOURNAL_ACTIVE_STATES = ("queued", "analyzing", "downloading", "transcoding", "uploading")
+
+class JobJournal:
+    def __init__(self):
+        self.writes = 0
+        self.write_time = 0.0
+        self.jobs = 0
+        
+    def _execute(self, query, params):
+        inicio = time.perf_counter()
+        try:
+            conn = conectar_db()
+            conn.execute(query, params)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            log_event(f"⚠️ Error escribiendo en el diario de trabajos: {e}")
+        finally:
+            self.writes += 1
+            self.write_time += time.perf_counter() - inicio
+            
+    def enqueue(self, priority, task_data):
+        job_id, user_id, url, tipo, chat_id, message_id = task_data
+        ahora = int(time.time())
+        self.jobs += 1
+        self._execute("""
+            INSERT INTO job_journal (job_id, user_id, url, tipo, chat_id, message_id, priority, state, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)
+            ON CONFLICT(job_id) DO UPDATE SET state = 'queued', priority = excluded.priority, updated_at = excluded.updated_at
+        """, (job_id, user_id, url, tipo, chat_id, message_id, priority, ahora, ahora))
+        
+    def set_state(self, job_id, state, error=None):
+        self._execute(
+            "UPDATE job_journal SET state = ?, error = COALESCE(?, error), updated_at = ? WHERE job_id = ?",
+            (state, error, int(time.time()), job_id)
+        )
+        
+    def finish(self, job_id):
+        """Un trabajo que termina sin llegar a 'done' ni 'cancelled' queda como fallido"""
+        self._execute(
+            "UPDATE job_journal SET state = 'failed', updated_at = ? WHERE job_id = ? AND state NOT IN ('done', 'failed', 'cancelled')",
+            (int(time.time()), job_id)
+        )
+        
+    def mark_attempt(self, job_id):
+        self._execute("UPDATE job_journal SET attempts = attempts + 1 WHERE job_id = ?", (job_id,))
+        
+    def interrupted(self):
+        conn = conectar_db()
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT * FROM job_journal WHERE state IN ({','.join('?' * len(JOURNAL_ACTIVE_STATES))}) ORDER BY created_at",
+            JOURNAL_ACTIVE_STATES
+        )
+        filas = [dict(row) for row in cur.fetchall()]
+        conn.close()
+        return filas
+        
+    def purge(self, retention=JOURNAL_RETENTION):
+        self._execute(
+            "DELETE FROM job_journal WHERE state IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+            (int(time.time()) - retention,)
+        )
+        
+    def status(self):
+        conn = conectar_db()
+        cur = conn.cursor()
+        cur.execute("SELECT state, COUNT(*) FROM job_journal GROUP BY state")
+        por_estado = {row[0]: row[1] for row in cur.fetchall()}
+        conn.close()
+        return {
+            "por_estado": por_estado,
+            "escrituras": self.writes,
+            "ms_por_escritura": round(self.write_time / self.writes * 1000, 3) if self.writes else 0,
+            "ms_por_trabajo": round(self.write_time / self.jobs * 1000, 3) if self.jobs else 0
+        }
+
+job_journal = JobJournal()
+
+# Sistema de colas mejorado
+class DownloadQueueSystem:
+    def __init__(self, max_workers=3):
+        self.max_workers = max_workers
+        self.priority_queue = FairScheduler()
+        self.active_tasks = {}
+        self.task_counter = 0
+        self.workers = []
+        self.is_running = True
+        self.app = None
+        self.post_tasks = set()
+        self.download_metrics = StageMetrics("descarga", max_workers)
+        self.slot_metrics = StageMetrics("worker", max_workers)
+        self.queue_messages = {}
+        self.cancel_tokens = {}
+        self.running_jobs = {}
+        self.cancellations = {etapa: 0 for etapa in JOB_STAGES}
+        self.worker_seq = 0
+        self.idle_workers = {}
+        self.retire_pending = 0
+        self.downloaded_bytes = deque(maxlen=500)
+        self.upload_bytes = deque(maxlen=200)
+        self.fit_choices = {}
+        self.disk_ready = {}
+        self.pending_keys = {}
+        self.job_keys = {}
+        self.duplicates = {"job_id": 0, "mismo_video": 0}
+        
+    def set_application(self, app):
+        self.app = app
+        
+    async def start(self):
+        """Inicia los workers de la cola"""
+        for i in range(self.max_workers):
+            self.spawn_worker()
+        log_event(f"🚀 Sistema de colas iniciado con {self.max_workers} workers")
+        
+    def spawn_worker(self):
+        worker_id = self.worker_seq
+        self.worker_seq += 1
+        worker = asyncio.create_task(self._worker(worker_id))
+        self.workers.append(worker)
+        return worker
+        
+    def alive_workers(self):
+        return sum(1 for w in self.workers if not w.done())
+        
+    def scale_to(self, target):
+        """Ajusta el número de workers; los sobrantes ociosos se retiran al momento"""
+        actuales = self.alive_workers() - self.retire_pending
+        self.max_workers = target
+        self.download_metrics.concurrency = target
+        self.slot_metrics.concurrency = target
+        
+        if target > actuales:
+            cancelar_retiros = min(self.retire_pending, target - actuales)
+            self.retire_pending -= cancelar_retiros
+            for _ in range(target - actuales - cancelar_retiros):
+                self.spawn_worker()
+        elif target < actuales:
+            sobrantes = actuales - target
+            for worker_id, worker in list(self.idle_workers.items()):
+                if sobrantes == 0:
+                    break
+                self.idle_workers.pop(worker_id, None)
+                worker.cancel()
+                sobrantes -= 1
+            # Los que están ocupados se retiran al terminar su trabajo
+            self.retire_pending += sobrantes
+            
+    def network_throughput(self, window=AUTOSCALE_INTERVAL * 4):
+        """Bytes por segundo descargados (archivos completados) en la ventana"""
+        limite = time.time() - window
+        return sum(tamano for ts, tamano in self.downloaded_bytes if ts >= limite) / window
+        
+    def upload_stats(self):
+        """Duración y velocidad reales de las últimas subidas a Telegram"""
+        if not self.upload_bytes:
+            return {"subidas": 0, "segundos_media": 0, "mb_por_segundo": 0}
+        total_bytes = sum(tamano for _, tamano, _ in self.upload_bytes)
+        total_segundos = sum(duracion for _, _, duracion in self.upload_bytes)
+        return {
+            "subidas": len(self.upload_bytes),
+            "segundos_media": round(total_segundos / len(self.upload_bytes), 2),
+            "mb_por_segundo": round(total_bytes / total_segundos / (1024 * 1024), 2)
+        }
+        
+    async def stop(self):
+        """Detiene todos los workers"""
+        self.is_running = False
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        
+    async def add_task(self, priority, task_data):
+        """Añade una tarea a la cola con prioridad"""
+        self.task_counter += 1
+        task_id = self.task_counter
+        job_id, user_id, url, tipo = task_data[:4]
+        if job_id in self.cancel_tokens:
+            # Cada job_id se admite una sola vez mientras siga vivo
+            self.duplicates["job_id"] += 1
+            log_event(f"♊ Trabajo {job_id} ya admitido, se ignora el duplicado")
+            return None
+        self.cancel_tokens[job_id] = CancellationToken(job_id, user_id)
+        clave = (user_id, clave_video(url), tipo)
+        self.pending_keys.setdefault(clave, job_id)
+        self.job_keys[job_id] = clave
+        job_journal.enqueue(priority, task_data)
+        await self.priority_queue.put(priority, task_id, task_data)
+        return task_id
+        
+    def find_pending(self, user_id, url, tipo):
+        """job_id del trabajo vivo del usuario para el mismo vídeo y formato, si lo hay"""
+        existente = self.pending_keys.get((user_id, clave_video(url), tipo))
+        token = self.cancel_tokens.get(existente)
+        if token is None or token.cancelled:
+            return None
+        return existente
+        
+    def _release_key(self, job_id):
+        clave = self.job_keys.pop(job_id, None)
+        if clave is not None and self.pending_keys.get(clave) == job_id:
+            del self.pending_keys[clave]
+            
+    def remove_queued(self, job_id):
+        """Quita de la cola las entradas de un trabajo"""
+        return self.priority_queue.remove(job_id)
+        
+    def cancel_job(self, job_id, user_id):
+        """Cancela un trabajo del usuario en cualquier etapa; devuelve la etapa o None"""
+        token = self.cancel_tokens.get(job_id)
+        if not token or token.user_id != user_id or token.stage == "completado":
+            return None
+        if token.cancelled:
+            return token.stage
+            
+        token.cancel()
+        self.cancellations[token.stage] = self.cancellations.get(token.stage, 0) + 1
+        job_journal.set_state(job_id, "cancelled")
+        if token.tracker:
+            # Evita que una edición de progreso pise el mensaje de cancelación
+            token.tracker.close()
+        
+        if self.remove_queued(job_id):
+            self.cancel_tokens.pop(job_id, None)
+            self._release_key(job_id)
+            self._liberar_preparado(job_id)
+            
+        tarea = self.running_jobs.get(job_id)
+        if tarea and not tarea.done():
+            # Cancelar la tarea aborta la descarga, ffmpeg y la subida en curso
+            tarea.cancel()
+            
+        log_event(f"🛑 Trabajo {job_id} cancelado en etapa '{token.stage}'")
+        return token.stage
+        
+    def estimate(self, job_id, tipo=""):
+        """Posición en cola (0 = siguiente) y segundos estimados hasta la entrega"""
+        rango = self.priority_queue.rank(job_id)
+        if rango is None:
+            return None, None
+        slot = self.slot_metrics.rolling_mean(ETA_DEFAULT_JOB_SECONDS)
+        workers = max(1, self.max_workers)
+        
+        espera = (rango // workers) * slot
+        if len(self.active_tasks) >= workers:
+            # De media, a los trabajos en curso les queda la mitad
+            espera += slot / 2
+        propio = slot
+        if tipo.endswith("audio"):
+            propio += transcode_stage.metrics.rolling_mean(0)
+        return rango, int(espera + propio)
+        
+    def _stage(self, token, stage):
+        token.stage = stage
+        job_journal.set_state(token.job_id, JOURNAL_STATES[stage])
+        
+    def _finish_job(self, job_id, task=None):
+        if task is not None and self.running_jobs.get(job_id) is not task:
+            return
+        self.running_jobs.pop(job_id, None)
+        token = self.cancel_tokens.pop(job_id, None)
+        if token and token.tracker and progress_trackers.get(token.user_id) is token.tracker:
+            progress_trackers.pop(token.user_id)
+        self._release_key(job_id)
+        job_journal.finish(job_id)
+        
+    async def recover(self):
+        """Reencola los trabajos que quedaron a medias tras un reinicio o caída"""
+        while self.app is None or not self.app.running:
+            await asyncio.sleep(1)
+            
+        job_journal.purge()
+        shared_queue.purge()
+        pendientes = job_journal.interrupted()
+        if not pendientes:
+            return
+        log_event(f"♻️ Recuperando {len(pendientes)} trabajos interrumpidos")
+        
+        for job in pendientes:
+            task_data = (job["job_id"], job["user_id"], job["url"], job["tipo"], job["chat_id"], job["message_id"])
+            lang = get_user_language(job["user_id"])
+            t = catalogo.t(lang)
+            
+            if job["attempts"] >= JOURNAL_MAX_ATTEMPTS or time.time() - job["created_at"] > JOURNAL_MAX_AGE:
+                job_journal.set_state(job["job_id"], "failed", "no recuperable")
+                texto = t['job_not_resumed']
+                teclado = None
+            else:
+                job_journal.mark_attempt(job["job_id"])
+                await self.add_task(job["priority"], task_data)
+                texto = t['job_resumed']
+                teclado = catalogo.boton_cancelar(lang, job['job_id'])
+                
+            try:
+                await self.app.bot.edit_message_text(
+                    chat_id=job["chat_id"],
+                    message_id=job["message_id"],
+                    text=texto,
+                    reply_markup=teclado,
+                    parse_mode='Markdown'
+                )
+            except Exception as e:
+                log_event(f"⚠️ No se pudo actualizar el mensaje del trabajo {job['job_id']}: {e}")
+        
+    async def _worker(self, worker_id):
+        """Worker que procesa tareas de la cola"""
+        log_event(f"👷 Worker {worker_id} iniciado")
+        
+        while self.is_running:
+            try:
+                # El planificador bloquea hasta tener un trabajo de un usuario sin tarea activa
+                self.idle_workers[worker_id] = asyncio.current_task()
+                try:
+                    priority, task_id, task_data = await self.priority_queue.get()
+                finally:
+                    self.idle_workers.pop(worker_id, None)
+                job_id, user_id, url, tipo, chat_id, message_id = task_data
+                
+                token = self.cancel_tokens.get(job_id)
+                if token is None or token.cancelled:
+                    self.cancel_tokens.pop(job_id, None)
+                    self._liberar_preparado(job_id)
+                    await self.priority_queue.release_user(user_id)
+                    continue
+                
+                self.active_tasks[user_id] = task_id
+                job_task = asyncio.create_task(self._process_task(worker_id, priority, task_id, task_data, token))
+                self.running_jobs[job_id] = job_task
+                inicio_slot = self.slot_metrics.start()
+                try:
+                    await job_task
+                except asyncio.CancelledError:
+                    # Solo se propaga si el que fue cancelado es el worker, no el trabajo
+                    if not token.cancelled:
+                        raise
+                finally:
+                    self.slot_metrics.finish(inicio_slot, not token.cancelled)
+                    if user_id in self.active_tasks:
+                        del self.active_tasks[user_id]
+                    self._finish_job(job_id, job_task)
+                    await self.priority_queue.release_user(user_id)
+                    
+                if self.retire_pending > 0:
+                    self.retire_pending -= 1
+                    log_event(f"👋 Worker {worker_id} retirado por el autoescalado")
+                    break
+                    
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                log_event(f"❌ Error en worker {worker_id}: {e}")
+                await asyncio.sleep(1)
+                
+    async def _process_task(self, worker_id, priority, task_id, task_data, token):
+        """Procesa una tarea individual"""
+        job_id, user_id, url, tipo, chat_id, message_id = task_data
+        reserva_disco = False
+        
+        try:
+            log_event(f"🔁 Worker {worker_id} procesando tarea para usuario {user_id}")
+            
+            if token.tracker is None:
+                token.tracker = SafeProgressTracker(chat_id, message_id, user_id, self.app)
+                token.tracker.set_cancel_button(job_id)
+            progress_tracker = token.tracker
+            progress_trackers[user_id] = progress_tracker
+            
+            lang = get_user_language(user_id)
+            t = catalogo.t(lang)
+            
+            # Si vuelve de esperar espacio en disco ya está analizado y con la reserva hecha
+            tamano_estimado = self.disk_ready.pop(job_id, None)
+            if tamano_estimado is None:
+                tamano_estimado = await self._preparar(priority, task_id, task_data, token, progress_tracker)
+                if tamano_estimado is None:
+                    return
+            reserva_disco = True
+            
+            downloader = SafeParallelDownloader(url, user_id, tipo, progress_tracker)
+            downloader.estimated_size = tamano_estimado
+            downloader.cancel_token = token
+            disk_manager.track(job_id, downloader.base_filename)
+            
+            self._stage(token, "descarga")
+            inicio = self.download_metrics.start()
+            try:
+                if DOWNLOAD_EXEC_MODE == "process":
+                    success = await download_runner.run(downloader)
+                elif DOWNLOAD_EXEC_MODE == "remote":
+                    success = await remote_runner.run(downloader, job_id)
+                else:
+                    future = executor.submit(downloader.download)
+                    try:
+                        success = await asyncio.wrap_future(future)
+                    except asyncio.CancelledError:
+                        # El hilo aborta en el siguiente progress hook; luego se borran los parciales
+                        future.add_done_callback(lambda _: downloader.remove_partial_files())
+                        raise
+            except asyncio.CancelledError:
+                self.download_metrics.finish(inicio, False)
+                raise
+            filename = downloader.filename
+            self.download_metrics.finish(inicio, bool(success and filename))
+            if success and filename and os.path.exists(filename):
+                self.downloaded_bytes.append((time.time(), os.path.getsize(filename)))
+                # El archivo se renombra con el título; sus derivados comparten la base
+                disk_manager.track(job_id, os.path.splitext(os.path.basename(filename))[0])
+            
+            if token.cancelled:
+                downloader.remove_partial_files()
+                return
+            
+            if not success or not filename:
+                error_msg = t['download_failed'].format(1)
+                await progress_tracker.final_message(error_msg)
+                log_event(f"❌ Error al descargar: {url}")
+                return
+            
+            # Transcodificación y subida corren en sus propias etapas y liberan el worker de descarga.
+            # Si la cola de subida está llena, el worker espera aquí antes de tomar otra descarga
+            await upload_stage.admit(job_id)
+            plan = planificar_audio(filename, downloader.acodec, downloader.vcodec) if tipo.endswith("audio") else None
+            archivos = [filename]
+            self._spawn_post_task(
+                job_id, self._postprocesar(task_data, filename, plan, downloader.acodec, progress_tracker, token, archivos), archivos
+            )
+            reserva_disco = False
+                
+        except JobCancelled:
+            pass
+        except Exception as e:
+            log_event(f"❌ Error procesando tarea: {e}")
+            try:
+                lang = get_user_language(user_id)
+                await progress_tracker.final_message(catalogo.texto(lang, 'error_generic', str(e)))
+            except:
+                pass
+        finally:
+            if reserva_disco:
+                await disk_manager.release(job_id)
+                
+    async def _preparar(self, priority, task_id, task_data, token, progress_tracker):
+        """Análisis y reserva de disco; devuelve el tamaño estimado o None si el trabajo no sigue en este worker"""
+        job_id, user_id, url, tipo, chat_id, message_id = task_data
+        lang = progress_tracker.lang
+        t = progress_tracker.t
+        
+        if "youtube.com" in url or "youtu.be" in url:
+            if not await puede_descargar_youtube(user_id):
+                await progress_tracker.final_message(catalogo.texto(lang, 'youtube_limit'))
+                return None
+        
+        self._stage(token, "analisis")
+        await progress_tracker.safe_edit_message(t['analyzing_size'])
+        
+        async with analysis_stage.slot(job_id):
+            es_valido, tamano_estimado, titulo, duracion, calidad, formato = await analizar_video_con_detalles(url, user_id, tipo)
+        
+        if not es_valido:
+            if tipo.startswith("tt_"):
+                tamano_mb = tamano_estimado / (1024 * 1024)
+                error_msg = t['video_too_large'].format(tamano_mb)
+                await progress_tracker.final_message(error_msg)
+            return None
+            
+        tamano_mb = tamano_estimado / (1024 * 1024) if tamano_estimado > 0 else 0
+        duracion_formateada = format_duration(duracion) if duracion > 0 else t['unknown_duration']
+        
+        if "youtube" in url:
+            platform = "YouTube"
+        else:
+            platform = "TikTok"
+            
+        info_msg = catalogo.texto(lang, 'size_info', platform, duracion_formateada, tamano_mb, calidad)
+        await progress_tracker.safe_edit_message(info_msg)
+        
+        if delivery_fitter.parts_needed(tamano_estimado) > FIT_MAX_PARTS:
+            # Ni dividido cabría en los envíos permitidos: se avisa antes de descargarlo
+            await progress_tracker.final_message(t['upload_too_large'].format(tamano_mb, UPLOAD_LIMIT // (1024 * 1024)))
+            return None
+            
+        if not disk_manager.try_reserve(job_id, tamano_estimado):
+            # La espera no ocupa el worker: el trabajo vuelve a la cola cuando tiene su reserva
+            await progress_tracker.safe_edit_message(t['waiting_disk'])
+            log_event(f"💽 Esperando espacio en disco para {job_id}")
+            self._aparcar(priority, task_id, task_data, token, tamano_estimado)
+            return None
+        return tamano_estimado
+        
+    def _aparcar(self, priority, task_id, task_data, token, tamano_estimado):
+        job_id = task_data[0]
+        task = asyncio.create_task(self._esperar_disco(priority, task_id, task_data, token, tamano_estimado))
+        self.running_jobs[job_id] = task
+        task.add_done_callback(lambda t: self._finish_job(job_id, t))
+        return task
+        
+    async def _esperar_disco(self, priority, task_id, task_data, token, tamano_estimado):
+        """Espera la reserva fuera del worker; al conseguirla devuelve el trabajo a la cola"""
+        job_id = task_data[0]
+        try:
+            reservado = await disk_manager.reserve(job_id, tamano_estimado)
+        except asyncio.CancelledError:
+            await disk_manager.release(job_id)
+            if not token.cancelled:
+                raise
+            return
+            
+        if not reservado:
+            await token.tracker.final_message(token.tracker.t['disk_full'])
+            log_event(f"❌ Sin espacio en disco para {job_id}")
+            return
+        if token.cancelled:
+            await disk_manager.release(job_id)
+            return
+            
+        # Deja de ser la tarea del trabajo para que su callback no lo dé por terminado
+        self.disk_ready[job_id] = tamano_estimado
+        self.running_jobs.pop(job_id, None)
+        self._stage(token, "cola")
+        await self.priority_queue.put(priority, task_id, task_data)
+        
+    def _liberar_preparado(self, job_id):
+        """Suelta la reserva de un trabajo que salió de la cola sin volver a un worker"""
+        if self.disk_ready.pop(job_id, None) is not None:
+            disk_manager.release_nowait(job_id)
+        
+    def _spawn_post_task(self, job_id, coro, archivos):
+        task = asyncio.create_task(coro)
+        self.post_tasks.add(task)
+        self.running_jobs[job_id] = task
+        task.add_done_callback(self.post_tasks.discard)
+        task.add_done_callback(lambda t: self._finish_job(job_id, t))
+        # Aunque la tarea se cancele antes de empezar se devuelven su sitio en la cola
+        # de subida y su reserva de disco, y se borran sus archivos
+        task.add_done_callback(lambda t: upload_stage.leave(job_id))
+        task.add_done_callback(lambda t: self._limpiar_archivos(job_id, archivos))
+        return task
+        
+    def _limpiar_archivos(self, job_id, archivos):
+        for archivo in archivos:
+            try:
+                if os.path.exists(archivo):
+                    os.remove(archivo)
+            except Exception as e:
+                log_event(f"⚠️ Error eliminando archivo: {e}")
+        disk_manager.release_nowait(job_id)
+        
+    async def _postprocesar(self, task_data, filename, plan, acodec, progress_tracker, token, archivos):
+        """Transcodifica o remuxea el audio si hace falta y entrega el archivo al usuario.
+        
+        Los archivos que genera se añaden a archivos; los borra el callback de la tarea"""
+        job_id, user_id, url, tipo, chat_id, message_id = task_data
+        salida = filename
+        
+        try:
+            if plan is not None:
+                self._stage(token, "transcodificacion")
+                if plan == "transcode":
+                    await progress_tracker.safe_edit_message(progress_tracker.t['transcoding'])
+                salida = await transcode_stage.submit(filename, plan, acodec)
+                if salida != filename:
+                    archivos.append(salida)
+                    os.remove(filename)
+            entregas = [salida]
+            if os.path.getsize(salida) > UPLOAD_LIMIT:
+                entregas = await self._ajustar_entrega(task_data, salida, progress_tracker, token, archivos)
+            async with upload_stage.slot(job_id):
+                await self._entregar(task_data, entregas, progress_tracker, token)
+        except asyncio.CancelledError:
+            if not token.cancelled:
+                raise
+        except JobCancelled:
+            pass
+        except Exception as e:
+            log_event(f"❌ Error en el postproceso de {filename}: {e}")
+            try:
+                await progress_tracker.final_message(catalogo.texto(progress_tracker.lang, 'error_generic', str(e)))
+            except:
+                pass
+                
+    async def _ajustar_entrega(self, task_data, filename, progress_tracker, token, archivos):
+        """Divide o recomprime un archivo mayor que el límite de envío; devuelve lo que hay que enviar"""
+        job_id, user_id, url, tipo, chat_id, message_id = task_data
+        t = progress_tracker.t
+        tamano_mb = os.path.getsize(filename) / (1024 * 1024)
+        
+        if delivery_fitter.parts_needed(os.path.getsize(filename)) > FIT_MAX_PARTS:
+            raise Exception(t['upload_too_large'].format(tamano_mb, UPLOAD_LIMIT // (1024 * 1024)))
+            
+        # Mientras el usuario decide, su sitio en la cola de subida pasa a otro trabajo;
+        # slot() lo vuelve a pedir al enviar. La reserva de disco se mantiene porque cubre
+        # las partes o el archivo recomprimido que aún hay que generar
+        upload_stage.leave(job_id)
+        eleccion = await self._preguntar_ajuste(job_id, tamano_mb, progress_tracker)
+        token.check()
+        self._stage(token, "transcodificacion")
+        
+        if eleccion == "reencode":
+            await progress_tracker.safe_edit_message(t['fit_reencoding'])
+            try:
+                entregas = await delivery_fitter.reencode(filename, tipo)
+            except Exception as e:
+                log_event(f"⚠️ Recompresión fallida para {job_id}, se divide en partes: {e}")
+                await progress_tracker.safe_edit_message(t['fit_reencode_failed'])
+            else:
+                archivos.extend(entregas)
+                os.remove(filename)
+                return entregas
+                
+        await progress_tracker.safe_edit_message(t['fit_splitting'])
+        entregas = await delivery_fitter.split(filename)
+        archivos.extend(entregas)
+        os.remove(filename)
+        return entregas
+        
+    async def _preguntar_ajuste(self, job_id, tamano_mb, progress_tracker):
+        """Pregunta al usuario si dividir o recomprimir; sin respuesta se aplica FIT_DEFAULT_CHOICE"""
+        t = progress_tracker.t
+        futuro = asyncio.get_event_loop().create_future()
+        self.fit_choices[job_id] = futuro
+        anterior = progress_tracker.reply_markup
+        progress_tracker.reply_markup = InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton(t['fit_split_button'], callback_data=f"fit_split_{job_id}"),
+                InlineKeyboardButton(t['fit_reencode_button'], callback_data=f"fit_reencode_{job_id}")
+            ],
+            [InlineKeyboardButton(t['cancel_button'], callback_data=f"cancel_job_{job_id}")]
+        ])
+        try:
+            await progress_tracker.safe_edit_message(
+                t['fit_choice'].format(tamano_mb, UPLOAD_LIMIT // (1024 * 1024))
+            )
+            return await asyncio.wait_for(futuro, FIT_CHOICE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return FIT_DEFAULT_CHOICE
+        finally:
+            self.fit_choices.pop(job_id, None)
+            progress_tracker.reply_markup = anterior
+            
+    def choose_fit(self, job_id, user_id, eleccion):
+        """Registra la opción pulsada; False si el trabajo no espera respuesta de ese usuario"""
+        token = self.cancel_tokens.get(job_id)
+        futuro = self.fit_choices.get(job_id)
+        if not token or token.user_id != user_id or futuro is None or futuro.done():
+            return False
+        futuro.set_result(eleccion)
+        return True
+        
+    async def _entregar(self, task_data, archivos, progress_tracker, token):
+        """Envía el archivo (o sus partes), registra la descarga y limpia los temporales"""
+        job_id, user_id, url, tipo, chat_id, message_id = task_data
+        
+        try:
+            token.check()
+            self._stage(token, "subida")
+            await progress_tracker.safe_edit_message(progress_tracker.t['preparing_upload'])
+            if len(archivos) == 1:
+                await self._send_file(user_id, archivos[0], tipo, progress_tracker)
+            else:
+                await self._send_parts(user_id, archivos, tipo, progress_tracker)
+            
+            recompensa = incrementar_descarga(user_id)
+            
+            if "youtube.com" in url or "youtu.be" in url:
+                incrementar_descarga_youtube(user_id)
+                
+            actualizar_estadisticas(user_id)
+            
+            # CORREGIDO: Asegurar que se muestre el menú después de la descarga
+            self._stage(token, "completado")
+            progress_tracker.stop()
+            await mostrar_menu_post_descarga(self.app, chat_id, message_id, recompensa)
+        finally:
+            for filename in archivos:
+                try:
+                    if filename and os.path.exists(filename):
+                        os.remove(filename)
+                        log_event(f"🧹 Archivo temporal eliminado: {filename}")
+                except Exception as e:
+                    log_event(f"⚠️ Error eliminando archivo: {e}")
+            await disk_manager.release(job_id)
+            
+    async def _send_parts(self, user_id, partes, tipo, progress_tracker):
+        """Sube las partes en paralelo (hasta FIT_PARALLEL_PARTS a la vez)"""
+        tamanos = [os.path.getsize(parte) for parte in partes]
+        total = sum(tamanos) or 1
+        avance = [0.0] * len(partes)
+        limite = asyncio.Semaphore(FIT_PARALLEL_PARTS)
+        
+        async def _enviar(indice, parte):
+            async with limite:
+                await self._send_file(
+                    user_id, parte, tipo,
+                    PartProgress(progress_tracker, avance, indice, tamanos[indice] / total),
+                    caption=catalogo.texto(progress_tracker.lang, 'part_caption', indice + 1, len(partes))
+                )
+                
+        tareas = [asyncio.ensure_future(_enviar(i, parte)) for i, parte in enumerate(partes)]
+        try:
+            await asyncio.gather(*tareas)
+        except BaseException:
+            # Si falla una parte se cancelan las demás antes de borrar los archivos
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+            raise
+                
+    async def _send_file(self, user_id, filename, tipo, progress_tracker, caption=None):
+        """Envía el archivo al usuario"""
+        caption = caption or progress_tracker.t['upload_caption']
+        try:
+            file_size = os.path.getsize(filename)
+            file_size_mb = file_size / (1024 * 1024)
+            
+            if file_size > MAX_FILE_SIZE:
+                raise Exception(f"Archivo demasiado grande ({file_size_mb:.2f}MB)")
+            if file_size > UPLOAD_LIMIT:
+                # Telegram lo rechazaría tras subirlo entero; se avisa sin gastar la subida
+                raise Exception(progress_tracker.t['upload_too_large'].format(file_size_mb, UPLOAD_LIMIT // (1024 * 1024)))
+            
+            bot = await media_client.bot()
+            loop = asyncio.get_running_loop()
+            progreso = {"tarea": None, "porcentaje": None}
+            
+            async def _publicar():
+                while progreso["porcentaje"] is not None:
+                    porcentaje, progreso["porcentaje"] = progreso["porcentaje"], None
+                    await progress_tracker.update_upload_progress(porcentaje)
+                    
+            def _progreso(porcentaje):
+                # Lo invoca httpx al leer cada bloque: una sola edición en curso, con el último valor
+                progreso["porcentaje"] = porcentaje
+                if progreso["tarea"] is None or progreso["tarea"].done():
+                    progreso["tarea"] = loop.create_task(_publicar())
+                
+            async def _subir(contenido):
+                if tipo.endswith("video"):
+                    await bot.send_video(chat_id=user_id, video=contenido, caption=caption, supports_streaming=True)
+                else:
+                    await bot.send_audio(chat_id=user_id, audio=contenido, caption=caption)
+                    
+            async def _intento():
+                if TELEGRAM_LOCAL_MODE:
+                    # El servidor local lee el archivo del disco: no se envían bytes por HTTP
+                    await progress_tracker.update_upload_progress(0)
+                    await _subir(Path(filename).resolve())
+                    return
+                # Cada intento reabre el archivo y el progreso vuelve a empezar
+                with open(filename, 'rb') as archivo:
+                    await _subir(InputFile(ProgressFileReader(archivo, _progreso), read_file_handle=False))
+                    
+            inicio = time.time()
+            try:
+                await media_client.with_retries(_intento, f"la subida de {filename}")
+            finally:
+                if progreso["tarea"] is not None:
+                    progreso["tarea"].cancel()
+                    
+            duracion = max(0.001, time.time() - inicio)
+            self.upload_bytes.append((time.time(), file_size, duracion))
+            log_event(f"✅ Archivo enviado: {filename} ({file_size_mb:.2f}MB en {duracion:.1f}s, {file_size_mb / duracion:.2f}MB/s)")
+            
+        except Exception as e:
+            log_event(f"❌ Error enviando archivo: {e}")
+            raise
+
+download_queue_system = DownloadQueueSystem(max_workers=MAX_WORKERS)
+
+stats = {
+    "start_time": time.time(),
+    "total_downloads": 0,
+    "daily_downloads": 0,
+    "unique_users": set(),
+    "premium_users": 0,
+    "active_downloads": 0,
+    "completed_today": 0,
+    "queue_size": 0,
+    "errors": 0,
+    "total_rewards": 0.0,
+    "total_withdrawals": 0.0,
+    "total_referral_earnings": 0.0,
+    "api_requests": 0,
+    "last_api_request": None
+}
+
+translations = {
+    "es": {
+        "welcome": "🌟 ¡Bienvenido al Bot de Descargas más Potente! 🚀",
+        "download_options": "🎬 Descarga videos y audio en calidad premium de TikTok y YouTube ✨",
+        "select_option": "👇 ¡Elige una opción y comienza a descargar!",
+        "download_content": "⬇️ Descargar Contenido",
+        "premium": "💎 Premium VIP",
+        "referrals": "👥 Programa de Referidos",
+        "stats": "📊 Mis Estadísticas",
+        "support": "🆘 Soporte Técnico",
+        "withdraw": "💰 Retirar Fondos",
+        "language": "🌐 Idioma/Language",
+        "menu_principal": "🏠 Menú Principal",
+        "back": "🔙 Volver",
+        "available_downloads": "📊 Descargas disponibles hoy: {}/{}",
+        "youtube_downloads": "🎵 Descargas de YouTube hoy: {}/{}",
+        "balance_info": "💰 Balance Actual: ${:.2f} USDT",
+        "withdraw_minimum": "⚠️ El mínimo para retirar es {} USDT",
+        "withdraw_success": "✅ ¡Retiro procesado exitosamente!",
+        "withdraw_request": "📋 Solicitud de retiro enviada para revisión",
+        "insufficient_funds": "❌ Fondos insuficientes",
+        "referral_notification": "🎉 ¡Has ganado ${} por referir a un nuevo usuario!",
+        "limit_reached": "⛔ ¡Límite Diario Alcanzado!",
+        "limit_message": "Has usado tus {} descargas gratuitas de hoy.\n🔓 Obtén descargas ilimitadas:",
+        "large_file": "📦 El archivo es grande ({:.2f}MB). ⏳ Esto puede tardar varios minutos...",
+        "community": "👥 Unirse a la Comunidad",
+        "donate": "❤️ Apoyar con Donación",
+        "video_too_large": "❌ **Video demasiado grande**\n\nEste video es de {:.2f}MB y supera el límite de 50MB. ⚠️\n\n💎 Conviértete en Premium para descargar videos de cualquier tamaño.",
+        "referral_earnings": "💰 **Ganancias por referidos:** ${:.2f} USDT",
+        "processing_queue": "⏳ **Procesando tu solicitud**\n\n{}",
+        "queue_position": "📊 Posición en cola: {}",
+        "premium_priority": "🚀 Prioridad Premium (procesamiento inmediato)",
+        "queue_eta": "⏱️ Tiempo estimado: {}",
+        "queue_starting": "🚀 Tu descarga está comenzando...",
+        "queue_waiting": "En cola de espera",
+        "upload_too_large": "El archivo pesa {:.2f}MB y Telegram solo admite {}MB por envío.",
+        "fit_choice": "📦 **El archivo pesa {:.2f}MB** y el límite de envío es {}MB.\n\n✂️ *Dividir*: varias partes con la calidad original.\n🗜️ *Recomprimir*: un solo archivo con menos calidad.",
+        "fit_split_button": "✂️ Dividir en partes",
+        "fit_reencode_button": "🗜️ Recomprimir",
+        "fit_splitting": "✂️ **Dividiendo el archivo en partes...**",
+        "fit_reencoding": "🗜️ **Recomprimiendo para que quepa en un envío...**",
+        "fit_reencode_failed": "⚠️ No se pudo recomprimir; se enviará dividido en partes.",
+        "part_caption": "✅ Parte {}/{}",
+        "preparing_upload": "📤 Preparando para enviar...",
+        "upload_caption": "✅ ¡Descarga completada!",
+        "duplicate_job": "♊ **Este vídeo ya se está procesando**\n\nTe lo enviaremos en cuanto esté listo; no hace falta volver a pedirlo.",
+        "analyzing": "🔍 **Analizando video...**",
+        "downloading": "⬇️ **Descargando... {}%**",
+        "uploading": "📤 **Enviando... {}%**",
+        "daily_reminder": "📢 **Recordatorio Diario**\n\nTienes {} descargas disponibles hoy!\n\n",
+        "error_download": "❌ Error durante la descarga: {}",
+        "error_upload": "❌ Error durante el envío: {}",
+        "file_too_large": "❌ El archivo es demasiado grande ({:.2f}MB). El límite de Telegram es {:.2f}MB.",
+        "try_audio": "💡 Intenta descargar solo el audio o un video de menor calidad.",
+        "download_failed": "❌ La descarga falló después de {} intentos.",
+        "retrying": "🔄 Reintentando ({}/{})...",
+        "download_cancelled": "❌ Descarga cancelada debido a múltiples errores.",
+        "analyzing_size": "🔍 **Analizando video...**\n\n📊 Calculando tamaño y duración...",
+        "size_info": "📊 **Información del {}:**\n• Duración: {}\n• Tamaño estimado: {:.2f}MB\n• Calidad: {}",
+        "unknown_duration": "Desconocida",
+        "new_referral": "🎉 **¡Nuevo referido!**\n\n@{} ha usado tu enlace de referido.\n💰 Has ganado ${:.2f} USDT de recompensa!",
+        "queue_stalled": "⚠️ **Procesamiento retrasado**\n\nEl sistema está experimentando alta demanda. Tu descarga se reanudará automáticamente.",
+        "youtube_premium_only": "❌ **YouTube requiere Premium para video**\n\nPara descargar videos de YouTube necesitas una cuenta Premium. 💎\n\n🎵 Pero puedes descargar el audio MP3 gratis (límite 5 por día)",
+        "more_rewards": "🎁 Más Recompensas",
+        "youtube_audio_only": "🎵 **Descarga de YouTube**\n\nLos usuarios gratuitos pueden descargar solo audio MP3 de YouTube (límite 5 por día).\n\n💎 Conviértete en Premium para descargar videos completos de YouTube.",
+        "transcoding": "🎛️ **Convirtiendo audio...**",
+        "cancel_button": "✖️ Cancelar descarga",
+        "job_resumed": "♻️ **Descarga reanudada**\n\nEl servidor se reinició y tu descarga volvió a la cola.",
+        "job_not_resumed": "❌ **No se pudo reanudar tu descarga** tras el reinicio del servidor. Por favor, envía el enlace de nuevo.",
+        "job_cancelled": "🛑 **Descarga cancelada**\n\nPuedes enviar un nuevo enlace cuando quieras.",
+        "waiting_disk": "💽 **Esperando espacio en disco...**\n\nTu descarga comenzará en cuanto haya espacio disponible.",
+        "disk_full": "❌ No hay espacio en disco suficiente para esta descarga. Intenta más tarde.",
+        "enter_tx_hash": "🔍 **Verificación de Pago**\n\nPor favor, envía el **hash de la transacción (TX ID)** de tu pago de 4.99 USDT.\n\nEjemplo: `0x1234567890abcdef...`\n\n⚠️ Asegúrate de que:\n- El monto sea exactamente 4.99 USDT\n- La red sea BSC (BEP-20)\n- La transacción esté confirmada",
+        "language_name": "🇪🇸 Español",
+        "welcome_short": "¡Bienvenido!",
+        "language_prompt": "Selecciona tu idioma",
+        "choose_language": "🌐 **SELECCIONA TU IDIOMA** 🌐\n\nElige el idioma de tu preferencia:",
+        "language_changed": "✅ Idioma cambiado a {}",
+        "unlimited_downloads": "💎 Descargas ilimitadas (Premium)",
+        "unlimited_youtube": "🎵 Descargas YouTube ilimitadas (Premium)",
+        "premium_menu": "💎 **¡CONVIÉRTETE EN PREMIUM!** 💎\n\n✨ **Beneficios exclusivos:**\n- Descargas ilimitadas 24/7\n- Videos en 4K/HD sin restricciones\n- Procesamiento prioritario\n- Soporte directo\n- Videos sin límite de tamaño\n- Descargas ilimitadas de YouTube\n\n💳 **Cómo activar:**\n1. Envía *{min_usdt} USDT* (BEP-20) a:\n`{usdt_address}`\n2. Verifica tu pago enviando el TX Hash\n\n⏱️ **Activación inmediata** después de la confirmación\n🛡️ **Garantía de satisfacción**",
+        "verify_tx_button": "🔍 Verificar TX Hash",
+        "how_to_pay_button": "❓ Cómo pagar",
+        "how_to_pay": "❓ **¿Cómo pagar?** ❓\n\n1. **Necesitas tener una billetera con USDT en la red BSC (Binance Smart Chain).**\n2. Envía exactamente **{min_usdt} USDT** a la siguiente dirección:\n`{usdt_address}`\n3. Asegúrate de que la red sea **BEP-20 (BSC)**.\n4. Después de enviar, copia el **TX Hash** de la transacción.\n5. Regresa al bot y presiona '🔍 Verificar TX Hash'.\n\n⚠️ **Nota:** Las transacciones pueden tardar unos minutos en confirmarse.",
+        "referral_menu": "🔥 **¡GANA DESCARGAS EXTRA Y RECOMPENSAS!** 🔥\n\n👥 **Referidos actuales:** {0}\n💰 **Ganancias por referidos:** ${1:.2f} USDT\n🎁 **Recompensa por referido:** ${referral_reward} USDT\n🎯 **Beneficios:** +1 descarga/día por cada amigo\n\n🔗 Tu enlace exclusivo:\n`{2}`\n\n📤 ¡Compártelo con tus amigos y disfruta de más descargas y recompensas!",
+        "copy_link_button": "📋 Copiar enlace",
+        "referral_link": "🔗 Copia este enlace de referido:\n\n`{}`\n\nLuego compártelo con tus amigos!",
+        "withdraw_menu": "💰 **RETIRO DE FONDOS** 💰\n\n💵 **Balance disponible:** ${:.2f} USDT\n📦 **Mínimo para retirar:** {min_withdrawal} USDT\n\nPara retirar tus fondos, envía un mensaje con el siguiente formato:\n`/withdraw <cantidad> <dirección_billetera>`\n\nEjemplo:\n`/withdraw 50 0xTuDirecciónDeBilletera`",
+        "download_complete": "🎉 **¡Descarga completada!**",
+        "download_reward": "💰 Has ganado ${:.2f} USDT por esta descarga!",
+        "what_next": "¿Qué deseas hacer ahora?",
+        "download_another": "⬇️ Descargar Otro",
+        "invite_friends": "👥 Invitar Amigos",
+        "get_premium": "💎 Obtener Premium",
+        "no_stats": "❌ No se encontraron estadísticas.",
+        "stats_menu": "📊 **TUS ESTADÍSTICAS** 📊\n\n⬇️ **Descargas TikTok hoy:** {0}/{1}\n🎵 **Descargas YouTube hoy:** {2}/{3}\n💰 **Balance actual:** ${4:.2f} USDT\n🎯 **Total ganado:** ${5:.2f} USDT\n👥 **Referidos:** {6} (${7:.2f} USDT)\n👤 **Referidos activos:** {8}\n💎 **Estado:** {9}",
+        "status_premium": "Premium ✅",
+        "status_free": "Gratuito ⏳",
+        "stats_upgrade": "🔓 **Mejora a Premium para:**\n- Descargas ilimitadas\n- Videos sin límite de tamaño\n- Prioridad en procesamiento\n- Descargas ilimitadas de YouTube",
+        "withdraw_format": "❌ Formato incorrecto. Usa:\n`/withdraw <cantidad> <dirección_billetera>`",
+        "invalid_address": "❌ Dirección de billetera inválida.",
+        "invalid_amount": "❌ Cantidad inválida. Debe ser un número.",
+        "error_generic": "❌ Error: {}",
+        "verifying_tx": "🔍 Verificando transacción...",
+        "invalid_tx_format": "❌ Formato de TX Hash inválido. Debe tener 64 caracteres hexadecimales después de '0x'.",
+        "tx_already_used": "❌ Esta transacción ya fue utilizada anteriormente.",
+        "tx_no_valid_payment": "❌ No se encontró un pago válido de {min_usdt} USDT en esta transacción.",
+        "tx_not_found": "❌ Transacción no encontrada o fallida.",
+        "tx_no_details": "❌ No se pudieron obtener los detalles de la transacción.",
+        "tx_price_error": "❌ Error consultando el precio de BNB. Intenta más tarde.",
+        "tx_wrong_address": "❌ Esta transacción no fue enviada a la dirección correcta.",
+        "tx_explorer_error": "❌ Error consultando BscScan. Intenta más tarde.",
+        "tx_connection_error": "❌ Error de conexión: {}",
+        "payment_confirmed": "✅ **¡Pago confirmado!** 🎉\n\n💎 **Cuenta Premium Activada**\n💰 Monto: {:.2f} {}\n🔗 TX: `{}`\n\n¡Disfruta de tus beneficios premium!",
+        "premium_activation_error": "❌ Error activando cuenta premium.",
+        "invalid_link": "❌ Solo se admiten enlaces de TikTok o YouTube.",
+        "youtube_limit": "❌ Has alcanzado tu límite diario de descargas de YouTube ({youtube_limit}).\n\n💎 Conviértete en Premium para descargas ilimitadas de YouTube.",
+        "limit_unlock": "🔓 Para descargas ilimitadas y máxima calidad:",
+        "video_hd_button": "🎥 Video HD",
+        "audio_mp3_button": "🎵 Audio MP3",
+        "youtube_format_premium": "🎬 **Selecciona formato para YouTube:**\n✅ Calidad HD Premium",
+        "tiktok_format": "🎬 **Selecciona formato para TikTok:**\n✅ Calidad HD sin marca de agua",
+        "send_link": "⬇️ **Envía el enlace del video que deseas descargar:**\nSe admiten enlaces de TikTok y YouTube.",
+        "cancel": "❌ Cancelar",
+        "link_expired": "❌ El enlace ha expirado. Por favor, envía un nuevo enlace."
+    },
+    "en": {
+        "welcome": "🌟 Welcome to the Most Powerful Download Bot! 🚀",
+        "download_options": "🎬 Download premium quality videos and audio from TikTok and YouTube ✨",
+        "select_option": "👇 Choose an option and start downloading!",
+        "download_content": "⬇️ Download Content",
+        "premium": "💎 Premium VIP", 
+        "referrals": "👥 Referral Program",
+        "stats": "📊 My Statistics",
+        "support": "🆘 Technical Support",
+        "withdraw": "💰 Withdraw Funds",
+        "language": "🌐 Language/Idioma",
+        "menu_principal": "🏠 Main Menu",
+        "back": "🔙 Back",
+        "available_downloads": "📊 Downloads available today: {}/{}",
+        "youtube_downloads": "🎵 YouTube downloads today: {}/{}",
+        "balance_info": "💰 Current Balance: ${:.2f} USDT",
+        "withdraw_minimum": "⚠️ Minimum withdrawal is {} USDT",
+        "withdraw_success": "✅ Withdrawal processed successfully!",
+        "withdraw_request": "📋 Withdrawal request sent for review",
+        "insufficient_funds": "❌ Insufficient funds",
+        "referral_notification": "🎉 You've earned ${} for referring a new user!",
+        "limit_reached": "⛔ Daily Limit Reached!",
+        "limit_message": "You've used your {} free downloads today.\n🔓 Get unlimited downloads:",
+        "large_file": "📦 The file is large ({:.2f}MB). ⏳ This may take several minutes...",
+        "community": "👥 Join Community",
+        "donate": "❤️ Support with Donation",
+        "video_too_large": "❌ **Video too large**\n\nThis video is {:.2f}MB and exceeds the 50MB limit. ⚠️\n\n💎 Become Premium to download videos of any size.",
+        "referral_earnings": "💰 **Referral earnings:** ${:.2f} USDT",
+        "processing_queue": "⏳ **Processing your request**\n\n{}",
+        "queue_position": "📊 Queue position: {}",
+        "premium_priority": "🚀 Premium priority (immediate processing)",
+        "queue_eta": "⏱️ Estimated time: {}",
+        "queue_starting": "🚀 Your download is starting...",
+        "queue_waiting": "Waiting in queue",
+        "upload_too_large": "The file is {:.2f}MB and Telegram only accepts {}MB per upload.",
+        "fit_choice": "📦 **The file is {:.2f}MB** and the upload limit is {}MB.\n\n✂️ *Split*: several parts at original quality.\n🗜️ *Re-encode*: a single file at lower quality.",
+        "fit_split_button": "✂️ Split into parts",
+        "fit_reencode_button": "🗜️ Re-encode",
+        "fit_splitting": "✂️ **Splitting the file into parts...**",
+        "fit_reencoding": "🗜️ **Re-encoding to fit a single upload...**",
+        "fit_reencode_failed": "⚠️ Re-encoding failed; the file will be sent in parts.",
+        "part_caption": "✅ Part {}/{}",
+        "preparing_upload": "📤 Preparing to send...",
+        "upload_caption": "✅ Download complete!",
+        "duplicate_job": "♊ **This video is already being processed**\n\nWe'll send it as soon as it's ready; no need to request it again.",
+        "analyzing": "🔍 **Analyzing video...**",
+        "downloading": "⬇️ **Downloading... {}%**",
+        "uploading": "📤 **Uploading... {}%**",
+        "daily_reminder": "📢 **Daily Reminder**\n\nYou have {} downloads available today!\n\n",
+        "error_download": "❌ Error during download: {}",
+        "error_upload": "❌ Error during upload: {}",
+        "file_too_large": "❌ The file is too large ({:.2f}MB). The Telegram limit is {:.2f}MB.",
+        "try_audio": "💡 Try downloading only audio or a lower quality video.",
+        "download_failed": "❌ Download failed after {} attempts.",
+        "retrying": "🔄 Retrying ({}/{})...",
+        "download_cancelled": "❌ Download cancelled due to multiple errors.",
+        "analyzing_size": "🔍 **Analyzing video...**\n\n📊 Calculating size and duration...",
+        "size_info": "📊 **{} information:**\n• Duration: {}\n• Estimated size: {:.2f}MB\n• Quality: {}",
+        "unknown_duration": "Unknown",
+        "new_referral": "🎉 **New referral!**\n\n@{} used your referral link.\n💰 You earned ${:.2f} USDT reward!",
+        "queue_stalled": "⚠️ **Processing delayed**\n\nThe system is experiencing high demand. Your download will resume automatically.",
+        "youtube_premium_only": "❌ **YouTube requires Premium for video**\n\nTo download YouTube videos you need a Premium account. 💎\n\n🎵 But you can download MP3 audio for free (limit 5 per day)",
+        "more_rewards": "🎁 More Rewards",
+        "youtube_audio_only": "🎵 **YouTube Download**\n\nFree users can only download MP3 audio from YouTube (limit 5 per day).\n\n💎 Become Premium to download full YouTube videos.",
+        "transcoding": "🎛️ **Converting audio...**",
+        "cancel_button": "✖️ Cancel download",
+        "job_resumed": "♻️ **Download resumed**\n\nThe server restarted and your download is back in the queue.",
+        "job_not_resumed": "❌ **Your download could not be resumed** after the server restart. Please send the link again.",
+        "job_cancelled": "🛑 **Download cancelled**\n\nYou can send a new link whenever you want.",
+        "waiting_disk": "💽 **Waiting for disk space...**\n\nYour download will start as soon as space is available.",
+        "disk_full": "❌ Not enough disk space for this download. Please try again later.",
+        "enter_tx_hash": "🔍 **Payment Verification**\n\nPlease send the **transaction hash (TX ID)** of your 4.99 USDT payment.\n\nExample: `0x1234567890abcdef...`\n\n⚠️ Make sure:\n- Amount is exactly 4.99 USDT\n- Network is BSC (BEP-20)\n- Transaction is confirmed",
+        "language_name": "🇺🇸 English",
+        "welcome_short": "Welcome!",
+        "language_prompt": "Select your language",
+        "choose_language": "🌐 **SELECT YOUR LANGUAGE** 🌐\n\nChoose your preferred language:",
+        "language_changed": "✅ Language changed to {}",
+        "unlimited_downloads": "💎 Unlimited downloads (Premium)",
+        "unlimited_youtube": "🎵 Unlimited YouTube downloads (Premium)",
+        "premium_menu": "💎 **BECOME PREMIUM!** 💎\n\n✨ **Exclusive benefits:**\n- Unlimited downloads 24/7\n- 4K/HD videos without restrictions\n- Priority processing\n- Direct support\n- Videos with no size limit\n- Unlimited YouTube downloads\n\n💳 **How to activate:**\n1. Send *{min_usdt} USDT* (BEP-20) to:\n`{usdt_address}`\n2. Verify your payment by sending the TX Hash\n\n⏱️ **Instant activation** after confirmation\n🛡️ **Satisfaction guaranteed**",
+        "verify_tx_button": "🔍 Verify TX Hash",
+        "how_to_pay_button": "❓ How to pay",
+        "how_to_pay": "❓ **How to pay?** ❓\n\n1. **You need a wallet with USDT on the BSC network (Binance Smart Chain).**\n2. Send exactly **{min_usdt} USDT** to the following address:\n`{usdt_address}`\n3. Make sure the network is **BEP-20 (BSC)**.\n4. After sending, copy the transaction **TX Hash**.\n5. Come back to the bot and press '🔍 Verify TX Hash'.\n\n⚠️ **Note:** Transactions may take a few minutes to confirm.",
+        "referral_menu": "🔥 **EARN EXTRA DOWNLOADS AND REWARDS!** 🔥\n\n👥 **Current referrals:** {0}\n💰 **Referral earnings:** ${1:.2f} USDT\n🎁 **Reward per referral:** ${referral_reward} USDT\n🎯 **Benefits:** +1 download/day for each friend\n\n🔗 Your exclusive link:\n`{2}`\n\n📤 Share it with your friends and enjoy more downloads and rewards!",
+        "copy_link_button": "📋 Copy link",
+        "referral_link": "🔗 Copy this referral link:\n\n`{}`\n\nThen share it with your friends!",
+        "withdraw_menu": "💰 **WITHDRAW FUNDS** 💰\n\n💵 **Available balance:** ${:.2f} USDT\n📦 **Minimum withdrawal:** {min_withdrawal} USDT\n\nTo withdraw your funds, send a message with the following format:\n`/withdraw <amount> <wallet_address>`\n\nExample:\n`/withdraw 50 0xYourWalletAddress`",
+        "download_complete": "🎉 **Download complete!**",
+        "download_reward": "💰 You earned ${:.2f} USDT for this download!",
+        "what_next": "What would you like to do now?",
+        "download_another": "⬇️ Download Another",
+        "invite_friends": "👥 Invite Friends",
+        "get_premium": "💎 Get Premium",
+        "no_stats": "❌ No statistics found.",
+        "stats_menu": "📊 **YOUR STATISTICS** 📊\n\n⬇️ **TikTok downloads today:** {0}/{1}\n🎵 **YouTube downloads today:** {2}/{3}\n💰 **Current balance:** ${4:.2f} USDT\n🎯 **Total earned:** ${5:.2f} USDT\n👥 **Referrals:** {6} (${7:.2f} USDT)\n👤 **Active referrals:** {8}\n💎 **Status:** {9}",
+        "status_premium": "Premium ✅",
+        "status_free": "Free ⏳",
+        "stats_upgrade": "🔓 **Upgrade to Premium for:**\n- Unlimited downloads\n- Videos with no size limit\n- Priority processing\n- Unlimited YouTube downloads",
+        "withdraw_format": "❌ Wrong format. Use:\n`/withdraw <amount> <wallet_address>`",
+        "invalid_address": "❌ Invalid wallet address.",
+        "invalid_amount": "❌ Invalid amount. It must be a number.",
+        "error_generic": "❌ Error: {}",
+        "verifying_tx": "🔍 Verifying transaction...",
+        "invalid_tx_format": "❌ Invalid TX Hash format. It must have 64 hexadecimal characters after '0x'.",
+        "tx_already_used": "❌ This transaction has already been used.",
+        "tx_no_valid_payment": "❌ No valid payment of {min_usdt} USDT was found in this transaction.",
+        "tx_not_found": "❌ Transaction not found or failed.",
+        "tx_no_details": "❌ Could not get the transaction details.",
+        "tx_price_error": "❌ Error getting the BNB price. Please try again later.",
+        "tx_wrong_address": "❌ This transaction was not sent to the correct address.",
+        "tx_explorer_error": "❌ Error querying BscScan. Please try again later.",
+        "tx_connection_error": "❌ Connection error: {}",
+        "payment_confirmed": "✅ **Payment confirmed!** 🎉\n\n💎 **Premium Account Activated**\n💰 Amount: {:.2f} {}\n🔗 TX: `{}`\n\nEnjoy your premium benefits!",
+        "premium_activation_error": "❌ Error activating premium account.",
+        "invalid_link": "❌ Only TikTok or YouTube links are supported.",
+        "youtube_limit": "❌ You have reached your daily YouTube download limit ({youtube_limit}).\n\n💎 Become Premium for unlimited YouTube downloads.",
+        "limit_unlock": "🔓 For unlimited downloads and maximum quality:",
+        "video_hd_button": "🎥 HD Video",
+        "audio_mp3_button": "🎵 MP3 Audio",
+        "youtube_format_premium": "🎬 **Select a format for YouTube:**\n✅ Premium HD quality",
+        "tiktok_format": "🎬 **Select a format for TikTok:**\n✅ HD quality without watermark",
+        "send_link": "⬇️ **Send the link of the video you want to download:**\nTikTok and YouTube links are supported.",
+        "cancel": "❌ Cancel",
+        "link_expired": "❌ The link has expired. Please send a new link."
+    }
+}
+
+# Teclados de los menús: filas de (clave de texto, callback_data o URL). El catálogo los construye
+# una vez por idioma; añadir un idioma solo requiere su entrada en translations
+TECLADOS = {
+    "principal": [
+        [("download_content", "iniciar_descarga")],
+        [("premium", "menu_premium"), ("referrals", "menu_referral")],
+        [("more_rewards", RECOMPENSAS_URL), ("withdraw", "menu_withdraw")],
+        [("support", SOPORTE_URL), ("language", "menu_language")],
+        [("community", COMUNIDAD_URL), ("donate", DONACION_URL)]
+    ],
+    "premium": [
+        [("verify_tx_button", "verificar_pago")],
+        [("how_to_pay_button", "como_pagar")],
+        [("back", "menu_principal")]
+    ],
+    "como_pagar": [
+        [("verify_tx_button", "verificar_pago")],
+        [("back", "menu_premium")]
+    ],
+    "referidos": [
+        [("copy_link_button", "copiar_enlace")],
+        [("more_rewards", RECOMPENSAS_URL)],
+        [("menu_principal", "menu_principal")]
+    ],
+    "volver_principal": [
+        [("menu_principal", "menu_principal")]
+    ],
+    "post_descarga": [
+        [("download_another", "iniciar_descarga"), ("invite_friends", "menu_referral")],
+        [("get_premium", "menu_premium"), ("more_rewards", RECOMPENSAS_URL)],
+        [("menu_principal", "menu_principal")]
+    ],
+    "limite_youtube": [
+        [("get_premium", "menu_premium")],
+        [("menu_principal", "menu_principal")]
+    ],
+    "limite_diario": [
+        [("get_premium", "menu_premium")],
+        [("invite_friends", "menu_referral")],
+        [("menu_principal", "menu_principal")]
+    ],
+    # El trabajo se identifica por el mensaje que lleva el teclado, así que son iguales para todos
+    "formato_youtube_premium": [
+        [("video_hd_button", "yt_video|"), ("audio_mp3_button", "yt_audio|")],
+        [("menu_principal", "menu_principal")]
+    ],
+    "formato_youtube_gratis": [
+        [("audio_mp3_button", "yt_audio|")],
+        [("get_premium", "menu_premium")],
+        [("menu_principal", "menu_principal")]
+    ],
+    "formato_tiktok": [
+        [("video_hd_button", "tt_video|"), ("audio_mp3_button", "tt_audio|")],
+        [("menu_principal", "menu_principal")]
+    ],
+    "verificar_pago": [
+        [("cancel", "cancelar_verificacion")]
+    ],
+    "tras_cancelar": [
+        [("download_another", "iniciar_descarga")],
+        [("menu_principal", "menu_principal")]
+    ]
+}
+
+# Valores fijos que los textos del catálogo pueden usar por nombre
+CONSTANTES_TEXTO = {
+    "usdt_address": USDT_ADDRESS,
+    "min_usdt": MIN_USDT,
+    "min_withdrawal": MIN_WITHDRAWAL,
+    "referral_reward": REFERRAL_REWARD,
+    "youtube_limit": YOUTUBE_DAILY_LIMIT
+}
+
+class MessageCatalog:
+    """Textos y teclados compilados por idioma.
+    
+    Al compilar, las claves que faltan en un idioma se toman del idioma por defecto, los textos
+    que solo usan CONSTANTES_TEXTO quedan ya formateados y cada teclado de TECLADOS se construye
+    una vez por idioma (los InlineKeyboardMarkup son inmutables y se comparten). Los textos con
+    datos variables se formatean a través de una caché LRU."""
+    
+    def __init__(self, fuente, default="es", cache_size=CATALOG_CACHE_SIZE):
+        self.default = default
+        self.textos = {}
+        self.plantillas = {}
+        self.teclados = {}
+        self.bench = {}
+        self._render = lru_cache(maxsize=cache_size)(self._formatear)
+        self.compilar(fuente)
+        
+    @staticmethod
+    def _campos(plantilla):
+        return [campo for _, campo, _, _ in Formatter().parse(plantilla) if campo is not None]
+        
+    def compilar(self, fuente):
+        base = fuente[self.default]
+        for lang, textos in fuente.items():
+            compilado = dict(base)
+            compilado.update(textos)
+            for clave, valor in compilado.items():
+                campos = self._campos(valor)
+                if campos and all(campo in CONSTANTES_TEXTO for campo in campos):
+                    compilado[clave] = valor.format(**CONSTANTES_TEXTO)
+            self.textos[lang] = compilado
+            self.plantillas[lang] = {clave: valor for clave, valor in compilado.items() if "{" in valor}
+            
+        for lang in self.textos:
+            for nombre, filas in TECLADOS.items():
+                self.teclados[(lang, nombre)] = self.construir(lang, filas)
+            self.teclados[(lang, "idiomas")] = InlineKeyboardMarkup(
+                self._botones_idioma() + [[InlineKeyboardButton(self.textos[lang]["back"], callback_data="menu_principal")]]
+            )
+        # Primer contacto: todavía no se sabe el idioma del usuario
+        self.bienvenida = (
+            "🌐 **" + " ".join(self.textos[lang]["welcome_short"] for lang in self.textos) + "** 🌐\n\n"
+            + " / ".join(self.textos[lang]["language_prompt"] for lang in self.textos) + ":"
+        )
+        self.teclado_bienvenida = InlineKeyboardMarkup(self._botones_idioma())
+        self._render.cache_clear()
+        
+    def construir(self, lang, filas):
+        textos = self.textos[lang]
+        teclado = []
+        for fila in filas:
+            botones = []
+            for clave, destino in fila:
+                if destino.startswith("http"):
+                    botones.append(InlineKeyboardButton(textos[clave], url=destino))
+                else:
+                    botones.append(InlineKeyboardButton(textos[clave], callback_data=destino))
+            teclado.append(botones)
+        return InlineKeyboardMarkup(teclado)
+        
+    def _botones_idioma(self):
+        botones = [InlineKeyboardButton(self.textos[lang]["language_name"], callback_data=f"setlang_{lang}") for lang in self.textos]
+        return [botones[i:i + 2] for i in range(0, len(botones), 2)]
+        
+    def idiomas(self):
+        return list(self.textos)
+        
+    def idioma(self, lang):
+        return lang if lang in self.textos else self.default
+        
+    def t(self, lang):
+        return self.textos[self.idioma(lang)]
+        
+    def teclado(self, lang, nombre):
+        return self.teclados[(self.idioma(lang), nombre)]
+        
+    def boton_cancelar(self, lang, job_id):
+        """El de cancelar lleva el job_id y no se puede compartir"""
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton(self.t(lang)["cancel_button"], callback_data=f"cancel_job_{job_id}")]
+        ])
+        
+    def _formatear(self, lang, clave, args):
+        return self.textos[lang][clave].format(*args, **CONSTANTES_TEXTO)
+        
+    def texto(self, lang, clave, *args):
+        lang = self.idioma(lang)
+        if clave not in self.plantillas[lang]:
+            return self.textos[lang][clave]
+        return self._render(lang, clave, args)
+        
+    def benchmark(self, iteraciones=200):
+        """Coste medio por menú de construir el teclado como antes frente a tomarlo del catálogo"""
+        resultado = {}
+        lang = self.default
+        for nombre, filas in TECLADOS.items():
+            inicio = time.perf_counter()
+            for _ in range(iteraciones):
+                self.construir(lang, filas)
+            construir = (time.perf_counter() - inicio) / iteraciones
+            inicio = time.perf_counter()
+            for _ in range(iteraciones):
+                self.teclado(lang, nombre)
+            catalogo = (time.perf_counter() - inicio) / iteraciones
+            resultado[nombre] = {"construir_us": round(construir * 1e6, 2), "catalogo_us": round(catalogo * 1e6, 2)}
+        self.bench = resultado
+        return resultado
+        
+    def status(self):
+        cache = self._render.cache_info()
+        return {
+            "idiomas": self.idiomas(),
+            "teclados": len(self.teclados),
+            "cache": {"aciertos": cache.hits, "fallos": cache.misses, "tamano": cache.currsize},
+            "benchmark": self.bench
+        }
+
+catalogo = MessageCatalog(translations)
+
+# ===========================================
+# FUNCIONES PARA LA API
+# ===========================================
+
+def obtener_estadisticas_db():
+    """Obtiene estadísticas detalladas de la base de datos"""
+    conn = conectar_db()
+    cur = conn.cursor()
+    
+    # Estadísticas generales
+    cur.execute("SELECT COUNT(*) FROM usuarios")
+    total_usuarios = cur.fetchone()[0]
+    
+    cur.execute("SELECT COUNT(*) FROM usuarios WHERE premium = 1")
+    premium_usuarios = cur.fetchone()[0]
+    
+    cur.execute("SELECT SUM(descargas) FROM usuarios")
+    total_descargas = cur.fetchone()[0] or 0
+    
+    cur.execute("SELECT SUM(balance) FROM usuarios")
+    total_balance = cur.fetchone()[0] or 0.0
+    
+    cur.execute("SELECT SUM(total_earned) FROM usuarios")
+    total_ganado = cur.fetchone()[0] or 0.0
+    
+    cur.execute("SELECT SUM(referral_earnings) FROM usuarios")
+    total_referidos = cur.fetchone()[0] or 0.0
+    
+    cur.execute("SELECT COUNT(DISTINCT id) FROM usuarios WHERE last_active > ?", (int(time.time()) - 86400,))
+    activos_24h = cur.fetchone()[0]
+    
+    cur.execute("SELECT COUNT(*) FROM withdrawals WHERE status = 'pending'")
+    retiros_pendientes = cur.fetchone()[0]
+    
+    cur.execute("SELECT SUM(amount) FROM withdrawals WHERE status = 'completed'")
+    retiros_completados = cur.fetchone()[0] or 0.0
+    
+    # Top usuarios
+    cur.execute("SELECT username, descargas, balance, premium FROM usuarios ORDER BY descargas DESC LIMIT 10")
+    top_usuarios = []
+    for row in cur.fetchall():
+        top_usuarios.append({
+            "username": row[0] or "Sin nombre",
+            "descargas": row[1],
+            "balance": row[2],
+            "premium": bool(row[3])
+        })
+    
+    conn.close()
+    
+    return {
+        "total_usuarios": total_usuarios,
+        "premium_usuarios": premium_usuarios,
+        "total_descargas": total_descargas,
+        "total_balance": total_balance,
+        "total_ganado": total_ganado,
+        "total_referidos": total_referidos,
+        "activos_24h": activos_24h,
+        "retiros_pendientes": retiros_pendientes,
+        "retiros_completados": retiros_completados,
+        "top_usuarios": top_usuarios
+    }
+
+def obtener_estado_sistema():
+    """Obtiene el estado actual del sistema"""
+    ahora = datetime.now()
+    uptime = time.time() - stats["start_time"]
+    horas, resto = divmod(uptime, 3600)
+    minutos, segundos = divmod(resto, 60)
+    
+    return {
+        "estado": "🟢 Activo" if stats["active_downloads"] > 0 or stats["queue_size"] > 0 else "🟡 En espera",
+        "uptime": f"{int(horas)}h {int(minutos)}m {int(segundos)}s",
+        "tiempo_activo": uptime,
+        "hora_servidor": ahora.strftime("%Y-%m-%d %H:%M:%S"),
+        "ultimo_reinicio": datetime.fromtimestamp(stats["start_time"]).strftime("%Y-%m-%d %H:%M:%S"),
+        "api_requests": stats["api_requests"],
+        "ultima_api_request": stats["last_api_request"]
+    }
+
+def verificar_autenticacion(auth_header):
+    """Verifica la autenticación de la API"""
+    if not auth_header:
+        return False
+    
+    try:
+        # Formato: Bearer {API_SECRET_KEY}
+        if auth_header.startswith("Bearer "):
+            token = auth_header.split(" ")[1]
+            return token == API_SECRET_KEY
+    except:
+        pass
+    
+    return False
+
+# ===========================================
+# ENDPOINTS DE LA API
+# ===========================================
+
+@api_app.route('/')
+def index():
+    """Página principal de la API"""
+    return jsonify({
+        "api": "Bot de Descargas - API de Monitoreo",
+        "version": "1.0.0",
+        "endpoints": {
+            "/api/status": "Estado general del sistema",
+            "/api/stats": "Estadísticas detalladas",
+            "/api/users": "Información de usuarios",
+            "/api/queue": "Estado de la cola de descargas",
+            "/api/health": "Verificación de salud del sistema"
+        },
+        "documentation": "Usa Bearer token para autenticación"
+    })
+
+@api_app.route('/api/status', methods=['GET'])
+def api_status():
+    """Endpoint para estado general del sistema"""
+    stats["api_requests"] += 1
+    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    auth_header = request.headers.get('Authorization')
+    if not verificar_autenticacion(auth_header):
+        return jsonify({"error": "No autorizado"}), 401
+    
+    estado_sistema = obtener_estado_sistema()
+    
+    return jsonify({
+        "sistema": estado_sistema,
+        "estadisticas_activas": {
+            "descargas_totales": stats["total_downloads"],
+            "descargas_hoy": stats["daily_downloads"],
+            "usuarios_unicos": len(stats["unique_users"]),
+            "usuarios_premium": stats["premium_users"],
+            "descargas_activas": stats["active_downloads"],
+            "en_cola": stats["queue_size"],
+            "completadas_hoy": stats["completed_today"],
+            "errores": stats["errors"],
+            "recompensas": stats["total_rewards"],
+            "retiros": stats["total_withdrawals"],
+            "ganancias_referidos": stats["total_referral_earnings"]
+        },
+        "rendimiento": {
+            "modo_descarga": DOWNLOAD_EXEC_MODE,
+            "descargas_por_minuto": round(download_queue_system.download_metrics.throughput(), 2),
+            "event_loop": loop_lag_monitor.snapshot(),
+            "procesos": download_runner.status(),
+            "remoto": remote_runner.status() if DOWNLOAD_EXEC_MODE == "remote" else None,
+            "updates": update_latency.snapshot(),
+            "procesador_updates": update_processor.status(),
+            "catalogo": catalogo.status(),
+            "bot_api": {
+                "servidor": TELEGRAM_API_URL or "https://api.telegram.org",
+                "modo_local": TELEGRAM_LOCAL_MODE,
+                "webhook": webhook_server.status() if webhook_server else None,
+                "limite_subida_mb": UPLOAD_LIMIT // (1024 * 1024),
+                "pools": {nombre: pool.status() for nombre, pool in list(http_pools.items())},
+                "subidas": media_client.status(),
+                "envios": outbound_limiter.status(),
+                "notificaciones": notification_service.status(),
+                "explorador_bsc": bsc_client.status(),
+                "indexador_pagos": payment_indexer.status(),
+                "recordatorio_diario": daily_broadcast.status()
+            }
+        }
+    })
+
+@api_app.route('/api/stats', methods=['GET'])
+def api_stats():
+    """Endpoint para estadísticas detalladas"""
+    stats["api_requests"] += 1
+    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    auth_header = request.headers.get('Authorization')
+    if not verificar_autenticacion(auth_header):
+        return jsonify({"error": "No autorizado"}), 401
+    
+    estadisticas_db = obtener_estadisticas_db()
+    estado_sistema = obtener_estado_sistema()
+    
+    return jsonify({
+        "estadisticas_generales": estadisticas_db,
+        "estado_sistema": estado_sistema,
+        "estadisticas_tiempo_real": {
+            "descargas_hoy": stats["daily_downloads"],
+            "descargas_activas": stats["active_downloads"],
+            "tareas_en_cola": stats["queue_size"],
+            "errores_hoy": stats["errors"]
+        }
+    })
+
+@api_app.route('/api/users', methods=['GET'])
+def api_users():
+    """Endpoint para información de usuarios"""
+    stats["api_requests"] += 1
+    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    auth_header = request.headers.get('Authorization')
+    if not verificar_autenticacion(auth_header):
+        return jsonify({"error": "No autorizado"}), 401
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    
+    # Parámetros de consulta
+    limit = request.args.get('limit', 50, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    
+    cur.execute("""
+        SELECT id, username, descargas, youtube_descargas, premium, 
+               referrals, balance, total_earned, referral_earnings,
+               datetime(last_active, 'unixepoch') as ultima_actividad
+        FROM usuarios 
+        ORDER BY descargas DESC 
+        LIMIT ? OFFSET ?
+    """, (limit, offset))
+    
+    usuarios = []
+    for row in cur.fetchall():
+        usuarios.append({
+            "id": row[0],
+            "username": row[1] or "Sin nombre",
+            "descargas": row[2],
+            "youtube_descargas": row[3],
+            "premium": bool(row[4]),
+            "referrals": row[5],
+            "balance": row[6],
+            "total_earned": row[7],
+            "referral_earnings": row[8],
+            "ultima_actividad": row[9]
+        })
+    
+    # Total de usuarios para paginación
+    cur.execute("SELECT COUNT(*) FROM usuarios")
+    total = cur.fetchone()[0]
+    
+    conn.close()
+    
+    return jsonify({
+        "usuarios": usuarios,
+        "paginacion": {
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "pagina_actual": (offset // limit) + 1,
+            "total_paginas": (total + limit - 1) // limit
+        }
+    })
+
+@api_app.route('/api/queue', methods=['GET'])
+def api_queue():
+    """Endpoint para estado de la cola de descargas"""
+    stats["api_requests"] += 1
+    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    auth_header = request.headers.get('Authorization')
+    if not verificar_autenticacion(auth_header):
+        return jsonify({"error": "No autorizado"}), 401
+    
+    # Obtener información de la cola
+    queue_info = {
+        "tareas_activas": list(download_queue_system.active_tasks.values()),
+        "cantidad_activas": len(download_queue_system.active_tasks),
+        "tamaño_cola": download_queue_system.priority_queue.qsize(),
+        "workers_activos": sum(1 for w in download_queue_system.workers if not w.done()),
+        "total_workers": download_queue_system.max_workers,
+        "tareas_procesadas": download_queue_system.task_counter,
+        "en_postproceso": len(download_queue_system.post_tasks),
+        "planificador": download_queue_system.priority_queue.snapshot(),
+        "diario": job_journal.status(),
+        "autoescalado": autoscaler.status(),
+        "duplicados_suprimidos": download_queue_system.duplicates,
+        "ajuste_envio": delivery_fitter.counts,
+        "cancelaciones": {
+            "total": sum(download_queue_system.cancellations.values()),
+            "por_etapa": download_queue_system.cancellations
+        }
+    }
+    
+    etapas = {
+        "worker": download_queue_system.slot_metrics.snapshot(download_queue_system.priority_queue.qsize()),
+        "descarga": download_queue_system.download_metrics.snapshot(download_queue_system.priority_queue.qsize()),
+        "analisis": analysis_stage.snapshot(),
+        "transcodificacion": transcode_stage.metrics.snapshot(transcode_stage.qsize()),
+        "subida": upload_stage.snapshot()
+    }
+    etapas["transcodificacion"]["modos_audio"] = transcode_stage.benchmark()
+    etapas["subida"]["telegram"] = download_queue_system.upload_stats()
+    
+    # Obtener descargas activas
+    descargas_activas = []
+    for user_id, tracker in progress_trackers.items():
+        if tracker.is_active:
+            descargas_activas.append({
+                "user_id": user_id,
+                "chat_id": tracker.chat_id,
+                "progreso_descarga": tracker.download_progress,
+                "progreso_upload": tracker.upload_progress,
+                "ultima_actualizacion": tracker.last_update_time
+            })
+    
+    # Posición y tiempo estimado de cada trabajo en cola
+    trabajos_en_cola = []
+    for rango, entrada in download_queue_system.priority_queue.jobs()[:100]:
+        job_id, user_id, url, tipo = entrada[2][:4]
+        _, eta = download_queue_system.estimate(job_id, tipo)
+        trabajos_en_cola.append({
+            "job_id": job_id,
+            "user_id": user_id,
+            "tipo": tipo,
+            "posicion": rango + 1,
+            "eta_segundos": eta,
+            "prioridad": entrada[0],
+            "esperando_segundos": int(time.time() - entrada[3])
+        })
+    
+    return jsonify({
+        "estado_cola": queue_info,
+        "etapas": etapas,
+        "trabajos_en_cola": trabajos_en_cola,
+        "descargas_activas": descargas_activas,
+        "jobs_pendientes": len(download_jobs),
+        "memoria_estado": {
+            almacen.name: almacen.status()
+            for almacen in (download_jobs, format_prompts, progress_trackers, waiting_for_tx)
+        }
+    })
+
+@api_app.route('/api/health', methods=['GET'])
+def api_health():
+    """Endpoint de verificación de salud del sistema"""
+    stats["api_requests"] += 1
+    
+    try:
+        # Verificar base de datos
+        conn = conectar_db()
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        db_ok = cur.fetchone()[0] == 1
+        conn.close()
+        
+        # Verificar sistema de colas
+        queue_ok = download_queue_system.is_running
+        
+        # Verificar workers
+        workers_ok = len([w for w in download_queue_system.workers if not w.done()]) > 0
+        
+        # Verificar espacio en disco
+        disco = disk_manager.status()
+        disk_ok = disco["libre_bytes"] > disk_manager.safety_margin
+        
+        return jsonify({
+            "status": "healthy" if all([db_ok, queue_ok, workers_ok, disk_ok]) else "degraded",
+            "checks": {
+                "database": db_ok,
+                "queue_system": queue_ok,
+                "workers": workers_ok,
+                "disk": disk_ok,
+                "total_checks": 4,
+                "passed_checks": sum([db_ok, queue_ok, workers_ok, disk_ok])
+            },
+            "disco": disco,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            "status": "unhealthy",
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@api_app.route('/api/transactions', methods=['GET'])
+def api_transactions():
+    """Endpoint para ver transacciones recientes"""
+    stats["api_requests"] += 1
+    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    auth_header = request.headers.get('Authorization')
+    if not verificar_autenticacion(auth_header):
+        return jsonify({"error": "No autorizado"}), 401
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    
+    limit = request.args.get('limit', 100, type=int)
+    
+    cur.execute("""
+        SELECT t.id, t.user_id, u.username, t.amount, t.type, t.description,
+               datetime(t.timestamp, 'unixepoch') as fecha
+        FROM transactions t
+        LEFT JOIN usuarios u ON t.user_id = u.id
+        ORDER BY t.timestamp DESC
+        LIMIT ?
+    """, (limit,))
+    
+    transacciones = []
+    for row in cur.fetchall():
+        transacciones.append({
+            "id": row[0],
+            "user_id": row[1],
+            "username": row[2] or f"User_{row[1]}",
+            "amount": row[3],
+            "type": row[4],
+            "description": row[5],
+            "fecha": row[6]
+        })
+    
+    conn.close()
+    
+    return jsonify({"transacciones": transacciones})
+
+@api_app.route('/api/withdrawals', methods=['GET'])
+def api_withdrawals():
+    """Endpoint para ver retiros"""
+    stats["api_requests"] += 1
+    stats["last_api_request"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    auth_header = request.headers.get('Authorization')
+    if not verificar_autenticacion(auth_header):
+        return jsonify({"error": "No autorizado"}), 401
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    
+    status = request.args.get('status', 'all')
+    limit = request.args.get('limit', 50, type=int)
+    
+    query = """
+        SELECT w.id, w.user_id, u.username, w.amount, w.address, 
+               w.status, datetime(w.timestamp, 'unixepoch') as fecha, w.tx_hash
+        FROM withdrawals w
+        LEFT JOIN usuarios u ON w.user_id = u.id
+    """
+    
+    params = []
+    if status != 'all':
+        query += " WHERE w.status = ?"
+        params.append(status)
+    
+    query += " ORDER BY w.timestamp DESC LIMIT ?"
+    params.append(limit)
+    
+    cur.execute(query, params)
+    
+    retiros = []
+    for row in cur.fetchall():
+        retiros.append({
+            "id": row[0],
+            "user_id": row[1],
+            "username": row[2] or f"User_{row[1]}",
+            "amount": row[3],
+            "address": row[4],
+            "status": row[5],
+            "fecha": row[6],
+            "tx_hash": row[7]
+        })
+    
+    conn.close()
+    
+    return jsonify({"retiros": retiros})
+
+class UpdateLatencyMonitor:
+    """Edad de cada mensaje al empezar a procesarlo (fecha de Telegram -> handler).
+    
+    Incluye la espera de long polling o la entrega del webhook y la cola interna, así que
+    sirve para comparar los dos modos con el mismo tráfico."""
+    
+    def __init__(self, maxlen=500):
+        self.samples = deque(maxlen=maxlen)
+        self.updates = 0
+        
+    async def registrar(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        self.updates += 1
+        mensaje = update.message or update.edited_message
+        if mensaje is not None and mensaje.date is not None:
+            self.samples.append(max(0.0, time.time() - mensaje.date.timestamp()))
+            
+    def snapshot(self):
+        muestras = sorted(self.samples)
+        if not muestras:
+            return {"modo": BOT_MODE, "updates": self.updates, "edad_media_ms": 0, "edad_p95_ms": 0}
+        return {
+            "modo": BOT_MODE,
+            "updates": self.updates,
+            "edad_media_ms": round(sum(muestras) / len(muestras) * 1000, 1),
+            "edad_p95_ms": round(muestras[min(len(muestras) - 1, int(len(muestras) * 0.95))] * 1000, 1)
+        }
+
+update_latency = UpdateLatencyMonitor()
+webhook_server = None
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Procesa en paralelo las updates de chats distintos y en orden de llegada las de un mismo chat.
+    
+    El semáforo de la clase base solo limita las updates admitidas (UPDATE_MAX_PENDING); el tope
+    de concurrencia real se aplica después de obtener el turno del chat, para que un usuario
+    que manda muchas updates seguidas no ocupe las plazas de los demás mientras espera."""
+    
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING):
+        super().__init__(max_pending)
+        self.concurrency = concurrency
+        self.slots = None
+        self.turnos = {}
+        self.en_curso = 0
+        self.esperando = 0
+        self.procesadas = 0
+        self.tiempos = {"menu": deque(maxlen=500), "mensajes": deque(maxlen=500), "otros": deque(maxlen=500)}
+        
+    async def initialize(self):
+        self.slots = asyncio.Semaphore(self.concurrency)
+        
+    async def shutdown(self):
+        pass
+        
+    @staticmethod
+    def clave(update):
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return update.effective_user.id
+        return None
+        
+    @asynccontextmanager
+    async def _turno(self, clave):
+        if clave is None:
+            yield
+            return
+        turno = self.turnos.get(clave)
+        if turno is None:
+            turno = self.turnos[clave] = [asyncio.Lock(), 0]
+        turno[1] += 1
+        try:
+            async with turno[0]:
+                yield
+        finally:
+            turno[1] -= 1
+            if turno[1] == 0:
+                del self.turnos[clave]
+                
+    async def do_process_update(self, update, coroutine):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+        llegada = time.monotonic()
+        empezada = False
+        self.esperando += 1
+        try:
+            async with self._turno(self.clave(update)), self.slots:
+                self.esperando -= 1
+                empezada = True
+                self.en_curso += 1
+                inicio = time.monotonic()
+                try:
+                    await coroutine
+                finally:
+                    self.en_curso -= 1
+                    self.procesadas += 1
+                    self._registrar(update, inicio - llegada, time.monotonic() - inicio)
+        finally:
+            if not empezada:
+                self.esperando -= 1
+                coroutine.close()
+                
+    def _registrar(self, update, espera, proceso):
+        if isinstance(update, Update) and update.callback_query is not None:
+            tipo = "menu"
+        elif isinstance(update, Update) and update.message is not None:
+            tipo = "mensajes"
+        else:
+            tipo = "otros"
+        self.tiempos[tipo].append((espera, proceso))
+        
+    @staticmethod
+    def _p95(valores):
+        ordenados = sorted(valores)
+        return round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.95))] * 1000, 1)
+        
+    def status(self):
+        por_tipo = {}
+        for tipo, muestras in self.tiempos.items():
+            muestras = list(muestras)
+            if not muestras:
+                continue
+            por_tipo[tipo] = {
+                "muestras": len(muestras),
+                "espera_p95_ms": self._p95([espera for espera, _ in muestras]),
+                "proceso_p95_ms": self._p95([proceso for _, proceso in muestras]),
+                "total_p95_ms": self._p95([espera + proceso for espera, proceso in muestras])
+            }
+        colas = [turno[1] for turno in list(self.turnos.values())]
+        return {
+            "concurrencia": self.concurrency,
+            "en_curso": self.en_curso,
+            "esperando": self.esperando,
+            "procesadas": self.procesadas,
+            "chats_activos": len(colas),
+            "cola_chat_max": max(colas) if colas else 0,
+            "latencias": por_tipo
+        }
+
+update_processor = UserOrderedUpdateProcessor()
+
+class WebhookServer:
+    """Servidor aiohttp en el mismo loop que el bot (BOT_MODE=webhook).
+    
+    Recibe las updates de Telegram en WEBHOOK_PATH y sirve también los endpoints de
+    monitorización de api_app, que se ejecutan vía WSGI en el pool por defecto porque
+    son síncronos y leen SQLite."""
+    
+    def __init__(self, application, host=API_HOST, port=API_PORT):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.runner = None
+        self.recibidas = 0
+        self.rechazadas = 0
+        
+    async def start(self):
+        web_app = web.Application()
+        web_app.router.add_post(WEBHOOK_PATH, self.recibir_update)
+        web_app.router.add_route("*", "/{ruta:.*}", self.api)
+        self.runner = web.AppRunner(web_app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        
+        await self.application.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+        log_event(f"🔗 Webhook registrado en {WEBHOOK_URL}{WEBHOOK_PATH}")
+        
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+            
+    async def recibir_update(self, peticion):
+        if peticion.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            self.rechazadas += 1
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await peticion.json(), self.application.bot)
+        except Exception as e:
+            log_event(f"⚠️ Update de webhook inválida: {e}")
+            self.rechazadas += 1
+            return web.Response(status=400)
+        self.recibidas += 1
+        # Se responde a Telegram en cuanto la update está en cola; el procesado va aparte
+        await self.application.update_queue.put(update)
+        return web.Response()
+        
+    async def api(self, peticion):
+        entorno = EnvironBuilder(
+            path=peticion.path,
+            method=peticion.method,
+            headers=list(peticion.headers.items()),
+            query_string=peticion.query_string,
+            data=await peticion.read()
+        ).get_environ()
+        loop = asyncio.get_event_loop()
+        respuesta = await loop.run_in_executor(None, WSGIResponse.from_app, api_app, entorno)
+        return web.Response(
+            status=respuesta.status_code,
+            body=respuesta.get_data(),
+            headers={k: v for k, v in respuesta.headers.items() if k.lower() != "content-length"}
+        )
+        
+    def status(self):
+        return {"recibidas": self.recibidas, "rechazadas": self.rechazadas}
+
+def print_stats():
+    os.system('cls' if os.name == 'nt' else 'clear')
+    
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    elapsed_time = time.time() - stats["start_time"]
+    hours, remainder = divmod(elapsed_time, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    
+    stats["queue_size"] = download_queue_system.priority_queue.qsize()
+    stats["active_downloads"] = len(download_queue_system.active_tasks)
+    
+    print(f"🤖 BOT ACTIVO | {current_time}")
+    print("=" * 50)
+    print(f"⬇️  DESCARGAS TOTALES: {stats['total_downloads']}")
+    print(f"📊 DESCARGAS HOY: {stats['daily_downloads']}")
+    print(f"👤 USUARIOS ÚNICOS: {len(stats['unique_users'])}")
+    print(f"💎 USUARIOS PREMIUM: {stats['premium_users']}")
+    print(f"🚀 DESCARGAS ACTIVAS: {stats['active_downloads']}")
+    print(f"⏳ EN COLA: {stats['queue_size']}")
+    print(f"✅ COMPLETADAS HOY: {stats['completed_today']}")
+    print(f"❌ ERRORES: {stats['errors']}")
+    print(f"💰 RECOMPENSAS: ${stats['total_rewards']:.2f}")
+    print(f"💸 RETIROS: ${stats['total_withdrawals']:.2f}")
+    print(f"👥 GANANCIAS POR REFERIDOS: ${stats['total_referral_earnings']:.2f}")
+    print(f"🌐 API REQUESTS: {stats['api_requests']}")
+    print(f"⏱  TIEMPO ACTIVO: {int(hours)}h {int(minutes)}m {int(seconds)}s")
+    print("=" * 50)
+    
+    if stats["active_downloads"] > 0:
+        print("ESTADO ACTUAL: Procesando descargas...")
+    elif stats["queue_size"] > 0:
+        print("ESTADO ACTUAL: En espera (cola no vacía)")
+    else:
+        print("ESTADO ACTUAL: Esperando solicitudes...")
+
+def log_event(event):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[{timestamp}] {event}")
+
+def conectar_db():
+    conn = sqlite3.connect(DB_NAME)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def crear_tabla():
+    shared_queue.ensure_schema()
+    conn = conectar_db()
+    # WAL reduce el coste de los commits frecuentes del diario de trabajos
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            descargas INTEGER DEFAULT 0,
+            youtube_descargas INTEGER DEFAULT 0,
+            ultimo_reset INTEGER,
+            youtube_ultimo_reset INTEGER,
+            premium INTEGER DEFAULT 0,
+            referido_por INTEGER,
+            ultima_tx TEXT DEFAULT '',
+            referrals INTEGER DEFAULT 0,
+            last_active INTEGER,
+            balance REAL DEFAULT 0.0,
+            language TEXT DEFAULT 'es',
+            total_earned REAL DEFAULT 0.0,
+            referral_earnings REAL DEFAULT 0.0,
+            last_daily_notification INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            type TEXT,
+            description TEXT,
+            timestamp INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_journal (
+            job_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            url TEXT,
+            tipo TEXT,
+            chat_id INTEGER,
+            message_id INTEGER,
+            priority REAL,
+            state TEXT,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            created_at INTEGER,
+            updated_at INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_journal_state ON job_journal (state)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_campaigns (
+            campaign_id TEXT PRIMARY KEY,
+            corte INTEGER,
+            last_user_id INTEGER DEFAULT 0,
+            enviados INTEGER DEFAULT 0,
+            bloqueados INTEGER DEFAULT 0,
+            fallidos INTEGER DEFAULT 0,
+            omitidos INTEGER DEFAULT 0,
+            state TEXT,
+            started_at INTEGER,
+            updated_at INTEGER,
+            finished_at INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            tx_hash TEXT PRIMARY KEY,
+            block_number INTEGER,
+            from_address TEXT,
+            token TEXT,
+            amount REAL,
+            amount_usdt REAL,
+            timestamp INTEGER,
+            user_id INTEGER,
+            claimed_at INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_from ON payments (from_address)")
+    # activar_premium busca los hashes ya usados sin distinguir mayúsculas
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_ultima_tx_lower ON usuarios (lower(ultima_tx))")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chain_cursor (
+            name TEXT PRIMARY KEY,
+            next_block INTEGER,
+            updated_at INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            address TEXT,
+            status TEXT DEFAULT 'pending',
+            timestamp INTEGER,
+            tx_hash TEXT
+        )
+    """)
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(usuarios)")
+        columns = [column[1] for column in cur.fetchall()]
+        
+        if 'youtube_descargas' not in columns:
+            conn.execute("ALTER TABLE usuarios ADD COLUMN youtube_descargas INTEGER DEFAULT 0")
+            log_event("✅ Columna 'youtube_descargas' añadida")
+            
+        if 'youtube_ultimo_reset' not in columns:
+            conn.execute("ALTER TABLE usuarios ADD COLUMN youtube_ultimo_reset INTEGER DEFAULT 0")
+            log_event("✅ Columna 'youtube_ultimo_reset' añadida")
+            
+        if 'ultima_tx' not in columns:
+            conn.execute("ALTER TABLE usuarios ADD COLUMN ultima_tx TEXT DEFAULT ''")
+            log_event("✅ Columna 'ultima_tx' añadida")
+            
+        if 'bloqueado' not in columns:
+            conn.execute("ALTER TABLE usuarios ADD COLUMN bloqueado INTEGER DEFAULT 0")
+            log_event("✅ Columna 'bloqueado' añadida")
+            
+    except Exception as e:
+        log_event(f"⚠️ Error verificando columnas: {e}")
+    
+    conn.commit()
+    conn.close()
+
+def es_url_valida(url):
+    patterns = [
+        r'https?://(www\.)?tiktok\.com/',
+        r'https?://vm\.tiktok\.com/',
+        r'https?://(www\.)?youtube\.com/',
+        r'https?://youtu\.be/'
+    ]
+    return any(re.match(pattern, url) for pattern in patterns)
+
+def clave_video(url):
+    """Identificador canónico del vídeo para detectar envíos repetidos del mismo enlace"""
+    patrones = [
+        r'youtu\.be/([\w-]{6,})',
+        r'youtube\.com/(?:shorts|embed|live)/([\w-]{6,})',
+        r'youtube\.com/.*[?&]v=([\w-]{6,})',
+        r'tiktok\.com/.*/video/(\d+)'
+    ]
+    for patron in patrones:
+        encontrado = re.search(patron, url)
+        if encontrado:
+            return encontrado.group(1)
+    # Enlaces cortos (vm.tiktok.com) y otros: URL sin parámetros ni barra final
+    return url.split('?')[0].split('#')[0].rstrip('/')
+
+def get_user_language(user_id):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT language FROM usuarios WHERE id=?", (user_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row["language"] if row else "es"
+
+def enlace_referido(user_id):
+    return f"https://t.me/DescargaVideoTikTokBot?start=ref_{user_id}"
+
+def get_user_balance(user_id):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT balance FROM usuarios WHERE id=?", (user_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row["balance"] if row else 0.0
+
+def add_user_balance(user_id, amount):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("UPDATE usuarios SET balance = balance + ?, total_earned = total_earned + ? WHERE id=?", 
+                (amount, amount, user_id))
+    conn.commit()
+    conn.close()
+    stats["total_rewards"] += amount
+
+def add_referral_earnings(user_id, amount):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("UPDATE usuarios SET referral_earnings = referral_earnings + ? WHERE id=?", 
+                (amount, user_id))
+    conn.commit()
+    conn.close()
+    stats["total_referral_earnings"] += amount
+
+def es_premium(user_id):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT premium FROM usuarios WHERE id=?", (user_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row and row["premium"] == 1
+
+def get_priority(user_id):
+    return 0 if es_premium(user_id) else 1
+
+def actualizar_estadisticas(user_id):
+    stats["unique_users"].add(user_id)
+    stats["daily_downloads"] += 1
+    stats["total_downloads"] += 1
+    stats["completed_today"] += 1
+    
+    if es_premium(user_id):
+        stats["premium_users"] = len([u for u in stats["unique_users"] if es_premium(u)])
+    
+    print_stats()
+
+def sanitize_filename(filename):
+    invalid_chars = '<>:"/\\|?*'
+    for char in invalid_chars:
+        filename = filename.replace(char, '_')
+    if len(filename) > 100:
+        filename = filename[:100]
+    return filename
+
+def format_duration(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours > 0:
+        return f"{int(hours)}:{int(minutes):02d}:{int(seconds):02d}"
+    else:
+        return f"{int(minutes)}:{int(seconds):02d}"
+
+def registrar_usuario(user_id, username, referido_por=None):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM usuarios WHERE id=?", (user_id,))
+    usuario_existente = cur.fetchone()
+    
+    if not usuario_existente:
+        cur.execute(
+            "INSERT INTO usuarios (id, username, descargas, youtube_descargas, ultimo_reset, youtube_ultimo_reset, premium, referido_por, last_active, balance, language, total_earned, referral_earnings, last_daily_notification, ultima_tx) VALUES (?, ?, 0, 0, ?, ?, 0, ?, ?, 0.0, 'es', 0.0, 0.0, ?, '')",
+            (user_id, username, int(time.time()), int(time.time()), referido_por, int(time.time()), int(time.time()))
+        )
+        
+        if referido_por:
+            cur.execute("UPDATE usuarios SET referrals = referrals + 1 WHERE id=?", (referido_por,))
+            add_user_balance(referido_por, REFERRAL_REWARD)
+            add_referral_earnings(referido_por, REFERRAL_REWARD)
+            
+            cur.execute(
+                "INSERT INTO transactions (user_id, amount, type, description, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (referido_por, REFERRAL_REWARD, 'referral', 'Bonus por nuevo referido', int(time.time()))
+            )
+    else:
+        # Si había bloqueado el bot y vuelve a escribir, recibe otra vez los recordatorios
+        cur.execute("UPDATE usuarios SET last_active = ?, username = ?, bloqueado = 0 WHERE id = ?", 
+                   (int(time.time()), username, user_id))
+    conn.commit()
+    conn.close()
+    
+    stats["unique_users"].add(user_id)
+    print_stats()
+    log_event(f"👤 Usuario registrado: @{username} ({user_id})")
+
+class MeteredHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest con keep-alive configurable que mide la ocupación de su pool"""
+    
+    def __init__(self, name, pool_size, **kwargs):
+        super().__init__(
+            connection_pool_size=pool_size,
+            pool_timeout=TG_POOL_TIMEOUT,
+            httpx_kwargs={"limits": httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=TG_KEEPALIVE_EXPIRY
+            )},
+            **kwargs
+        )
+        self.name = name
+        self.pool_size = pool_size
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.pool_timeouts = 0
+        self.errors = 0
+        self.total_time = 0.0
+        
+    async def do_request(self, *args, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        inicio = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        except TimedOut as e:
+            if "Pool timeout" in str(e):
+                self.pool_timeouts += 1
+            self.errors += 1
+            raise
+        except NetworkError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.requests += 1
+            self.total_time += time.perf_counter() - inicio
+            
+    def status(self):
+        return {
+            "conexiones": self.pool_size,
+            "en_uso": self.in_flight,
+            "max_en_uso": self.max_in_flight,
+            # Por encima de 1 hay peticiones esperando conexión libre
+            "saturacion": round(self.in_flight / self.pool_size, 2),
+            "peticiones": self.requests,
+            "pool_agotado": self.pool_timeouts,
+            "errores": self.errors,
+            "ms_medio": round(self.total_time / self.requests * 1000, 1) if self.requests else 0
+        }
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        
+    def _refill(self, ahora):
+        self.tokens = min(self.burst, self.tokens + (ahora - self.updated) * self.rate)
+        self.updated = ahora
+        
+    def wait_time(self, ahora):
+        """Segundos hasta que haya un token disponible (0 si ya lo hay)"""
+        self._refill(ahora)
+        espera = max(0.0, self.blocked_until - ahora)
+        if self.tokens < 1:
+            espera = max(espera, (1 - self.tokens) / self.rate)
+        return espera
+        
+    def take(self):
+        self.tokens -= 1
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Planificador de envíos a Telegram con cubetas de tokens global y por chat.
+    
+    Las peticiones salen por prioridad (respuestas al usuario antes que progreso) y las
+    ediciones de progreso pendientes de un mismo mensaje se fusionan en la última."""
+    
+    INMEDIATOS = ("answerCallbackQuery", "getMe", "getUpdates", "deleteWebhook", "setWebhook", "getFile")
+    
+    def __init__(self, global_rate=TG_GLOBAL_RATE, global_burst=TG_GLOBAL_BURST):
+        self.global_bucket = TokenBucket(global_rate, max(1, global_burst))
+        self.chat_buckets = {}
+        self.pending = []
+        self.seq = 0
+        self.loop = None
+        self.wakeup = None
+        self.dispatcher = None
+        self.sent = {PRIORIDAD_USUARIO: 0, PRIORIDAD_PROGRESO: 0, PRIORIDAD_AVISOS: 0}
+        self.coalesced = 0
+        self.retry_after = 0
+        self.max_wait = 0.0
+        self.recent = deque(maxlen=2000)
+        
+    async def initialize(self):
+        self._ensure_started()
+        
+    async def shutdown(self):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            self.dispatcher = None
+            
+    def _ensure_started(self):
+        if self.dispatcher is None or self.dispatcher.done():
+            self.loop = asyncio.get_running_loop()
+            self.wakeup = asyncio.Event()
+            self.dispatcher = self.loop.create_task(self._dispatch())
+            
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Los grupos (id negativo) tienen un límite mucho más bajo que los chats privados
+            es_grupo = isinstance(chat_id, int) and chat_id < 0
+            bucket = TokenBucket(TG_GROUP_RATE, 1) if es_grupo else TokenBucket(TG_CHAT_RATE, TG_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+        
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in self.INMEDIATOS or "chat_id" not in data:
+            return await callback(*args, **kwargs)
+            
+        if self.loop is not None and asyncio.get_running_loop() is not self.loop:
+            # Llamadas desde otros hilos (progreso de las descargas): se encolan en el loop del bot
+            futuro = asyncio.run_coroutine_threadsafe(
+                self.process_request(callback, args, kwargs, endpoint, data, rate_limit_args), self.loop
+            )
+            return await asyncio.wrap_future(futuro)
+            
+        self._ensure_started()
+        opciones = rate_limit_args if isinstance(rate_limit_args, dict) else {}
+        prioridad = opciones.get("prioridad", PRIORIDAD_USUARIO)
+        clave = None
+        if endpoint.startswith("editMessage"):
+            clave = (data.get("chat_id"), data.get("message_id"))
+            # Cualquier edición deja obsoletas las de progreso aún pendientes del mismo mensaje
+            for entrada in [e for e in self.pending if e["clave"] == clave and e["fusionable"]]:
+                self.pending.remove(entrada)
+                self.coalesced += 1
+                if not entrada["futuro"].done():
+                    entrada["futuro"].set_result(True)
+                    
+        self.seq += 1
+        entrada = {
+            "orden": (prioridad, self.seq),
+            "prioridad": prioridad,
+            "chat_id": data.get("chat_id"),
+            "clave": clave,
+            "fusionable": bool(opciones.get("fusionar")) and clave is not None,
+            "llamada": (callback, args, kwargs),
+            "futuro": self.loop.create_future(),
+            "creado": time.monotonic(),
+            "intentos": 0
+        }
+        self.pending.append(entrada)
+        self.wakeup.set()
+        return await entrada["futuro"]
+        
+    async def _dispatch(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+                
+            ahora = time.monotonic()
+            espera_global = self.global_bucket.wait_time(ahora)
+            elegida = None
+            espera_minima = None
+            if espera_global == 0:
+                for entrada in sorted(self.pending, key=lambda e: e["orden"]):
+                    espera = self._chat_bucket(entrada["chat_id"]).wait_time(ahora)
+                    if espera == 0:
+                        elegida = entrada
+                        break
+                    espera_minima = espera if espera_minima is None else min(espera_minima, espera)
+                    
+            if elegida is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=max(espera_global, espera_minima or 0.05))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+                
+            self.pending.remove(elegida)
+            self.global_bucket.take()
+            self._chat_bucket(elegida["chat_id"]).take()
+            self.max_wait = max(self.max_wait, ahora - elegida["creado"])
+            asyncio.create_task(self._send(elegida))
+            
+            if len(self.chat_buckets) > 10000:
+                # Se olvidan los chats sin actividad reciente
+                for chat_id in [c for c, b in self.chat_buckets.items() if ahora - b.updated > 60]:
+                    del self.chat_buckets[chat_id]
+                    
+    async def _send(self, entrada):
+        callback, args, kwargs = entrada["llamada"]
+        futuro = entrada["futuro"]
+        try:
+            resultado = await callback(*args, **kwargs)
+        except RetryAfter as e:
+            self.retry_after += 1
+            espera = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            self._chat_bucket(entrada["chat_id"]).blocked_until = time.monotonic() + espera
+            entrada["intentos"] += 1
+            if entrada["intentos"] > TG_RETRY_AFTER_MAX_RETRIES:
+                if not futuro.done():
+                    futuro.set_exception(e)
+                return
+            log_event(f"⏰ Flood limit en chat {entrada['chat_id']}, reintento en {espera:.0f}s")
+            self.pending.append(entrada)
+            self.wakeup.set()
+            return
+        except Exception as e:
+            if not futuro.done():
+                futuro.set_exception(e)
+            return
+        self.sent[entrada["prioridad"]] = self.sent.get(entrada["prioridad"], 0) + 1
+        self.recent.append(time.monotonic())
+        if not futuro.done():
+            futuro.set_result(resultado)
+            
+    def status(self):
+        ahora = time.monotonic()
+        return {
+            "pendientes": len(self.pending),
+            "enviados_por_prioridad": {
+                {PRIORIDAD_USUARIO: "usuario", PRIORIDAD_PROGRESO: "progreso", PRIORIDAD_AVISOS: "avisos"}.get(p, p): n
+                for p, n in list(self.sent.items())
+            },
+            "envios_por_segundo": round(sum(1 for ts in list(self.recent) if ts >= ahora - 10) / 10, 2),
+            "fusionados": self.coalesced,
+            "retry_after": self.retry_after,
+            "espera_maxima_segundos": round(self.max_wait, 2),
+            "chats_con_cubeta": len(self.chat_buckets)
+        }
+
+outbound_limiter = OutboundRateLimiter()
+
+http_pools = {}
+
+def crear_aplicacion(pool_name=None):
+    """ApplicationBuilder apuntando a la Bot API pública o al servidor propio"""
+    peticiones = MeteredHTTPXRequest(pool_name or "api", TG_API_POOL_SIZE)
+    if pool_name:
+        http_pools[pool_name] = peticiones
+    builder = ApplicationBuilder().token(BOT_TOKEN).request(peticiones).rate_limiter(outbound_limiter)
+    builder = builder.concurrent_updates(update_processor)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        builder = builder.local_mode(TELEGRAM_LOCAL_MODE)
+    return builder.post_stop(al_detener).build()
+
+async def al_detener(application):
+    # Los avisos encolados (pagos confirmados, referidos) salen antes de cerrar
+    await notification_service.stop()
+
+class MediaClient:
+    """Bot con pool propio para las subidas, para que no compitan con ediciones y menús"""
+    
+    def __init__(self):
+        self.request = None
+        self._bot = None
+        self.retries = 0
+        self.failures = 0
+        
+    async def bot(self):
+        if self._bot is None:
+            self.request = MeteredHTTPXRequest(
+                "subidas", TG_MEDIA_POOL_SIZE,
+                read_timeout=TG_MEDIA_READ_TIMEOUT,
+                media_write_timeout=TG_MEDIA_WRITE_TIMEOUT
+            )
+            http_pools["subidas"] = self.request
+            opciones = {}
+            if TELEGRAM_API_URL:
+                opciones = {
+                    "base_url": f"{TELEGRAM_API_URL}/bot",
+                    "base_file_url": f"{TELEGRAM_API_URL}/file/bot",
+                    "local_mode": TELEGRAM_LOCAL_MODE
+                }
+            bot = ExtBot(BOT_TOKEN, request=self.request, rate_limiter=outbound_limiter, **opciones)
+            await bot.initialize()
+            self._bot = bot
+        return self._bot
+        
+    async def with_retries(self, operacion, descripcion):
+        """Reintenta con espera exponencial ante errores de red.
+        
+        RetryAfter ya lo reintenta outbound_limiter respetando la espera de Telegram; si llega
+        hasta aquí es que se agotaron esos reintentos y no se vuelve a empezar."""
+        for intento in range(UPLOAD_MAX_RETRIES + 1):
+            try:
+                return await operacion()
+            except (TimedOut, NetworkError) as e:
+                # BadRequest, RetryAfter y demás errores de Telegram no se reintentan
+                espera = UPLOAD_RETRY_BASE * (2 ** intento) + random.uniform(0, 1)
+                error = e
+            if intento == UPLOAD_MAX_RETRIES:
+                self.failures += 1
+                raise error
+            self.retries += 1
+            log_event(f"🔁 Reintentando {descripcion} en {espera:.1f}s ({intento + 1}/{UPLOAD_MAX_RETRIES}): {error}")
+            await asyncio.sleep(espera)
+            
+    def status(self):
+        return {
+            "reintentos": self.retries,
+            "fallos_definitivos": self.failures
+        }
+
+media_client = MediaClient()
+
+class NotificationService:
+    """Envía avisos con el bot de la aplicación en marcha.
+    
+    notify() se puede llamar desde cualquier hilo y no bloquea; los avisos agrupables
+    que llegan al mismo chat dentro de NOTIFY_BATCH_WINDOW salen en un solo mensaje.
+    Al parar el bot, stop() envía lo que quede en cola antes de cerrar."""
+    
+    def __init__(self, max_queue=NOTIFY_QUEUE_SIZE, concurrency=NOTIFY_CONCURRENCY, batch_window=NOTIFY_BATCH_WINDOW):
+        self.max_queue = max_queue
+        self.concurrency = concurrency
+        self.batch_window = batch_window
+        self.pending = deque()
+        self.lock = Lock()
+        self.app = None
+        self.loop = None
+        self.wakeup = None
+        self.worker = None
+        self.tasks = set()
+        self.sent = 0
+        self.batched = 0
+        self.retries = 0
+        self.dropped = 0
+        self.failed = 0
+        
+    def start(self, application):
+        """Arranca el worker en el loop del bot"""
+        self.app = application
+        self.loop = asyncio.get_event_loop()
+        self.wakeup = asyncio.Event()
+        if self.pending:
+            self.wakeup.set()
+        self.worker = self.loop.create_task(self._worker())
+        
+    async def stop(self, timeout=NOTIFY_FLUSH_TIMEOUT):
+        """Detiene el worker y envía lo pendiente sin esperar a agrupar; lo que no salga en timeout se descarta"""
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        await asyncio.gather(self.worker, return_exceptions=True)
+        self.worker = None
+        self.loop = None
+        
+        limite = asyncio.Semaphore(self.concurrency)
+        
+        async def enviar(chat_id, texto, parse_mode):
+            async with limite:
+                await self._send(chat_id, texto, parse_mode)
+                
+        for chat_id, texto, parse_mode in self._agrupar(self._drain()):
+            self._lanzar(enviar(chat_id, texto, parse_mode))
+        if not self.tasks:
+            return
+        _, sin_enviar = await asyncio.wait(set(self.tasks), timeout=timeout)
+        for tarea in sin_enviar:
+            tarea.cancel()
+        if sin_enviar:
+            self.dropped += len(sin_enviar)
+            log_event(f"⚠️ {len(sin_enviar)} avisos sin enviar al cerrar")
+        
+    def _lanzar(self, coro):
+        tarea = asyncio.create_task(coro)
+        self.tasks.add(tarea)
+        tarea.add_done_callback(self.tasks.discard)
+        return tarea
+        
+    def notify(self, chat_id, text, parse_mode=None, batch=False):
+        with self.lock:
+            if len(self.pending) >= self.max_queue:
+                self.dropped += 1
+                log_event(f"⚠️ Cola de notificaciones llena, aviso a {chat_id} descartado")
+                return False
+            self.pending.append((chat_id, text, parse_mode, batch))
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        return True
+        
+    def _drain(self):
+        with self.lock:
+            lote = list(self.pending)
+            self.pending.clear()
+        return lote
+        
+    async def _worker(self):
+        limite = asyncio.Semaphore(self.concurrency)
+        while True:
+            try:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                with self.lock:
+                    hay_agrupables = any(batch for _, _, _, batch in self.pending)
+                if hay_agrupables:
+                    # Se espera un poco para juntar los avisos que llegan seguidos al mismo chat
+                    await asyncio.sleep(self.batch_window)
+                    
+                lote = deque(self._agrupar(self._drain()))
+                try:
+                    while lote:
+                        await limite.acquire()
+                        chat_id, texto, parse_mode = lote.popleft()
+                        tarea = self._lanzar(self._send(chat_id, texto, parse_mode))
+                        tarea.add_done_callback(lambda _: limite.release())
+                except asyncio.CancelledError:
+                    # Lo que no llegó a salir vuelve a la cola para que stop() lo envíe
+                    with self.lock:
+                        self.pending.extendleft((c, t, p, False) for c, t, p in reversed(lote))
+                    raise
+            except Exception as e:
+                log_event(f"❌ Error en el servicio de notificaciones: {e}")
+                await asyncio.sleep(1)
+                
+    def _agrupar(self, lote):
+        """Une los avisos agrupables de cada chat respetando el tamaño máximo de mensaje"""
+        salida = []
+        grupos = {}
+        for chat_id, texto, parse_mode, batch in lote:
+            if not batch:
+                salida.append((chat_id, texto, parse_mode))
+                continue
+            partes = grupos.setdefault((chat_id, parse_mode), [])
+            if partes and len(partes[-1]) + len(texto) + 2 <= TELEGRAM_MAX_MESSAGE:
+                partes[-1] = f"{partes[-1]}\n\n{texto}"
+                self.batched += 1
+            else:
+                partes.append(texto)
+        for (chat_id, parse_mode), partes in grupos.items():
+            salida.extend((chat_id, texto, parse_mode) for texto in partes)
+        return salida
+        
+    async def _send(self, chat_id, texto, parse_mode):
+        for intento in range(NOTIFY_MAX_RETRIES + 1):
+            try:
+                await self.app.bot.send_message(
+                    chat_id=chat_id,
+                    text=texto,
+                    parse_mode=parse_mode,
+                    rate_limit_args={"prioridad": PRIORIDAD_AVISOS}
+                )
+                self.sent += 1
+                return True
+            except (Forbidden, BadRequest) as e:
+                # Usuario que bloqueó el bot o chat inexistente: reintentar no sirve
+                log_event(f"⚠️ Aviso a {chat_id} descartado: {e}")
+                break
+            except Exception as e:
+                if intento == NOTIFY_MAX_RETRIES:
+                    log_event(f"❌ Error enviando aviso a {chat_id}: {e}")
+                    break
+                self.retries += 1
+                await asyncio.sleep(UPLOAD_RETRY_BASE * (2 ** intento))
+        self.failed += 1
+        return False
+        
+    def status(self):
+        return {
+            "pendientes": len(self.pending),
+            "enviados": self.sent,
+            "agrupados": self.batched,
+            "reintentos": self.retries,
+            "descartados": self.dropped,
+            "fallidos": self.failed
+        }
+
+notification_service = NotificationService()
+
+def notificar_referidor(referidor_id, username_referido, recompensa):
+    texto = catalogo.texto(get_user_language(referidor_id), 'new_referral', username_referido, recompensa)
+    notification_service.notify(referidor_id, texto, parse_mode='Markdown')
+
+def puede_descargar(user_id):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM usuarios WHERE id=?", (user_id,))
+    usuario = cur.fetchone()
+    conn.close()
+    
+    if not usuario:
+        return False, 0, 0
+        
+    limite_base = LIMIT_POR_DIA
+    limite_extra = usuario["referrals"]
+    limite_total = limite_base + limite_extra
+    
+    if usuario["premium"]:
+        return True, 0, 0
+        
+    ahora = int(time.time())
+    if ahora - usuario["ultimo_reset"] > 86400:
+        conn = conectar_db()
+        conn.execute(
+            "UPDATE usuarios SET descargas=0, ultimo_reset=? WHERE id=?", (ahora, user_id)
+        )
+        conn.commit()
+        conn.close()
+        return True, 0, limite_total
+        
+    descargas_restantes = limite_total - usuario["descargas"]
+    return usuario["descargas"] < limite_total, usuario["descargas"], limite_total
+
+async def puede_descargar_youtube(user_id):
+    if es_premium(user_id):
+        return True
+        
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT youtube_descargas, youtube_ultimo_reset FROM usuarios WHERE id=?", (user_id,))
+    usuario = cur.fetchone()
+    
+    if not usuario:
+        conn.close()
+        return False
+        
+    ahora = int(time.time())
+    
+    if ahora - usuario["youtube_ultimo_reset"] > 86400:
+        conn.execute(
+            "UPDATE usuarios SET youtube_descargas=0, youtube_ultimo_reset=? WHERE id=?", (ahora, user_id)
+        )
+        conn.commit()
+        conn.close()
+        return True
+        
+    puede = usuario["youtube_descargas"] < YOUTUBE_DAILY_LIMIT
+    conn.close()
+    return puede
+
+def incrementar_descarga(user_id):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("UPDATE usuarios SET descargas = descargas + 1, last_active = ? WHERE id=?", 
+                (int(time.time()), user_id))
+    
+    recompensa = round(random.uniform(REWARD_PER_DOWNLOAD_MIN, REWARD_PER_DOWNLOAD_MAX), 2)
+    cur.execute("UPDATE usuarios SET balance = balance + ?, total_earned = total_earned + ? WHERE id=?", 
+                (recompensa, recompensa, user_id))
+    
+    conn.commit()
+    conn.close()
+    
+    stats["total_rewards"] += recompensa
+    return recompensa
+
+def incrementar_descarga_youtube(user_id):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("UPDATE usuarios SET youtube_descargas = youtube_descargas + 1 WHERE id=?", (user_id,))
+    conn.commit()
+    conn.close()
+
+def get_youtube_stats(user_id):
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT youtube_descargas, youtube_ultimo_reset FROM usuarios WHERE id=?", (user_id,))
+    usuario = cur.fetchone()
+    conn.close()
+    
+    if not usuario:
+        return 0, YOUTUBE_DAILY_LIMIT
+        
+    ahora = int(time.time())
+    if ahora - usuario["youtube_ultimo_reset"] > 86400:
+        return 0, YOUTUBE_DAILY_LIMIT
+    else:
+        return usuario["youtube_descargas"], YOUTUBE_DAILY_LIMIT
+
+# NUEVO: Diccionario para usuarios esperando TX
+waiting_for_tx = BoundedStore("waiting_for_tx", TX_STORE_TTL, TX_STORE_MAX)
+
+class ChainClientError(Exception):
+    pass
+
+class BscScanClient:
+    """Cliente asíncrono del explorador de BSC con un pool de conexiones compartido.
+    
+    Cada llamada tiene su propio timeout; cuando el explorador responde con límite de
+    peticiones (HTTP 429 o "Max rate limit reached") se reintenta con espera exponencial.
+    BSCSCAN_API_URL permite apuntarlo a un explorador simulado en local."""
+    
+    def __init__(self, api_url=BSCSCAN_API_URL, api_key=BSC_API_KEY, pool_size=CHAIN_POOL_SIZE):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.session = None
+        self.bnb_price_cache = None
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.latencias = deque(maxlen=200)
+        
+    def _sesion(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            )
+        return self.session
+        
+    @staticmethod
+    def _limitado(datos):
+        resultado = datos.get("result") if isinstance(datos, dict) else None
+        return isinstance(resultado, str) and "rate limit" in resultado.lower()
+        
+    async def _get(self, url, params=None, timeout=CHAIN_CALL_TIMEOUT):
+        for intento in range(CHAIN_MAX_RETRIES + 1):
+            self.calls += 1
+            inicio = time.monotonic()
+            try:
+                async with self._sesion().get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as respuesta:
+                    if respuesta.status == 429:
+                        datos = None
+                        limitado = True
+                    elif respuesta.status != 200:
+                        raise ChainClientError(f"HTTP {respuesta.status}")
+                    else:
+                        datos = await respuesta.json(content_type=None)
+                        limitado = self._limitado(datos)
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                self.errors += 1
+                raise ChainClientError(f"{type(e).__name__}: {e}")
+            finally:
+                self.latencias.append(time.monotonic() - inicio)
+                
+            if not limitado:
+                return datos
+            self.rate_limited += 1
+            if intento == CHAIN_MAX_RETRIES:
+                break
+            self.retries += 1
+            await asyncio.sleep(CHAIN_RETRY_BASE * (2 ** intento))
+        self.errors += 1
+        raise ChainClientError("límite de peticiones del explorador")
+        
+    async def _proxy(self, action, **params):
+        datos = await self._get(self.api_url, dict(module="proxy", action=action, apikey=self.api_key, **params))
+        resultado = datos.get("result") if isinstance(datos, dict) else None
+        return resultado if isinstance(resultado, dict) else None
+        
+    async def block_number(self):
+        datos = await self._get(self.api_url, dict(module="proxy", action="eth_blockNumber", apikey=self.api_key))
+        try:
+            return int(datos["result"], 16)
+        except (KeyError, TypeError, ValueError):
+            raise ChainClientError(f"eth_blockNumber: {datos}")
+            
+    async def _account(self, action, **params):
+        """Listados del módulo account; "No transactions found" es una lista vacía, no un error"""
+        datos = await self._get(self.api_url, dict(module="account", action=action, apikey=self.api_key, **params))
+        resultado = datos.get("result") if isinstance(datos, dict) else None
+        if isinstance(resultado, list):
+            return resultado
+        if str(datos.get("message") if isinstance(datos, dict) else "").startswith("No transactions found"):
+            return []
+        raise ChainClientError(f"{action}: {resultado}")
+        
+    async def token_transfers(self, address, contract, startblock, endblock):
+        return await self._account(
+            "tokentx", address=address, contractaddress=contract, startblock=startblock,
+            endblock=endblock, sort="asc", page=1, offset=PAYMENT_PAGE_SIZE
+        )
+        
+    async def transactions(self, address, startblock, endblock):
+        return await self._account(
+            "txlist", address=address, startblock=startblock,
+            endblock=endblock, sort="asc", page=1, offset=PAYMENT_PAGE_SIZE
+        )
+        
+    async def transaction(self, tx_hash):
+        return await self._proxy("eth_getTransactionByHash", txhash=tx_hash)
+        
+    async def receipt(self, tx_hash):
+        return await self._proxy("eth_getTransactionReceipt", txhash=tx_hash)
+        
+    async def bnb_price(self):
+        if self.bnb_price_cache and time.monotonic() - self.bnb_price_cache[1] < BNB_PRICE_TTL:
+            return self.bnb_price_cache[0]
+        datos = await self._get(BNB_PRICE_URL)
+        precio = float(datos["price"])
+        self.bnb_price_cache = (precio, time.monotonic())
+        return precio
+        
+    def status(self):
+        latencias = sorted(self.latencias)
+        return {
+            "explorador": self.api_url,
+            "llamadas": self.calls,
+            "reintentos": self.retries,
+            "limitadas": self.rate_limited,
+            "errores": self.errors,
+            "latencia_p95_ms": round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))] * 1000, 1) if latencias else 0
+        }
+
+bsc_client = BscScanClient()
+
+def usdt_recibido(recibo):
+    """USDT (BEP-20) transferidos a USDT_ADDRESS según los eventos Transfer del recibo"""
+    total = 0
+    for evento in recibo.get("logs") or []:
+        topics = [topic.lower() for topic in evento.get("topics") or []]
+        if (
+            (evento.get("address") or "").lower() == USDT_BEP20_CONTRACT
+            and len(topics) == 3
+            and topics[0] == ERC20_TRANSFER_TOPIC
+            and "0x" + topics[2][-40:] == USDT_ADDRESS
+        ):
+            total += int(evento.get("data") or "0x0", 16)
+    return total / 10 ** USDT_BEP20_DECIMALS
+
+def buscar_pago(tx_hash):
+    """Pago ya indexado por PaymentIndexer (o registrado al verificarlo), por hash"""
+    conn = conectar_db()
+    try:
+        fila = conn.execute(
+            "SELECT token, amount, amount_usdt, user_id FROM payments WHERE tx_hash = ?", (tx_hash,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if not fila:
+        return None
+    return {"token": fila[0], "amount": fila[1], "amount_usdt": fila[2], "user_id": fila[3]}
+
+async def validar_pago_con_tx(user_id, tx_hash):
+    """Verifica un pago específico usando el hash de transacción.
+    
+    Devuelve (ok, clave, args): el mensaje se compone con catalogo.texto en el idioma del usuario"""
+    tx_hash = tx_hash.lower()
+    try:
+        # Si el indexador ya vio la transferencia basta una consulta local
+        pago = buscar_pago(tx_hash)
+        if pago:
+            if pago["user_id"] is not None:
+                return False, 'tx_already_used', ()
+            if pago["amount_usdt"] >= MIN_USDT:
+                return activar_premium(user_id, tx_hash, pago["amount_usdt"], pago["token"], pago["amount"])
+            return False, 'tx_no_valid_payment', ()
+            
+        # Aún no indexada (pocas confirmaciones o indexador desactivado): se consulta el explorador
+        # Detalles, recibo y precio de BNB no dependen entre sí: se piden a la vez
+        tx_result, recibo, bnb_price = await asyncio.gather(
+            bsc_client.transaction(tx_hash),
+            bsc_client.receipt(tx_hash),
+            bsc_client.bnb_price(),
+            return_exceptions=True
+        )
+        for resultado in (tx_result, recibo):
+            if isinstance(resultado, Exception):
+                raise resultado
+                
+        # Verificar si la transacción existe y fue exitosa
+        if not recibo or recibo.get("status") != "0x1":
+            return False, 'tx_not_found', ()
+        if not tx_result:
+            return False, 'tx_no_details', ()
+            
+        destino = (tx_result.get("to") or "").lower()
+        
+        # Pago directo en BNB a nuestra dirección
+        if destino == USDT_ADDRESS:
+            value_bnb = int(tx_result.get("value") or "0x0", 16) / 10**18
+            if value_bnb > 0:
+                if isinstance(bnb_price, Exception):
+                    log_event(f"⚠️ Precio de BNB no disponible: {bnb_price}")
+                    return False, 'tx_price_error', ()
+                value_usdt = value_bnb * bnb_price
+                if value_usdt >= MIN_USDT:
+                    return activar_premium(user_id, tx_hash, value_usdt, "BNB", value_bnb)
+                    
+        # Pago en USDT: la transacción va al contrato del token y el destino está en el evento Transfer
+        amount = usdt_recibido(recibo)
+        if amount >= MIN_USDT:
+            return activar_premium(user_id, tx_hash, amount, "USDT")
+            
+        if amount == 0 and destino not in (USDT_ADDRESS, USDT_BEP20_CONTRACT):
+            return False, 'tx_wrong_address', ()
+        return False, 'tx_no_valid_payment', ()
+        
+    except ChainClientError as e:
+        log_event(f"❌ Error consultando BscScan: {e}")
+        return False, 'tx_explorer_error', ()
+    except Exception as e:
+        log_event(f"❌ Error validando TX: {e}")
+        return False, 'tx_connection_error', (str(e),)
+
+def activar_premium(user_id, tx_hash, amount, token_type, token_amount=None):
+    """Activa la cuenta premium para un usuario; amount va en USDT y token_amount en el token pagado.
+    
+    Devuelve (ok, clave, args) como validar_pago_con_tx"""
+    if token_amount is None:
+        token_amount = amount
+    try:
+        conn = conectar_db()
+        cur = conn.cursor()
+        
+        # Verificar si el TX ya fue usado (pagos anteriores a la tabla payments)
+        cur.execute("SELECT id FROM usuarios WHERE lower(ultima_tx) = ?", (tx_hash,))
+        if cur.fetchone():
+            conn.close()
+            return False, 'tx_already_used', ()
+        
+        # Reclamar el pago en payments: el UPDATE condicional impide usarlo dos veces
+        ahora = int(time.time())
+        cur.execute(
+            "INSERT OR IGNORE INTO payments (tx_hash, token, amount, amount_usdt, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (tx_hash, token_type, token_amount, amount, ahora)
+        )
+        cur.execute(
+            "UPDATE payments SET user_id=?, claimed_at=? WHERE tx_hash=? AND user_id IS NULL",
+            (user_id, ahora, tx_hash)
+        )
+        if cur.rowcount == 0:
+            conn.close()
+            return False, 'tx_already_used', ()
+        
+        # Activar premium
+        cur.execute("UPDATE usuarios SET premium=1, ultima_tx=? WHERE id=?", (tx_hash, user_id))
+        conn.commit()
+        conn.close()
+        
+        stats["premium_users"] += 1
+        print_stats()
+        
+        log_event(f"✅ Pago confirmado para usuario {user_id}: {amount:.2f} {token_type} (TX: {tx_hash})")
+        return True, 'payment_confirmed', (amount, token_type, tx_hash)
+        
+    except Exception as e:
+        log_event(f"❌ Error activando premium: {e}")
+        return False, 'premium_activation_error', ()
+
+class PaymentIndexer:
+    """Indexa en segundo plano las transferencias recibidas en USDT_ADDRESS.
+    
+    Cada ciclo pide al explorador solo lo nuevo desde el último bloque visto (tokentx del
+    contrato USDT y txlist para BNB) hasta el último bloque con PAYMENT_CONFIRMATIONS
+    confirmaciones, y lo guarda en payments; verificar un pago pasa a ser una consulta
+    por tx_hash. El cursor se guarda en chain_cursor junto con los pagos."""
+    
+    CURSOR = "payments"
+    
+    def __init__(self, interval=PAYMENT_INDEX_INTERVAL):
+        self.interval = interval
+        self.next_block = None
+        self.head = None
+        self.indexed = 0
+        self.credited = 0
+        self.errors = 0
+        self.last_run = None
+        
+    def _cursor(self):
+        conn = conectar_db()
+        try:
+            fila = conn.execute("SELECT next_block FROM chain_cursor WHERE name = ?", (self.CURSOR,)).fetchone()
+        finally:
+            conn.close()
+        return fila[0] if fila else None
+        
+    def _guardar(self, pagos, next_block):
+        """Inserta los pagos y avanza el cursor en una transacción; devuelve los nuevos"""
+        nuevos = []
+        conn = conectar_db()
+        try:
+            with conn:
+                for pago in pagos:
+                    cur = conn.execute(
+                        "INSERT OR IGNORE INTO payments (tx_hash, block_number, from_address, token, amount, amount_usdt, timestamp) "
+                        "VALUES (:tx_hash, :block_number, :from_address, :token, :amount, :amount_usdt, :timestamp)",
+                        pago
+                    )
+                    if cur.rowcount:
+                        nuevos.append(pago)
+                conn.execute(
+                    "INSERT OR REPLACE INTO chain_cursor (name, next_block, updated_at) VALUES (?, ?, ?)",
+                    (self.CURSOR, next_block, int(time.time()))
+                )
+        finally:
+            conn.close()
+        return nuevos
+        
+    @staticmethod
+    def _pago(tx, token, amount, amount_usdt):
+        return {
+            "tx_hash": tx["hash"].lower(),
+            "block_number": int(tx["blockNumber"]),
+            "from_address": (tx.get("from") or "").lower(),
+            "token": token,
+            "amount": amount,
+            "amount_usdt": amount_usdt,
+            "timestamp": int(tx.get("timeStamp") or time.time())
+        }
+        
+    async def sync(self):
+        """Un ciclo de indexado; devuelve los pagos nuevos"""
+        self.head = await bsc_client.block_number()
+        hasta = self.head - PAYMENT_CONFIRMATIONS
+        desde = self._cursor()
+        if desde is None:
+            # Primera ejecución: no se recorre todo el historial de la dirección
+            desde = max(0, hasta - PAYMENT_INITIAL_LOOKBACK)
+        self.next_block = desde
+        if hasta < desde:
+            return []
+            
+        tokens, nativas = await asyncio.gather(
+            bsc_client.token_transfers(USDT_ADDRESS, USDT_BEP20_CONTRACT, desde, hasta),
+            bsc_client.transactions(USDT_ADDRESS, desde, hasta)
+        )
+        
+        pagos = {}
+        for tx in tokens:
+            if (tx.get("to") or "").lower() != USDT_ADDRESS or (tx.get("contractAddress") or "").lower() != USDT_BEP20_CONTRACT:
+                continue
+            amount = int(tx["value"]) / 10 ** int(tx.get("tokenDecimal") or USDT_BEP20_DECIMALS)
+            pago = pagos.get(tx["hash"].lower())
+            if pago:
+                # Varias transferencias a nuestra dirección en la misma transacción
+                pago["amount"] += amount
+                pago["amount_usdt"] += amount
+            else:
+                pagos[tx["hash"].lower()] = self._pago(tx, "USDT", amount, amount)
+                
+        validas = [
+            tx for tx in nativas
+            if (tx.get("to") or "").lower() == USDT_ADDRESS and tx.get("isError", "0") == "0" and int(tx.get("value") or 0) > 0
+        ]
+        if validas:
+            bnb_price = await bsc_client.bnb_price()
+            for tx in validas:
+                value_bnb = int(tx["value"]) / 10**18
+                pagos.setdefault(tx["hash"].lower(), self._pago(tx, "BNB", value_bnb, value_bnb * bnb_price))
+                
+        # Con una página llena el resto de su último bloque puede faltar: se relee desde él.
+        # Se mira la respuesta sin filtrar: una página llena de envíos ajenos también corta
+        siguiente = hasta + 1
+        for lista in (tokens, nativas):
+            if len(lista) >= PAYMENT_PAGE_SIZE:
+                siguiente = min(siguiente, int(lista[-1]["blockNumber"]))
+        if siguiente <= desde:
+            log_event(f"⚠️ Más de {PAYMENT_PAGE_SIZE} transferencias en el bloque {desde}, se avanza igualmente")
+            siguiente = desde + 1
+            
+        nuevos = self._guardar(list(pagos.values()), siguiente)
+        self.next_block = siguiente
+        self.indexed += len(nuevos)
+        if nuevos:
+            log_event(f"💳 {len(nuevos)} pagos nuevos indexados (bloques {desde}-{siguiente - 1})")
+        return nuevos
+        
+    def _propietario(self, address):
+        """Usuario cuya wallet de retiros coincide con el remitente, si es uno solo y no es premium"""
+        conn = conectar_db()
+        try:
+            filas = conn.execute(
+                "SELECT DISTINCT w.user_id FROM withdrawals w JOIN usuarios u ON u.id = w.user_id "
+                "WHERE lower(w.address) = ? AND u.premium = 0",
+                (address,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return filas[0][0] if len(filas) == 1 else None
+        
+    def acreditar(self, pagos):
+        for pago in pagos:
+            if not pago["from_address"] or pago["amount_usdt"] < MIN_USDT:
+                continue
+            user_id = self._propietario(pago["from_address"])
+            if user_id is None:
+                continue
+            ok, clave, args = activar_premium(user_id, pago["tx_hash"], pago["amount_usdt"], pago["token"], pago["amount"])
+            if ok:
+                self.credited += 1
+                msg = catalogo.texto(get_user_language(user_id), clave, *args)
+                notification_service.notify(user_id, msg, parse_mode="Markdown")
+                
+    async def run(self):
+        log_event(f"💳 Indexador de pagos iniciado (cada {self.interval}s)")
+        while True:
+            try:
+                nuevos = await self.sync()
+                if PAYMENT_AUTO_CREDIT and nuevos:
+                    self.acreditar(nuevos)
+                self.last_run = time.time()
+            except ChainClientError as e:
+                self.errors += 1
+                log_event(f"⚠️ Indexador de pagos: error del explorador: {e}")
+            except Exception as e:
+                self.errors += 1
+                log_event(f"❌ Error en el indexador de pagos: {e}")
+            await asyncio.sleep(self.interval)
+            
+    def status(self):
+        return {
+            "activo": PAYMENT_INDEXER,
+            "siguiente_bloque": self.next_block,
+            "bloque_actual": self.head,
+            "retraso_bloques": self.head - self.next_block + 1 if self.head is not None and self.next_block is not None else None,
+            "indexados": self.indexed,
+            "acreditados": self.credited,
+            "autoacreditar": PAYMENT_AUTO_CREDIT,
+            "errores": self.errors,
+            "ultimo_ciclo": self.last_run
+        }
+
+payment_indexer = PaymentIndexer()
+
+def solicitar_retiro(user_id, amount, address, lang=None):
+    lang = lang or get_user_language(user_id)
+    user_balance = get_user_balance(user_id)
+    
+    if amount < MIN_WITHDRAWAL:
+        return False, catalogo.texto(lang, 'withdraw_minimum', MIN_WITHDRAWAL)
+    
+    if amount > user_balance:
+        return False, catalogo.texto(lang, 'insufficient_funds')
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    
+    cur.execute(
+        "INSERT INTO withdrawals (user_id, amount, address, timestamp) VALUES (?, ?, ?, ?)",
+        (user_id, amount, address, int(time.time()))
+    )
+    
+    cur.execute("UPDATE usuarios SET balance = balance - ? WHERE id = ?", (amount, user_id))
+    
+    conn.commit()
+    conn.close()
+    
+    stats["total_withdrawals"] += amount
+    
+    for admin_id in ADMIN_IDS:
+        notification_service.notify(
+            admin_id,
+            f"🔄 Nueva solicitud de retiro:\nUser: {user_id}\nAmount: {amount} USDT\nAddress: {address}",
+            batch=True
+        )
+    
+    return True, catalogo.texto(lang, 'withdraw_request')
+
+async def analizar_video_con_detalles(url, user_id, tipo):
+    try:
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+            'forcejson': True
+        }
+        
+        with YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            
+            titulo = info.get('title', 'Video sin título')
+            duracion = info.get('duration', 0)
+            formato = info.get('ext', 'desconocido')
+            
+            if 'filesize' in info and info['filesize']:
+                tamaño = info['filesize']
+            elif 'filesize_approx' in info and info['filesize_approx']:
+                tamaño = info['filesize_approx']
+            else:
+                if duracion > 0:
+                    tamaño = duracion * 2 * 1024 * 1024 / 60
+                else:
+                    tamaño = 0
+            
+            calidad = "Desconocida"
+            if 'height' in info:
+                calidad = f"{info['height']}p"
+            
+            if ("youtube.com" in url or "youtu.be" in url) and tipo == "yt_audio":
+                return True, tamaño, titulo, duracion, calidad, formato
+            
+            if not es_premium(user_id) and tamaño > MAX_TT_SIZE_NON_PREMIUM:
+                return False, tamaño, titulo, duracion, calidad, formato
+            
+            return True, tamaño, titulo, duracion, calidad, formato
+            
+    except Exception as e:
+        log_event(f"❌ Error analizando video: {e}")
+        return True, 0, "Video", 0, "Desconocida", "desconocido"
+
+class ProgressFileReader:
+    """Envuelve el archivo que lee el cliente HTTP y cuenta los bytes enviados.
+    
+    on_progress(porcentaje) se llama en el hilo del event loop cada vez que el
+    porcentaje avanza al menos `step` puntos."""
+    
+    def __init__(self, fileobj, on_progress, step=5):
+        self.fileobj = fileobj
+        self.name = fileobj.name
+        self.size = os.fstat(fileobj.fileno()).st_size
+        self.on_progress = on_progress
+        self.step = step
+        self.sent = 0
+        self.last_reported = -step
+        
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.sent += len(chunk)
+        porcentaje = int(self.sent * 100 / self.size) if self.size else 100
+        if porcentaje - self.last_reported >= self.step or (porcentaje == 100 and self.last_reported < 100):
+            self.last_reported = porcentaje
+            self.on_progress(porcentaje)
+        return chunk
+        
+    def seek(self, offset, whence=0):
+        # httpx rebobina antes de enviar (y en reintentos): el recuento vuelve a empezar
+        posicion = self.fileobj.seek(offset, whence)
+        self.sent = posicion
+        self.last_reported = -self.step
+        return posicion
+        
+    def tell(self):
+        return self.fileobj.tell()
+        
+    def fileno(self):
+        return self.fileobj.fileno()
+
+class PartProgress:
+    """Progreso de una parte de un envío dividido; el tracker muestra el total ponderado por bytes"""
+    def __init__(self, tracker, avance, indice, peso):
+        self.tracker = tracker
+        self.t = tracker.t
+        self.avance = avance
+        self.indice = indice
+        self.peso = peso
+        
+    async def update_upload_progress(self, progress):
+        self.avance[self.indice] = progress * self.peso
+        await self.tracker.update_upload_progress(min(100, round(sum(self.avance))))
+
+class SafeProgressTracker:
+    def __init__(self, chat_id, message_id, user_id, app):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.app = app
+        self.download_progress = 0
+        self.upload_progress = 0
+        self.is_active = True
+        self.lang = get_user_language(user_id)
+        self.t = catalogo.t(self.lang)
+        self.last_update_time = 0
+        self.last_message = ""
+        self.reply_markup = None
+        self.closed = False
+        
+    def set_cancel_button(self, job_id):
+        """Mantiene el botón de cancelar en cada edición mientras el trabajo sigue activo"""
+        self.reply_markup = catalogo.boton_cancelar(self.lang, job_id)
+        
+    async def final_message(self, text):
+        """Último mensaje del trabajo, sin botón de cancelar"""
+        self.reply_markup = None
+        self.stop()
+        self.last_message = ""
+        return await self.safe_edit_message(text, PRIORIDAD_USUARIO)
+        
+    async def safe_edit_message(self, text, prioridad=PRIORIDAD_PROGRESO):
+        if self.closed or text == self.last_message:
+            return False
+            
+        try:
+            await self.app.bot.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=self.message_id,
+                text=text,
+                reply_markup=self.reply_markup,
+                parse_mode='Markdown',
+                rate_limit_args={"prioridad": prioridad, "fusionar": prioridad == PRIORIDAD_PROGRESO}
+            )
+            self.last_message = text
+            self.last_update_time = time.time()
+            return True
+        except BadRequest as e:
+            if "Message is not modified" in str(e):
+                self.last_message = text
+                return True
+            else:
+                log_event(f"⚠️ Error editando mensaje: {e}")
+                return False
+        except Exception as e:
+            log_event(f"⚠️ Error editando mensaje: {e}")
+            return False
+            
+    async def update_download_progress(self, progress):
+        if not self.is_active:
+            return
+            
+        self.download_progress = progress
+        if time.time() - self.last_update_time >= 1:
+            text = self.t['downloading'].format(progress)
+            await self.safe_edit_message(text)
+            
+    async def update_upload_progress(self, progress):
+        if not self.is_active:
+            return
+            
+        self.upload_progress = progress
+        if time.time() - self.last_update_time >= 1:
+            text = self.t['uploading'].format(progress)
+            await self.safe_edit_message(text)
+            
+    def stop(self):
+        self.is_active = False
+        
+    def close(self):
+        """El mensaje ya no pertenece al trabajo (p. ej. tras cancelarlo)"""
+        self.closed = True
+        self.stop()
+
+class SafeParallelDownloader:
+    def __init__(self, url, user_id, tipo, progress_tracker):
+        self.url = url
+        self.user_id = user_id
+        self.tipo = tipo
+        self.filename = None
+        self.video_title = None
+        self.estimated_size = 0
+        self.timestamp = int(time.time())
+        self.prefix = "download"
+        self.base_filename = f"{self.prefix}_{user_id}_{self.timestamp}"
+        self.progress_tracker = progress_tracker
+        self.acodec = None
+        self.vcodec = None
+        self.cancel_token = None
+        try:
+            # Loop del bot: el hook de progreso se ejecuta en el hilo de la descarga
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+        self.progress_future = None
+        
+    def remove_partial_files(self):
+        """Borra los archivos que dejó una descarga abortada"""
+        for file in os.listdir(DOWNLOAD_DIR):
+            if file.startswith(self.base_filename):
+                try:
+                    os.remove(os.path.join(DOWNLOAD_DIR, file))
+                except OSError:
+                    pass
+        
+    def get_video_info(self):
+        try:
+            ydl_opts = {
+                'quiet': True,
+                'no_warnings': True,
+                'skip_download': True,
+                'forcejson': True
+            }
+            
+            with YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(self.url, download=False)
+                self.video_title = info.get('title', 'video')
+                self.estimated_size = info.get('filesize', 0) or info.get('filesize_approx', 0)
+                return True
+        except Exception as e:
+            log_event(f"❌ Error obteniendo información del video: {e}")
+            self.video_title = None
+            self.estimated_size = 0
+            return False
+            
+    def download(self):
+        try:
+            self.get_video_info()
+                
+            ydl_opts = self._get_ydl_options()
+            
+            ydl_opts['progress_hooks'] = [self._progress_hook]
+            
+            ydl_opts['socket_timeout'] = 0
+            ydl_opts['retries'] = 0
+            ydl_opts['fragment_retries'] = 0
+            
+            with open(os.devnull, 'w') as devnull:
+                with YoutubeDL(ydl_opts) as ydl:
+                    info = ydl.extract_info(self.url, download=True)
+                    if info:
+                        self.acodec = info.get('acodec')
+                        self.vcodec = info.get('vcodec')
+            
+            for file in os.listdir('.'):
+                if file.startswith(self.base_filename):
+                    self.filename = file
+                    
+                    if self.video_title:
+                        file_ext = os.path.splitext(file)[1]
+                        safe_title = sanitize_filename(self.video_title)
+                        new_filename = f"{safe_title}{file_ext}"
+                        
+                        counter = 1
+                        original_new_filename = new_filename
+                        while os.path.exists(new_filename):
+                            new_filename = f"{os.path.splitext(original_new_filename)[0]}_{counter}{file_ext}"
+                            counter += 1
+                            
+                        os.rename(file, new_filename)
+                        self.filename = new_filename
+                    
+                    file_size = os.path.getsize(self.filename)
+                    if file_size > MAX_FILE_SIZE:
+                        raise Exception(f"El archivo es demasiado grande ({file_size/1024/1024:.2f}MB > {MAX_FILE_SIZE/1024/1024}MB)")
+                        
+                    return True
+            return False
+        except Exception as e:
+            log_event(f"❌ Error en descarga: {e}")
+            stats["errors"] += 1
+            return False
+            
+    def _progress_hook(self, d):
+        if self.cancel_token is not None and self.cancel_token.cancelled:
+            raise DownloadCancelled("Descarga cancelada por el usuario")
+            
+        if d['status'] == 'downloading':
+            total = d.get('total_bytes', 0)
+            downloaded = d.get('downloaded_bytes', 0)
+            if total and downloaded:
+                progress = int((downloaded / total) * 100)
+                if progress % 5 == 0:
+                    self._publicar_progreso(progress)
+        elif d['status'] == 'finished':
+            self._publicar_progreso(100, final=True)
+            
+    def _publicar_progreso(self, progress, final=False):
+        """Entrega el progreso al tracker sin que el hilo de la descarga espere por la edición"""
+        if self.loop is None:
+            # Proceso hijo o worker.py: el reporter solo escribe en el pipe o en SQLite
+            asyncio.run(self.progress_tracker.update_download_progress(progress))
+            return
+        if not final and self.progress_future is not None and not self.progress_future.done():
+            # La edición anterior sigue en curso: este porcentaje se salta
+            return
+        coro = self.progress_tracker.update_download_progress(progress)
+        try:
+            self.progress_future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        except RuntimeError:
+            coro.close()
+            log_event("⚠️ Event loop cerrado, no se puede actualizar progreso")
+            
+    def _get_ydl_options(self):
+        base_opts = {
+            'outtmpl': self.base_filename + '.%(ext)s',
+            'noprogress': True,
+            'socket_timeout': 0,
+            'retries': 0,
+            'fragment_retries': 0,
+            'concurrent_fragment_downloads': MAX_FRAGMENTS,
+            'http_chunk_size': CHUNK_SIZE,
+            'abort_on_unavailable_fragment': False,
+            'quiet': True,
+        }
+        
+        if self.tipo == "tt_video":
+            return {**base_opts, 'format': 'best'}
+        elif self.tipo in ("tt_audio", "yt_audio"):
+            # La conversión la hace transcode_stage, fuera del pool de descargas.
+            # En modo passthrough se prefiere m4a/AAC, que Telegram reproduce sin recodificar
+            if AUDIO_MODE == "passthrough":
+                return {**base_opts, 'format': 'bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best'}
+            return {**base_opts, 'format': 'bestaudio/best'}
+        elif self.tipo == "yt_video":
+            return {**base_opts, 'format': 'best'}
+        else:
+            return {**base_opts, 'format': 'best'}
+
+# Modo de ejecución por procesos: cada descarga corre en un proceso 'spawn' propio
+class PipeProgressReporter:
+    """Sustituye al SafeProgressTracker dentro del proceso hijo y envía el progreso por el pipe"""
+    def __init__(self, conn):
+        self.conn = conn
+        
+    async def update_download_progress(self, progress):
+        try:
+            self.conn.send(("progress", progress))
+        except (BrokenPipeError, OSError):
+            pass
+
+def _download_en_proceso(url, user_id, tipo, estimated_size, base_filename, conn):
+    """Punto de entrada del proceso hijo"""
+    if hasattr(os, "setsid"):
+        # Grupo de procesos propio: al cancelar se matan también los ffmpeg que lance yt-dlp
+        os.setsid()
+    downloader = SafeParallelDownloader(url, user_id, tipo, PipeProgressReporter(conn))
+    downloader.estimated_size = estimated_size
+    # Mismos nombres que el downloader del bot, que es quien limpia los parciales
+    downloader.base_filename = base_filename
+    try:
+        success = downloader.download()
+        conn.send(("result", {
+            "success": success,
+            "filename": downloader.filename,
+            "acodec": downloader.acodec,
+            "vcodec": downloader.vcodec
+        }))
+    except Exception as e:
+        conn.send(("result", {"success": False, "error": str(e)}))
+    finally:
+        conn.close()
+
+class ProcessDownloadRunner:
+    def __init__(self, timeout=DOWNLOAD_TIMEOUT, target=_download_en_proceso):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.timeout = timeout
+        # Función del proceso hijo: recibe los datos del trabajo y el extremo del pipe
+        self.target = target
+        self.active = {}
+        self.killed = 0
+        self.timeouts = 0
+        
+    async def run(self, downloader):
+        """Ejecuta la descarga en un proceso hijo; lo mata si se cancela o expira"""
+        loop = asyncio.get_event_loop()
+        parent_conn, child_conn = self.ctx.Pipe(duplex=False)
+        proc = self.ctx.Process(
+            target=self.target,
+            args=(downloader.url, downloader.user_id, downloader.tipo, downloader.estimated_size, downloader.base_filename, child_conn),
+            daemon=True
+        )
+        proc.start()
+        child_conn.close()
+        self.active[proc.pid] = downloader.user_id
+        
+        mensajes = asyncio.Queue()
+        fd = parent_conn.fileno()
+        
+        def _leer():
+            try:
+                while parent_conn.poll():
+                    mensajes.put_nowait(parent_conn.recv())
+            except (EOFError, OSError):
+                loop.remove_reader(fd)
+                mensajes.put_nowait(("eof", None))
+                
+        loop.add_reader(fd, _leer)
+        deadline = loop.time() + self.timeout
+        terminado = False
+        exito = False
+        
+        try:
+            while True:
+                restante = deadline - loop.time()
+                if restante <= 0:
+                    raise asyncio.TimeoutError()
+                tipo_msg, valor = await asyncio.wait_for(mensajes.get(), timeout=restante)
+                
+                if tipo_msg == "progress":
+                    await downloader.progress_tracker.update_download_progress(valor)
+                elif tipo_msg == "result":
+                    terminado = True
+                    downloader.filename = valor.get("filename")
+                    downloader.acodec = valor.get("acodec")
+                    downloader.vcodec = valor.get("vcodec")
+                    exito = bool(valor.get("success") and downloader.filename)
+                    if not valor.get("success"):
+                        stats["errors"] += 1
+                    return bool(valor.get("success"))
+                else:
+                    log_event(f"❌ El proceso de descarga {proc.pid} terminó sin resultado")
+                    stats["errors"] += 1
+                    return False
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            stats["errors"] += 1
+            log_event(f"⏰ Descarga expirada tras {self.timeout}s, proceso {proc.pid} terminado")
+            return False
+        finally:
+            try:
+                loop.remove_reader(fd)
+            except Exception:
+                pass
+            parent_conn.close()
+            if terminado:
+                # El hijo ya envió el resultado; se le deja salir por sí mismo
+                await loop.run_in_executor(None, proc.join, 5)
+            if not terminado or proc.is_alive():
+                # Antes de recoger al hijo su pid sigue identificando a su grupo
+                if self._matar_grupo(proc):
+                    self.killed += 1
+            await loop.run_in_executor(None, proc.join, 5)
+            self.active.pop(proc.pid, None)
+            if not exito:
+                # Cancelada, expirada o fallida: no quedan escritores, se borran los .part
+                downloader.remove_partial_files()
+            
+    def _matar_grupo(self, proc):
+        """Mata el proceso hijo y sus descendientes; devuelve True si seguía vivo"""
+        vivo = proc.exitcode is None
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(proc.pid, signal.SIGKILL)
+                return vivo
+        except (ProcessLookupError, PermissionError):
+            # Aún no había creado su grupo (o ya terminó)
+            pass
+        if vivo:
+            proc.kill()
+        return vivo
+            
+    def status(self):
+        return {
+            "procesos_activos": len(self.active),
+            "procesos_terminados": self.killed,
+            "expirados": self.timeouts
+        }
+
+download_runner = ProcessDownloadRunner()
+
+class SharedJobQueue:
+    """Cola de descargas en SQLite (WAL) compartida por el bot y los procesos worker.py.
+    
+    Cualquier backend con los mismos métodos (submit, claim, heartbeat, progress,
+    complete, fail, cancel, poll) puede sustituirla."""
+    
+    def __init__(self, path=SHARED_QUEUE_DB, stale_after=SHARED_QUEUE_STALE, max_attempts=JOURNAL_MAX_ATTEMPTS):
+        self.path = path
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+        
+    def ensure_schema(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS shared_jobs (
+                job_id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                url TEXT,
+                tipo TEXT,
+                estimated_size INTEGER DEFAULT 0,
+                base_filename TEXT,
+                state TEXT DEFAULT 'pending',
+                worker TEXT,
+                attempts INTEGER DEFAULT 0,
+                progress INTEGER DEFAULT 0,
+                filename TEXT,
+                acodec TEXT,
+                vcodec TEXT,
+                error TEXT,
+                created_at INTEGER,
+                heartbeat_at INTEGER,
+                updated_at INTEGER
+            )
+        """)
+        columnas = [fila[1] for fila in conn.execute("PRAGMA table_info(shared_jobs)")]
+        if 'base_filename' not in columnas:
+            conn.execute("ALTER TABLE shared_jobs ADD COLUMN base_filename TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_jobs_state ON shared_jobs (state, created_at)")
+        conn.close()
+        
+    def _execute(self, query, params):
+        conn = self._connect()
+        try:
+            return conn.execute(query, params).rowcount
+        finally:
+            conn.close()
+            
+    def submit(self, job_id, user_id, url, tipo, estimated_size, base_filename=None):
+        """Publica un trabajo; base_filename es el nombre que el bot ya sigue en su reserva de disco"""
+        ahora = int(time.time())
+        self._execute("""
+            INSERT INTO shared_jobs (job_id, user_id, url, tipo, estimated_size, base_filename, state, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+            ON CONFLICT(job_id) DO UPDATE SET state = 'pending', worker = NULL, progress = 0,
+                base_filename = excluded.base_filename, filename = NULL, error = NULL, updated_at = excluded.updated_at
+        """, (job_id, user_id, url, tipo, estimated_size or 0, base_filename, ahora, ahora))
+        
+    def claim(self, worker_name):
+        """Toma el trabajo pendiente más antiguo; devuelve la fila o None"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            ahora = int(time.time())
+            # Los trabajos de workers que dejaron de latir vuelven a la cola (o fallan si agotaron intentos)
+            conn.execute(
+                "UPDATE shared_jobs SET state = 'pending', worker = NULL, updated_at = ? "
+                "WHERE state = 'claimed' AND heartbeat_at < ? AND attempts < ?",
+                (ahora, ahora - self.stale_after, self.max_attempts)
+            )
+            conn.execute(
+                "UPDATE shared_jobs SET state = 'failed', error = 'worker perdido', updated_at = ? "
+                "WHERE state = 'claimed' AND heartbeat_at < ?",
+                (ahora, ahora - self.stale_after)
+            )
+            row = conn.execute(
+                "SELECT * FROM shared_jobs WHERE state = 'pending' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE shared_jobs SET state = 'claimed', worker = ?, attempts = attempts + 1, "
+                "heartbeat_at = ?, updated_at = ? WHERE job_id = ?",
+                (worker_name, ahora, ahora, row["job_id"])
+            )
+            conn.execute("COMMIT")
+            return dict(row)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+            
+    def heartbeat(self, job_ids, worker_name):
+        """Renueva los trabajos del worker; devuelve los que ya no le pertenecen (cancelados o reasignados)"""
+        if not job_ids:
+            return set()
+        ahora = int(time.time())
+        marcas = ','.join('?' * len(job_ids))
+        conn = self._connect()
+        try:
+            conn.execute(
+                f"UPDATE shared_jobs SET heartbeat_at = ? WHERE worker = ? AND state = 'claimed' AND job_id IN ({marcas})",
+                (ahora, worker_name, *job_ids)
+            )
+            vivos = {row[0] for row in conn.execute(
+                f"SELECT job_id FROM shared_jobs WHERE worker = ? AND state = 'claimed' AND job_id IN ({marcas})",
+                (worker_name, *job_ids)
+            )}
+        finally:
+            conn.close()
+        return set(job_ids) - vivos
+        
+    def progress(self, job_id, progress):
+        self._execute(
+            "UPDATE shared_jobs SET progress = ?, heartbeat_at = ?, updated_at = ? WHERE job_id = ? AND state = 'claimed'",
+            (progress, int(time.time()), int(time.time()), job_id)
+        )
+        
+    def complete(self, job_id, worker_name, filename, acodec, vcodec):
+        return self._execute(
+            "UPDATE shared_jobs SET state = 'done', progress = 100, filename = ?, acodec = ?, vcodec = ?, updated_at = ? "
+            "WHERE job_id = ? AND worker = ? AND state = 'claimed'",
+            (filename, acodec, vcodec, int(time.time()), job_id, worker_name)
+        ) > 0
+        
+    def fail(self, job_id, worker_name, error):
+        self._execute(
+            "UPDATE shared_jobs SET state = 'failed', error = ?, updated_at = ? WHERE job_id = ? AND worker = ? AND state = 'claimed'",
+            (error, int(time.time()), job_id, worker_name)
+        )
+        
+    def cancel(self, job_id):
+        self._execute(
+            "UPDATE shared_jobs SET state = 'cancelled', updated_at = ? WHERE job_id = ? AND state IN ('pending', 'claimed')",
+            (int(time.time()), job_id)
+        )
+        
+    def poll(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM shared_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+        
+    def purge(self, retention=JOURNAL_RETENTION):
+        self._execute(
+            "DELETE FROM shared_jobs WHERE state IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+            (int(time.time()) - retention,)
+        )
+        
+    def status(self):
+        conn = self._connect()
+        try:
+            por_estado = {row[0]: row[1] for row in conn.execute("SELECT state, COUNT(*) FROM shared_jobs GROUP BY state")}
+            workers = [row[0] for row in conn.execute(
+                "SELECT DISTINCT worker FROM shared_jobs WHERE state = 'claimed' AND heartbeat_at >= ?",
+                (int(time.time()) - self.stale_after,)
+            )]
+        finally:
+            conn.close()
+        return {"por_estado": por_estado, "workers_activos": workers}
+
+shared_queue = SharedJobQueue()
+
+class RemoteDownloadRunner:
+    def __init__(self, queue, timeout=DOWNLOAD_TIMEOUT, claim_timeout=SHARED_QUEUE_CLAIM_TIMEOUT):
+        self.queue = queue
+        self.timeout = timeout
+        self.claim_timeout = claim_timeout
+        self.unclaimed = 0
+        self.timeouts = 0
+        
+    async def run(self, downloader, job_id):
+        """Publica la descarga en la cola compartida y espera a que un worker.py la complete"""
+        loop = asyncio.get_event_loop()
+        self.queue.submit(
+            job_id, downloader.user_id, downloader.url, downloader.tipo, downloader.estimated_size, downloader.base_filename
+        )
+        limite_toma = loop.time() + self.claim_timeout
+        limite = None
+        ultimo_progreso = -1
+        
+        try:
+            while True:
+                await asyncio.sleep(SHARED_QUEUE_POLL)
+                fila = self.queue.poll(job_id)
+                if fila is None:
+                    return False
+                    
+                estado = fila["state"]
+                if estado == "pending":
+                    if loop.time() > limite_toma:
+                        self.unclaimed += 1
+                        log_event(f"⏰ Ningún worker tomó {job_id} en {self.claim_timeout}s")
+                        self.queue.cancel(job_id)
+                        stats["errors"] += 1
+                        return False
+                    continue
+                    
+                if estado == "claimed":
+                    if limite is None:
+                        limite = loop.time() + self.timeout
+                    elif loop.time() > limite:
+                        self.timeouts += 1
+                        log_event(f"⏰ Descarga remota {job_id} expirada tras {self.timeout}s")
+                        self.queue.cancel(job_id)
+                        stats["errors"] += 1
+                        return False
+                    if fila["progress"] != ultimo_progreso:
+                        ultimo_progreso = fila["progress"]
+                        await downloader.progress_tracker.update_download_progress(ultimo_progreso)
+                    continue
+                    
+                if estado == "done":
+                    downloader.filename = fila["filename"]
+                    downloader.acodec = fila["acodec"]
+                    downloader.vcodec = fila["vcodec"]
+                    if not downloader.filename or not os.path.exists(downloader.filename):
+                        log_event(f"❌ {job_id}: el archivo {downloader.filename} no es visible desde el bot (¿directorio compartido?)")
+                        stats["errors"] += 1
+                        return False
+                    return True
+                    
+                log_event(f"❌ Descarga remota {job_id} terminó en estado {estado}: {fila.get('error')}")
+                stats["errors"] += 1
+                return False
+        except asyncio.CancelledError:
+            self.queue.cancel(job_id)
+            raise
+            
+    def status(self):
+        return {
+            "sin_worker": self.unclaimed,
+            "expirados": self.timeouts,
+            "cola_compartida": self.queue.status()
+        }
+
+remote_runner = RemoteDownloadRunner(shared_queue)
+
+def carga_cpu():
+    """Carga media del último minuto por núcleo"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+def decidir_escala(actual, senales, min_workers=AUTOSCALE_MIN_WORKERS, max_workers=AUTOSCALE_MAX_WORKERS):
+    """Número de workers deseado y motivo, a partir de las señales de carga"""
+    cola = senales["cola"]
+    ocupados = senales["ocupados"]
+    
+    if senales["disco_disponible"] < senales["disco_por_trabajo"] and actual > max(min_workers, ocupados):
+        return max(min_workers, ocupados), "disco sin espacio para más trabajos"
+    if senales["cpu"] >= AUTOSCALE_CPU_HIGH:
+        # Con la CPU al límite no se crece aunque haya cola; se baja si aún se puede
+        if actual > min_workers:
+            return actual - 1, f"CPU alta ({senales['cpu']:.2f} por núcleo)"
+        return actual, None
+    if cola > actual * AUTOSCALE_QUEUE_PER_WORKER and actual < max_workers:
+        if senales["red_saturada"]:
+            return actual, "cola pendiente pero la red no rinde más con más workers"
+        if senales["disco_disponible"] < senales["disco_por_trabajo"]:
+            return actual, "cola pendiente pero sin disco para más trabajos"
+        return actual + 1, f"cola de {cola} trabajos"
+    if cola == 0 and actual - ocupados > 1 and actual > min_workers:
+        return actual - 1, "workers ociosos"
+    return actual, None
+
+class WorkerAutoscaler:
+    def __init__(self, queue_system, interval=AUTOSCALE_INTERVAL, cooldown=AUTOSCALE_COOLDOWN,
+                 min_workers=AUTOSCALE_MIN_WORKERS, max_workers=AUTOSCALE_MAX_WORKERS, clock=time.time):
+        self.queue_system = queue_system
+        self.clock = clock
+        self.interval = interval
+        self.cooldown = cooldown
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.last_change = 0
+        self.decisions = deque(maxlen=50)
+        self.throughput_by_workers = {}
+        self.last_signals = {}
+        
+    def _red_saturada(self, ocupados, throughput):
+        # Media móvil del caudal observado con cada número de descargas simultáneas
+        previo = self.throughput_by_workers.get(ocupados)
+        self.throughput_by_workers[ocupados] = throughput if previo is None else previo * 0.7 + throughput * 0.3
+        con_menos = self.throughput_by_workers.get(ocupados - 1)
+        if ocupados < 2 or not con_menos:
+            return False
+        return self.throughput_by_workers[ocupados] < con_menos * (1 + AUTOSCALE_NET_MIN_GAIN)
+        
+    def signals(self):
+        qs = self.queue_system
+        # El caudal se mide desde un intervalo después del último cambio de escala, para no atribuir
+        # a los workers actuales lo que se descargó (o empezó a descargarse) con otro número
+        desde_cambio = self.clock() - self.last_change
+        ventana = min(self.interval * 4, desde_cambio - self.interval)
+        throughput = qs.network_throughput(ventana) if ventana >= self.interval else None
+        # Workers con un trabajo: la misma cuenta decide la escala y etiqueta el caudal de red
+        ocupados = len(qs.active_tasks)
+        disco = disk_manager.status()
+        return {
+            "cola": qs.priority_queue.qsize(),
+            "ocupados": ocupados,
+            "cpu": carga_cpu(),
+            "red_bytes_s": int(throughput or 0),
+            "red_saturada": self._red_saturada(ocupados, throughput) if ocupados and throughput is not None else False,
+            "disco_disponible": disco["disponible_bytes"],
+            "disco_por_trabajo": disk_manager.bytes_needed(0)
+        }
+        
+    def tick(self):
+        """Una evaluación: lee las señales y, fuera del enfriamiento, cambia la escala; devuelve el objetivo aplicado o None"""
+        actual = self.queue_system.max_workers
+        senales = self.signals()
+        self.last_signals = senales
+        objetivo, motivo = decidir_escala(actual, senales, self.min_workers, self.max_workers)
+        
+        if objetivo == actual or self.clock() - self.last_change < self.cooldown:
+            return None
+            
+        self.queue_system.scale_to(objetivo)
+        self.last_change = self.clock()
+        self.decisions.append({
+            "hora": datetime.fromtimestamp(self.last_change).strftime("%Y-%m-%d %H:%M:%S"),
+            "de": actual,
+            "a": objetivo,
+            "motivo": motivo,
+            "senales": senales
+        })
+        log_event(f"📈 Autoescalado: {actual} → {objetivo} workers ({motivo})")
+        return objetivo
+        
+    async def run(self):
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                self.tick()
+            except Exception as e:
+                log_event(f"❌ Error en autoescalado: {e}")
+                
+    def status(self):
+        return {
+            "workers": self.queue_system.max_workers,
+            "min": self.min_workers,
+            "max": self.max_workers,
+            "senales": self.last_signals,
+            "decisiones": list(self.decisions)[-10:]
+        }
+
+autoscaler = WorkerAutoscaler(download_queue_system)
+
+async def monitor_sistema():
+    while True:
+        try:
+            await asyncio.sleep(30)
+            
+            workers_activos = sum(1 for worker in download_queue_system.workers if not worker.done())
+            
+            if workers_activos < download_queue_system.max_workers:
+                log_event(f"⚠️ Solo {workers_activos}/{download_queue_system.max_workers} workers activos")
+                
+                for i in range(download_queue_system.max_workers - workers_activos):
+                    download_queue_system.spawn_worker()
+                log_event("🔄 Workers reiniciados")
+                
+            download_queue_system.workers = [w for w in download_queue_system.workers if not w.done()]
+            
+            for almacen in (download_jobs, format_prompts, progress_trackers, waiting_for_tx):
+                almacen.purge()
+            
+        except Exception as e:
+            log_event(f"❌ Error en monitor del sistema: {e}")
+            await asyncio.sleep(60)
+
+async def verificar_estado_sistema():
+    while True:
+        try:
+            await asyncio.sleep(60)
+            
+            stats["queue_size"] = download_queue_system.priority_queue.qsize()
+            stats["active_downloads"] = len(download_queue_system.active_tasks)
+            
+            print_stats()
+                
+        except Exception as e:
+            log_event(f"❌ Error en verificador del sistema: {e}")
+            await asyncio.sleep(60)
+
+async def mostrar_menu_principal(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id=None):
+    if hasattr(update, 'effective_user'):
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+    else:
+        user_id = update.from_user.id
+        chat_id = update.message.chat_id
+    
+    lang = get_user_language(user_id)
+    t = catalogo.t(lang)
+    
+    puede_desc, usadas, total = puede_descargar(user_id)
+    balance = get_user_balance(user_id)
+    youtube_usadas, youtube_total = get_youtube_stats(user_id)
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT referral_earnings FROM usuarios WHERE id=?", (user_id,))
+    row = cur.fetchone()
+    referral_earnings = row["referral_earnings"] if row else 0.0
+    conn.close()
+    
+    if es_premium(user_id):
+        descargas = t['unlimited_downloads']
+        descargas_youtube = t['unlimited_youtube']
+    else:
+        descargas = catalogo.texto(lang, 'available_downloads', usadas, total)
+        descargas_youtube = catalogo.texto(lang, 'youtube_downloads', youtube_usadas, youtube_total)
+    
+    texto = (
+        f"{t['welcome']}\n\n"
+        f"{t['download_options']}\n\n"
+        f"{descargas}\n"
+        f"{descargas_youtube}\n"
+        f"{catalogo.texto(lang, 'balance_info', balance)}\n"
+        f"{catalogo.texto(lang, 'referral_earnings', referral_earnings)}\n\n"
+        f"{t['select_option']}"
+    )
+    teclado = catalogo.teclado(lang, "principal")
+    
+    if message_id:
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=texto,
+            reply_markup=teclado,
+            parse_mode='Markdown'
+        )
+    else:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=texto,
+            reply_markup=teclado,
+            parse_mode='Markdown'
+        )
+
+# CORREGIDO: Función corregida con todos los parámetros necesarios
+async def mostrar_menu_premium(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id=None):
+    if hasattr(update, 'effective_user'):
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+    else:
+        user_id = update.from_user.id
+        chat_id = update.message.chat.id
+    
+    lang = get_user_language(user_id)
+    texto = catalogo.texto(lang, 'premium_menu')
+    teclado = catalogo.teclado(lang, "premium")
+    
+    if message_id:
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=texto,
+            reply_markup=teclado,
+            parse_mode='Markdown'
+        )
+    else:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=texto,
+            reply_markup=teclado,
+            parse_mode='Markdown'
+        )
+
+async def mostrar_como_pagar(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
+    if hasattr(update, 'effective_user'):
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+    else:
+        user_id = update.from_user.id
+        chat_id = update.message.chat.id
+    
+    lang = get_user_language(user_id)
+    
+    await context.bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=catalogo.texto(lang, 'how_to_pay'),
+        reply_markup=catalogo.teclado(lang, "como_pagar"),
+        parse_mode='Markdown'
+    )
+
+async def mostrar_menu_referral(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
+    if hasattr(update, 'effective_user'):
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+    else:
+        user_id = update.from_user.id
+        chat_id = update.message.chat.id
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT referrals, referral_earnings FROM usuarios WHERE id=?", (user_id,))
+    row = cur.fetchone()
+    referrals = row["referrals"] if row else 0
+    referral_earnings = row["referral_earnings"] if row else 0.0
+    conn.close()
+    
+    lang = get_user_language(user_id)
+    
+    await context.bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=catalogo.texto(lang, 'referral_menu', referrals, referral_earnings, enlace_referido(user_id)),
+        reply_markup=catalogo.teclado(lang, "referidos"),
+        parse_mode='Markdown'
+    )
+
+async def mostrar_menu_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
+    if hasattr(update, 'effective_user'):
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+    else:
+        user_id = update.from_user.id
+        chat_id = update.message.chat.id
+    
+    lang = get_user_language(user_id)
+    balance = get_user_balance(user_id)
+    
+    await context.bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=catalogo.texto(lang, 'withdraw_menu', balance),
+        reply_markup=catalogo.teclado(lang, "volver_principal"),
+        parse_mode='Markdown'
+    )
+
+async def mostrar_menu_language(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
+    if hasattr(update, 'effective_user'):
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+    else:
+        user_id = update.from_user.id
+        chat_id = update.message.chat.id
+    
+    lang = get_user_language(user_id)
+    
+    await context.bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=catalogo.texto(lang, 'choose_language'),
+        reply_markup=catalogo.teclado(lang, "idiomas"),
+        parse_mode='Markdown'
+    )
+
+async def mostrar_menu_post_descarga(app, chat_id: int, message_id: int, recompensa: float = 0):
+    user_id = chat_id
+    lang = get_user_language(user_id)
+    t = catalogo.t(lang)
+    
+    texto = f"{t['download_complete']}\n\n"
+    if recompensa > 0:
+        texto += f"{catalogo.texto(lang, 'download_reward', recompensa)}\n\n"
+    texto += t['what_next']
+    
+    await app.bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=texto,
+        reply_markup=catalogo.teclado(lang, "post_descarga"),
+        parse_mode='Markdown'
+    )
+
+async def mostrar_estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id):
+    if hasattr(update, 'effective_user'):
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+    else:
+        user_id = update.from_user.id
+        chat_id = update.message.chat.id
+    
+    lang = get_user_language(user_id)
+    t = catalogo.t(lang)
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    
+    cur.execute("""
+        SELECT descargas, youtube_descargas, premium, referrals, balance, total_earned, referral_earnings, 
+               (SELECT COUNT(*) FROM usuarios WHERE referido_por = ?) as referidos_activos
+        FROM usuarios WHERE id = ?
+    """, (user_id, user_id))
+    
+    usuario = cur.fetchone()
+    conn.close()
+    
+    if not usuario:
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=t['no_stats'],
+            parse_mode='Markdown'
+        )
+        return
+    
+    puede_desc, usadas, total = puede_descargar(user_id)
+    youtube_usadas, youtube_total = get_youtube_stats(user_id)
+    
+    texto = catalogo.texto(
+        lang, 'stats_menu',
+        usadas, total, youtube_usadas, youtube_total,
+        usuario['balance'], usuario['total_earned'],
+        usuario['referrals'], usuario['referral_earnings'], usuario['referidos_activos'],
+        t['status_premium'] if usuario['premium'] else t['status_free']
+    ) + "\n\n"
+    
+    if not usuario['premium']:
+        texto += t['stats_upgrade']
+    
+    await context.bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=texto,
+        reply_markup=catalogo.teclado(lang, "volver_principal"),
+        parse_mode='Markdown'
+    )
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    referido_por = None
+    
+    if context.args and context.args[0].startswith('ref_'):
+        try:
+            referido_por = int(context.args[0][4:])
+            log_event(f"👥 Referido detectado: {user.id} -> {referido_por}")
+        except:
+            pass
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM usuarios WHERE id=?", (user.id,))
+    usuario_existente = cur.fetchone()
+    conn.close()
+    
+    if not usuario_existente:
+        await update.message.reply_text(catalogo.bienvenida, reply_markup=catalogo.teclado_bienvenida)
+        
+        registrar_usuario(user.id, user.username, referido_por)
+        return
+    
+    registrar_usuario(user.id, user.username, referido_por)
+    await mostrar_menu_principal(update, context)
+
+async def withdraw_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    lang = get_user_language(user_id)
+    t = catalogo.t(lang)
+    
+    if not context.args or len(context.args) < 2:
+        await update.message.reply_text(t['withdraw_format'], parse_mode='Markdown')
+        return
+    
+    try:
+        amount = float(context.args[0])
+        address = context.args[1]
+        
+        if not re.match(r'^0x[a-fA-F0-9]{40}$', address):
+            await update.message.reply_text(t['invalid_address'])
+            return
+        
+        success, message = solicitar_retiro(user_id, amount, address, lang)
+        await update.message.reply_text(message)
+        
+    except ValueError:
+        await update.message.reply_text(t['invalid_amount'])
+    except Exception as e:
+        await update.message.reply_text(catalogo.texto(lang, 'error_generic', str(e)))
+
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        return
+    
+    conn = conectar_db()
+    cur = conn.cursor()
+    
+    cur.execute("SELECT COUNT(*) FROM usuarios")
+    total_usuarios = cur.fetchone()[0]
+    
+    cur.execute("SELECT COUNT(*) FROM usuarios WHERE premium = 1")
+    premium_usuarios = cur.fetchone()[0]
+    
+    cur.execute("SELECT SUM(descargas) FROM usuarios")
+    total_descargas = cur.fetchone()[0] or 0
+    
+    cur.execute("SELECT COUNT(DISTINCT id) FROM usuarios WHERE last_active > ?", (int(time.time()) - 86400,))
+    activos_24h = cur.fetchone()[0]
+    
+    cur.execute("SELECT SUM(balance) FROM usuarios")
+    total_balance = cur.fetchone()[0] or 0
+    
+    cur.execute("SELECT SUM(total_earned) FROM usuarios")
+    total_earned = cur.fetchone()[0] or 0
+    
+    cur.execute("SELECT SUM(referral_earnings) FROM usuarios")
+    total_referral_earnings = cur.fetchone()[0] or 0
+    
+    conn.close()
+    
+    texto = (
+        "👑 **ESTADÍSTICAS DE ADMINISTRADOR**\n\n"
+        f"👥 Usuarios totales: {total_usuarios}\n"
+        f"💎 Usuarios premium: {premium_usuarios}\n"
+        f"⬇️ Descargas totales: {total_descargas}\n"
+        f"👤 Usuarios activos (24h): {activos_24h}\n"
+        f"💰 Balance total en sistema: ${total_balance:.2f}\n"
+        f"🎁 Total ganado por usuarios: ${total_earned:.2f}\n"
+        f"👥 Ganancias por referidos: ${total_referral_earnings:.2f}\n\n"
+        f"📊 Hoy:\n"
+        f"- Descargas: {stats['daily_downloads']}\n"
+        f"- Completadas: {stats['completed_today']}\n"
+        f"- Errores: {stats['errors']}\n\n"
+        f"⚙️ Sistema:\n"
+        f"- En cola: {stats['queue_size']}\n"
+        f"- Activas: {stats['active_downloads']}\n"
+        f"- Uptime: {time.time() - stats['start_time']:.0f} segundos"
+    )
+    
+    await update.message.reply_text(texto, parse_mode='Markdown')
+
+async def procesar_descarga(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    username = update.effective_user.username
+    lang = get_user_language(user_id)
+    t = catalogo.t(lang)
+    
+    # Verificar si el usuario está esperando un TX
+    if user_id in waiting_for_tx:
+        tx_hash = update.message.text.strip()
+        if re.match(r'^0x[a-fA-F0-9]{64}$', tx_hash):
+            del waiting_for_tx[user_id]
+            await update.message.reply_text(t['verifying_tx'], parse_mode='Markdown')
+            
+            ok, clave, args = await validar_pago_con_tx(user_id, tx_hash)
+            await update.message.reply_text(catalogo.texto(lang, clave, *args), parse_mode='Markdown')
+            
+            if ok:
+                await mostrar_menu_principal(update, context)
+            else:
+                # CORREGIDO: Llamada corregida con todos los parámetros
+                await mostrar_menu_premium(update, context)
+        else:
+            await update.message.reply_text(t['invalid_tx_format'])
+        return
+    
+    registrar_usuario(user_id, username)
+    
+    text = update.message.text.strip()
+    
+    es_youtube = "youtube.com" in text or "youtu.be" in text
+    
+    if not es_url_valida(text):
+        await update.message.reply_text(t['invalid_link'])
+        log_event(f"❌ Enlace inválido de @{username}: {text}")
+        return
+    
+    if es_youtube:
+        if not await puede_descargar_youtube(user_id):
+            await update.message.reply_text(
+                catalogo.texto(lang, 'youtube_limit'),
+                reply_markup=catalogo.teclado(lang, "limite_youtube")
+            )
+            log_event(f"⚠️ Límite de YouTube alcanzado para @{username}")
+            return
+    else:
+        puede_desc, usadas, total = puede_descargar(user_id)
+        if not puede_desc:
+            texto = (
+                f"{t['limit_reached']}\n\n"
+                f"{catalogo.texto(lang, 'limit_message', total)}\n"
+                f"{t['limit_unlock']}"
+            )
+            await update.message.reply_text(texto, reply_markup=catalogo.teclado(lang, "limite_diario"), parse_mode='Markdown')
+            log_event(f"⚠️ Límite diario alcanzado para @{username}")
+            return
+    
+    job_id = f"{user_id}_{int(time.time())}_{random.randint(1000,9999)}"
+    
+    download_jobs[job_id] = {
+        'url': text,
+        'chat_id': update.message.chat_id,
+        'message_id': update.message.message_id,
+        'timestamp': time.time()
+    }
+    
+    if es_youtube:
+        if es_premium(user_id):
+            teclado = catalogo.teclado(lang, "formato_youtube_premium")
+            msg_text = t['youtube_format_premium']
+        else:
+            teclado = catalogo.teclado(lang, "formato_youtube_gratis")
+            msg_text = t['youtube_audio_only']
+    else:
+        teclado = catalogo.teclado(lang, "formato_tiktok")
+        msg_text = t['tiktok_format']
+    
+    msg = await update.message.reply_text(
+        msg_text,
+        reply_markup=teclado,
+        parse_mode='Markdown'
+    )
+    download_jobs[job_id]['message_id'] = msg.message_id
+    format_prompts[(msg.chat_id, msg.message_id)] = job_id
+    log_event(f"📥 Solicitud recibida de @{username}: {text}")
+
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    username = query.from_user.username
+    data = query.data
+    message_id = query.message.message_id
+    chat_id = query.message.chat_id
+    
+    # Obtener idioma ANTES de procesar cualquier callback
+    lang = get_user_language(user_id)
+    t = catalogo.t(lang)
+    
+    if data.startswith("setlang_"):
+        nuevo_idioma = data.split('_', 1)[1]
+        if nuevo_idioma not in catalogo.idiomas():
+            log_event(f"⚠️ Idioma desconocido '{nuevo_idioma}' pedido por @{username}")
+            return
+        conn = conectar_db()
+        conn.execute("UPDATE usuarios SET language = ? WHERE id = ?", (nuevo_idioma, user_id))
+        conn.commit()
+        conn.close()
+        
+        log_event(f"🌐 Idioma cambiado a {nuevo_idioma} por @{username}")
+        
+        # Recargar traducciones después del cambio
+        t = catalogo.t(nuevo_idioma)
+        
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=catalogo.texto(nuevo_idioma, 'language_changed', t['language_name']),
+            parse_mode='Markdown'
+        )
+        
+        # Mostrar menú principal con el nuevo idioma
+        await mostrar_menu_principal(update, context, message_id)
+        return
+    
+    if data == "menu_principal":
+        await mostrar_menu_principal(update, context, message_id)
+        log_event(f"🏠 Menú principal mostrado a @{username}")
+    
+    elif data == "menu_premium":
+        # CORREGIDO: Llamada corregida con todos los parámetros
+        await mostrar_menu_premium(update, context, message_id)
+        log_event(f"💎 Menú premium mostrado a @{username}")
+    
+    elif data == "menu_referral":
+        await mostrar_menu_referral(update, context, message_id)
+        log_event(f"👥 Menú referidos mostrado a @{username}")
+    
+    elif data == "menu_withdraw":
+        await mostrar_menu_withdraw(update, context, message_id)
+        log_event(f"💰 Menú retiros mostrado a @{username}")
+    
+    elif data == "menu_language":
+        await mostrar_menu_language(update, context, message_id)
+        log_event(f"🌐 Menú idioma mostrado a @{username}")
+    
+    elif data == "como_pagar":
+        await mostrar_como_pagar(update, context, message_id)
+        log_event(f"❓ Cómo pagar mostrado a @{username}")
+    
+    elif data == "iniciar_descarga":
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=t['send_link'],
+            reply_markup=catalogo.teclado(lang, "volver_principal"),
+            parse_mode='Markdown'
+        )
+        log_event(f"⬇️ Inicio de descarga solicitado por @{username}")
+    
+    elif data.startswith("copiar_"):
+        # El enlace es siempre el de quien pulsa: el menú de referidos solo lo ve su dueño
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=catalogo.texto(lang, 'referral_link', enlace_referido(user_id)),
+            parse_mode='Markdown'
+        )
+        log_event(f"📋 Enlace de referido copiado por @{username}")
+    
+    elif data == "verificar_pago":
+        # Marcar usuario como esperando TX
+        waiting_for_tx[user_id] = True
+        
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=t['enter_tx_hash'],
+            reply_markup=catalogo.teclado(lang, "verificar_pago"),
+            parse_mode='Markdown'
+        )
+        log_event(f"🔍 Solicitando TX Hash a @{username}")
+    
+    elif data == "cancelar_verificacion":
+        if user_id in waiting_for_tx:
+            del waiting_for_tx[user_id]
+        # CORREGIDO: Llamada corregida con todos los parámetros
+        await mostrar_menu_premium(update, context, message_id)
+        log_event(f"❌ Verificación cancelada por @{username}")
+    
+    elif data == "estadisticas":
+        await mostrar_estadisticas(update, context, message_id)
+        log_event(f"📊 Estadísticas mostradas a @{username}")
+    
+    elif data.startswith("fit_split_") or data.startswith("fit_reencode_"):
+        eleccion = "split" if data.startswith("fit_split_") else "reencode"
+        job_id = data[len(f"fit_{eleccion}_"):]
+        if not download_queue_system.choose_fit(job_id, user_id, eleccion):
+            log_event(f"⚠️ Elección de ajuste ignorada para {job_id} de @{username}")
+            return
+        log_event(f"📦 @{username} eligió '{eleccion}' para {job_id}")
+
+    elif data.startswith("cancel_job_"):
+        job_id = data[len("cancel_job_"):]
+        etapa = download_queue_system.cancel_job(job_id, user_id)
+        
+        if etapa is None:
+            log_event(f"⚠️ @{username} intentó cancelar un trabajo inexistente: {job_id}")
+            return
+            
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=t['job_cancelled'],
+            reply_markup=catalogo.teclado(lang, "tras_cancelar"),
+            parse_mode='Markdown'
+        )
+        stats["queue_size"] = download_queue_system.priority_queue.qsize()
+        log_event(f"🛑 Descarga {job_id} cancelada por @{username} (etapa: {etapa})")
+    
+    elif "|" in data:
+        tipo, job_id = data.split("|", 1)
+        if not job_id:
+            # Teclado compartido del catálogo: el trabajo es el del mensaje que lo muestra
+            job_id = format_prompts.get((chat_id, message_id))
+        job = download_jobs.get(job_id) if job_id else None
+        
+        if job and job.get('admitted'):
+            # Doble toque sobre un botón ya procesado: el mensaje ya muestra el estado del trabajo
+            download_queue_system.duplicates["job_id"] += 1
+            log_event(f"♊ Toque repetido ignorado para {job_id} de @{username}")
+            return
+        
+        if not job:
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=t['link_expired'],
+                parse_mode='Markdown'
+            )
+            log_event(f"❌ Tarea expirada: {job_id}")
+            return
+        
+        url = job['url']
+        
+        if tipo.startswith("yt_"):
+            if not await puede_descargar_youtube(user_id):
+                await context.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=catalogo.texto(lang, 'youtube_limit'),
+                    parse_mode='Markdown'
+                )
+                log_event(f"⚠️ Límite de YouTube alcanzado al procesar: @{username}")
+                return
+        else:
+            puede_desc, usadas, total = puede_descargar(user_id)
+            if not puede_desc:
+                await context.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=f"{t['limit_reached']}\n\n{catalogo.texto(lang, 'limit_message', total)}",
+                    parse_mode='Markdown'
+                )
+                log_event(f"⚠️ Límite diario alcanzado al procesar: @{username}")
+                return
+        
+        if tipo == "yt_video" and not es_premium(user_id):
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=t['youtube_premium_only'],
+                parse_mode='Markdown'
+            )
+            log_event(f"❌ Intento de descarga de YouTube video sin premium: @{username}")
+            return
+        
+        existente = download_queue_system.find_pending(user_id, url, tipo)
+        if existente:
+            # El mismo vídeo y formato ya está en curso: se remite al trabajo existente
+            download_queue_system.duplicates["mismo_video"] += 1
+            rango, eta = download_queue_system.estimate(existente, tipo)
+            texto = t['duplicate_job']
+            if rango is not None:
+                texto += "\n\n" + t['queue_position'].format(rango + 1)
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=texto,
+                reply_markup=catalogo.boton_cancelar(lang, existente),
+                parse_mode='Markdown'
+            )
+            job['admitted'] = True
+            log_event(f"♊ {job_id} de @{username} unido al trabajo existente {existente}")
+            return
+        
+        priority = 0 if es_premium(user_id) else 1
+        
+        task_id = await download_queue_system.add_task(
+            priority, 
+            (job_id, user_id, url, tipo, chat_id, message_id)
+        )
+        if task_id is None:
+            # Otro toque lo admitió mientras se hacían las comprobaciones
+            return
+        # Solo un trabajo que entró en la cola cuenta como admitido: si las comprobaciones
+        # lo rechazan, el mismo botón sigue valiendo cuando el usuario pueda descargar
+        job['admitted'] = True
+        
+        stats["queue_size"] = download_queue_system.priority_queue.qsize()
+        print_stats()
+        
+        rango, eta = download_queue_system.estimate(job_id, tipo)
+        if rango is not None:
+            download_queue_system.queue_messages[job_id] = (rango, time.time())
+            
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=texto_posicion_cola(t, rango, eta, priority == 0),
+            reply_markup=catalogo.boton_cancelar(lang, job_id),
+            parse_mode='Markdown'
+        )
+        log_event(f"📥 Tarea añadida a cola (Prioridad: {priority}, ID: {task_id}) por @{username}: {url}")
+
+def texto_posicion_cola(t, rango, eta, premium=False):
+    if rango is None:
+        return t['processing_queue'].format(t['queue_starting'])
+    lineas = [t['queue_position'].format(rango + 1)]
+    if eta:
+        lineas.append(t['queue_eta'].format(format_duration(eta)))
+    if premium:
+        lineas.append(t['premium_priority'])
+    return t['processing_queue'].format(t['queue_waiting']) + "\n\n" + "\n".join(lineas)
+
+async def actualizar_posiciones_cola():
+    """Edita los mensajes de los usuarios en cola cuando cambia su posición"""
+    while True:
+        try:
+            await asyncio.sleep(QUEUE_UPDATE_INTERVAL)
+            app = download_queue_system.app
+            if app is None:
+                continue
+                
+            enviados = download_queue_system.queue_messages
+            en_cola = set()
+            ediciones = 0
+            
+            for rango, entrada in download_queue_system.priority_queue.jobs():
+                priority, task_id, task_data = entrada[:3]
+                job_id, user_id, url, tipo, chat_id, message_id = task_data
+                en_cola.add(job_id)
+                
+                anterior = enviados.get(job_id)
+                if anterior and (anterior[0] == rango or time.time() - anterior[1] < QUEUE_UPDATE_MIN_GAP):
+                    continue
+                if ediciones >= QUEUE_UPDATE_MAX_EDITS:
+                    break
+                    
+                lang = get_user_language(user_id)
+                t = catalogo.t(lang)
+                _, eta = download_queue_system.estimate(job_id, tipo)
+                try:
+                    await app.bot.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        text=texto_posicion_cola(t, rango, eta, priority == 0),
+                        reply_markup=catalogo.boton_cancelar(lang, job_id),
+                        parse_mode='Markdown',
+                        rate_limit_args={"prioridad": PRIORIDAD_PROGRESO, "fusionar": True}
+                    )
+                except BadRequest as e:
+                    if "Message is not modified" not in str(e):
+                        log_event(f"⚠️ Error actualizando posición en cola: {e}")
+                enviados[job_id] = (rango, time.time())
+                ediciones += 1
+                
+            for job_id in list(enviados):
+                if job_id not in en_cola:
+                    del enviados[job_id]
+                    
+        except Exception as e:
+            log_event(f"❌ Error actualizando posiciones de la cola: {e}")
+
+class DailyBroadcast:
+    """Recordatorio diario de descargas disponibles.
+    
+    Recorre los usuarios por lotes en orden de id (paginación por clave primaria) y guarda en
+    broadcast_campaigns el último id procesado tras cada lote, así una campaña interrumpida se
+    reanuda donde quedó (como mucho se repite el lote en curso). Los mensajes salen con prioridad de aviso y a BROADCAST_RATE por
+    segundo, por debajo del límite global, para no retrasar las respuestas interactivas."""
+    
+    def __init__(self, batch_size=BROADCAST_BATCH, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY):
+        self.batch_size = batch_size
+        self.rate = rate
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, max(1, int(rate)))
+        self.app = None
+        self.campaign = None
+        self.pendientes = 0
+        
+    @staticmethod
+    def campaign_id(ahora=None):
+        return "daily-" + datetime.fromtimestamp(ahora or time.time()).strftime("%Y-%m-%d")
+        
+    @staticmethod
+    def inicio_del_dia(ahora=None):
+        dia = datetime.fromtimestamp(ahora or time.time())
+        return int(dia.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        
+    def _filtro(self):
+        condiciones = "premium = 0 AND bloqueado = 0 AND last_daily_notification < ?"
+        if BROADCAST_ACTIVE_DAYS > 0:
+            condiciones += " AND COALESCE(last_active, 0) >= ?"
+        return condiciones
+        
+    def _parametros(self, corte):
+        parametros = [corte]
+        if BROADCAST_ACTIVE_DAYS > 0:
+            parametros.append(int(time.time()) - BROADCAST_ACTIVE_DAYS * 86400)
+        return parametros
+        
+    def _preparar(self, campaign_id, corte):
+        """Carga la campaña del día (o la crea) y caduca las de días anteriores sin terminar"""
+        conn = conectar_db()
+        ahora = int(time.time())
+        conn.execute(
+            "UPDATE broadcast_campaigns SET state='expired', finished_at=? WHERE state='running' AND campaign_id != ?",
+            (ahora, campaign_id)
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO broadcast_campaigns (campaign_id, corte, state, started_at, updated_at) VALUES (?, ?, 'running', ?, ?)",
+            (campaign_id, corte, ahora, ahora)
+        )
+        conn.commit()
+        fila = conn.execute("SELECT * FROM broadcast_campaigns WHERE campaign_id=?", (campaign_id,)).fetchone()
+        campaign = dict(fila)
+        if campaign["state"] == "running":
+            pendientes = conn.execute(
+                f"SELECT COUNT(*) FROM usuarios WHERE id > ? AND {self._filtro()}",
+                [campaign["last_user_id"]] + self._parametros(corte)
+            ).fetchone()[0]
+        else:
+            pendientes = 0
+        conn.close()
+        return campaign, pendientes
+        
+    def _lote(self, ultimo_id, corte):
+        conn = conectar_db()
+        filas = conn.execute(
+            f"""SELECT id, language, descargas, ultimo_reset, referrals FROM usuarios
+                WHERE id > ? AND {self._filtro()} ORDER BY id LIMIT ?""",
+            [ultimo_id] + self._parametros(corte) + [self.batch_size]
+        ).fetchall()
+        conn.close()
+        return [dict(fila) for fila in filas]
+        
+    def _checkpoint(self, campaign, enviados, bloqueados, estado):
+        """Marca los usuarios del lote y avanza el punto de control en la misma transacción"""
+        conn = conectar_db()
+        ahora = int(time.time())
+        conn.executemany("UPDATE usuarios SET last_daily_notification=? WHERE id=?", [(ahora, uid) for uid in enviados])
+        conn.executemany("UPDATE usuarios SET bloqueado=1 WHERE id=?", [(uid,) for uid in bloqueados])
+        conn.execute(
+            """UPDATE broadcast_campaigns SET last_user_id=?, enviados=?, bloqueados=?, fallidos=?, omitidos=?,
+               state=?, updated_at=?, finished_at=? WHERE campaign_id=?""",
+            (campaign["last_user_id"], campaign["enviados"], campaign["bloqueados"], campaign["fallidos"],
+             campaign["omitidos"], estado, ahora, ahora if estado != "running" else None, campaign["campaign_id"])
+        )
+        conn.commit()
+        conn.close()
+        campaign["state"] = estado
+        campaign["updated_at"] = ahora
+        if estado != "running":
+            campaign["finished_at"] = ahora
+        
+    @staticmethod
+    def descargas_disponibles(usuario, ahora):
+        limite_total = LIMIT_POR_DIA + (usuario["referrals"] or 0)
+        if ahora - (usuario["ultimo_reset"] or 0) > 86400:
+            return limite_total
+        return max(0, limite_total - (usuario["descargas"] or 0))
+        
+    async def _enviar(self, usuario, texto):
+        try:
+            await self.app.bot.send_message(
+                chat_id=usuario["id"],
+                text=texto,
+                parse_mode='Markdown',
+                rate_limit_args={"prioridad": PRIORIDAD_AVISOS}
+            )
+            return "enviado"
+        except Forbidden:
+            return "bloqueado"
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "bloqueado"
+            log_event(f"⚠️ Recordatorio a {usuario['id']} rechazado: {e}")
+            return "fallido"
+        except Exception as e:
+            log_event(f"⚠️ Error enviando recordatorio a {usuario['id']}: {e}")
+            return "fallido"
+            
+    async def _procesar_lote(self, usuarios):
+        limite = asyncio.Semaphore(self.concurrency)
+        ahora = int(time.time())
+        resultados = {}
+        
+        async def uno(usuario, texto):
+            try:
+                resultados[usuario["id"]] = await self._enviar(usuario, texto)
+            finally:
+                limite.release()
+                
+        tareas = []
+        for usuario in usuarios:
+            restantes = self.descargas_disponibles(usuario, ahora)
+            if restantes <= 0:
+                resultados[usuario["id"]] = "omitido"
+                continue
+            texto = catalogo.texto(usuario["language"], "daily_reminder", restantes).strip()
+            
+            await limite.acquire()
+            espera = self.bucket.wait_time(time.monotonic())
+            if espera > 0:
+                await asyncio.sleep(espera)
+                self.bucket.wait_time(time.monotonic())
+            self.bucket.take()
+            tareas.append(asyncio.create_task(uno(usuario, texto)))
+        if tareas:
+            await asyncio.gather(*tareas)
+        return resultados
+        
+    async def run_campaign(self, application):
+        self.app = application
+        loop = asyncio.get_event_loop()
+        campaign_id = self.campaign_id()
+        corte = self.inicio_del_dia()
+        campaign, self.pendientes = await loop.run_in_executor(None, self._preparar, campaign_id, corte)
+        self.campaign = campaign
+        if campaign["state"] != "running":
+            return
+            
+        if campaign["last_user_id"]:
+            log_event(f"📢 Reanudando {campaign_id} desde el usuario {campaign['last_user_id']} ({self.pendientes} pendientes)")
+        else:
+            log_event(f"📢 Iniciando {campaign_id}: {self.pendientes} usuarios")
+            
+        while True:
+            if self.campaign_id() != campaign_id:
+                # Un recordatorio de ayer ya no tiene sentido; la campaña de hoy empieza aparte
+                await loop.run_in_executor(None, self._checkpoint, campaign, [], [], "expired")
+                log_event(f"⌛ {campaign_id} caducada con {campaign['enviados']} enviados")
+                return
+                
+            usuarios = await loop.run_in_executor(None, self._lote, campaign["last_user_id"], corte)
+            if not usuarios:
+                await loop.run_in_executor(None, self._checkpoint, campaign, [], [], "done")
+                log_event(f"✅ {campaign_id} terminada: {campaign['enviados']} enviados, "
+                          f"{campaign['bloqueados']} bloqueados, {campaign['fallidos']} fallidos")
+                return
+                
+            resultados = await self._procesar_lote(usuarios)
+            enviados = [uid for uid, r in resultados.items() if r == "enviado"]
+            bloqueados = [uid for uid, r in resultados.items() if r == "bloqueado"]
+            campaign["enviados"] += len(enviados)
+            campaign["bloqueados"] += len(bloqueados)
+            campaign["fallidos"] += sum(1 for r in resultados.values() if r == "fallido")
+            campaign["omitidos"] += sum(1 for r in resultados.values() if r == "omitido")
+            campaign["last_user_id"] = usuarios[-1]["id"]
+            self.pendientes = max(0, self.pendientes - len(usuarios))
+            await loop.run_in_executor(None, self._checkpoint, campaign, enviados, bloqueados, "running")
+            
+    async def tick(self, application):
+        """Arranca la campaña del día a partir de BROADCAST_HOUR; si se cortó, la reanuda desde el punto de control"""
+        if datetime.now().hour < BROADCAST_HOUR:
+            return
+        await self.run_campaign(application)
+        
+    def status(self):
+        campaign = dict(self.campaign) if self.campaign else None
+        eta = None
+        if campaign and campaign["state"] == "running" and self.rate > 0:
+            eta = int(self.pendientes / self.rate)
+        return {
+            "campana": campaign,
+            "pendientes": self.pendientes,
+            "ritmo_por_segundo": self.rate,
+            "eta_segundos": eta
+        }
+
+daily_broadcast = DailyBroadcast()
+
+async def scheduled_tasks(application):
+    while True:
+        try:
+            await daily_broadcast.tick(application)
+            await asyncio.sleep(BROADCAST_CHECK_INTERVAL)
+        except Exception as e:
+            log_event(f"❌ Error en tareas programadas: {e}")
+            await asyncio.sleep(BROADCAST_CHECK_INTERVAL)
+
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        raise context.error
+    except BadRequest as e:
+        if "Message is not modified" in str(e):
+            log_event("⚠️ Error 'Message is not modified' ignorado")
+        else:
+            log_event(f"❌ Error de BadRequest: {e}")
+    except RetryAfter as e:
+        log_event(f"⏰ Rate limit alcanzado: {e}")
+    except Exception as e:
+        log_event(f"❌ Error no manejado: {e}")
+        stats["errors"] += 1
+
+def start_background_tasks(application):
+    download_queue_system.set_application(application)
+    loop = asyncio.get_event_loop()
+    loop.create_task(download_queue_system.start())
+    loop.create_task(download_queue_system.recover())
+    loop.create_task(transcode_stage.start())
+    loop.create_task(loop_lag_monitor.run())
+    loop.create_task(monitor_sistema())
+    notification_service.start(application)
+    loop.create_task(autoscaler.run())
+    loop.create_task(actualizar_posiciones_cola())
+    loop.create_task(verificar_estado_sistema())
+    loop.create_task(scheduled_tasks(application))
+    if PAYMENT_INDEXER:
+        loop.create_task(payment_indexer.run())
+
+async def ejecutar_webhook(application):
+    """Ciclo de vida del bot en modo webhook: las updates entran por WebhookServer en vez del Updater"""
+    global webhook_server
+    webhook_server = WebhookServer(application)
+    await application.initialize()
+    await application.start()
+    await webhook_server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await webhook_server.stop()
+        await application.stop()
+        await application.shutdown()
+
+def run_api():
+    """Función para ejecutar la API en un hilo separado"""
+    log_event(f"🌐 Iniciando API web en puerto {API_PORT}...")
+    api_app.run(host=API_HOST, port=API_PORT, debug=False, use_reloader=False)
+
+def signal_handler(signum, frame):
+    """Manejador de señales para cerrar correctamente"""
+    log_event(f"🛑 Recibida señal {signum}, cerrando...")
+    download_queue_system.is_running = False
+    executor.shutdown(wait=False)
+    sys.exit(0)
+
+def main():
+    # Configurar manejadores de señales
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
+    crear_tabla()
+    medidas = catalogo.benchmark()
+    log_event(f"🌐 Catálogo: {len(catalogo.idiomas())} idiomas, {len(medidas)} teclados precompilados")
+    
+    stats["start_time"] = time.time()
+    print_stats()
+    log_event("🤖 Iniciando bot de descargas con sistema de colas mejorado y API web...")
+    
+    if os.environ.get("BOT_MODE") == "webhook" and BOT_MODE != "webhook":
+        log_event("⚠️ BOT_MODE=webhook requiere WEBHOOK_URL, se usa polling")
+        
+    if BOT_MODE == "webhook":
+        log_event("✅ API web servida por el servidor del webhook")
+    else:
+        # Iniciar la API en un hilo separado
+        api_thread = Thread(target=run_api, daemon=True)
+        api_thread.start()
+        log_event("✅ API web iniciada en segundo plano")
+    
+    application = crear_aplicacion("api")
+    
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("stats", admin_stats))
+    application.add_handler(CommandHandler("withdraw", withdraw_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, procesar_descarga))
+    application.add_handler(CallbackQueryHandler(callback_handler))
+    
+    application.add_handler(TypeHandler(Update, update_latency.registrar), group=-1)
+    
+    application.add_error_handler(error_handler)
+    
+    start_background_tasks(application)
+    
+    log_event("🚀 Bot en ejecución con NUEVO sistema de colas y API web...")
+    log_event(f"📊 API disponible en: http://localhost:{API_PORT}")
+    log_event(f"📊 Endpoints principales:")
+    log_event(f"  • http://localhost:{API_PORT}/api/status")
+    log_event(f"  • http://localhost:{API_PORT}/api/stats")
+    log_event(f"  • http://localhost:{API_PORT}/api/health")
+    
+    try:
+        if BOT_MODE == "webhook":
+            asyncio.get_event_loop().run_until_complete(ejecutar_webhook(application))
+        else:
+            application.run_polling()
+    except KeyboardInterrupt:
+        log_event("🛑 Bot detenido por el usuario")
+    except Exception as e:
+        log_event(f"❌ Error crítico: {e}")
+    finally:
+        executor.shutdown(wait=False)
+
+if __name__ == "__main__":
+    main()
+
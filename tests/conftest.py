@@ -0,0 +1,22 @@
+"""Configuración común de los tests.
+
+Importan app.py con un token falso y cada test trabaja en un directorio temporal con
+su propia base SQLite. Se ejecutan con: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def tmp_cwd(tmp_path, monkeypatch):
+    """Directorio de trabajo temporal con las tablas creadas"""
+    monkeypatch.chdir(tmp_path)
+    app.crear_tabla()
+    return tmp_path
@@ -0,0 +1,60 @@
+"""Descargas simuladas para comparar los modos hilo y proceso sin yt-dlp.
+
+No importa app: los procesos hijo (spawn) arrancan rápido y solo se mide el mecanismo
+de ejecución. Las funciones de proceso tienen la firma de app._download_en_proceso;
+la url indica el trabajo, p. ej. "stub://cpu/0.3"."""
+import os
+import subprocess
+import sys
+import time
+
+
+def trabajo_cpu(segundos, progreso=None):
+    """CPU en Python puro (como el parseo y el troceado de yt-dlp): retiene el GIL"""
+    fin = time.process_time() + segundos
+    paso = segundos / 10
+    siguiente = time.process_time() + paso
+    avance = 0
+    while time.process_time() < fin:
+        sum(i * i for i in range(200))
+        if progreso and time.process_time() >= siguiente:
+            avance += 10
+            siguiente += paso
+            progreso(avance)
+    return True
+
+
+def descarga_cpu(url, user_id, tipo, estimated_size, base_filename, conn):
+    if hasattr(os, "setsid"):
+        os.setsid()
+    try:
+        trabajo_cpu(float(url.rsplit("/", 1)[1]), lambda avance: conn.send(("progress", avance)))
+        conn.send(("result", {"success": True, "filename": base_filename + ".mp4", "acodec": "aac", "vcodec": "h264"}))
+    finally:
+        conn.close()
+
+
+def descarga_colgada(url, user_id, tipo, estimated_size, base_filename, conn):
+    """Deja un .part y un nieto (como el ffmpeg que lanza yt-dlp) y no termina nunca"""
+    if hasattr(os, "setsid"):
+        os.setsid()
+    nieto = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(120)"])
+    with open(f"nieto_{base_filename}.pid", "w") as f:
+        f.write(str(nieto.pid))
+    with open(base_filename + ".mp4.part", "wb") as f:
+        f.write(b"x" * 1000)
+    conn.send(("progress", 5))
+    time.sleep(120)
+
+
+class DescargaHilo:
+    """Downloader del modo hilo con el mismo trabajo de CPU que descarga_cpu"""
+
+    def __init__(self, segundos):
+        self.segundos = segundos
+        self.filename = None
+
+    def download(self):
+        trabajo_cpu(self.segundos)
+        self.filename = "hilo.mp4"
+        return True
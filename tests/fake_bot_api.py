@@ -0,0 +1,187 @@
+"""Bot API falsa en local (aiohttp) para medir el bot sin hablar con Telegram.
+
+Responde a los métodos que usa app.py, guarda cada llamada con su hora y, si se le pide,
+añade latencia y devuelve 429 (RetryAfter) al pasar los límites globales o por chat. A los
+chats de `bloqueados` responde 403, como cuando el usuario ha bloqueado el bot, y a los de
+`caidos` 502, un fallo transitorio que merece reintento."""
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+TOKEN = "123456:TEST"
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bot", "username": "test_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self, latencia=0.0, limite_global=None, limite_chat=None):
+        self.latencia = latencia
+        self.limite_global = limite_global
+        self.limite_chat = limite_chat
+        self.llamadas = []
+        self.rechazadas = 0
+        self.bloqueados = set()
+        self.prohibidas = 0
+        self.caidos = set()
+        self.fallidas = 0
+        self.updates = asyncio.Queue()
+        self.update_id = 0
+        self.webhook = None
+        self.message_id = 0
+        self.recientes = deque()
+        self.recientes_chat = defaultdict(deque)
+        self.runner = None
+        self.url = None
+
+    async def start(self):
+        web_app = web.Application(client_max_size=1024 ** 3)
+        web_app.router.add_route("*", "/bot{token}/{metodo}", self.atender)
+        self.runner = web.AppRunner(web_app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def metodos(self, *nombres):
+        return [llamada for llamada in self.llamadas if llamada["metodo"] in nombres]
+
+    def nueva_update(self, **contenido):
+        """Encola una update para getUpdates y la devuelve como dict (para el webhook)"""
+        self.update_id += 1
+        update = {"update_id": self.update_id, **contenido}
+        self.updates.put_nowait(update)
+        return update
+
+    def _supera_limite(self, chat_id, ahora):
+        """Ventana deslizante de 1 segundo, como la ve Telegram"""
+        for ventana, limite in ((self.recientes, self.limite_global),
+                                (self.recientes_chat[chat_id], self.limite_chat)):
+            while ventana and ventana[0] < ahora - 1:
+                ventana.popleft()
+            if limite is not None and len(ventana) >= limite:
+                return True
+        self.recientes.append(ahora)
+        self.recientes_chat[chat_id].append(ahora)
+        return False
+
+    async def _parametros(self, peticion):
+        parametros = {}
+        subidos = 0
+        if peticion.content_type.startswith("multipart/"):
+            lector = await peticion.multipart()
+            async for parte in lector:
+                if parte.filename:
+                    while True:
+                        bloque = await parte.read_chunk(256 * 1024)
+                        if not bloque:
+                            break
+                        subidos += len(bloque)
+                    parametros[parte.name] = f"attach://{parte.filename}"
+                else:
+                    parametros[parte.name] = await parte.text()
+        elif peticion.can_read_body:
+            if peticion.content_type == "application/json":
+                parametros = await peticion.json()
+            else:
+                parametros = dict(await peticion.post())
+        parametros.update(peticion.query)
+        for clave, valor in list(parametros.items()):
+            # PTB manda cada campo codificado en JSON
+            if isinstance(valor, str):
+                try:
+                    parametros[clave] = json.loads(valor)
+                except ValueError:
+                    pass
+        return parametros, subidos
+
+    def _mensaje(self, chat_id, message_id=None, texto=None):
+        if message_id is None:
+            self.message_id += 1
+            message_id = self.message_id
+        mensaje = {"message_id": message_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"}}
+        if texto is not None:
+            mensaje["text"] = texto
+        return mensaje
+
+    async def atender(self, peticion):
+        metodo = peticion.match_info["metodo"]
+        parametros, subidos = await self._parametros(peticion)
+
+        if metodo == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(parametros)})
+
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+        chat_id = parametros.get("chat_id")
+        ahora = time.monotonic()
+        if chat_id is not None and self._supera_limite(chat_id, ahora):
+            self.rechazadas += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            }, status=429)
+        if chat_id in self.bloqueados:
+            self.prohibidas += 1
+            return web.json_response({
+                "ok": False, "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user"
+            }, status=403)
+        if chat_id in self.caidos:
+            self.fallidas += 1
+            return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+
+        archivo = None
+        for campo in ("video", "audio", "document"):
+            valor = parametros.get(campo)
+            if isinstance(valor, str) and valor.startswith("file://"):
+                archivo = valor[len("file://"):]
+        self.llamadas.append({
+            "metodo": metodo,
+            "chat_id": chat_id,
+            "message_id": parametros.get("message_id"),
+            "texto": parametros.get("text"),
+            "bytes": subidos,
+            "archivo": archivo,
+            "t": ahora
+        })
+
+        if metodo == "getMe":
+            resultado = BOT_USER
+        elif metodo in ("setWebhook", "deleteWebhook"):
+            self.webhook = parametros.get("url")
+            resultado = True
+        elif metodo == "answerCallbackQuery":
+            resultado = True
+        elif metodo.startswith("editMessage"):
+            resultado = self._mensaje(chat_id, parametros.get("message_id"), parametros.get("text"))
+        elif metodo.startswith("send"):
+            resultado = self._mensaje(chat_id, texto=parametros.get("text"))
+        else:
+            resultado = True
+        return web.json_response({"ok": True, "result": resultado})
+
+    async def _get_updates(self, parametros):
+        """Long polling: la latencia se reparte entre la ida de la petición y la vuelta de las updates"""
+        desde = parametros.get("offset") or 0
+        espera = parametros.get("timeout") or 0
+        updates = []
+        await asyncio.sleep(self.latencia / 2)
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout=espera or 0.001))
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        await asyncio.sleep(self.latencia / 2)
+        return [update for update in updates if update["update_id"] >= desde]
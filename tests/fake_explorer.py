@@ -0,0 +1,116 @@
+"""Explorador de BSC simulado en local (aiohttp) con la API de BscScan y el precio de Binance.
+
+Cada respuesta tarda `latencia`; las siguientes `limitar` peticiones responden con el
+"Max rate limit reached" de BscScan y con precio_bnb=None el precio responde 503.
+Cuenta las peticiones en vuelo para medir el fan-out."""
+import asyncio
+
+from aiohttp import web
+
+import app
+
+BNB = 10 ** 18
+USDT = 10 ** app.USDT_BEP20_DECIMALS
+
+
+def tx_hash(n):
+    return "0x" + f"{n:064x}"
+
+
+def topic_direccion(direccion):
+    return "0x" + "0" * 24 + direccion[2:]
+
+
+class FakeExplorer:
+    def __init__(self, latencia=0.0, precio_bnb=600.0):
+        self.latencia = latencia
+        self.precio_bnb = precio_bnb
+        self.limitar = 0
+        self.transacciones = {}
+        self.tokentx = []
+        self.txlist = []
+        self.bloque = 1000
+        self.acciones = []
+        self.en_vuelo = 0
+        self.pico = 0
+        self.runner = None
+        self.url = None
+
+    async def start(self):
+        web_app = web.Application()
+        web_app.router.add_get("/api", self.api)
+        web_app.router.add_get("/price", self.precio)
+        self.runner = web.AppRunner(web_app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    # Transacciones de ejemplo
+
+    def pago_usdt(self, n, cantidad, destino=app.USDT_ADDRESS, remitente="0x" + "a" * 40):
+        tx = {"to": app.USDT_BEP20_CONTRACT, "value": "0x0", "from": remitente}
+        recibo = {"status": "0x1", "logs": [{
+            "address": app.USDT_BEP20_CONTRACT,
+            "topics": [app.ERC20_TRANSFER_TOPIC, topic_direccion(remitente), topic_direccion(destino)],
+            "data": hex(int(cantidad * USDT))
+        }]}
+        self.transacciones[tx_hash(n)] = (tx, recibo)
+        return tx_hash(n)
+
+    def pago_bnb(self, n, cantidad, destino=app.USDT_ADDRESS, estado="0x1"):
+        tx = {"to": destino, "value": hex(int(cantidad * BNB)), "from": "0x" + "b" * 40}
+        self.transacciones[tx_hash(n)] = (tx, {"status": estado, "logs": []})
+        return tx_hash(n)
+
+    # Servidor
+
+    async def _responder(self, datos):
+        self.en_vuelo += 1
+        self.pico = max(self.pico, self.en_vuelo)
+        try:
+            if self.latencia:
+                await asyncio.sleep(self.latencia)
+            if self.limitar > 0:
+                self.limitar -= 1
+                return web.json_response({"status": "0", "message": "NOTOK", "result": "Max rate limit reached"})
+            return web.json_response(datos)
+        finally:
+            self.en_vuelo -= 1
+
+    async def precio(self, peticion):
+        self.acciones.append("price")
+        if self.precio_bnb is None:
+            return web.Response(status=503)
+        return await self._responder({"symbol": "BNBUSDT", "price": str(self.precio_bnb)})
+
+    async def api(self, peticion):
+        accion = peticion.query["action"]
+        self.acciones.append(accion)
+        if accion == "eth_blockNumber":
+            return await self._responder({"jsonrpc": "2.0", "id": 83, "result": hex(self.bloque)})
+        if accion in ("eth_getTransactionByHash", "eth_getTransactionReceipt"):
+            par = self.transacciones.get(peticion.query["txhash"])
+            resultado = None
+            if par:
+                resultado = par[0] if accion == "eth_getTransactionByHash" else par[1]
+            return await self._responder({"jsonrpc": "2.0", "id": 1, "result": resultado})
+        if accion in ("tokentx", "txlist"):
+            return await self._responder(self._listado(accion, peticion.query))
+        return await self._responder({"status": "0", "message": "NOTOK", "result": f"acción desconocida {accion}"})
+
+    def _listado(self, accion, query):
+        desde = int(query.get("startblock", 0))
+        hasta = int(query.get("endblock", 99999999))
+        tamano = int(query.get("offset", 10000))
+        todas = self.tokentx if accion == "tokentx" else self.txlist
+        pagina = [tx for tx in todas if desde <= int(tx["blockNumber"]) <= hasta][:tamano]
+        if not pagina:
+            return {"status": "0", "message": "No transactions found", "result": []}
+        return {"status": "1", "message": "OK", "result": pagina}
@@ -0,0 +1,77 @@
+"""Archivos mayores que el límite de envío: división, limpieza y espera de la elección"""
+import asyncio
+
+import pytest
+
+import app
+
+MB = 1024 * 1024
+
+
+def test_split_borra_los_segmentos_si_ffmpeg_falla(tmp_path, monkeypatch):
+    origen = tmp_path / "video.mp4"
+    origen.write_bytes(b"x" * 1024)
+
+    async def duracion(path):
+        return 60.0
+
+    async def copia_fallida(input_path, output_path, args, modo):
+        # Deja un segmento a medias antes de fallar, como ffmpeg al quedarse sin disco
+        (tmp_path / "video_parte000.mp4").write_bytes(b"y" * 512)
+        raise Exception("ffmpeg falló: No space left on device")
+
+    monkeypatch.setattr(app, "duracion_media", duracion)
+    monkeypatch.setattr(app.transcode_stage, "copy", copia_fallida)
+    fitter = app.DeliveryFitter()
+
+    with pytest.raises(Exception, match="No space left"):
+        asyncio.run(fitter.split(str(origen), limit=512))
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["video.mp4"]
+    assert fitter.counts["fallidos"] == 1
+
+
+class TrackerAjuste:
+    def __init__(self):
+        self.lang = "es"
+        self.t = app.catalogo.t("es")
+        self.reply_markup = None
+        self.textos = []
+
+    async def safe_edit_message(self, texto):
+        self.textos.append(texto)
+
+
+def test_la_eleccion_no_ocupa_la_cola_de_subida(tmp_cwd, monkeypatch):
+    stage = app.PipelineStage("subida", 1, 0)
+    monkeypatch.setattr(app, "upload_stage", stage)
+    monkeypatch.setattr(app, "UPLOAD_LIMIT", MB)
+    archivo = tmp_cwd / "grande.mp4"
+    archivo.write_bytes(b"x" * (3 * MB))
+    qs = app.DownloadQueueSystem(max_workers=1)
+    tracker = TrackerAjuste()
+
+    parte = tmp_cwd / "grande_parte000.mp4"
+
+    async def dividir(path, limit=None):
+        parte.write_bytes(b"x")
+        return [str(parte)]
+    monkeypatch.setattr(app.delivery_fitter, "split", dividir)
+
+    async def correr():
+        token = app.CancellationToken("j1", 7)
+        qs.cancel_tokens["j1"] = token
+        await stage.admit("j1")
+        ajuste = asyncio.create_task(
+            qs._ajustar_entrega(("j1", 7, "url", "tt_video", 7, 1), str(archivo), tracker, token, [])
+        )
+        while "j1" not in qs.fit_choices:
+            await asyncio.sleep(0.01)
+        # Con la única plaza de la etapa, otro trabajo entra mientras j1 espera la respuesta
+        await asyncio.wait_for(stage.admit("j2"), timeout=1)
+        stage.leave("j2")
+        assert qs.choose_fit("j1", 7, "split")
+        return await ajuste
+
+    assert asyncio.run(correr()) == [str(parte)]
+    assert tracker.textos[-1] == tracker.t["fit_splitting"]
@@ -0,0 +1,98 @@
+"""BoundedStore con reloj inyectado: caducidad, expulsión LRU al llenarse y métricas de tamaño"""
+import sys
+
+import pytest
+
+import app
+
+
+class Reloj:
+    def __init__(self, ahora=1000.0):
+        self.ahora = ahora
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj():
+    return Reloj()
+
+
+def test_caduca_tras_el_ttl(reloj):
+    almacen = app.BoundedStore("prueba", ttl=60, max_items=10, clock=reloj)
+    almacen["a"] = 1
+    reloj.ahora += 30
+    almacen["b"] = 2
+
+    reloj.ahora += 30
+    # Justo en el límite sigue vigente
+    assert almacen.get("a") == 1
+    reloj.ahora += 1
+    assert "a" not in almacen
+    assert almacen.get("a", "nada") == "nada"
+    with pytest.raises(KeyError):
+        almacen["a"]
+    assert almacen.items() == [("b", 2)]
+    assert almacen.status()["caducadas"] == 1
+
+    # Volver a escribir una clave renueva su plazo
+    almacen["b"] = 3
+    reloj.ahora += 59
+    assert almacen["b"] == 3
+
+
+def test_purge_solo_quita_las_caducadas(reloj):
+    almacen = app.BoundedStore("prueba", ttl=10, max_items=10, clock=reloj)
+    for i in range(4):
+        almacen[i] = i
+        reloj.ahora += 5
+
+    # Escritas en 1000, 1005, 1010 y 1015; ahora son las 1020
+    assert almacen.purge() == 2
+    assert len(almacen) == 2
+    assert almacen.values() == [2, 3]
+    assert almacen.purge() == 0
+    assert almacen.status()["caducadas"] == 2
+
+
+def test_expulsa_la_menos_usada_al_llenarse(reloj):
+    almacen = app.BoundedStore("prueba", ttl=60, max_items=3, clock=reloj)
+    for clave in "abc":
+        almacen[clave] = clave.upper()
+
+    # Leer "a" la marca como reciente: la siguiente en salir es "b"
+    assert almacen["a"] == "A"
+    almacen["d"] = "D"
+    assert [k for k, _ in almacen.items()] == ["c", "a", "d"]
+    almacen["e"] = "E"
+    assert [k for k, _ in almacen.items()] == ["a", "d", "e"]
+    # Sobrescribir una clave existente no expulsa a nadie
+    almacen["a"] = "A2"
+    assert len(almacen) == 3
+    assert almacen.status()["expulsadas"] == 2
+    assert almacen.status()["caducadas"] == 0
+
+
+def test_metricas_de_tamano(reloj):
+    almacen = app.BoundedStore("prueba", ttl=60, max_items=100, clock=reloj)
+    vacio = almacen.status()
+    assert vacio == {
+        "entradas": 0, "maximo": 100, "ttl_segundos": 60,
+        "caducadas": 0, "expulsadas": 0, "memoria_bytes": sys.getsizeof(almacen.data)
+    }
+
+    valor = "x" * 1000
+    for i in range(50):
+        almacen[f"k{i}"] = valor
+    lleno = almacen.status()
+    assert lleno["entradas"] == 50
+    assert lleno["memoria_bytes"] - sys.getsizeof(almacen.data) == sum(
+        sys.getsizeof(f"k{i}") + sys.getsizeof(valor) for i in range(50)
+    )
+
+    # Al caducar y purgarse la memoria estimada vuelve a la del índice vacío
+    reloj.ahora += 61
+    almacen.purge()
+    assert almacen.status()["memoria_bytes"] == sys.getsizeof(almacen.data)
+    assert almacen.pop("k0") is None
@@ -0,0 +1,67 @@
+"""Benchmark por trabajo del modo de audio frente a recodificar siempre a mp3 (FFmpegExtractAudio)"""
+import asyncio
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import app
+
+requiere_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="requiere ffmpeg")
+
+
+def test_cpu_medido_por_proceso():
+    """Dos procesos a la vez: cada uno solo cuenta su propia CPU"""
+    ocupado = [sys.executable, "-c", "import time\nfin = time.process_time() + 0.5\nwhile time.process_time() < fin: pass"]
+    dormido = [sys.executable, "-c", "import time; time.sleep(0.5)"]
+
+    async def correr():
+        return await asyncio.gather(app.medir_proceso(ocupado), app.medir_proceso(dormido))
+
+    (_, cpu_ocupado), (reloj_dormido, cpu_dormido) = asyncio.run(correr())
+    assert cpu_ocupado >= 0.4
+    assert cpu_dormido < 0.2
+    assert reloj_dormido >= 0.5
+
+
+def test_fallo_incluye_stderr():
+    with pytest.raises(Exception, match="sin salida"):
+        asyncio.run(app.medir_proceso([sys.executable, "-c", "import sys; sys.exit('sin salida')"]))
+
+
+@requiere_ffmpeg
+@pytest.mark.parametrize("nombre, plan, acodec", [
+    ("pista.m4a", "passthrough", "mp4a.40.2"),
+    ("pista.mp4", "remux", "mp4a.40.2"),
+])
+def test_ahorro_por_trabajo(tmp_cwd, monkeypatch, nombre, plan, acodec):
+    monkeypatch.setattr(app, "AUDIO_BENCHMARK_SAMPLE", 1.0)
+    fuente = tmp_cwd / nombre
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=120",
+         "-c:a", "aac", "-b:a", "128k", str(fuente)],
+        check=True
+    )
+    assert app.planificar_audio(str(fuente), acodec, "none") == plan
+
+    etapa = app.TranscodeStage(workers=1)
+
+    async def correr():
+        await etapa.start()
+        try:
+            return await etapa.submit(str(fuente), plan, acodec)
+        finally:
+            await etapa.stop()
+
+    salida = asyncio.run(correr())
+    resumen = etapa.benchmark()["por_trabajo"]
+    print(f"\n{plan}: {resumen['ultimos']}")
+
+    assert resumen["trabajos"] == 1
+    medida = resumen["ultimos"][0]
+    assert medida["modo"] == plan
+    assert medida["segundos_cpu"] < medida["mp3_segundos_cpu"]
+    assert resumen["ahorro_cpu_medio"] > 0
+    # La recodificación de referencia no deja archivos
+    assert sorted(p.name for p in tmp_cwd.glob("pista*")) == sorted({fuente.name, salida.split("/")[-1]})
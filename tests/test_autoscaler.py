@@ -0,0 +1,149 @@
+"""Autoescalado de workers: reglas de decidir_escala y decisiones con reloj inyectado y carga sintética"""
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+MB = 1024 * 1024
+
+SENALES = {
+    "cola": 0,
+    "ocupados": 0,
+    "cpu": 0.1,
+    "red_saturada": False,
+    "disco_disponible": 100 * 1024 * MB,
+    "disco_por_trabajo": 400 * MB,
+}
+
+
+@pytest.mark.parametrize("actual, cambios, esperado", [
+    (2, {"cola": 5, "ocupados": 2}, 3),
+    (8, {"cola": 5, "ocupados": 8}, 8),
+    (3, {"cola": 5, "ocupados": 3, "red_saturada": True}, 3),
+    (3, {"cola": 5, "ocupados": 3, "disco_disponible": 100 * MB}, 3),
+    (5, {"cola": 0, "ocupados": 2, "disco_disponible": 100 * MB}, 2),
+    (4, {"cola": 5, "ocupados": 4, "cpu": 0.95}, 3),
+    (1, {"cola": 5, "ocupados": 1, "cpu": 0.95}, 1),
+    (4, {"cola": 0, "ocupados": 1}, 3),
+    (2, {"cola": 0, "ocupados": 1}, 2),
+])
+def test_decidir_escala(actual, cambios, esperado):
+    objetivo, motivo = app.decidir_escala(actual, {**SENALES, **cambios}, 1, 8)
+    assert objetivo == esperado
+    if objetivo != actual:
+        assert motivo
+
+
+class CargaSintetica:
+    """Hace de DownloadQueueSystem: `pendientes` trabajos, cada worker toma uno y la red da red(ocupados) bytes/s"""
+
+    def __init__(self, workers, pendientes, red):
+        self.max_workers = workers
+        self.pendientes = pendientes
+        self.red = red
+        self.priority_queue = self
+
+    @property
+    def active_tasks(self):
+        return dict.fromkeys(range(min(self.max_workers, self.pendientes)))
+
+    def qsize(self):
+        return max(0, self.pendientes - len(self.active_tasks))
+
+    def network_throughput(self, window):
+        return self.red(len(self.active_tasks))
+
+    def scale_to(self, target):
+        self.max_workers = target
+
+
+class Reloj:
+    def __init__(self, ahora=1000.0):
+        self.ahora = ahora
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def escalar(monkeypatch):
+    """Devuelve crear(carga, cpu) -> (autoescalado, avanzar(n)); avanzar da n pasos de 10s y devuelve los workers tras cada uno"""
+    monkeypatch.setattr(app, "disk_manager", SimpleNamespace(
+        status=lambda: {"disponible_bytes": SENALES["disco_disponible"]},
+        bytes_needed=lambda tamano: SENALES["disco_por_trabajo"]
+    ))
+
+    def crear(carga, cpu=0.1):
+        monkeypatch.setattr(app, "carga_cpu", lambda: cpu)
+        reloj = Reloj()
+        escalado = app.WorkerAutoscaler(carga, interval=10, cooldown=30, min_workers=1, max_workers=8, clock=reloj)
+
+        def avanzar(pasos):
+            traza = []
+            for _ in range(pasos):
+                reloj.ahora += escalado.interval
+                escalado.tick()
+                traza.append(carga.max_workers)
+            return traza
+        return escalado, avanzar
+    return crear
+
+
+def momentos(escalado):
+    return [(decision["de"], decision["a"]) for decision in escalado.decisions]
+
+
+def test_crece_hasta_el_techo_de_red(escalar):
+    # Cada descarga va a 30MB/s y la red da 60MB/s: el tercer worker ya no aporta caudal
+    carga = CargaSintetica(1, 100, lambda ocupados: min(30 * MB * ocupados, 60 * MB))
+    escalado, avanzar = escalar(carga)
+
+    traza = avanzar(12)
+
+    # Un cambio como mucho cada 30s; el caudal con 3 workers no mejora el de 2 y ahí se queda
+    assert traza == [2, 2, 2, 3, 3, 3, 3, 3, 3, 3, 3, 3]
+    assert momentos(escalado) == [(1, 2), (2, 3)]
+    assert escalado.last_signals["red_saturada"]
+    assert escalado.throughput_by_workers == {1: 30 * MB, 2: 60 * MB, 3: 60 * MB}
+
+
+def test_sin_techo_de_red_llega_al_maximo(escalar):
+    carga = CargaSintetica(1, 100, lambda ocupados: 30 * MB * ocupados)
+    escalado, avanzar = escalar(carga)
+
+    traza = avanzar(24)
+
+    assert traza == [2, 2, 2, 3, 3, 3, 4, 4, 4, 5, 5, 5, 6, 6, 6, 7, 7, 7, 8, 8, 8, 8, 8, 8]
+    assert momentos(escalado) == [(n, n + 1) for n in range(1, 8)]
+    assert not escalado.last_signals["red_saturada"]
+
+
+def test_cpu_alta_baja_y_no_deja_crecer(escalar):
+    carga = CargaSintetica(3, 100, lambda ocupados: 30 * MB * ocupados)
+    escalado, avanzar = escalar(carga, cpu=0.95)
+
+    assert avanzar(8) == [2, 2, 2, 1, 1, 1, 1, 1]
+    assert momentos(escalado) == [(3, 2), (2, 1)]
+    assert escalado.last_signals["cpu"] == 0.95
+
+
+def test_vuelve_al_minimo_al_vaciarse_la_cola(escalar):
+    carga = CargaSintetica(5, 1, lambda ocupados: 30 * MB * ocupados)
+    escalado, avanzar = escalar(carga)
+
+    # Con un trabajo en curso se queda un worker de reserva
+    assert avanzar(9) == [4, 4, 4, 3, 3, 3, 2, 2, 2]
+    carga.pendientes = 0
+    assert avanzar(4) == [1, 1, 1, 1]
+    assert momentos(escalado) == [(5, 4), (4, 3), (3, 2), (2, 1)]
+    assert all(decision["motivo"] == "workers ociosos" for decision in escalado.decisions)
+
+
+def test_sin_disco_no_crece(escalar, monkeypatch):
+    carga = CargaSintetica(2, 100, lambda ocupados: 30 * MB * ocupados)
+    escalado, avanzar = escalar(carga)
+    monkeypatch.setattr(app.disk_manager, "status", lambda: {"disponible_bytes": 100 * MB})
+
+    assert avanzar(6) == [2] * 6
+    assert momentos(escalado) == []
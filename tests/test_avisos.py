@@ -0,0 +1,130 @@
+"""Servicio de notificaciones contra la Bot API falsa: cola, agrupación, reintentos y vaciado al cerrar"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import ExtBot
+
+import app
+from fake_bot_api import FakeBotAPI, TOKEN
+
+
+@pytest.fixture
+def avisos(monkeypatch):
+    """Devuelve ejecutar(servicio, escenario(api, servicio), **opciones de la API)"""
+    monkeypatch.setattr(app, "UPLOAD_RETRY_BASE", 0.01)
+
+    def ejecutar(servicio, escenario, **opciones):
+        api = FakeBotAPI(**opciones)
+
+        async def correr():
+            await api.start()
+            bot = ExtBot(TOKEN, base_url=f"{api.url}/bot", rate_limiter=app.OutboundRateLimiter(global_rate=1000))
+            await bot.initialize()
+            try:
+                servicio.start(SimpleNamespace(bot=bot))
+                return await escenario(api, servicio)
+            finally:
+                await servicio.stop(timeout=1)
+                await bot.shutdown()
+                await api.stop()
+        return asyncio.run(correr())
+    return ejecutar
+
+
+def recibidos(api):
+    return [(llamada["chat_id"], llamada["texto"]) for llamada in api.metodos("sendMessage")]
+
+
+async def hasta(condicion, limite=5):
+    fin = time.monotonic() + limite
+    while not condicion() and time.monotonic() < fin:
+        await asyncio.sleep(0.01)
+
+
+def test_agrupa_los_avisos_del_mismo_chat(avisos):
+    servicio = app.NotificationService(batch_window=0.1)
+
+    async def escenario(api, servicio):
+        for i in range(3):
+            servicio.notify(1, f"pago {i}", batch=True)
+        servicio.notify(2, "referido")
+        await hasta(lambda: len(api.metodos("sendMessage")) == 2)
+        return recibidos(api)
+
+    assert sorted(avisos(servicio, escenario)) == [(1, "pago 0\n\npago 1\n\npago 2"), (2, "referido")]
+    assert servicio.status() == {
+        "pendientes": 0, "enviados": 2, "agrupados": 2, "reintentos": 0, "descartados": 0, "fallidos": 0
+    }
+
+
+def test_cola_llena_descarta(avisos):
+    servicio = app.NotificationService(max_queue=2)
+    # Antes de arrancar el bot los avisos esperan en cola, hasta el máximo
+    assert servicio.notify(1, "a") and servicio.notify(2, "b")
+    assert not servicio.notify(3, "c")
+
+    async def escenario(api, servicio):
+        await hasta(lambda: len(api.metodos("sendMessage")) == 2)
+        return recibidos(api)
+
+    assert sorted(avisos(servicio, escenario)) == [(1, "a"), (2, "b")]
+    assert servicio.status()["descartados"] == 1
+
+
+def test_reintenta_hasta_agotar_el_presupuesto(avisos):
+    servicio = app.NotificationService(batch_window=0)
+
+    async def escenario(api, servicio):
+        api.caidos = {1}
+        api.bloqueados = {2}
+        servicio.notify(1, "caído")
+        servicio.notify(2, "bloqueado")
+        servicio.notify(3, "bien")
+        await hasta(lambda: servicio.failed == 2)
+        return api.fallidas, api.prohibidas, recibidos(api)
+
+    fallidas, prohibidas, entregados = avisos(servicio, escenario)
+
+    # Un fallo transitorio se reintenta NOTIFY_MAX_RETRIES veces; un bloqueo no se reintenta
+    assert fallidas == app.NOTIFY_MAX_RETRIES + 1
+    assert prohibidas == 1
+    assert entregados == [(3, "bien")]
+    estado = servicio.status()
+    assert (estado["enviados"], estado["reintentos"], estado["fallidos"]) == (1, app.NOTIFY_MAX_RETRIES, 2)
+
+
+def test_al_cerrar_envia_lo_pendiente(avisos):
+    # Con una ventana de agrupación larga nada sale antes de cerrar
+    servicio = app.NotificationService(batch_window=60)
+
+    async def escenario(api, servicio):
+        servicio.notify(1, "pago confirmado", batch=True)
+        servicio.notify(1, "nuevo referido", batch=True)
+        servicio.notify(2, "retiro enviado")
+        await asyncio.sleep(0.1)
+        antes = recibidos(api)
+        inicio = time.monotonic()
+        await servicio.stop()
+        return antes, recibidos(api), time.monotonic() - inicio
+
+    antes, despues, duracion = avisos(servicio, escenario)
+
+    assert antes == []
+    assert sorted(despues) == [(1, "pago confirmado\n\nnuevo referido"), (2, "retiro enviado")]
+    assert duracion < 1
+    assert servicio.status()["pendientes"] == 0 and servicio.worker is None
+
+
+def test_al_cerrar_descarta_lo_que_no_sale_a_tiempo(avisos):
+    servicio = app.NotificationService(batch_window=60)
+
+    async def escenario(api, servicio):
+        servicio.notify(1, "lento")
+        await asyncio.sleep(0.05)
+        await servicio.stop(timeout=0.2)
+        return recibidos(api)
+
+    assert avisos(servicio, escenario, latencia=2) == []
+    assert servicio.status()["descartados"] == 1
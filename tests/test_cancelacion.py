@@ -0,0 +1,143 @@
+"""Cancelación de un trabajo en cada etapa (análisis, descarga, transcodificación y subida) con etapas simuladas"""
+import asyncio
+import os
+import time
+
+import pytest
+
+import app
+
+USUARIO = 7
+
+
+class TrackerFalso:
+    creados = []
+
+    def __init__(self, chat_id, message_id, user_id, application):
+        self.creados.append(self)
+        self.lang = "es"
+        self.t = app.catalogo.t("es")
+        self.reply_markup = None
+        self.finales = []
+
+    def set_cancel_button(self, job_id):
+        pass
+
+    async def safe_edit_message(self, texto):
+        pass
+
+    async def final_message(self, texto):
+        self.finales.append(texto)
+
+    def close(self):
+        pass
+
+
+class Etapas:
+    """Etapas simuladas: la que está en `colgar` avisa al llegar y no termina hasta que la cancelen"""
+
+    def __init__(self, colgar):
+        self.colgar = colgar
+        self.llegadas = {}
+
+    async def _llegar(self, etapa):
+        self.llegadas[etapa].set()
+        if etapa == self.colgar:
+            await asyncio.Event().wait()
+
+    async def analizar(self, url, user_id, tipo):
+        await self._llegar("analisis")
+        return True, 1000, "video", 10, "720p", "mp4"
+
+    def descargar(self, downloader):
+        parcial = os.path.join(app.DOWNLOAD_DIR, downloader.base_filename + ".mp4.part")
+        with open(parcial, "wb") as f:
+            f.write(b"x" * 1000)
+        if self.colgar == "descarga":
+            downloader.loop.call_soon_threadsafe(self.llegadas["descarga"].set)
+            while not downloader.cancel_token.cancelled:
+                time.sleep(0.01)
+            return False
+        downloader.filename = parcial[:-len(".part")]
+        os.rename(parcial, downloader.filename)
+        downloader.acodec, downloader.vcodec = "opus", None
+        return True
+
+    async def transcodificar(self, filename, plan, acodec):
+        await self._llegar("transcodificacion")
+        return filename
+
+    async def subir(self, user_id, archivo, tipo, progress_tracker):
+        await self._llegar("subida")
+
+
+@pytest.fixture
+def tuberia(tmp_cwd, monkeypatch):
+    """Devuelve ejecutar(colgar): lanza un trabajo de audio, lo cancela en la etapa `colgar` y devuelve lo observado"""
+    monkeypatch.setattr(app, "SafeProgressTracker", TrackerFalso)
+    monkeypatch.setattr(app, "DOWNLOAD_EXEC_MODE", "thread")
+    monkeypatch.setattr(app, "disk_manager", app.DiskReservationManager(path=str(tmp_cwd), overhead_factor=1.0, safety_margin=0))
+    monkeypatch.setattr(app, "analysis_stage", app.PipelineStage("analisis", 1))
+    monkeypatch.setattr(app, "upload_stage", app.PipelineStage("subida", 1, 1))
+    monkeypatch.setattr(app, "planificar_audio", lambda filename, acodec, vcodec: "transcode")
+
+    def ejecutar(colgar):
+        etapas = Etapas(colgar)
+        TrackerFalso.creados = []
+        monkeypatch.setattr(app, "analizar_video_con_detalles", etapas.analizar)
+        monkeypatch.setattr(app.SafeParallelDownloader, "download", lambda downloader: etapas.descargar(downloader))
+        monkeypatch.setattr(app.transcode_stage, "submit", etapas.transcodificar)
+        qs = app.DownloadQueueSystem(max_workers=1)
+        qs.app = object()
+        monkeypatch.setattr(qs, "_send_file", etapas.subir)
+
+        async def correr():
+            etapas.llegadas = {etapa: asyncio.Event() for etapa in app.JOB_STAGES}
+            await qs.start()
+            try:
+                await qs.add_task(1, ("j1", USUARIO, "https://www.tiktok.com/@u/video/1", "tt_audio", USUARIO, 50))
+                await asyncio.wait_for(etapas.llegadas[colgar].wait(), 5)
+                etapa = qs.cancel_job("j1", USUARIO)
+                # La tarea del trabajo termina y deja libre el worker
+                limite = time.monotonic() + 5
+                while (qs.running_jobs or qs.post_tasks or qs.active_tasks) and time.monotonic() < limite:
+                    await asyncio.sleep(0.01)
+                return etapa
+            finally:
+                await qs.stop()
+
+        etapa = asyncio.run(correr())
+        # El hilo de la descarga aborta en su siguiente comprobación y después se borran los parciales
+        limite = time.monotonic() + 5
+        while descargas() and time.monotonic() < limite:
+            time.sleep(0.01)
+        return etapa, qs, etapas
+    return ejecutar
+
+
+def descargas():
+    return [archivo for archivo in os.listdir(app.DOWNLOAD_DIR) if archivo.startswith("download_")]
+
+
+def estado_en_diario(job_id):
+    with app.conectar_db() as conn:
+        return conn.execute("SELECT state FROM job_journal WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+
+@pytest.mark.parametrize("colgar", ["analisis", "descarga", "transcodificacion", "subida"])
+def test_cancelar_en_cada_etapa(tuberia, colgar):
+    etapa, qs, etapas = tuberia(colgar)
+
+    assert etapa == colgar
+    assert {e: n for e, n in qs.cancellations.items() if n} == {colgar: 1}
+    assert estado_en_diario("j1") == "cancelled"
+    # Ninguna etapa posterior llega a empezar
+    siguientes = app.JOB_STAGES[app.JOB_STAGES.index(colgar) + 1:]
+    assert not [e for e in siguientes if etapas.llegadas[e].is_set()]
+    # Sin parciales ni archivos descargados, sin reserva de disco y sin sitio ocupado en la subida
+    assert descargas() == []
+    assert app.disk_manager.reservations == {}
+    assert app.upload_stage.admitted == set()
+    assert qs.cancel_tokens == {} and qs.running_jobs == {}
+    # Cancelar no es un fallo: el trabajo no le muestra ningún error al usuario
+    assert [tracker.finales for tracker in TrackerFalso.creados] == [[]]
@@ -0,0 +1,22 @@
+"""Catálogo de mensajes: todos los idiomas tienen los mismos textos y los mensajes no mezclan idiomas"""
+import app
+
+
+def test_idiomas_con_las_mismas_claves():
+    claves = {lang: set(textos) for lang, textos in app.translations.items()}
+    for lang, propias in claves.items():
+        assert propias == claves["es"], lang
+
+
+def test_mensajes_en_el_idioma_del_usuario(tmp_cwd):
+    app.registrar_usuario(7, "u7")
+    with app.conectar_db() as conn:
+        conn.execute("UPDATE usuarios SET language = 'en', balance = 10 WHERE id = 7")
+
+    ok, minimo = app.solicitar_retiro(7, 1, "0x" + "a" * 40)
+    assert not ok and minimo == app.catalogo.texto("en", "withdraw_minimum", app.MIN_WITHDRAWAL)
+    ok, fondos = app.solicitar_retiro(7, app.MIN_WITHDRAWAL, "0x" + "a" * 40)
+    assert not ok and fondos == app.catalogo.t("en")["insufficient_funds"]
+
+    cola = app.texto_posicion_cola(app.catalogo.t("en"), 2, 90)
+    assert "En cola" not in cola and "Waiting in queue" in cola
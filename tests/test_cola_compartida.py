@@ -0,0 +1,154 @@
+"""Cola compartida con worker.py: toma, latido, reasignación, cancelación y nombre de archivo del bot"""
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+import app
+import worker
+
+
+class DescargaFalsa:
+    """Sustituye a SafeParallelDownloader en el worker: escribe un .part y espera a que la suelten"""
+    creadas = []
+    liberar = threading.Event()
+
+    def __init__(self, url, user_id, tipo, progress_tracker):
+        self.base_filename = f"download_{user_id}_{time.time_ns()}"
+        self.filename = None
+        self.acodec = "aac"
+        self.vcodec = "h264"
+        self.cancel_token = None
+        self.creadas.append(self)
+
+    def download(self):
+        parcial = self.base_filename + ".mp4.part"
+        with open(parcial, "wb") as f:
+            f.write(b"x" * 1000)
+        while not self.liberar.wait(0.01):
+            if self.cancel_token.cancelled:
+                return False
+        self.filename = self.base_filename + ".mp4"
+        os.rename(parcial, self.filename)
+        return True
+
+    def remove_partial_files(self):
+        for archivo in os.listdir("."):
+            if archivo.startswith(self.base_filename):
+                os.remove(archivo)
+
+
+@pytest.fixture
+def cola(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = app.SharedJobQueue(path=str(tmp_path / "cola.db"), stale_after=60, max_attempts=2)
+    queue.ensure_schema()
+    return queue
+
+
+@pytest.fixture
+def en_worker(cola, monkeypatch):
+    """worker.py con la cola temporal, la descarga falsa y latidos rápidos"""
+    DescargaFalsa.creadas = []
+    DescargaFalsa.liberar = threading.Event()
+    monkeypatch.setattr(worker, "shared_queue", cola)
+    monkeypatch.setattr(worker, "SafeParallelDownloader", DescargaFalsa)
+    monkeypatch.setattr(worker, "SHARED_QUEUE_HEARTBEAT", 0.02)
+    monkeypatch.setattr(worker, "SHARED_QUEUE_POLL", 0.02)
+    monkeypatch.setattr(worker, "detener", threading.Event())
+    hilos = []
+
+    def arrancar(objetivo, *args):
+        hilo = threading.Thread(target=objetivo, args=args)
+        hilo.start()
+        hilos.append(hilo)
+        return hilo
+
+    yield arrancar
+    worker.detener.set()
+    DescargaFalsa.liberar.set()
+    for hilo in hilos:
+        hilo.join(5)
+
+
+def envejecer_latido(cola, job_id):
+    conn = cola._connect()
+    conn.execute("UPDATE shared_jobs SET heartbeat_at = ? WHERE job_id = ?", (int(time.time()) - 120, job_id))
+    conn.close()
+
+
+def test_toma_latido_y_reasignacion(cola):
+    cola.submit("j1", 7, "https://vm.tiktok.com/a", "tt_video", 100, "download_7_1")
+
+    assert cola.claim("w1")["base_filename"] == "download_7_1"
+    assert cola.heartbeat(["j1"], "w1") == set()
+    # Con el latido al día nadie más puede tomarlo
+    assert cola.claim("w2") is None
+
+    envejecer_latido(cola, "j1")
+    assert cola.claim("w2")["job_id"] == "j1"
+    fila = cola.poll("j1")
+    assert fila["worker"] == "w2" and fila["attempts"] == 2
+    # El primer worker se entera en su latido y ya no puede completarlo
+    assert cola.heartbeat(["j1"], "w1") == {"j1"}
+    assert not cola.complete("j1", "w1", "x.mp4", None, None)
+
+    # Agotados los intentos, un worker perdido hace fallar el trabajo
+    envejecer_latido(cola, "j1")
+    assert cola.claim("w3") is None
+    fila = cola.poll("j1")
+    assert fila["state"] == "failed" and fila["error"] == "worker perdido"
+
+
+def test_cancelar_detiene_al_worker_y_borra_parciales(cola, en_worker):
+    cola.submit("j1", 7, "https://vm.tiktok.com/a", "tt_video", 100, "download_7_1")
+    trabajo = cola.claim(worker.WORKER_NAME)
+
+    proceso = en_worker(worker.procesar, trabajo)
+    en_worker(worker.bucle_latido)
+    limite = time.monotonic() + 2
+    while not os.path.exists("download_7_1.mp4.part") and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert DescargaFalsa.creadas[0].base_filename == "download_7_1"
+
+    cola.cancel("j1")
+    proceso.join(2)
+
+    assert not proceso.is_alive()
+    assert DescargaFalsa.creadas[0].cancel_token.cancelled
+    assert not [archivo for archivo in os.listdir(".") if archivo.startswith("download_7_1")]
+    assert cola.poll("j1")["state"] == "cancelled"
+    assert "j1" not in worker.activos
+
+
+def test_el_worker_escribe_con_el_nombre_que_sigue_el_bot(cola, en_worker, monkeypatch):
+    monkeypatch.setattr(app, "SHARED_QUEUE_POLL", 0.02)
+    disco = app.DiskReservationManager(path=".", overhead_factor=1.0, safety_margin=0)
+    en_worker(worker.bucle_descargas, 0)
+
+    class Progreso:
+        async def update_download_progress(self, progress):
+            pass
+
+    async def escenario():
+        downloader = app.SafeParallelDownloader("https://vm.tiktok.com/a", 7, "tt_video", Progreso())
+        downloader.base_filename = "download_7_bot"
+        assert disco.try_reserve("j1", 5000)
+        disco.track("j1", downloader.base_filename)
+        tarea = asyncio.create_task(app.RemoteDownloadRunner(cola).run(downloader, "j1"))
+        limite = time.monotonic() + 2
+        while not os.path.exists("download_7_bot.mp4.part") and time.monotonic() < limite:
+            await asyncio.sleep(0.01)
+        # Lo que el worker va escribiendo cuenta contra la reserva del bot
+        escritos = disco._escritos()["j1"]
+        DescargaFalsa.liberar.set()
+        return await asyncio.wait_for(tarea, 5), downloader, escritos
+
+    ok, downloader, escritos = asyncio.run(escenario())
+
+    assert ok
+    assert escritos == 1000
+    assert os.path.basename(downloader.filename) == "download_7_bot.mp4"
+    assert DescargaFalsa.creadas[0].base_filename == "download_7_bot"
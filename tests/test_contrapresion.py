@@ -0,0 +1,127 @@
+"""Contrapresión entre descarga y subida: con la etapa de subida llena el worker de descarga espera"""
+import asyncio
+import os
+import time
+
+import pytest
+
+import app
+
+USUARIOS = [11, 12, 13, 14]
+
+
+class TrackerFalso:
+    def __init__(self, chat_id, message_id, user_id, application):
+        self.lang = "es"
+        self.t = app.catalogo.t("es")
+        self.reply_markup = None
+
+    def set_cancel_button(self, job_id):
+        pass
+
+    async def safe_edit_message(self, texto):
+        pass
+
+    async def final_message(self, texto):
+        raise AssertionError(texto)
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Tuberia:
+    """Descarga instantánea y subida que espera a que el test suelte a su usuario"""
+
+    def __init__(self):
+        self.descargados = []
+        self.subiendo = []
+        self.entregados = []
+        self.soltar = {}
+
+    def descargar(self, downloader):
+        downloader.filename = os.path.join(app.DOWNLOAD_DIR, downloader.base_filename + ".mp4")
+        with open(downloader.filename, "wb") as f:
+            f.write(b"x" * 1000)
+        self.descargados.append(downloader.user_id)
+        return True
+
+    async def subir(self, user_id, archivo, tipo, progress_tracker):
+        self.subiendo.append(user_id)
+        await self.soltar[user_id].wait()
+        self.entregados.append(user_id)
+
+
+@pytest.fixture
+def tuberia(tmp_cwd, monkeypatch):
+    for uid in USUARIOS:
+        app.registrar_usuario(uid, f"u{uid}")
+    simulada = Tuberia()
+
+    async def analizar(url, user_id, tipo):
+        return True, 1000, "video", 10, "720p", "mp4"
+
+    async def menu(application, chat_id, message_id, recompensa):
+        pass
+
+    monkeypatch.setattr(app, "SafeProgressTracker", TrackerFalso)
+    monkeypatch.setattr(app, "DOWNLOAD_EXEC_MODE", "thread")
+    monkeypatch.setattr(app, "analizar_video_con_detalles", analizar)
+    monkeypatch.setattr(app, "mostrar_menu_post_descarga", menu)
+    monkeypatch.setattr(app.SafeParallelDownloader, "download", lambda downloader: simulada.descargar(downloader))
+    monkeypatch.setattr(app, "disk_manager", app.DiskReservationManager(path=str(tmp_cwd), overhead_factor=1.0, safety_margin=0))
+    # Una subida en curso y una en cola como mucho
+    monkeypatch.setattr(app, "upload_stage", app.PipelineStage("subida", 1, 1))
+    return simulada
+
+
+async def hasta(condicion, limite=5):
+    fin = time.monotonic() + limite
+    while not condicion() and time.monotonic() < fin:
+        await asyncio.sleep(0.01)
+    assert condicion()
+
+
+def test_descarga_espera_a_que_se_libere_la_subida(tuberia):
+    qs = app.DownloadQueueSystem(max_workers=1)
+    qs.app = object()
+    qs._send_file = tuberia.subir
+
+    async def correr():
+        tuberia.soltar = {uid: asyncio.Event() for uid in USUARIOS}
+        await qs.start()
+        try:
+            for i, uid in enumerate(USUARIOS):
+                await qs.add_task(1, (f"j{i}", uid, f"https://www.tiktok.com/@u/video/{i}", "tt_video", uid, 50))
+
+            # 11 sube, 12 espera en la cola de subida y 13, ya descargado, no cabe: el worker se queda esperando
+            await hasta(lambda: app.upload_stage.backpressure_waits == 1)
+            await asyncio.sleep(0.1)
+            lleno = (list(tuberia.descargados), list(tuberia.subiendo), set(app.upload_stage.admitted), len(qs.post_tasks))
+
+            # Al terminar una subida entra la siguiente y el worker sigue descargando
+            tuberia.soltar[11].set()
+            await hasta(lambda: tuberia.descargados == USUARIOS)
+            await hasta(lambda: app.upload_stage.backpressure_waits == 2)
+            tras_soltar = (list(tuberia.subiendo), set(app.upload_stage.admitted))
+
+            for evento in tuberia.soltar.values():
+                evento.set()
+            await hasta(lambda: len(tuberia.entregados) == len(USUARIOS) and not qs.post_tasks)
+            return lleno, tras_soltar
+        finally:
+            await qs.stop()
+
+    lleno, tras_soltar = asyncio.run(correr())
+
+    descargados, subiendo, admitidos, en_subida = lleno
+    assert descargados == [11, 12, 13]
+    assert subiendo == [11]
+    assert admitidos == {"j0", "j1"} and en_subida == 2
+    assert tras_soltar == ([11, 12], {"j1", "j2"})
+    assert tuberia.entregados == USUARIOS
+    assert app.upload_stage.admitted == set()
+    assert app.disk_manager.reservations == {}
+    assert not [f for f in os.listdir(app.DOWNLOAD_DIR) if f.startswith("download_")]
@@ -0,0 +1,123 @@
+"""Diario de trabajos: recuperación tras un reinicio y coste de escribir el diario"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram.ext import ExtBot
+
+import app
+from fake_bot_api import FakeBotAPI, TOKEN
+
+
+def sembrar(job_id, estado, intentos=0, antiguedad=0, user_id=7, priority=1):
+    """Inserta una fila como la dejaría un proceso anterior; message_id = hash estable del job_id"""
+    ahora = int(time.time())
+    with app.conectar_db() as conn:
+        conn.execute(
+            "INSERT INTO job_journal (job_id, user_id, url, tipo, chat_id, message_id, priority, state, attempts, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'tt_video', ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, user_id, f"https://vm.tiktok.com/{job_id}", user_id, mensaje(job_id), priority, estado,
+             intentos, ahora - antiguedad, ahora - antiguedad)
+        )
+
+
+def mensaje(job_id):
+    return sum(ord(c) for c in job_id)
+
+
+def estados():
+    with app.conectar_db() as conn:
+        return {fila[0]: (fila[1], fila[2], fila[3]) for fila in conn.execute(
+            "SELECT job_id, state, attempts, error FROM job_journal"
+        )}
+
+
+class BotMudo:
+    async def edit_message_text(self, **kwargs):
+        pass
+
+
+def recuperar(sistema, bot):
+    sistema.set_application(SimpleNamespace(running=True, bot=bot))
+    asyncio.run(sistema.recover())
+
+
+def test_recupera_tras_reinicio(tmp_cwd):
+    app.registrar_usuario(7, "u7")
+    with app.conectar_db() as conn:
+        conn.execute("UPDATE usuarios SET language = 'en' WHERE id = 7")
+    sembrar("en_cola", "queued", priority=0)
+    sembrar("descargando", "downloading", intentos=1)
+    sembrar("subiendo", "uploading")
+    sembrar("agotado", "transcoding", intentos=app.JOURNAL_MAX_ATTEMPTS)
+    sembrar("viejo", "analyzing", antiguedad=app.JOURNAL_MAX_AGE + 60)
+    sembrar("hecho", "done")
+    sembrar("cancelado", "cancelled")
+    sembrar("purgable", "done", antiguedad=app.JOURNAL_RETENTION + 60)
+
+    api = FakeBotAPI()
+    sistema = app.DownloadQueueSystem(max_workers=1)
+
+    async def escenario():
+        await api.start()
+        bot = ExtBot(TOKEN, base_url=f"{api.url}/bot")
+        await bot.initialize()
+        try:
+            sistema.set_application(SimpleNamespace(running=True, bot=bot))
+            await sistema.recover()
+        finally:
+            await bot.shutdown()
+            await api.stop()
+
+    asyncio.run(escenario())
+
+    # Los interrumpidos recuperables vuelven a la cola con su prioridad y un intento más
+    en_cola = {entrada[2][0]: entrada[0] for _, entrada in sistema.priority_queue.jobs()}
+    assert en_cola == {"en_cola": 0, "descargando": 1, "subiendo": 1}
+    diario = estados()
+    assert diario["en_cola"] == ("queued", 1, None)
+    assert diario["descargando"] == ("queued", 2, None)
+    assert diario["subiendo"] == ("queued", 1, None)
+    # Los que agotaron intentos o son demasiado viejos se dan por fallidos
+    assert diario["agotado"] == ("failed", app.JOURNAL_MAX_ATTEMPTS, "no recuperable")
+    assert diario["viejo"] == ("failed", 0, "no recuperable")
+    assert diario["hecho"][0] == "done" and diario["cancelado"][0] == "cancelled"
+    assert "purgable" not in diario
+
+    # Cada usuario ve en su mensaje si el trabajo se reanudó, en su idioma
+    textos = {llamada["message_id"]: llamada["texto"] for llamada in api.metodos("editMessageText")}
+    assert len(textos) == 5
+    assert textos[mensaje("en_cola")] == app.catalogo.t("en")["job_resumed"]
+    assert textos[mensaje("agotado")] == app.catalogo.t("en")["job_not_resumed"]
+
+    # Un segundo arranque no vuelve a encolar lo ya recuperado: add_task ignora los duplicados
+    recuperar(sistema, BotMudo())
+    assert sistema.priority_queue.qsize() == 3
+    assert sistema.duplicates["job_id"] == 3
+
+
+def test_benchmark_diario(tmp_cwd):
+    trabajos = 300
+    diario = app.JobJournal()
+
+    # Escrituras de un trabajo completo: encolar, cada etapa y el final
+    for i in range(trabajos):
+        diario.enqueue(1, (f"b{i}", 7, "https://vm.tiktok.com/b", "tt_video", 7, i))
+        for etapa in ("analisis", "descarga", "transcodificacion", "subida", "completado"):
+            diario.set_state(f"b{i}", app.JOURNAL_STATES[etapa])
+        diario.finish(f"b{i}")
+    escritura = diario.status()
+
+    for i in range(trabajos):
+        sembrar(f"r{i}", "downloading")
+    sistema = app.DownloadQueueSystem(max_workers=1)
+    inicio = time.perf_counter()
+    recuperar(sistema, BotMudo())
+    recuperacion = (time.perf_counter() - inicio) * 1000 / trabajos
+
+    print(f"\ndiario: {escritura['ms_por_escritura']}ms por escritura, {escritura['ms_por_trabajo']}ms por trabajo "
+          f"({escritura['escrituras'] // trabajos} escrituras); recover: {recuperacion:.2f}ms por trabajo")
+    assert escritura["escrituras"] == trabajos * 7
+    assert escritura["por_estado"] == {"done": trabajos}
+    assert sistema.priority_queue.qsize() == trabajos
+    assert all(estado == ("queued", 1, None) for job_id, estado in estados().items() if job_id.startswith("r"))
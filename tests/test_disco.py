@@ -0,0 +1,123 @@
+"""Reservas de disco: admisión, bytes ya escritos, espera de espacio y trabajos aparcados"""
+import asyncio
+import os
+from collections import namedtuple
+
+import pytest
+
+import app
+
+Uso = namedtuple("Uso", "total used free")
+
+
+@pytest.fixture
+def disco(tmp_path, monkeypatch):
+    """Volumen falso de 1000 bytes: el espacio libre descuenta los archivos escritos en él"""
+    directorio = tmp_path / "descargas"
+    directorio.mkdir()
+
+    def disk_usage(path):
+        usado = sum(entrada.stat().st_size for entrada in os.scandir(path))
+        return Uso(1000, usado, 1000 - usado)
+
+    monkeypatch.setattr(app.shutil, "disk_usage", disk_usage)
+    return app.DiskReservationManager(path=str(directorio), overhead_factor=2.0, safety_margin=100)
+
+
+def escribir(directorio, nombre, tamano):
+    with open(os.path.join(directorio, nombre), "wb") as f:
+        f.write(b"x" * tamano)
+
+
+def test_admite_hasta_el_margen(disco):
+    assert disco.try_reserve("a", 200)
+    assert disco.try_reserve("b", 200)
+    # 1000 - 800 reservados - 100 de margen no alcanzan para 2 x 100
+    assert not disco.try_reserve("c", 100)
+    assert disco.try_reserve("a", 200)
+    estado = disco.status()
+    assert estado["reservado_bytes"] == 800
+    assert estado["disponible_bytes"] == 100
+    assert estado["reservas_activas"] == 2
+
+
+def test_lo_escrito_se_descuenta_de_la_reserva(disco):
+    assert disco.try_reserve("a", 200)
+    disco.track("a", "job_a")
+    escribir(disco.path, "job_a.f137.mp4.part", 300)
+    escribir(disco.path, "otro.mp4", 50)
+
+    # El volumen ya descuenta los 300 bytes: de la reserva solo quedan 100 pendientes
+    assert disco._escritos() == {"a": 300}
+    assert disco.reserved_bytes() == 100
+    assert disco.status()["disponible_bytes"] == 1000 - 350 - 100 - 100
+    assert disco.try_reserve("b", 200)
+
+    disco.track("c", "job_c")
+    assert "c" not in disco.tracked
+
+    asyncio.run(disco.release("a"))
+    assert "a" not in disco.tracked and "a" not in disco.reservations
+
+
+def test_reserve_espera_hasta_que_se_libera(disco):
+    async def escenario():
+        assert disco.try_reserve("a", 400)
+        espera = asyncio.create_task(disco.reserve("b", 200, timeout=5))
+        await asyncio.sleep(0.05)
+        assert disco.waiting == 1 and not espera.done()
+
+        await disco.release("a")
+        assert await asyncio.wait_for(espera, 1)
+        assert disco.reservations == {"b": 400}
+
+        # release_nowait también despierta a los que esperan
+        espera = asyncio.create_task(disco.reserve("c", 300, timeout=5))
+        await asyncio.sleep(0.05)
+        disco.release_nowait("b")
+        assert await asyncio.wait_for(espera, 1)
+
+        assert not await disco.reserve("d", 300, timeout=0.05)
+        assert not await disco.reserve("grande", 1000)
+        return disco.rejected
+
+    assert asyncio.run(escenario()) == 2
+    assert disco.waiting == 0
+
+
+def test_trabajo_aparcado_vuelve_a_la_cola(disco, tmp_cwd, monkeypatch):
+    monkeypatch.setattr(app, "disk_manager", disco)
+    sistema = app.DownloadQueueSystem(max_workers=1)
+    task_data = ("j1", 7, "https://youtu.be/x", "yt_video", 7, 1)
+
+    async def escenario():
+        assert disco.try_reserve("otro", 400)
+        token = app.CancellationToken("j1", 7)
+        tarea = sistema._aparcar(1, 1, task_data, token, 200)
+        await asyncio.sleep(0.05)
+        assert sistema.running_jobs["j1"] is tarea
+        assert sistema.priority_queue.rank("j1") is None
+
+        await disco.release("otro")
+        await asyncio.wait_for(tarea, 1)
+        # Con la reserva hecha el trabajo vuelve a la cola y deja de ser la tarea en curso
+        assert sistema.disk_ready["j1"] == 200
+        assert "j1" not in sistema.running_jobs
+        assert sistema.priority_queue.rank("j1") == 0
+        assert disco.reservations == {"j1": 400}
+
+        # Si se cancela mientras espera, la reserva no queda retenida
+        sistema.priority_queue.remove("j1")
+        sistema._liberar_preparado("j1")
+        await asyncio.sleep(0)
+        assert disco.try_reserve("otro", 400)
+        token = app.CancellationToken("j2", 8)
+        tarea = sistema._aparcar(1, 2, ("j2", 8, "https://youtu.be/y", "yt_video", 8, 2), token, 200)
+        await asyncio.sleep(0.05)
+        token.cancel()
+        tarea.cancel()
+        await asyncio.gather(tarea, return_exceptions=True)
+        assert "j2" not in disco.reservations
+        assert "j2" not in sistema.running_jobs
+
+    asyncio.run(escenario())
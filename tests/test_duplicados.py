@@ -0,0 +1,112 @@
+"""Toques repetidos en los botones de formato: un solo trabajo por botón y reintento tras un rechazo"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+from telegram.ext import ExtBot
+
+import app
+from fake_bot_api import FakeBotAPI, TOKEN
+
+USUARIO = 7
+
+
+@pytest.fixture
+def tocar(tmp_cwd, monkeypatch):
+    """Devuelve ejecutar(escenario(pulsar)); pulsar(data) pasa un toque por callback_handler"""
+    app.registrar_usuario(USUARIO, "u7")
+    monkeypatch.setattr(app, "download_queue_system", app.DownloadQueueSystem(max_workers=1))
+    api = FakeBotAPI()
+    toques = [0]
+
+    def ejecutar(escenario):
+        async def correr():
+            await api.start()
+            bot = ExtBot(TOKEN, base_url=f"{api.url}/bot")
+            await bot.initialize()
+            contexto = SimpleNamespace(bot=bot)
+
+            async def pulsar(data):
+                toques[0] += 1
+                update = Update.de_json({
+                    "update_id": toques[0],
+                    "callback_query": {
+                        "id": str(toques[0]), "chat_instance": "c", "data": data,
+                        "from": {"id": USUARIO, "is_bot": False, "first_name": "u"},
+                        "message": {"message_id": 50, "date": int(time.time()),
+                                    "chat": {"id": USUARIO, "type": "private"}}
+                    }
+                }, bot)
+                await app.callback_handler(update, contexto)
+
+            try:
+                return await escenario(pulsar)
+            finally:
+                await bot.shutdown()
+                await api.stop()
+        return asyncio.run(correr())
+
+    return ejecutar
+
+
+def nuevo_trabajo(job_id, url):
+    app.download_jobs[job_id] = {"url": url, "chat_id": USUARIO, "message_id": 50, "timestamp": time.time()}
+
+
+def en_cola():
+    return [entrada[2][0] for _, entrada in app.download_queue_system.priority_queue.jobs()]
+
+
+def test_doble_toque_encola_una_vez(tocar):
+    nuevo_trabajo("j1", "https://www.tiktok.com/@a/video/1")
+
+    async def escenario(pulsar):
+        await pulsar("tt_video|j1")
+        await pulsar("tt_video|j1")
+
+    tocar(escenario)
+
+    assert en_cola() == ["j1"]
+    assert app.download_jobs["j1"]["admitted"]
+    assert app.download_queue_system.duplicates["job_id"] == 1
+
+
+def test_rechazo_por_premium_y_reintento(tocar):
+    nuevo_trabajo("j2", "https://youtu.be/abc")
+
+    async def escenario(pulsar):
+        await pulsar("yt_video|j2")
+        rechazado = (en_cola(), app.download_jobs["j2"].get("admitted"))
+        with app.conectar_db() as conn:
+            conn.execute("UPDATE usuarios SET premium = 1 WHERE id = ?", (USUARIO,))
+        await pulsar("yt_video|j2")
+        return rechazado
+
+    rechazado = tocar(escenario)
+
+    assert rechazado == ([], None)
+    assert en_cola() == ["j2"]
+    assert app.download_queue_system.duplicates["job_id"] == 0
+
+
+def test_rechazo_por_limite_diario_y_reintento(tocar):
+    nuevo_trabajo("j3", "https://www.tiktok.com/@a/video/3")
+    with app.conectar_db() as conn:
+        conn.execute(
+            "UPDATE usuarios SET descargas = ?, ultimo_reset = ? WHERE id = ?",
+            (app.LIMIT_POR_DIA, int(time.time()), USUARIO)
+        )
+
+    async def escenario(pulsar):
+        await pulsar("tt_audio|j3")
+        rechazado = en_cola()
+        # Al día siguiente el contador se reinicia y el mismo botón vuelve a servir
+        with app.conectar_db() as conn:
+            conn.execute("UPDATE usuarios SET ultimo_reset = 0 WHERE id = ?", (USUARIO,))
+        await pulsar("tt_audio|j3")
+        return rechazado
+
+    assert tocar(escenario) == []
+    assert en_cola() == ["j3"]
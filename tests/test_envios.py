@@ -0,0 +1,102 @@
+"""Planificador de envíos a Telegram contra la Bot API falsa: caudal, fusión de ediciones y prioridad"""
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+import app
+from fake_bot_api import FakeBotAPI, TOKEN
+
+
+def con_bot(api, limiter, escenario):
+    """Ejecuta escenario(bot) con un bot apuntando a la API falsa"""
+    async def correr():
+        await api.start()
+        bot = ExtBot(TOKEN, base_url=f"{api.url}/bot", rate_limiter=limiter)
+        await bot.initialize()
+        try:
+            return await escenario(bot)
+        finally:
+            await bot.shutdown()
+            await api.stop()
+    return asyncio.run(correr())
+
+
+async def enviar_a_muchos(bot, chats, por_chat):
+    inicio = time.monotonic()
+    resultados = await asyncio.gather(*[
+        bot.send_message(chat_id=chat, text=f"aviso {i}")
+        for i in range(por_chat) for chat in range(1, chats + 1)
+    ], return_exceptions=True)
+    return time.monotonic() - inicio, resultados
+
+
+def test_caudal_sin_flood_limit():
+    # Telegram corta por encima de ~30 mensajes/s globales y unos pocos por chat
+    api = FakeBotAPI(limite_global=30, limite_chat=4)
+    limiter = app.OutboundRateLimiter(global_rate=25)
+
+    duracion, resultados = con_bot(api, limiter, lambda bot: enviar_a_muchos(bot, 40, 2))
+
+    assert not [r for r in resultados if isinstance(r, Exception)]
+    assert api.rechazadas == 0
+    assert len(api.metodos("sendMessage")) == 80
+    # 80 mensajes a 25/s con una ráfaga inicial pequeña
+    assert 80 / duracion <= 30
+    assert duracion < 80 / 25 + 1
+
+
+def test_sin_planificador_salta_el_flood_limit():
+    api = FakeBotAPI(limite_global=30, limite_chat=4)
+
+    _, resultados = con_bot(api, None, lambda bot: enviar_a_muchos(bot, 40, 2))
+
+    assert api.rechazadas > 0
+    assert any(isinstance(r, RetryAfter) for r in resultados)
+
+
+def test_ediciones_de_progreso_se_fusionan():
+    api = FakeBotAPI()
+    limiter = app.OutboundRateLimiter()
+
+    async def escenario(bot):
+        opciones = {"prioridad": app.PRIORIDAD_PROGRESO, "fusionar": True}
+        ediciones = [
+            asyncio.create_task(bot.edit_message_text(
+                chat_id=5, message_id=10, text=f"⬇️ {p}%", rate_limit_args=opciones
+            ))
+            for p in range(0, 101, 5)
+        ]
+        await asyncio.gather(*ediciones)
+
+    con_bot(api, limiter, escenario)
+
+    enviadas = api.metodos("editMessageText")
+    assert len(enviadas) < 5
+    assert enviadas[-1]["texto"] == "⬇️ 100%"
+    assert limiter.coalesced >= 21 - len(enviadas)
+
+
+def test_respuesta_al_usuario_antes_que_el_progreso():
+    api = FakeBotAPI()
+    limiter = app.OutboundRateLimiter()
+
+    async def escenario(bot):
+        opciones = {"prioridad": app.PRIORIDAD_PROGRESO, "fusionar": True}
+        # Progreso de varios trabajos del mismo chat: agota la ráfaga de la cubeta del chat
+        progreso = [
+            asyncio.create_task(bot.edit_message_text(
+                chat_id=5, message_id=mensaje, text="⬇️ 50%", rate_limit_args=opciones
+            ))
+            for mensaje in range(10, 16)
+        ]
+        await asyncio.sleep(0.05)
+        await bot.send_message(chat_id=5, text="menú")
+        await asyncio.gather(*progreso)
+
+    con_bot(api, limiter, escenario)
+
+    orden = [llamada["metodo"] for llamada in api.llamadas if llamada["chat_id"] == 5]
+    # Solo salen antes las ediciones que cabían en la ráfaga inicial del chat
+    assert orden.index("sendMessage") == app.TG_CHAT_BURST
@@ -0,0 +1,150 @@
+"""Modo proceso frente a modo hilo: caudal y latencia del bot, y cancelación/expiración del proceso"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+from descarga_falsa import DescargaHilo, descarga_colgada, descarga_cpu
+
+
+class Progreso:
+    def __init__(self):
+        self.valores = []
+
+    async def update_download_progress(self, progress):
+        self.valores.append(progress)
+
+
+def medir(modo, trabajos=6, concurrencia=3, segundos=0.3):
+    """Lanza las descargas simuladas en el modo dado mientras se mide el retraso del loop.
+
+    Devuelve (resultados, trabajos por minuto, snapshot del LoopLagMonitor)"""
+    runner = app.ProcessDownloadRunner(target=descarga_cpu)
+    monitor = app.LoopLagMonitor(interval=0.005)
+
+    async def correr():
+        hilos = ThreadPoolExecutor(max_workers=concurrencia)
+        limite = asyncio.Semaphore(concurrencia)
+        lag = asyncio.create_task(monitor.run())
+
+        async def una(i):
+            async with limite:
+                if modo == "hilo":
+                    return await asyncio.wrap_future(hilos.submit(DescargaHilo(segundos).download))
+                downloader = app.SafeParallelDownloader(f"stub://cpu/{segundos}", 7, "tt_video", Progreso())
+                downloader.base_filename = f"download_7_bench{i}"
+                return await runner.run(downloader)
+
+        inicio = time.monotonic()
+        try:
+            resultados = await asyncio.gather(*[una(i) for i in range(trabajos)])
+        finally:
+            lag.cancel()
+            hilos.shutdown()
+        return resultados, trabajos * 60 / (time.monotonic() - inicio)
+
+    resultados, por_minuto = asyncio.run(correr())
+    return resultados, por_minuto, monitor.snapshot()
+
+
+def test_benchmark_hilo_frente_a_proceso(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    numeros = {}
+    for modo in ("hilo", "proceso"):
+        resultados, por_minuto, lag = medir(modo)
+        assert resultados == [True] * len(resultados), modo
+        numeros[modo] = (por_minuto, lag)
+
+    print()
+    for modo, (por_minuto, lag) in numeros.items():
+        print(f"{modo:8} {por_minuto:6.1f} descargas/min  lag del loop p95 {lag['lag_p95_ms']}ms máx {lag['lag_max_ms']}ms")
+    # Los hilos compiten por el GIL con el loop del bot; los procesos no
+    assert numeros["proceso"][1]["lag_p95_ms"] < numeros["hilo"][1]["lag_p95_ms"]
+
+
+def vivo(pid):
+    """El proceso existe y no es un zombi pendiente de recoger"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+def arrancar_colgada(runner):
+    """Lanza una descarga que no termina; devuelve (tarea, downloader, pid del nieto)"""
+    downloader = app.SafeParallelDownloader("stub://colgada", 7, "tt_video", Progreso())
+    downloader.base_filename = "download_7_colgada"
+    tarea = asyncio.create_task(runner.run(downloader))
+    return tarea, downloader
+
+
+async def esperar_nieto():
+    limite = time.monotonic() + 20
+    while time.monotonic() < limite:
+        if os.path.exists("download_7_colgada.mp4.part") and os.path.exists("nieto_download_7_colgada.pid"):
+            with open("nieto_download_7_colgada.pid") as f:
+                contenido = f.read()
+            if contenido:
+                return int(contenido)
+        await asyncio.sleep(0.02)
+    raise AssertionError("el proceso de descarga no arrancó")
+
+
+def parciales():
+    return [archivo for archivo in os.listdir(".") if archivo.startswith("download_7_colgada")]
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="requiere grupos de procesos")
+def test_cancelar_mata_el_grupo_y_borra_parciales(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runner = app.ProcessDownloadRunner(target=descarga_colgada)
+
+    async def escenario():
+        tarea, _ = arrancar_colgada(runner)
+        nieto = await esperar_nieto()
+        assert vivo(nieto) and parciales()
+        tarea.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarea
+        return nieto
+
+    nieto = asyncio.run(escenario())
+
+    limite = time.monotonic() + 2
+    while vivo(nieto) and time.monotonic() < limite:
+        time.sleep(0.02)
+    assert not vivo(nieto)
+    assert parciales() == []
+    assert runner.killed == 1 and runner.active == {}
+
+
+@pytest.mark.skipif(not hasattr(os, "killpg"), reason="requiere grupos de procesos")
+def test_expirar_mata_el_grupo_y_borra_parciales(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runner = app.ProcessDownloadRunner(timeout=3, target=descarga_colgada)
+
+    async def escenario():
+        tarea, downloader = arrancar_colgada(runner)
+        nieto = await esperar_nieto()
+        return await tarea, nieto, downloader
+
+    ok, nieto, downloader = asyncio.run(escenario())
+
+    assert ok is False
+    assert runner.timeouts == 1 and runner.killed == 1
+    assert downloader.progress_tracker.valores == [5]
+    limite = time.monotonic() + 2
+    while vivo(nieto) and time.monotonic() < limite:
+        time.sleep(0.02)
+    assert not vivo(nieto)
+    assert parciales() == []
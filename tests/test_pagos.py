@@ -0,0 +1,230 @@
+"""Verificación de pagos con el cliente asíncrono de BscScan contra un explorador simulado"""
+import asyncio
+import time
+
+import pytest
+
+import app
+from fake_explorer import FakeExplorer, tx_hash
+
+
+@pytest.fixture
+def explorador(tmp_cwd, monkeypatch):
+    """Explorador simulado y usuarios 7 y 8; devuelve ejecutar(escenario(explorador))"""
+    app.registrar_usuario(7, "u7")
+    app.registrar_usuario(8, "u8")
+    monkeypatch.setattr(app, "CHAIN_RETRY_BASE", 0.01)
+    explorer = FakeExplorer()
+
+    def ejecutar(escenario):
+        async def correr():
+            await explorer.start()
+            monkeypatch.setattr(app, "bsc_client", app.BscScanClient(api_url=f"{explorer.url}/api"))
+            monkeypatch.setattr(app, "BNB_PRICE_URL", f"{explorer.url}/price")
+            try:
+                return await escenario(explorer)
+            finally:
+                if app.bsc_client.session is not None:
+                    await app.bsc_client.session.close()
+                await explorer.stop()
+        return asyncio.run(correr())
+
+    return ejecutar
+
+
+def test_pago_usdt_con_llamadas_en_paralelo(explorador):
+    async def escenario(explorer):
+        explorer.latencia = 0.2
+        tx = explorer.pago_usdt(1, 5)
+        inicio = time.monotonic()
+        resultado = await app.validar_pago_con_tx(7, tx)
+        return resultado, time.monotonic() - inicio, explorer.pico
+
+    (ok, clave, _), duracion, pico = explorador(escenario)
+
+    assert ok and clave == "payment_confirmed"
+    assert app.es_premium(7)
+    # Transacción, recibo y precio a la vez: una latencia en lugar de tres
+    assert pico == 3
+    assert duracion < 0.2 * 2
+
+
+def test_pago_no_se_usa_dos_veces(explorador):
+    async def escenario(explorer):
+        tx = explorer.pago_usdt(1, 5)
+        primero = await app.validar_pago_con_tx(7, tx)
+        segundo = await app.validar_pago_con_tx(8, tx)
+        return primero, segundo
+
+    primero, segundo = explorador(escenario)
+
+    assert primero[0]
+    assert segundo[:2] == (False, "tx_already_used")
+    assert not app.es_premium(8)
+
+
+@pytest.mark.parametrize("preparar, valido, clave", [
+    (lambda e: e.pago_bnb(2, 0.02), True, "payment_confirmed"),
+    (lambda e: e.pago_bnb(3, 0.001), False, "tx_no_valid_payment"),
+    (lambda e: e.pago_bnb(4, 1, destino="0x" + "c" * 40), False, "tx_wrong_address"),
+    (lambda e: e.pago_bnb(5, 1, estado="0x0"), False, "tx_not_found"),
+    (lambda e: "0x" + "f" * 64, False, "tx_not_found"),
+])
+def test_resultados_de_la_verificacion(explorador, preparar, valido, clave):
+    async def escenario(explorer):
+        return await app.validar_pago_con_tx(7, preparar(explorer))
+
+    assert explorador(escenario)[:2] == (valido, clave)
+
+
+def test_reintenta_el_limite_de_peticiones(explorador):
+    async def escenario(explorer):
+        tx = explorer.pago_usdt(1, 5)
+        explorer.limitar = 3
+        resultado = await app.validar_pago_con_tx(7, tx)
+        return resultado, app.bsc_client.status()
+
+    (ok, _, _), estado = explorador(escenario)
+
+    assert ok
+    assert estado["limitadas"] == 3
+    assert estado["reintentos"] == 3
+
+
+def test_limite_persistente_da_error_sin_activar(explorador):
+    async def escenario(explorer):
+        tx = explorer.pago_usdt(1, 5)
+        explorer.limitar = 1000
+        return await app.validar_pago_con_tx(7, tx)
+
+    assert explorador(escenario) == (False, "tx_explorer_error", ())
+    assert not app.es_premium(7)
+
+
+def test_no_bloquea_el_event_loop(explorador):
+    async def escenario(explorer):
+        explorer.latencia = 0.3
+        tx = explorer.pago_usdt(1, 5)
+        huecos = []
+
+        async def latido():
+            anterior = time.monotonic()
+            while True:
+                await asyncio.sleep(0.01)
+                ahora = time.monotonic()
+                huecos.append(ahora - anterior)
+                anterior = ahora
+
+        tarea = asyncio.create_task(latido())
+        await app.validar_pago_con_tx(7, tx)
+        tarea.cancel()
+        return huecos
+
+    huecos = explorador(escenario)
+
+    # Con requests.get el loop quedaba parado durante cada llamada al explorador
+    assert len(huecos) > 10
+    assert max(huecos) < 0.1
+
+
+def test_guarda_la_cantidad_en_bnb(explorador):
+    async def escenario(explorer):
+        tx = explorer.pago_bnb(2, 0.02)
+        return tx, await app.validar_pago_con_tx(7, tx)
+
+    tx, (ok, _, _) = explorador(escenario)
+
+    assert ok
+    pago = app.buscar_pago(tx)
+    assert pago["token"] == "BNB"
+    assert pago["amount"] == pytest.approx(0.02)
+    assert pago["amount_usdt"] == pytest.approx(12.0)
+
+
+def test_busqueda_de_tx_usada_con_indice(tmp_cwd):
+    conn = app.conectar_db()
+    try:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM usuarios WHERE lower(ultima_tx) = ?", ("0x1",)
+        ).fetchall()
+    finally:
+        conn.close()
+    assert any("idx_usuarios_ultima_tx_lower" in fila[-1] for fila in plan)
+
+
+def test_pagina_llena_de_envios_ajenos_se_relee(explorador, monkeypatch):
+    monkeypatch.setattr(app, "PAYMENT_PAGE_SIZE", 3)
+    otra = "0x" + "d" * 40
+
+    def nativa(n, bloque, desde, hacia):
+        return {"hash": tx_hash(n), "blockNumber": str(bloque), "timeStamp": "0",
+                "from": desde, "to": hacia, "value": str(2 * 10 ** 16), "isError": "0"}
+
+    async def escenario(explorer):
+        # La página se llena con salidas de nuestra dirección y el pago entrante queda fuera
+        explorer.txlist = [
+            nativa(10, 10, app.USDT_ADDRESS, otra),
+            nativa(11, 11, app.USDT_ADDRESS, otra),
+            nativa(12, 12, app.USDT_ADDRESS, otra),
+            nativa(13, 12, otra, app.USDT_ADDRESS),
+        ]
+        indexer = app.PaymentIndexer()
+        primero = await indexer.sync()
+        cursor = indexer.next_block
+        segundo = await indexer.sync()
+        return primero, cursor, segundo
+
+    primero, cursor, segundo = explorador(escenario)
+
+    assert primero == []
+    assert cursor == 12
+    assert [pago["tx_hash"] for pago in segundo] == [tx_hash(13)]
+    assert segundo[0]["amount"] == pytest.approx(0.02)
+
+
+def test_confirmacion_en_el_idioma_del_usuario(explorador):
+    with app.conectar_db() as conn:
+        conn.execute("UPDATE usuarios SET language = 'en' WHERE id = 7")
+
+    async def escenario(explorer):
+        return await app.validar_pago_con_tx(7, explorer.pago_usdt(1, 5))
+
+    ok, clave, args = explorador(escenario)
+    mensaje = app.catalogo.texto(app.get_user_language(7), clave, *args)
+
+    assert ok
+    assert "Payment confirmed" in mensaje and "5.00 USDT" in mensaje
+    assert "Pago confirmado" not in mensaje
+
+
+def pago_indexado_insuficiente(explorer):
+    with app.conectar_db() as conn:
+        conn.execute(
+            "INSERT INTO payments (tx_hash, token, amount, amount_usdt, timestamp) VALUES (?, 'USDT', 1, 1, 0)",
+            (tx_hash(9),)
+        )
+    return tx_hash(9)
+
+
+def pago_sin_precio(explorer):
+    explorer.precio_bnb = None
+    return explorer.pago_bnb(2, 0.02)
+
+
+@pytest.mark.parametrize("preparar, clave, texto", [
+    (pago_indexado_insuficiente, "tx_no_valid_payment", f"No valid payment of {app.MIN_USDT} USDT"),
+    (lambda e: e.pago_bnb(3, 0.001), "tx_no_valid_payment", f"No valid payment of {app.MIN_USDT} USDT"),
+    (pago_sin_precio, "tx_price_error", "Error getting the BNB price"),
+    (lambda e: e.pago_bnb(4, 1, destino="0x" + "c" * 40), "tx_wrong_address", "not sent to the correct address"),
+])
+def test_errores_de_importe_precio_y_destino_en_ingles(explorador, preparar, clave, texto):
+    async def escenario(explorer):
+        return await app.validar_pago_con_tx(7, preparar(explorer))
+
+    ok, recibida, args = explorador(escenario)
+    mensaje = app.catalogo.texto("en", recibida, *args)
+
+    assert not ok and recibida == clave
+    assert texto in mensaje
+    assert mensaje != app.catalogo.texto("es", recibida, *args)
+    assert not app.es_premium(7)
@@ -0,0 +1,40 @@
+"""Progreso de descarga en modo hilo: el hook de yt-dlp no espera a las ediciones de Telegram"""
+import asyncio
+import time
+
+import app
+
+
+class TrackerLento:
+    def __init__(self):
+        self.progreso = []
+
+    async def update_download_progress(self, progress):
+        await asyncio.sleep(0.3)
+        self.progreso.append(progress)
+
+
+def test_hook_no_bloquea_el_hilo_de_descarga():
+    tracker = TrackerLento()
+
+    def descargar(downloader):
+        inicio = time.perf_counter()
+        for descargado in range(5, 101, 5):
+            downloader._progress_hook({"status": "downloading", "total_bytes": 100, "downloaded_bytes": descargado})
+        downloader._progress_hook({"status": "finished"})
+        return time.perf_counter() - inicio
+
+    async def correr():
+        downloader = app.SafeParallelDownloader("url", 1, "tt_video", tracker)
+        duracion = await asyncio.get_running_loop().run_in_executor(None, descargar, downloader)
+        await asyncio.sleep(0.7)
+        return duracion
+
+    duracion = asyncio.run(correr())
+
+    # Antes cada porcentaje esperaba su edición (20 x 0.3s) dentro del hilo de la descarga
+    assert duracion < 0.2
+    # Con una edición en curso los porcentajes intermedios se saltan; el final siempre se envía
+    assert tracker.progreso[0] == 5
+    assert tracker.progreso[-1] == 100
+    assert len(tracker.progreso) < 5
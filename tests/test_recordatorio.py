@@ -0,0 +1,123 @@
+"""Recordatorio diario contra la Bot API falsa: ritmo de envío, reanudación tras una caída y bloqueos"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import ExtBot
+
+import app
+from fake_bot_api import FakeBotAPI, TOKEN
+
+
+@pytest.fixture
+def usuarios(tmp_cwd):
+    """Registra usuarios 1..n listos para recibir el recordatorio de hoy"""
+    def crear(n):
+        for uid in range(1, n + 1):
+            app.registrar_usuario(uid, f"u{uid}")
+        with app.conectar_db() as conn:
+            conn.execute("UPDATE usuarios SET last_daily_notification = 0")
+        return list(range(1, n + 1))
+    return crear
+
+
+def campana(api, difusion):
+    async def correr():
+        await api.start()
+        bot = ExtBot(TOKEN, base_url=f"{api.url}/bot", rate_limiter=app.OutboundRateLimiter(global_rate=1000))
+        await bot.initialize()
+        try:
+            await difusion.run_campaign(SimpleNamespace(bot=bot))
+        finally:
+            await bot.shutdown()
+            await api.stop()
+    asyncio.run(correr())
+
+
+def destinatarios(api):
+    return [llamada["chat_id"] for llamada in api.metodos("sendMessage")]
+
+
+def fila(campaign_id):
+    with app.conectar_db() as conn:
+        return dict(conn.execute("SELECT * FROM broadcast_campaigns WHERE campaign_id=?", (campaign_id,)).fetchone())
+
+
+def test_ritmo_por_lotes(usuarios):
+    ids = usuarios(25)
+    api = FakeBotAPI()
+    difusion = app.DailyBroadcast(batch_size=10, rate=10, concurrency=4)
+
+    campana(api, difusion)
+
+    assert sorted(destinatarios(api)) == ids
+    # Cabe una ráfaga de `rate` mensajes; el resto sale a `rate` por segundo
+    envios = [llamada["t"] for llamada in api.metodos("sendMessage")]
+    assert envios[-1] - envios[0] >= (25 - 10) / 10 - 0.1
+    registro = fila(difusion.campaign_id())
+    assert registro["state"] == "done"
+    assert registro["last_user_id"] == 25 and registro["enviados"] == 25
+
+
+def test_reanuda_tras_una_caida_sin_repetir_lotes_cerrados(usuarios, monkeypatch):
+    usuarios(12)
+    checkpoint = app.DailyBroadcast._checkpoint
+    cerrados = []
+
+    def caer_en_el_segundo(self, campaign, enviados, bloqueados, estado):
+        if cerrados:
+            raise RuntimeError("caída del proceso")
+        cerrados.append(list(enviados))
+        checkpoint(self, campaign, enviados, bloqueados, estado)
+
+    monkeypatch.setattr(app.DailyBroadcast, "_checkpoint", caer_en_el_segundo)
+    api = FakeBotAPI()
+    with pytest.raises(RuntimeError):
+        campana(api, app.DailyBroadcast(batch_size=5, rate=1000))
+    primer_lote = cerrados[0]
+    assert primer_lote == [1, 2, 3, 4, 5]
+    assert fila(app.DailyBroadcast.campaign_id())["last_user_id"] == 5
+
+    # El proceso nuevo sigue desde el punto de control: el lote cerrado no se repite
+    monkeypatch.setattr(app.DailyBroadcast, "_checkpoint", checkpoint)
+    reanudada = FakeBotAPI()
+    difusion = app.DailyBroadcast(batch_size=5, rate=1000)
+    campana(reanudada, difusion)
+
+    assert sorted(destinatarios(reanudada)) == list(range(6, 13))
+    assert not set(destinatarios(reanudada)) & set(primer_lote)
+    registro = fila(difusion.campaign_id())
+    assert registro["state"] == "done" and registro["enviados"] == 12
+
+    # Terminada la campaña del día, otro arranque no envía nada
+    otra = FakeBotAPI()
+    campana(otra, app.DailyBroadcast(batch_size=5, rate=1000))
+    assert destinatarios(otra) == []
+
+
+def test_403_marca_bloqueado(usuarios):
+    usuarios(6)
+    api = FakeBotAPI()
+    api.bloqueados = {2, 5}
+    difusion = app.DailyBroadcast(batch_size=4, rate=1000)
+
+    campana(api, difusion)
+
+    assert sorted(destinatarios(api)) == [1, 3, 4, 6]
+    assert api.prohibidas == 2
+    with app.conectar_db() as conn:
+        bloqueados = [uid for (uid,) in conn.execute("SELECT id FROM usuarios WHERE bloqueado = 1 ORDER BY id")]
+    assert bloqueados == [2, 5]
+    registro = fila(difusion.campaign_id())
+    assert (registro["enviados"], registro["bloqueados"], registro["fallidos"]) == (4, 2, 0)
+
+    # Al día siguiente ya no se les escribe; si vuelven a hablar con el bot, sí
+    with app.conectar_db() as conn:
+        conn.execute("UPDATE usuarios SET last_daily_notification = 0")
+        conn.execute("DELETE FROM broadcast_campaigns")
+    app.registrar_usuario(5, "u5")
+    with app.conectar_db() as conn:
+        conn.execute("UPDATE usuarios SET last_daily_notification = 0 WHERE id = 5")
+    manana = FakeBotAPI()
+    campana(manana, app.DailyBroadcast(batch_size=4, rate=1000))
+    assert sorted(destinatarios(manana)) == [1, 3, 4, 5, 6]
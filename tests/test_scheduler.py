@@ -0,0 +1,159 @@
+"""Planificador justo: índice de rangos y posición real de despacho"""
+import asyncio
+import random
+import threading
+
+import app
+
+
+def test_rank_index_frente_a_lista_ordenada():
+    rnd = random.Random(7)
+    indice = app.RankIndex()
+    referencia = []
+    for _ in range(5000):
+        if referencia and rnd.random() < 0.4:
+            clave = rnd.choice(referencia)
+            assert indice.remove(clave)
+            referencia.remove(clave)
+        else:
+            clave = (rnd.randint(0, 300), rnd.random())
+            indice.insert(clave)
+            referencia.append(clave)
+        referencia.sort()
+        assert len(indice) == len(referencia)
+        assert indice.first() == (referencia[0] if referencia else None)
+        if referencia:
+            muestra = rnd.choice(referencia)
+            assert indice.rank(muestra) == referencia.index(muestra)
+    assert list(indice) == referencia
+    assert not indice.remove((999, 0))
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+def orden_de_despacho(planificador, ahora):
+    """Orden en que el _pick original (recorrido lineal) sacaría los trabajos elegibles"""
+    pendientes = {
+        clave: entrada for clave, entrada in planificador.entries.items()
+        if entrada[2][1] not in planificador.busy_users
+    }
+    orden = []
+    while pendientes:
+        claves = sorted(pendientes)
+        elegido = claves[0]
+        mas_antiguo = min(claves, key=lambda clave: pendientes[clave][3])
+        if mas_antiguo != elegido and ahora - pendientes[mas_antiguo][3] >= planificador.aging_seconds:
+            elegido = mas_antiguo
+        orden.append(pendientes.pop(elegido)[2][0])
+    return orden
+
+
+def test_rango_es_la_posicion_de_despacho(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(app.time, "time", reloj)
+    rnd = random.Random(3)
+    planificador = app.FairScheduler(aging_seconds=60)
+
+    async def simular():
+        vivos = []
+        for paso in range(3000):
+            reloj.ahora += rnd.random() * 2
+            accion = rnd.random()
+            if accion < 0.5 or not vivos:
+                job_id = f"j{paso}"
+                await planificador.put(rnd.choice([0, 1]), paso, (job_id, rnd.randint(1, 25), "u", "yt_video", 0, 0))
+                vivos.append(job_id)
+            elif accion < 0.7:
+                esperado = orden_de_despacho(planificador, reloj.ahora)
+                if not esperado:
+                    continue
+                _, _, task_data = await planificador.get()
+                assert task_data[0] == esperado[0]
+                vivos.remove(task_data[0])
+            elif accion < 0.85 and planificador.busy_users:
+                await planificador.release_user(rnd.choice(sorted(planificador.busy_users)))
+            else:
+                job_id = rnd.choice(vivos)
+                assert planificador.remove(job_id)
+                vivos.remove(job_id)
+
+            orden = orden_de_despacho(planificador, reloj.ahora)
+            for posicion, job_id in enumerate(orden):
+                assert planificador.rank(job_id) == posicion
+            rangos = {entrada[2][0]: rango for rango, entrada in planificador.jobs()}
+            assert len(rangos) == planificador.qsize()
+            assert all(rangos[job_id] == posicion for posicion, job_id in enumerate(orden))
+
+    asyncio.run(simular())
+    assert planificador.aged > 0
+
+
+def test_leer_no_envejece(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(app.time, "time", reloj)
+    planificador = app.FairScheduler(aging_seconds=60)
+
+    async def encolar():
+        await planificador.put(1, 1, ("a", 1, "u", "yt_video", 0, 0))
+        await planificador.put(0, 2, ("b", 2, "u", "yt_video", 0, 0))
+
+    asyncio.run(encolar())
+    rangos = {job_id: planificador.rank(job_id) for job_id in ("a", "b")}
+    reloj.ahora += 120
+    assert {job_id: planificador.rank(job_id) for job_id in ("a", "b")} == rangos
+    planificador.jobs()
+    planificador.snapshot()
+    assert len(planificador.fresh) == 2 and len(planificador.aged_by_age) == 0
+
+
+def test_lecturas_desde_otro_hilo():
+    """La API de Flask lee rank/jobs/snapshot mientras el loop encola y despacha"""
+    planificador = app.FairScheduler(aging_seconds=0.001)
+    parar = threading.Event()
+    errores = []
+
+    def api():
+        while not parar.is_set():
+            try:
+                trabajos = planificador.jobs()
+                for _, entrada in trabajos[:20]:
+                    planificador.rank(entrada[2][0])
+                planificador.snapshot()
+            except Exception as e:
+                errores.append(e)
+                return
+
+    async def simular():
+        rnd = random.Random(5)
+        vivos = []
+        for paso in range(4000):
+            if rnd.random() < 0.55 or not vivos:
+                job_id = f"j{paso}"
+                await planificador.put(rnd.choice([0, 1]), paso, (job_id, rnd.randint(1, 40), "u", "yt_video", 0, 0))
+                vivos.append(job_id)
+            elif rnd.random() < 0.5 and planificador.index.first() is not None:
+                _, _, task_data = await planificador.get()
+                vivos.remove(task_data[0])
+                await planificador.release_user(task_data[1])
+            else:
+                job_id = vivos.pop(rnd.randrange(len(vivos)))
+                assert planificador.remove(job_id)
+            if paso % 50 == 0:
+                await asyncio.sleep(0)
+
+    hilo = threading.Thread(target=api)
+    hilo.start()
+    try:
+        asyncio.run(simular())
+    finally:
+        parar.set()
+        hilo.join()
+    assert not errores
+    assert len(planificador.index) == planificador.qsize()
+    assert list(planificador.index) == sorted(planificador.entries)
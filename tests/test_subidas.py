@@ -0,0 +1,122 @@
+"""Subidas a Telegram contra la Bot API falsa: progreso real, latencia y servidor propio"""
+import asyncio
+import os
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+import app
+from fake_bot_api import FakeBotAPI
+
+MB = 1024 * 1024
+
+
+class TrackerSubida:
+    def __init__(self):
+        self.t = app.catalogo.t("es")
+        self.progreso = []
+
+    async def update_upload_progress(self, porcentaje):
+        self.progreso.append(porcentaje)
+
+
+def enviar(monkeypatch, ruta, tipo="tt_video", local=False, **opciones):
+    """Envía `ruta` con _send_file a una Bot API falsa; devuelve (api, tracker, segundos)"""
+    api = FakeBotAPI(**opciones)
+    tracker = TrackerSubida()
+    qs = app.DownloadQueueSystem(max_workers=1)
+    monkeypatch.setattr(app, "media_client", app.MediaClient())
+    monkeypatch.setattr(app, "outbound_limiter", app.OutboundRateLimiter())
+    monkeypatch.setattr(app, "TELEGRAM_LOCAL_MODE", local)
+    monkeypatch.setattr(app, "UPLOAD_LIMIT", app.LOCAL_API_UPLOAD_LIMIT if local else app.PUBLIC_API_UPLOAD_LIMIT)
+
+    async def correr():
+        await api.start()
+        monkeypatch.setattr(app, "TELEGRAM_API_URL", api.url)
+        try:
+            inicio = time.perf_counter()
+            await qs._send_file(42, str(ruta), tipo, tracker)
+            duracion = time.perf_counter() - inicio
+            await asyncio.sleep(0.05)
+            return duracion
+        finally:
+            if app.media_client.request is not None:
+                await app.media_client.request.shutdown()
+            await api.stop()
+
+    return api, tracker, asyncio.run(correr())
+
+
+def test_progreso_real_sin_espera_sintetica(tmp_path, monkeypatch):
+    ruta = tmp_path / "video.mp4"
+    ruta.write_bytes(os.urandom(3 * MB))
+
+    api, tracker, duracion = enviar(monkeypatch, ruta)
+
+    envios = api.metodos("sendVideo")
+    assert len(envios) == 1
+    assert envios[0]["bytes"] == 3 * MB
+    # El bucle sintético anterior sumaba ~3s antes de empezar a subir
+    assert duracion < 1.5
+    assert tracker.progreso == sorted(tracker.progreso)
+    assert tracker.progreso[-1] == 100
+    assert len(set(tracker.progreso)) >= 5
+
+
+def test_latencia_es_la_de_la_api(tmp_path, monkeypatch):
+    ruta = tmp_path / "audio.mp3"
+    ruta.write_bytes(os.urandom(256 * 1024))
+
+    api, _, duracion = enviar(monkeypatch, ruta, tipo="yt_audio", latencia=0.3)
+
+    assert len(api.metodos("sendAudio")) == 1
+    assert 0.3 <= duracion < 0.3 + 1.0
+
+
+def test_modo_local_envia_la_ruta(tmp_path, monkeypatch):
+    # Más grande que el límite de la API pública: solo cabe con el servidor propio
+    ruta = tmp_path / "grande.mp4"
+    with open(ruta, "wb") as archivo:
+        archivo.truncate(60 * MB)
+
+    api, _, duracion = enviar(monkeypatch, ruta, local=True)
+
+    envios = api.metodos("sendVideo")
+    assert len(envios) == 1
+    assert envios[0]["archivo"] == str(ruta.resolve())
+    assert envios[0]["bytes"] == 0
+    assert duracion < 1.0
+
+
+def test_api_publica_rechaza_antes_de_subir(tmp_path, monkeypatch):
+    ruta = tmp_path / "grande.mp4"
+    with open(ruta, "wb") as archivo:
+        archivo.truncate(60 * MB)
+
+    with pytest.raises(Exception, match="50MB"):
+        enviar(monkeypatch, ruta)
+
+
+def test_aplicacion_apunta_al_servidor_propio(monkeypatch):
+    monkeypatch.setattr(app, "TELEGRAM_API_URL", "http://127.0.0.1:8081")
+    monkeypatch.setattr(app, "TELEGRAM_LOCAL_MODE", True)
+
+    aplicacion = app.crear_aplicacion()
+
+    assert aplicacion.bot.base_url.startswith("http://127.0.0.1:8081/bot")
+    assert aplicacion.bot.local_mode
+
+
+def test_retry_after_se_reintenta_en_una_sola_capa(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "TG_RETRY_AFTER_MAX_RETRIES", 1)
+    ruta = tmp_path / "video.mp4"
+    ruta.write_bytes(os.urandom(64 * 1024))
+
+    # Límite por chat 0: Telegram responde siempre 429
+    with pytest.raises(RetryAfter):
+        enviar(monkeypatch, ruta, limite_chat=0)
+
+    # El planificador reintenta una vez; MediaClient no vuelve a empezar la subida
+    assert app.media_client.retries == 0
+    assert app.outbound_limiter.retry_after == 2
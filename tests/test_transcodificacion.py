@@ -0,0 +1,144 @@
+"""Etapas del pipeline sin ffmpeg: admisión y contrapresión, y CPU de cada proceso medida con wait4"""
+import asyncio
+import glob
+import os
+import sys
+
+import pytest
+
+import app
+
+# Hace de ffmpeg: el archivo de entrada dice qué hacer antes de escribir la salida
+FFMPEG_FALSO = """
+import os, sys, time
+entrada, salida = sys.argv[1:3]
+orden = open(entrada).read()
+open(salida + ".en_curso", "w").close()
+if orden.startswith("cpu:"):
+    fin = time.process_time() + float(orden[4:])
+    while time.process_time() < fin:
+        pass
+elif orden.startswith("dormir:"):
+    time.sleep(float(orden[7:]))
+elif orden == "puerta":
+    while not os.path.exists(os.path.join(os.path.dirname(salida), "abrir")):
+        time.sleep(0.01)
+elif orden == "fallar":
+    os.remove(salida + ".en_curso")
+    sys.exit("Unknown encoder 'libmp3lame'")
+os.remove(salida + ".en_curso")
+with open(salida, "w") as f:
+    f.write("mp3")
+"""
+
+
+@pytest.fixture
+def etapa(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.TranscodeStage, "_comando", staticmethod(
+        lambda input_path, output_path, args: [sys.executable, "-c", FFMPEG_FALSO, input_path, output_path]
+    ))
+    return app.TranscodeStage(workers=2)
+
+
+def entrada(directorio, nombre, orden):
+    ruta = directorio / f"{nombre}.m4a"
+    ruta.write_text(orden)
+    return str(ruta)
+
+
+def en_curso(directorio):
+    return len(glob.glob(str(directorio / "*.en_curso")))
+
+
+def test_admite_tantos_procesos_como_workers(etapa, tmp_path):
+    entradas = [entrada(tmp_path, f"pista{i}", "puerta") for i in range(5)]
+
+    async def correr():
+        await etapa.start()
+        try:
+            tareas = [asyncio.create_task(etapa.submit(ruta)) for ruta in entradas]
+            while en_curso(tmp_path) < 2:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.2)
+            # Dos procesos en marcha; el resto espera turno en la cola de la etapa
+            retenidos = (en_curso(tmp_path), etapa.qsize(), etapa.metrics.snapshot(etapa.qsize()))
+            (tmp_path / "abrir").touch()
+            return retenidos, await asyncio.wait_for(asyncio.gather(*tareas), 10)
+        finally:
+            await etapa.stop()
+
+    (procesos, cola, metricas), salidas = asyncio.run(correr())
+
+    assert procesos == 2 and cola == 3
+    assert metricas["activos"] == 2
+    assert salidas == [ruta[:-len(".m4a")] + ".mp3" for ruta in entradas]
+    assert all(os.path.exists(salida) for salida in salidas)
+    assert etapa.modes["transcode"]["trabajos"] == 5
+
+
+def test_cpu_de_cada_proceso_con_wait4(etapa, tmp_path):
+    ocupado = entrada(tmp_path, "ocupado", "cpu:0.4")
+    dormido = entrada(tmp_path, "dormido", "dormir:0.4")
+
+    async def correr():
+        await etapa.start()
+        try:
+            # A la vez: RUSAGE_CHILDREN sumaría los dos, wait4 separa lo de cada uno
+            await asyncio.gather(
+                etapa.encode(ocupado, str(tmp_path / "ocupado.mp3"), [], "transcode"),
+                etapa.encode(dormido, str(tmp_path / "dormido.mp3"), [], "ajustar")
+            )
+        finally:
+            await etapa.stop()
+
+    asyncio.run(correr())
+
+    if hasattr(os, "wait4"):
+        assert etapa.modes["transcode"]["segundos_cpu"] >= 0.35
+        assert etapa.modes["ajustar"]["segundos_cpu"] < 0.15
+    assert etapa.modes["ajustar"]["segundos_reloj"] >= 0.4
+    resumen = etapa.benchmark()
+    assert resumen["transcode"]["trabajos"] == 1 and resumen["transcode"]["cpu_medio"] >= 0.35
+
+
+def test_fallo_del_proceso_llega_al_trabajo(etapa, tmp_path):
+    ruta = entrada(tmp_path, "rota", "fallar")
+
+    async def correr():
+        await etapa.start()
+        try:
+            return await etapa.submit(ruta)
+        finally:
+            await etapa.stop()
+
+    with pytest.raises(Exception, match="libmp3lame"):
+        asyncio.run(correr())
+    assert etapa.metrics.snapshot(0)["fallidos"] == 1
+    assert etapa.modes["transcode"]["trabajos"] == 0
+
+
+def test_contrapresion_de_la_etapa():
+    fase = app.PipelineStage("subida", concurrency=1, max_queue=1)
+
+    async def correr():
+        await fase.admit("a")
+        await fase.admit("b")
+        # Etapa llena (uno en curso y uno en cola): la etapa anterior espera
+        tercero = asyncio.create_task(fase.admit("c"))
+        await asyncio.sleep(0.05)
+        bloqueado = not tercero.done()
+        async with fase.slot("a"):
+            en_curso = fase.snapshot()
+        # Al terminar "a" su sitio pasa al que esperaba
+        await asyncio.wait_for(tercero, 1)
+        fase.leave("b")
+        fase.leave("b")  # devolver el sitio dos veces no libera uno ajeno
+        return bloqueado, en_curso
+
+    bloqueado, en_curso = asyncio.run(correr())
+
+    assert bloqueado
+    assert en_curso["activos"] == 1 and en_curso["en_cola"] == 1
+    assert fase.backpressure_waits == 1
+    assert fase.admitted == {"c"}
+    assert fase.snapshot()["esperas_contrapresion"] == 1
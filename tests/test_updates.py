@@ -0,0 +1,109 @@
+"""Procesado concurrente de updates: orden por chat, tope global y latencia de los menús bajo carga"""
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, MessageHandler, filters
+
+import app
+from fake_bot_api import FakeBotAPI, TOKEN
+
+LENTO = 0.2  # procesar_descarga o validar_pago_con_tx de un usuario
+
+
+def inundar(procesador, mensajes=20, menus=30):
+    """Un usuario manda mensajes lentos seguidos y otros usuarios pulsan menús a la vez.
+
+    Devuelve (orden de los mensajes procesados, latencias de los menús, pico de handlers a la vez)"""
+    api = FakeBotAPI()
+    orden = []
+    latencias = []
+    llegadas = {}
+    activos = [0, 0]
+
+    async def lento(update, context):
+        activos[0] += 1
+        activos[1] = max(activos[1], activos[0])
+        await asyncio.sleep(LENTO)
+        activos[0] -= 1
+        orden.append(update.message.text)
+
+    async def menu(update, context):
+        latencias.append(time.monotonic() - llegadas[update.update_id])
+
+    async def correr():
+        await api.start()
+        builder = ApplicationBuilder().token(TOKEN).base_url(f"{api.url}/bot")
+        if procesador is not None:
+            builder = builder.concurrent_updates(procesador)
+        aplicacion = builder.build()
+        aplicacion.add_handler(MessageHandler(filters.TEXT, lento))
+        aplicacion.add_handler(CallbackQueryHandler(menu))
+        await aplicacion.initialize()
+        await aplicacion.start()
+        ahora = int(time.time())
+        update_id = 0
+        try:
+            for i in range(mensajes):
+                update_id += 1
+                llegadas[update_id] = time.monotonic()
+                await aplicacion.update_queue.put(Update.de_json({
+                    "update_id": update_id,
+                    "message": {"message_id": i, "date": ahora, "text": str(i),
+                                "chat": {"id": 5, "type": "private"},
+                                "from": {"id": 5, "is_bot": False, "first_name": "a"}}
+                }, aplicacion.bot))
+            for usuario in range(100, 100 + menus):
+                update_id += 1
+                llegadas[update_id] = time.monotonic()
+                await aplicacion.update_queue.put(Update.de_json({
+                    "update_id": update_id,
+                    "callback_query": {"id": str(update_id), "chat_instance": "c", "data": "menu_principal",
+                                       "from": {"id": usuario, "is_bot": False, "first_name": "b"},
+                                       "message": {"message_id": 1, "date": ahora,
+                                                   "chat": {"id": usuario, "type": "private"}}}
+                }, aplicacion.bot))
+            limite = time.monotonic() + mensajes * LENTO + 5
+            while (len(orden) < mensajes or len(latencias) < menus) and time.monotonic() < limite:
+                await asyncio.sleep(0.02)
+        finally:
+            await aplicacion.stop()
+            await aplicacion.shutdown()
+            await api.stop()
+
+    asyncio.run(correr())
+    return orden, latencias, activos[1]
+
+
+def p95(valores):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.95))]
+
+
+def test_menus_no_esperan_al_usuario_lento():
+    procesador = app.UserOrderedUpdateProcessor(concurrency=8)
+    orden, latencias, _ = inundar(procesador)
+
+    # Los mensajes del mismo chat se procesan uno tras otro y en orden de llegada
+    assert orden == [str(i) for i in range(20)]
+    assert len(latencias) == 30
+    assert p95(latencias) < LENTO
+    assert procesador.status()["latencias"]["menu"]["muestras"] == 30
+
+
+def test_secuencial_retrasa_los_menus():
+    # Referencia: procesado secuencial por defecto de python-telegram-bot
+    orden, latencias, _ = inundar(None)
+
+    assert orden == [str(i) for i in range(20)]
+    assert min(latencias) >= 20 * LENTO
+
+
+def test_tope_global_de_concurrencia(monkeypatch):
+    # Cada update cuenta como un chat distinto: solo el tope de 3 plazas las limita
+    procesador = app.UserOrderedUpdateProcessor(concurrency=3)
+    monkeypatch.setattr(app.UserOrderedUpdateProcessor, "clave", staticmethod(lambda update: update.update_id))
+    orden, _, pico = inundar(procesador, mensajes=12, menus=0)
+
+    assert sorted(orden, key=int) == [str(i) for i in range(12)]
+    assert pico == 3
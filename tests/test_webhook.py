@@ -0,0 +1,157 @@
+"""Modo webhook frente a polling con un generador de updates local: latencia update -> respuesta
+y rechazo de las peticiones al webhook sin el secreto"""
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+from telegram.ext import MessageHandler, filters
+
+import pytest
+
+import app
+from fake_bot_api import FakeBotAPI
+
+UPDATES = 60
+RITMO = 50  # updates por segundo
+LATENCIA = 0.04  # ida y vuelta con Telegram
+
+
+def mensaje(numero):
+    chat = {"id": 1000 + numero, "type": "private"}
+    return {"message_id": numero, "date": int(time.time()), "chat": chat,
+            "from": {"id": chat["id"], "is_bot": False, "first_name": "u"}, "text": str(numero)}
+
+
+async def responder(update, context):
+    await update.message.reply_text(f"ok {update.message.text}")
+
+
+@pytest.fixture
+def bot_local(monkeypatch):
+    """Devuelve ejecutar(escenario(api, aplicacion)) con la aplicación real apuntando a la Bot API falsa"""
+    monkeypatch.setattr(app, "outbound_limiter", app.OutboundRateLimiter(global_rate=1000, global_burst=1000))
+    monkeypatch.setattr(app, "update_processor", app.UserOrderedUpdateProcessor())
+    monkeypatch.setattr(app, "WEBHOOK_URL", "https://bot.example")
+
+    def ejecutar(escenario):
+        api = FakeBotAPI(latencia=LATENCIA)
+
+        async def correr():
+            await api.start()
+            monkeypatch.setattr(app, "TELEGRAM_API_URL", api.url)
+            aplicacion = app.crear_aplicacion()
+            aplicacion.add_handler(MessageHandler(filters.TEXT, responder))
+            await aplicacion.initialize()
+            await aplicacion.start()
+            try:
+                return await escenario(api, aplicacion)
+            finally:
+                await aplicacion.stop()
+                await aplicacion.shutdown()
+                await api.stop()
+        return asyncio.run(correr())
+    return ejecutar
+
+
+async def en_webhook(aplicacion):
+    servidor = app.WebhookServer(aplicacion, host="127.0.0.1", port=0)
+    await servidor.start()
+    host, port = servidor.runner.addresses[0][:2]
+    return servidor, f"http://{host}:{port}{app.WEBHOOK_PATH}"
+
+
+def medir(bot_local, modo):
+    """Respuestas del bot y latencias (segundos) desde que el generador emite cada update hasta que el bot responde"""
+    async def escenario(api, aplicacion):
+        emitidas = {}
+        servidor = None
+        try:
+            if modo == "webhook":
+                servidor, destino = await en_webhook(aplicacion)
+                assert api.webhook == app.WEBHOOK_URL + app.WEBHOOK_PATH
+                async with aiohttp.ClientSession() as sesion:
+                    async def entregar(numero):
+                        # Telegram empuja la update: solo el viaje de ida
+                        await asyncio.sleep(LATENCIA / 2)
+                        await sesion.post(
+                            destino, json={"update_id": numero, "message": mensaje(numero)},
+                            headers={"X-Telegram-Bot-Api-Secret-Token": app.WEBHOOK_SECRET}
+                        )
+
+                    for numero in range(1, UPDATES + 1):
+                        emitidas[str(numero)] = time.monotonic()
+                        asyncio.ensure_future(entregar(numero))
+                        await asyncio.sleep(1 / RITMO)
+                    await esperar_respuestas(api)
+            else:
+                await aplicacion.updater.start_polling(poll_interval=0, timeout=10)
+                for numero in range(1, UPDATES + 1):
+                    emitidas[str(numero)] = time.monotonic()
+                    api.nueva_update(message=mensaje(numero))
+                    await asyncio.sleep(1 / RITMO)
+                await esperar_respuestas(api)
+                await aplicacion.updater.stop()
+        finally:
+            if servidor is not None:
+                await servidor.stop()
+        respuestas = api.metodos("sendMessage")
+        return (
+            [llamada["texto"] for llamada in respuestas],
+            [llamada["t"] - emitidas[llamada["texto"].split()[1]] for llamada in respuestas]
+        )
+
+    return bot_local(escenario)
+
+
+async def esperar_respuestas(api, total=UPDATES, limite=10):
+    inicio = time.monotonic()
+    while len(api.metodos("sendMessage")) < total and time.monotonic() - inicio < limite:
+        await asyncio.sleep(0.05)
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def test_webhook_frente_a_polling(bot_local):
+    esperadas = sorted(f"ok {numero}" for numero in range(1, UPDATES + 1))
+    print()
+    for modo in ("webhook", "polling"):
+        respuestas, latencias = medir(bot_local, modo)
+        # Cada update llega una vez y recibe exactamente una respuesta
+        assert sorted(respuestas) == esperadas, modo
+        print(f"{modo:8} mediana {statistics.median(latencias) * 1000:6.1f}ms  "
+              f"p95 {percentil(latencias, 0.95) * 1000:6.1f}ms  máx {max(latencias) * 1000:6.1f}ms")
+
+
+def test_webhook_rechaza_peticiones_sin_secreto(bot_local):
+    async def escenario(api, aplicacion):
+        servidor, destino = await en_webhook(aplicacion)
+        try:
+            async with aiohttp.ClientSession() as sesion:
+                async def enviar(cuerpo, secreto):
+                    cabeceras = {"X-Telegram-Bot-Api-Secret-Token": secreto} if secreto is not None else {}
+                    async with sesion.post(destino, data=cuerpo, headers=cabeceras) as respuesta:
+                        return respuesta.status
+
+                valida = json.dumps({"update_id": 1, "message": mensaje(1)})
+                estados = [
+                    await enviar(valida, None),
+                    await enviar(valida, "otro secreto"),
+                    await enviar("no es json", app.WEBHOOK_SECRET),
+                    await enviar(valida, app.WEBHOOK_SECRET),
+                ]
+                await esperar_respuestas(api, total=1)
+                return estados, servidor.status(), [llamada["texto"] for llamada in api.metodos("sendMessage")]
+        finally:
+            await servidor.stop()
+
+    estados, contadores, respuestas = bot_local(escenario)
+
+    assert estados == [403, 403, 400, 200]
+    assert contadores == {"recibidas": 1, "rechazadas": 3}
+    # Solo la update con el secreto llega a los handlers
+    assert respuestas == ["ok 1"]
@@ -0,0 +1,137 @@
+"""Worker de descargas: toma trabajos de la cola compartida y los descarga fuera del bot.
+
+El bot (app.py con DOWNLOAD_EXEC_MODE=remote) solo publica los trabajos y hace la
+E/S con Telegram; se añade capacidad arrancando más procesos de este script.
+
+Variables de entorno:
+  WORKER_CONCURRENCY  descargas simultáneas por proceso (por defecto 2)
+  WORKER_NAME         identificador del worker (por defecto host-pid)
+  WORKER_SHARED_DIR   directorio donde se dejan los archivos; el bot debe verlo en la misma ruta
+  SHARED_QUEUE_DB     ruta de la base SQLite de la cola (la misma que usa el bot)
+"""
+import os
+import signal
+import socket
+from threading import Thread, Event, Lock
+
+from app import SafeParallelDownloader, shared_queue, log_event, SHARED_QUEUE_HEARTBEAT, SHARED_QUEUE_POLL
+
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "2"))
+WORKER_NAME = os.environ.get("WORKER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+WORKER_SHARED_DIR = os.environ.get("WORKER_SHARED_DIR", "")
+
+detener = Event()
+activos = {}
+activos_lock = Lock()
+
+class SharedCancelFlag:
+    """Hace de CancellationToken: el latido lo marca si el bot cancela o reasigna el trabajo"""
+    def __init__(self):
+        self.cancelled = False
+
+class SharedProgressReporter:
+    """Sustituye al SafeProgressTracker y escribe el progreso en la cola compartida"""
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    async def update_download_progress(self, progress):
+        try:
+            shared_queue.progress(self.job_id, progress)
+        except Exception as e:
+            log_event(f"⚠️ No se pudo informar el progreso de {self.job_id}: {e}")
+
+def procesar(trabajo):
+    job_id = trabajo["job_id"]
+    bandera = SharedCancelFlag()
+    with activos_lock:
+        activos[job_id] = bandera
+
+    downloader = SafeParallelDownloader(trabajo["url"], trabajo["user_id"], trabajo["tipo"], SharedProgressReporter(job_id))
+    downloader.estimated_size = trabajo["estimated_size"]
+    if trabajo.get("base_filename"):
+        # El mismo nombre que sigue el bot: su reserva de disco y la limpieza de parciales lo ven
+        downloader.base_filename = trabajo["base_filename"]
+    downloader.cancel_token = bandera
+
+    try:
+        log_event(f"⬇️ {WORKER_NAME} descargando {job_id} (intento {trabajo['attempts'] + 1})")
+        success = downloader.download()
+
+        if bandera.cancelled:
+            downloader.remove_partial_files()
+            log_event(f"🚫 {job_id} cancelado o reasignado, descarga descartada")
+            return
+
+        if not success or not downloader.filename:
+            shared_queue.fail(job_id, WORKER_NAME, "descarga fallida")
+            log_event(f"❌ {job_id} falló en {WORKER_NAME}")
+            return
+
+        filename = os.path.abspath(downloader.filename)
+        if not shared_queue.complete(job_id, WORKER_NAME, filename, downloader.acodec, downloader.vcodec):
+            # El bot canceló el trabajo mientras terminaba la descarga
+            os.remove(filename)
+            return
+        log_event(f"✅ {job_id} listo en {filename}")
+    except Exception as e:
+        log_event(f"❌ Error procesando {job_id}: {e}")
+        shared_queue.fail(job_id, WORKER_NAME, str(e))
+    finally:
+        with activos_lock:
+            activos.pop(job_id, None)
+
+def bucle_descargas(indice):
+    while not detener.is_set():
+        try:
+            trabajo = shared_queue.claim(WORKER_NAME)
+        except Exception as e:
+            log_event(f"⚠️ Error tomando trabajo ({indice}): {e}")
+            trabajo = None
+
+        if trabajo is None:
+            detener.wait(SHARED_QUEUE_POLL)
+            continue
+        procesar(trabajo)
+
+def bucle_latido():
+    """Renueva los trabajos en curso y marca los que el bot canceló o reasignó"""
+    while not detener.wait(SHARED_QUEUE_HEARTBEAT):
+        with activos_lock:
+            ids = list(activos)
+        try:
+            perdidos = shared_queue.heartbeat(ids, WORKER_NAME)
+        except Exception as e:
+            log_event(f"⚠️ Error en el latido: {e}")
+            continue
+        with activos_lock:
+            for job_id in perdidos:
+                if job_id in activos:
+                    activos[job_id].cancelled = True
+
+def signal_handler(sig, frame):
+    log_event("🛑 Deteniendo worker, se terminan las descargas en curso...")
+    detener.set()
+
+def main():
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    # La ruta de la cola se fija antes de cambiar de directorio
+    shared_queue.path = os.path.abspath(shared_queue.path)
+    if WORKER_SHARED_DIR:
+        os.makedirs(WORKER_SHARED_DIR, exist_ok=True)
+        os.chdir(WORKER_SHARED_DIR)
+
+    shared_queue.ensure_schema()
+    log_event(f"👷 Worker {WORKER_NAME} iniciado con {WORKER_CONCURRENCY} descargas simultáneas")
+
+    hilos = [Thread(target=bucle_latido, daemon=True)]
+    hilos += [Thread(target=bucle_descargas, args=(i,)) for i in range(WORKER_CONCURRENCY)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos[1:]:
+        hilo.join()
+    log_event(f"👋 Worker {WORKER_NAME} detenido")
+
+if __name__ == "__main__":
+    main()